@@ -0,0 +1,45 @@
+"""Load test of the analyzers on synthetic prediction streams
+
+Run from the root of the repository:
+
+    python benchmarks/loadtest.py benchmarks/scenario.json --label 0.1.3 --output reports/
+
+Every scenario of the file drives one analyzer per model version over its stream and prints the throughput, the
+p50/p99 run latencies, the peak RSS and the detection delays of the injected drifts. With --output, the reports
+are saved as JSON files named after the scenario and the label, to be compared between releases.
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.append(".")
+# The metrics modules import their constants as a top level module
+sys.path.append("pulsar_metrics/metrics")
+
+from pulsar_metrics.analyzers.loadtest import Scenario, run_load_test  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("scenarios", help="JSON file of the scenarios")
+    parser.add_argument("--data-dir", default="data", help="directory of the bundled datasets")
+    parser.add_argument("--label", default=None, help="label of the reports (a release for instance)")
+    parser.add_argument("--output", default=None, help="directory the JSON reports are saved to")
+    parser.add_argument("--only", default=None, help="name of the only scenario to run")
+    args = parser.parse_args()
+
+    for scenario in Scenario.load(args.scenarios):
+        if (args.only is not None) and (scenario.name != args.only):
+            continue
+        report = run_load_test(scenario, data_dir=args.data_dir, label=args.label)
+        print(json.dumps(report.summary(), indent=2, default=float))
+        print(report.detections().to_string(index=False))
+        if args.output is not None:
+            os.makedirs(args.output, exist_ok=True)
+            name = scenario.name if args.label is None else f"{scenario.name}_{args.label}"
+            report.save(os.path.join(args.output, f"{name}.json"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,446 @@
+#  Author:   Adel Benlagra  <abenlagra@rocketscience.one>
+import numpy as np
+import pandas as pd
+
+from ..exceptions import CustomExceptionPulsarMetric as error_msg
+from .history import MetricHistory
+
+_OPERATORS = {">": np.greater, ">=": np.greater_equal, "<": np.less, "<=": np.less_equal}
+_CHANGES = (None, "absolute", "relative")
+ALERT_COLUMNS = [
+    "rule",
+    "severity",
+    "model_id",
+    "model_version",
+    "metric_name",
+    "feature_name",
+    "metric_value",
+    "threshold",
+    "n_features",
+    "features",
+    "window",
+    "period_end",
+]
+
+
+class AlertRule:
+    """Declarative alert rule on the values of a metric
+
+    The condition of a rule compares the values of a metric, or their change from the previous window of the series
+    (absolute or relative), to a threshold. It has to hold on `consecutive` successive windows of a series, the values
+    of a metric on a feature of a model version. A rule raises an alert per series, or with min_features one alert
+    per model version when at least min_features features of the group hold the condition at the same time.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        metric_name: str,
+        threshold: float,
+        operator: str = ">",
+        features: list = None,
+        consecutive: int = 1,
+        change: str = None,
+        min_features: int = None,
+        cooldown: int = 0,
+        severity: str = "warning",
+        model_id=None,
+        model_version=None,
+    ):
+        """Constructor of the AlertRule class
+
+        Parameters
+        ----------
+        name : str
+            Name of the rule
+        metric_name : str
+            Name of the metric
+        threshold : float
+            Threshold of the values (or of their changes)
+        operator : str, optional
+            Comparison of the values to the threshold, one of ">", ">=", "<" and "<="
+        features : list, optional
+            Group of features of the rule (all the features if None)
+        consecutive : int, optional
+            Number of successive windows of a series the condition has to hold on
+        change : str, optional
+            "absolute" or "relative" to compare the change of the values from the previous window (None for the values)
+        min_features : int, optional
+            Minimum number of features of the group holding the condition to raise one alert per model version (an
+            alert per feature if None)
+        cooldown : int, optional
+            Number of windows before an alert still holding is raised again (0 to raise it again only after it clears)
+        severity : str, optional
+            Severity of the alerts
+        model_id : optional
+            Model id of the rule (all the models if None)
+        model_version : optional
+            Model version of the rule (all the versions if None)
+        """
+        if operator not in _OPERATORS:
+            raise error_msg(value=operator, message=f"InvalidInput: operator should be one of {list(_OPERATORS)}")
+        if change not in _CHANGES:
+            raise error_msg(value=change, message=f"InvalidInput: change should be one of {list(_CHANGES)}")
+        if consecutive < 1 or cooldown < 0 or (min_features is not None and min_features < 1):
+            raise error_msg(
+                value=(consecutive, cooldown, min_features),
+                message=f'{"InvalidInput: consecutive and min_features should be positive, cooldown non negative"}',
+            )
+        self.name = name
+        self.metric_name = metric_name
+        self.threshold = threshold
+        self.operator = operator
+        self.features = None if features is None else np.asarray(list(features), dtype=object)
+        self.consecutive = consecutive
+        self.change = change
+        self.min_features = min_features
+        self.cooldown = cooldown
+        self.severity = severity
+        self.model_id = None if model_id is None else str(model_id)
+        self.model_version = None if model_version is None else str(model_version)
+
+    @property
+    def depth(self) -> int:
+        """Number of windows of a series the condition depends on"""
+        return self.consecutive + (self.change is not None)
+
+    def condition(self, values: np.ndarray) -> np.ndarray:
+        """Whether the condition holds on (n_series, depth) values of series, the last column being the last window
+
+        Missing values (windows not yet seen) never satisfy the condition.
+        """
+        if self.change is not None:
+            previous = values[:, :-1]
+            values = values[:, 1:] - previous
+            if self.change == "relative":
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    values = values / np.abs(previous)
+        start = values.shape[1] - self.consecutive
+        return _OPERATORS[self.operator](values[:, start:], self.threshold).all(axis=1)
+
+    def worst(self, values: np.ndarray) -> float:
+        """Value of a group alert, the most extreme value of the features holding the condition"""
+        return float(values.max() if self.operator in (">", ">=") else values.min())
+
+
+def _grow(array: np.ndarray, size: int, fill) -> np.ndarray:
+    """Array extended to size rows with a fill value"""
+    if len(array) >= size:
+        return array
+    extension = np.full((size - len(array),) + array.shape[1:], fill, dtype=array.dtype)
+    return np.concatenate([array, extension])
+
+
+def _lookup(index: pd.Index, keys: np.ndarray) -> tuple:
+    """Positions of unique keys in an index, the new keys being appended to it"""
+    positions = index.get_indexer(keys)
+    new = positions < 0
+    if new.any():
+        positions[new] = np.arange(len(index), len(index) + new.sum())
+        index = index.append(pd.Index(keys[new], dtype=index.dtype))
+    return index, positions
+
+
+def _factorize(results: pd.DataFrame, column: str) -> tuple:
+    """Codes of the values of a column of the results and their labels (strings, missing values as '')"""
+    if column not in results.columns:
+        return np.zeros(len(results), dtype=np.int64), np.array([""], dtype=object)
+    codes, uniques = pd.factorize(results[column], use_na_sentinel=False)
+    return codes, np.where(pd.isnull(uniques), "", np.asarray(uniques).astype(str)).astype(object)
+
+
+def _raised(holds: np.ndarray, active: np.ndarray, last_alert: np.ndarray, window: int, cooldown: int) -> np.ndarray:
+    """Alerts raised by conditions holding: new ones, and ones still holding once their cooldown has elapsed"""
+    again = (window - last_alert >= cooldown) if cooldown > 0 else np.zeros(len(holds), dtype=bool)
+    return holds & (~active | again)
+
+
+class _RuleState:
+    """Last values and alert state of the series of a rule, as arrays indexed by slot, and of its groups (models)"""
+
+    def __init__(self, rule: AlertRule):
+        self.rule = rule
+        # Per series of the engine: whether the rule applies to it, and its slot (-1 if not seen yet)
+        self.eligible = np.zeros(0, dtype=bool)
+        self.slot = np.zeros(0, dtype=np.int64)
+        # Per slot
+        self.series = np.zeros(0, dtype=np.int64)
+        self.values = np.empty((0, rule.depth))
+        self.active = np.zeros(0, dtype=bool)
+        self.last_alert = np.zeros(0, dtype=np.int64)
+        # Per model of the engine
+        self.group_active = np.zeros(0, dtype=bool)
+        self.group_last_alert = np.zeros(0, dtype=np.int64)
+
+    def extend(self, eligible: np.ndarray, n_models: int):
+        """Register new series of the engine"""
+        self.eligible = np.concatenate([self.eligible, eligible])
+        self.slot = _grow(self.slot, len(self.eligible), -1)
+        self.group_active = _grow(self.group_active, n_models, False)
+        self.group_last_alert = _grow(self.group_last_alert, n_models, 0)
+
+    def slots(self, series: np.ndarray) -> np.ndarray:
+        """Slots of unique series, the series seen for the first time getting new slots without values"""
+        slots = self.slot[series]
+        new = slots < 0
+        if new.any():
+            slots[new] = np.arange(len(self.series), len(self.series) + new.sum())
+            self.slot[series[new]] = slots[new]
+            self.series = np.concatenate([self.series, series[new]])
+            self.values = _grow(self.values, len(self.series), np.nan)
+            self.active = _grow(self.active, len(self.series), False)
+            self.last_alert = _grow(self.last_alert, len(self.series), 0)
+        return slots
+
+
+class AlertEngine:
+    """Incremental evaluation of alert rules over the results of successive windows
+
+    Every call of evaluate() processes the results of a window (or of several windows, split by period end) as
+    arrays. The series (metric values of a feature of a model version) are registered once as integer codes: only
+    the distinct labels of a call are looked up. The rows of the metric of a rule are then selected with one mask,
+    and the last values of its series are shifted in a (n_series, depth) matrix on which the condition is evaluated
+    at once. The series of the models of a window without a result in it get a missing value (a gap breaking their
+    consecutive windows and clearing their condition), the series of the other models are left as they are.
+
+    Alerts are deduplicated: a series (or a group) raises an alert when its condition starts holding, and again while
+    it holds only once its cooldown has elapsed. Rules can be silenced for a number of windows, the alerts raised
+    meanwhile being dropped. The state can be warmed up from a metric history, without raising alerts.
+    """
+
+    def __init__(self, rules: list):
+        """Constructor of the AlertEngine class
+
+        Parameters
+        ----------
+        rules : list
+            List of alert rules (AlertRule)
+        """
+        names = [rule.name for rule in rules]
+        if len(set(names)) != len(names):
+            raise error_msg(value=names, message=f'{"InvalidInput: the names of the rules should be unique"}')
+        self._states = [_RuleState(rule) for rule in rules]
+        self._silenced = {}
+        self.window = 0
+        # Registries of the models ("model_id\x1fmodel_version"), features and series (model and feature codes)
+        self._models = pd.Index([], dtype=object)
+        self._model_keys = np.empty((0, 2), dtype=object)
+        self._features = pd.Index([], dtype=object)
+        self._series = pd.Index([], dtype=np.int64)
+        self._series_model = np.zeros(0, dtype=np.int64)
+        self._series_feature = np.zeros(0, dtype=np.int64)
+
+    @property
+    def rules(self) -> list:
+        return [state.rule for state in self._states]
+
+    def silence(self, rule_name: str, windows: int):
+        """Drop the alerts of a rule for the next windows (the state of its series is still updated)"""
+        self._silenced[rule_name] = self.window + windows
+
+    def _register(self, results: pd.DataFrame) -> np.ndarray:
+        """Series of the rows of results, the new models, features and series being registered"""
+        id_codes, id_labels = _factorize(results, "model_id")
+        version_codes, version_labels = _factorize(results, "model_version")
+        feature_codes, feature_labels = _factorize(results, "feature_name")
+
+        pair_codes, pairs = pd.factorize(id_codes * len(version_labels) + version_codes)
+        model_labels = id_labels[pairs // len(version_labels)] + "\x1f" + version_labels[pairs % len(version_labels)]
+        n_models = len(self._models)
+        self._models, models = _lookup(self._models, model_labels)
+        if len(self._models) > n_models:
+            added = [label.split("\x1f") for label in self._models.to_numpy()[n_models:]]
+            self._model_keys = np.concatenate([self._model_keys, np.array(added, dtype=object).reshape(-1, 2)])
+        self._features, features = _lookup(self._features, feature_labels)
+
+        keys = models[pair_codes] * 2**32 + features[feature_codes]
+        series_codes, series_keys = pd.factorize(keys)
+        n_series = len(self._series)
+        self._series, series = _lookup(self._series, series_keys)
+        if len(self._series) > n_series:
+            added = self._series.to_numpy()[n_series:]
+            self._series_model = np.concatenate([self._series_model, added // 2**32])
+            self._series_feature = np.concatenate([self._series_feature, added % 2**32])
+            for state in self._states:
+                state.extend(self._eligible(state.rule, added // 2**32, added % 2**32), len(self._models))
+        return series[series_codes]
+
+    def _eligible(self, rule: AlertRule, models: np.ndarray, features: np.ndarray) -> np.ndarray:
+        """Whether a rule applies to series, from its group of features and its model"""
+        eligible = np.ones(len(models), dtype=bool)
+        if rule.features is not None:
+            eligible &= np.isin(self._features.to_numpy()[features], rule.features)
+        for column, value in enumerate([rule.model_id, rule.model_version]):
+            if value is not None:
+                eligible &= self._model_keys[models, column] == value
+        return eligible
+
+    def evaluate(self, results: pd.DataFrame, emit: bool = True) -> pd.DataFrame:
+        """Update the series of the rules with new results and raise the alerts
+
+        Parameters
+        ----------
+        results : DataFrame
+            Results of a window (Analyzer.results_to_pandas()), or of several windows with a period_end column
+        emit : bool, optional
+            Whether the alerts are returned (False to update the state only)
+
+        Returns
+        -------
+        DataFrame
+            the alerts, one row per series or group
+        """
+        if results is None or len(results) == 0:
+            return pd.DataFrame(columns=ALERT_COLUMNS)
+        for column in ["metric_name", "metric_value"]:
+            if column not in results.columns:
+                raise error_msg(value=column, message=f'{"InvalidInput: the results have no metric name or value"}')
+
+        series = self._register(results)
+        metric_codes, metric_names = pd.factorize(results["metric_name"])
+        rule_codes = [np.flatnonzero(metric_names == state.rule.metric_name) for state in self._states]
+        values = pd.to_numeric(results["metric_value"], errors="coerce").to_numpy(dtype=float)
+
+        if "period_end" in results.columns:
+            periods, windows = pd.factorize(pd.to_datetime(results["period_end"], cache=False), sort=True)
+            order = np.argsort(periods, kind="stable")
+            splits = np.split(order, np.flatnonzero(np.diff(periods[order])) + 1)
+        else:
+            windows, splits = [None], [np.arange(len(results))]
+
+        alerts = {column: [] for column in ALERT_COLUMNS}
+        for period_end, rows in zip(windows, splits):
+            self.window += 1
+            models = np.unique(self._series_model[series[rows]])
+            for state, code in zip(self._states, rule_codes):
+                metric_rows = rows[metric_codes[rows] == code[0]] if len(code) else rows[:0]
+                raised = self._update(state, metric_rows, series, values, models, period_end, emit)
+                for column, data in raised.items():
+                    alerts[column].extend(data)
+        return pd.DataFrame(alerts, columns=ALERT_COLUMNS)
+
+    def _update(
+        self,
+        state: _RuleState,
+        rows: np.ndarray,
+        series: np.ndarray,
+        values: np.ndarray,
+        models: np.ndarray,
+        period_end,
+        emit: bool,
+    ) -> dict:
+        """Update the series of a rule with the rows of its metric in a window (of the given models), returning the
+        columns of its alerts"""
+        rule = state.rule
+        rows = rows[state.eligible[series[rows]]]
+        # The last result of a series in the window
+        window_series, last = np.unique(series[rows][::-1], return_index=True)
+        rows = rows[::-1][last]
+        slots = state.slots(window_series)
+        # Slots of the models of the window without a result
+        absent = np.isin(self._series_model[state.series], models)
+        absent[slots] = False
+        absent = np.flatnonzero(absent)
+        if not (len(slots) or len(absent)):
+            return {}
+
+        shifted = np.concatenate([slots, absent])
+        state.values[shifted, :-1] = state.values[shifted, 1:]
+        state.values[slots, -1] = values[rows]
+        state.values[absent, -1] = np.nan
+        state.active[absent] = False
+        holds = rule.condition(state.values[slots])
+        emit = emit and (self._silenced.get(rule.name, 0) < self.window)
+
+        if rule.min_features is None:
+            raised = _raised(holds, state.active[slots], state.last_alert[slots], self.window, rule.cooldown)
+            state.active[slots] = holds
+            state.last_alert[slots[raised]] = self.window
+            if not emit:
+                return {}
+            raised_series = window_series[raised]
+            feature_names = self._features.to_numpy()[self._series_feature[raised_series]]
+            models = self._series_model[raised_series]
+            return self._alerts(rule, models, feature_names, values[rows[raised]], [[name] for name in feature_names], period_end)
+
+        state.active[slots] = holds
+        slot_models = self._series_model[state.series]
+        groups = np.unique(slot_models[shifted])
+        counts = np.bincount(slot_models[state.active], minlength=len(self._models))[groups]
+        group_holds = counts >= rule.min_features
+        raised = _raised(group_holds, state.group_active[groups], state.group_last_alert[groups], self.window, rule.cooldown)
+        state.group_active[groups] = group_holds
+        state.group_last_alert[groups[raised]] = self.window
+        if not emit:
+            return {}
+        models = groups[raised]
+        members = [np.flatnonzero(state.active & (slot_models == group)) for group in models]
+        features = [list(self._features.to_numpy()[self._series_feature[state.series[slots]]]) for slots in members]
+        worst = [rule.worst(state.values[slots, -1]) for slots in members]
+        return self._alerts(rule, models, [None] * len(models), worst, features, period_end)
+
+    def _alerts(self, rule: AlertRule, models: np.ndarray, feature_names, metric_values, features: list, period_end) -> dict:
+        """Columns of the alerts of a rule"""
+        n = len(models)
+        return {
+            "rule": [rule.name] * n,
+            "severity": [rule.severity] * n,
+            "model_id": self._model_keys[models, 0].tolist(),
+            "model_version": self._model_keys[models, 1].tolist(),
+            "metric_name": [rule.metric_name] * n,
+            "feature_name": list(feature_names),
+            "metric_value": np.asarray(metric_values, dtype=float).tolist(),
+            "threshold": [rule.threshold] * n,
+            "n_features": [len(names) for names in features],
+            "features": features,
+            "window": [self.window] * n,
+            "period_end": [period_end] * n,
+        }
+
+    def warm_start(self, history: MetricHistory, model_id=None, model_version=None, start=None, end=None) -> int:
+        """Replay the results of a metric history to restore the state of the rules, without raising alerts
+
+        The series holding their condition at the end of the replay are considered already alerted.
+
+        Parameters
+        ----------
+        history : MetricHistory
+            Metric history of the results
+        model_id : optional
+            Model id (all the models if None)
+        model_version : optional
+            Model version (all the versions if None)
+        start : optional
+            Start (included) of the range of period ends, ideally covering the deepest rule
+        end : optional
+            End (excluded) of the range of period ends
+
+        Returns
+        -------
+        int
+            the number of replayed windows
+        """
+        results = pd.concat(
+            [
+                history.query(metric_name, model_id=model_id, model_version=model_version, start=start, end=end)
+                for metric_name in dict.fromkeys(rule.metric_name for rule in self.rules)
+            ]
+        )
+        window = self.window
+        self.evaluate(results, emit=False)
+        return self.window - window
+
+    def active(self) -> pd.DataFrame:
+        """Series (and groups, without feature) of the rules whose condition holds on their last window"""
+        rows = []
+        for state in self._states:
+            if state.rule.min_features is None:
+                keys = [(self._series_model[s], self._features[self._series_feature[s]]) for s in state.series[state.active]]
+            else:
+                keys = [(model, None) for model in np.flatnonzero(state.group_active)]
+            for model, feature_name in keys:
+                model_id, model_version = self._model_keys[model]
+                rows.append(
+                    {"rule": state.rule.name, "model_id": model_id, "model_version": model_version, "feature_name": feature_name}
+                )
+        return pd.DataFrame(rows, columns=["rule", "model_id", "model_version", "feature_name"])
@@ -0,0 +1,158 @@
+#  Author:   Adel Benlagra  <abenlagra@rocketscience.one>
+import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Union
+
+import constant
+import pandas as pd
+
+from ..exceptions import CustomExceptionPulsarMetric as error_msg
+from .plan import MetricPlan
+
+EXECUTORS = ("thread", "process")
+
+
+# Datasets and options of the run of the workers of an owned process pool, received once by every worker
+_WORKER_DATA = {}
+
+
+def execute_batch(plan: MetricPlan, current: pd.DataFrame, reference: pd.DataFrame, options: dict = {}) -> list:
+    """Execute a sub-plan in an executor worker, returning the list of results of every step"""
+    return plan.execute_steps(current, reference, options, progress=False)
+
+
+def _attach_data(current: pd.DataFrame, reference: pd.DataFrame, options: dict):
+    """Initializer of the workers of an owned process pool"""
+    _WORKER_DATA.update(current=current, reference=reference, options=options)
+
+
+def _execute_attached(plan: MetricPlan) -> list:
+    """Execute a sub-plan on the datasets attached to the worker"""
+    return execute_batch(plan, _WORKER_DATA["current"], _WORKER_DATA["reference"], _WORKER_DATA["options"])
+
+
+def make_executor(
+    executor: Union[str, Executor] = "thread",
+    current: pd.DataFrame = None,
+    reference: pd.DataFrame = None,
+    options: dict = {},
+    max_workers: int = None,
+) -> tuple:
+    """Executor of the batches of a plan
+
+    The workers of a new process pool receive the datasets and the options once, when they start, and only the
+    batches of steps are sent to them. Other executors receive the datasets with every batch (threads share them
+    without copying).
+
+    Parameters
+    ----------
+    executor : Union[str, Executor], optional
+        "thread" for the default executor of the event loop, "process" for a new process pool, or an executor
+    current : DataFrame, optional
+        The input current (pandas DataFrame), attached to the workers of a new process pool
+    reference : DataFrame, optional
+        The input reference (pandas DataFrame), attached to the workers of a new process pool
+    options : dict, optional
+        Options of the metrics, attached to the workers of a new process pool
+    max_workers : int, optional
+        Number of processes of a new process pool (os.cpu_count() if None)
+
+    Returns
+    -------
+    tuple
+        the executor (None for the default executor of the loop) and whether it is owned by the run
+    """
+    if isinstance(executor, Executor):
+        return executor, False
+    if executor == "thread":
+        return None, False
+    if executor == "process":
+        return ProcessPoolExecutor(max_workers, initializer=_attach_data, initargs=(current, reference, options)), True
+    raise error_msg(
+        value=executor,
+        message=f"InvalidInput: executor should be an Executor or one of {EXECUTORS}",
+    )
+
+
+async def execute_async(
+    plan: MetricPlan,
+    current: pd.DataFrame,
+    reference: pd.DataFrame,
+    options: dict = {},
+    executor: Union[str, Executor] = "thread",
+    batch_size: int = constant.ASYNC_BATCH_SIZE,
+) -> list:
+    """Execute a compiled plan in an executor without blocking the event loop
+
+    The plan is split into batches of steps sharing their intermediate nodes, and the batches are submitted
+    to the executor one at a time: the event loop runs its other tasks between two batches, and a cancelled
+    run stops at the end of the running batch without submitting the next ones.
+
+    Parameters
+    ----------
+    plan : MetricPlan
+        The compiled plan
+    current : DataFrame
+        The input current (pandas DataFrame)
+    reference : DataFrame
+        The input reference (pandas DataFrame)
+    options : dict, optional
+        Options of the metrics, keyed by metric name
+    executor : Union[str, Executor], optional
+        "thread", "process" or an executor. Custom metrics defined in closures cannot be sent to processes
+    batch_size : int, optional
+        Target number of steps of a batch
+
+    Returns
+    -------
+    list
+        the results of the summary statistics followed by the results of the metrics
+    """
+    loop = asyncio.get_running_loop()
+    pool, owned = make_executor(executor, current, reference, options)
+    step_results = [None] * len(plan._steps)
+    try:
+        for batch in plan.split(batch_size):
+            if owned:
+                results = await loop.run_in_executor(pool, _execute_attached, batch)
+            else:
+                results = await loop.run_in_executor(pool, execute_batch, batch, current, reference, options)
+            for index, result in zip(batch.indices, results):
+                step_results[index] = result
+            await asyncio.sleep(0)
+    finally:
+        if owned:
+            pool.shutdown(wait=False, cancel_futures=True)
+    return [result for results in step_results for result in results]
+
+
+async def run_analyzers(
+    analyzers: list,
+    current: pd.DataFrame,
+    reference: pd.DataFrame,
+    max_concurrency: int = constant.MAX_CONCURRENT_ANALYZERS,
+    **kwargs,
+) -> list:
+    """Run several analyzers concurrently, at most max_concurrency of them at a time
+
+    Parameters
+    ----------
+    analyzers : list
+        List of analyzers
+    current : DataFrame
+        The input current (pandas DataFrame)
+    reference : DataFrame
+        The input reference (pandas DataFrame)
+    max_concurrency : int, optional
+        Maximum number of analyzers running at the same time
+    kwargs :
+        Arguments of Analyzer.arun()
+
+    Returns
+    -------
+    list
+        the results of the analyzers (in pandas format), None for the analyzers without results
+    """
+    limiter = asyncio.Semaphore(max_concurrency)
+    await asyncio.gather(*[analyzer.arun(current, reference, limiter=limiter, **kwargs) for analyzer in analyzers])
+    return [analyzer.results_to_pandas() for analyzer in analyzers]
@@ -1,23 +1,38 @@
 #  Author:   Adel Benlagra  <abenlagra@rocketscience.one>
 
+import asyncio
 from abc import ABC, abstractmethod
+from concurrent.futures import Executor
 from datetime import datetime
+from typing import Union
 
-import numpy as np
+import constant
 import pandas as pd
 
-# import warnings
-from tqdm import tqdm
-
 from ..exceptions import CustomExceptionPulsarMetric as error_msg
-from ..metrics.drift import DriftMetric, DriftTestMetric
+from ..metrics.drift import CUSTOM_DRIFT_METRICS, DriftMetric, DriftTestMetric
 from ..metrics.enums import (  # MetricsType,
+    DataQualityMetricsFuncs,
     DriftMetricsFuncs,
     DriftTestMetricsFuncs,
     PerformanceMetricsFuncs,
 )
 from ..metrics.performance import PerformanceMetric
-from ..metrics.statistics import FeatureSummary
+from ..metrics.quality import DATASET_CHECKS, DataQualityMetric
+from ..metrics.reference import DecayedReference
+from ..metrics.sampling import Sampler
+from ..utils import ERROR_MSG_PRECISION, PRECISIONS, compact_dataframe
+from .asynchronous import execute_async
+from .calibration import ThresholdCalibration
+from .cascade import Cascade
+from .distributed import run_partitioned
+from .history import MetricHistory
+from .memory import MemoryBudget
+from .plan import MetricPlan, evaluate_metric
+from .schema import Schema
+from .store import StoredReference
+
+# import warnings
 
 
 class AbstractAnalyzer(ABC):
@@ -44,6 +59,11 @@ class AbstractAnalyzer(ABC):
         self._metrics_list = []
         self._metadata = {"name": name, "description": description, "model_id": model_id, "model_version": model_version}
         self._results = None
+        self._plan = None
+        self._memory_report = None
+        self._cascade_report = None
+        self._schema = None
+        self._thresholds = None
 
     @property
     @abstractmethod
@@ -65,9 +85,39 @@ class AbstractAnalyzer(ABC):
     def add_drift_test_metrics(self, metrics_list: list):
         pass
 
+    def add_quality_metrics(self, metrics_list: list):
+        pass
+
     def get_result(self):
         return self._results
 
+    def get_memory_report(self):
+        return self._memory_report
+
+    def get_cascade_report(self):
+        return self._cascade_report
+
+    def get_schema(self):
+        return self._schema
+
+    def set_schema(self, schema: Schema):
+        self._schema = schema
+
+    def get_thresholds(self):
+        return self._thresholds
+
+    def set_thresholds(self, thresholds: ThresholdCalibration):
+        self._thresholds = thresholds
+
+    def _apply_thresholds(self, reference, thresholds: ThresholdCalibration = None, options: dict = {}):
+        """Apply the calibrated thresholds given to the run, of the analyzer or stored with the reference"""
+        if thresholds is None:
+            thresholds = self._thresholds
+        if (thresholds is None) and isinstance(reference, StoredReference):
+            thresholds = reference.thresholds
+        if (thresholds is not None) and (self._results is not None):
+            thresholds.apply(self._results, options)
+
     def results_to_json(self):
         empty_dict = {}
         result = empty_dict if self._results is None else [result.json() for result in self._results]
@@ -79,7 +129,9 @@ class AbstractAnalyzer(ABC):
             results = pd.DataFrame.from_records([self._results[i].dict() for i in range(len(self._results))])
             for key, value in self._metadata.items():
                 if key not in ["name", "description"]:
-                    results[key] = value
+                    # A list keeps dict values (the options) from being aligned on the index
+                    results[key] = [value] * len(results)
+            result = results
 
         return result
 
@@ -102,7 +154,9 @@ class Analyzer(AbstractAnalyzer):
         description : str, optional
             The input value for description for the analyzer
         kwargs :
-            keyworded variable length of arguments to a function
+            keyworded variable length of arguments to a function. `precision` ("float64" by default or
+            "float32") sets the compute mode: in float32 mode the datasets are stored with compact dtypes
+            (see pulsar_metrics.utils.compact_dataframe) before the metrics are computed
 
         Returns
         -------
@@ -112,6 +166,13 @@ class Analyzer(AbstractAnalyzer):
         # Call the constructor of the parent class
         super().__init__(name, model_id, model_version, description)
 
+        self._precision = kwargs.get("precision", "float64")
+        if self._precision not in PRECISIONS:
+            raise error_msg(
+                value=self._precision,
+                message=ERROR_MSG_PRECISION,
+            )
+
     def add_performance_metrics(self, metrics_list: list, **kwargs):
         """Method to add performance metrics list to the analyzer
 
@@ -137,16 +198,17 @@ class Analyzer(AbstractAnalyzer):
         ----------
         metrics_list : list
             List of performance metrics names
-        features_list : list
-            List of features for drift metrics
+        features_list : list, optional
+            List of features for drift metrics (the features of the schema of the analyzer if None)
         """
 
-        # TODO: better handling of numeric vs categorical variables
         if features_list is None:
-            input_array = self._data.select_dtypes("number").columns
-            input_comparison_array = ["y_true", "y_pred", "y_pred_proba", "model_id", "model_version"]
-
-            features_list = np.setdiff1d(input_array, input_comparison_array)
+            if self._schema is None:
+                raise error_msg(
+                    value=None,
+                    message=f'{"No features given and no schema: set the schema of the analyzer or give the features."}',
+                )
+            features_list = self._schema.features
 
         for metric_name in metrics_list:
             for feature in features_list:
@@ -157,6 +219,9 @@ class Analyzer(AbstractAnalyzer):
                     elif metric_name in DriftTestMetricsFuncs._member_names_:
                         metric = DriftTestMetric(metric_name=metric_name, feature_name=feature)
                         self._metrics_list.append(metric)
+                    elif metric_name in CUSTOM_DRIFT_METRICS:
+                        metric = CUSTOM_DRIFT_METRICS[metric_name](metric_name=metric_name, feature_name=feature)
+                        self._metrics_list.append(metric)
                     else:
                         raise error_msg(
                             value=metric_name,
@@ -165,27 +230,154 @@ class Analyzer(AbstractAnalyzer):
                 except Exception as e:
                     print(f"Error in add_drift_metrics() in the analysers base: {str(e)}")
 
-    def run(self, current: pd.DataFrame, reference: pd.DataFrame, options: dict = {}):
-        """Method run() in analyzer from the list of metrics
+    def add_quality_metrics(self, metrics_list: list, features_list: list = None):
+        """Method to add data quality checks to the analyzer
+
+        The checks of the features are evaluated from the nodes of their summary statistics, and duplicate_rows
+        once on the rows of the features.
+
+        Parameters
+        ----------
+        metrics_list : list
+            List of data quality checks names
+        features_list : list, optional
+            List of features to check (the features of the schema of the analyzer if None)
+        """
+
+        if features_list is None:
+            if self._schema is None:
+                raise error_msg(
+                    value=None,
+                    message=f'{"No features given and no schema: set the schema of the analyzer or give the features."}',
+                )
+            features_list = self._schema.features
+
+        for metric_name in metrics_list:
+            try:
+                if metric_name not in DataQualityMetricsFuncs._member_names_:
+                    raise error_msg(
+                        value=metric_name,
+                        message=f'{"unknown data quality metric key {metric_name} given."}',
+                    )
+                if metric_name in DATASET_CHECKS:
+                    self._metrics_list.append(DataQualityMetric(metric_name=metric_name, columns=features_list))
+                else:
+                    for feature in features_list:
+                        self._metrics_list.append(DataQualityMetric(metric_name=metric_name, feature_name=feature))
+            except Exception as e:
+                print(f"Error in add_quality_metrics() in the analysers base: {str(e)}")
+
+    def calibrate(
+        self,
+        reference: pd.DataFrame,
+        options: dict = {},
+        n_splits: int = constant.CALIBRATION_SPLITS,
+        alpha: float = constant.SIGNIFICANCE_LEVEL,
+        current_size: int = None,
+        n_jobs: int = 1,
+        seed: int = constant.SEED_SIZE,
+        executor: Union[str, Executor] = "process",
+    ) -> ThresholdCalibration:
+        """Method calibrate() calibrating the thresholds of the drift metrics of the analyzer feature by feature
+
+        The thresholds are kept by the analyzer and applied to the results of its next runs (see ThresholdCalibration).
+
+        Parameters
+        ----------
+        reference : Union[DataFrame, StoredReference]
+            The input reference (pandas DataFrame), or a reference attached from a ReferenceStore
+        options : dict, optional
+            Options of the metrics, keyed by metric name
+        n_splits : int, optional
+            Number of splits of the reference against itself
+        alpha : float, optional
+            Target rate of drift statuses without drift
+        current_size : int, optional
+            Number of rows of the current side of a split (half of the reference if None)
+        n_jobs : int, optional
+            Number of workers evaluating the splits
+        seed : int, optional
+            seed value for random number generator
+        executor : Union[str, Executor], optional
+            "process" for a pool of n_jobs processes, "thread" for n_jobs threads, or an executor
+
+        Returns
+        -------
+        ThresholdCalibration
+            the calibrated thresholds
+        """
+        if isinstance(reference, StoredReference):
+            df_reference = reference.frame
+        else:
+            df_reference = reference.loc[
+                (reference.model_id == self._metadata["model_id"]) & (reference.model_version == self._metadata["model_version"])
+            ]
+        if len(df_reference) < 2:
+            raise error_msg(value=None, message=f'{"Wrong model metadata for reference dataset."}')
+        self._thresholds = ThresholdCalibration.fit(
+            df_reference,
+            self._metrics_list,
+            options,
+            n_splits=n_splits,
+            alpha=alpha,
+            current_size=current_size,
+            n_jobs=n_jobs,
+            seed=seed,
+            executor=executor,
+        )
+        return self._thresholds
+
+    def _prepare(self, current: pd.DataFrame, reference: pd.DataFrame, options: dict = {}):
+        """Filter the datasets on the model metadata of the analyzer and validate them
 
         Parameters
         ----------
         current : DataFrame
             The input current (pandas DataFrame)
-        reference : DataFrame
-            The input reference (pandas DataFrame)
+        reference : Union[DataFrame, StoredReference, DecayedReference]
+            The input reference (pandas DataFrame), the reference of the model version attached from a store, or an
+            incrementally maintained reference
         options : dict,optional
             List of performance metrics names
+
+        Returns
+        -------
+        tuple
+            the filtered current and reference datasets
         """
 
-        ref_model_id_validation = reference.model_id == self._metadata["model_id"]
-        ref_model_version_validation = reference.model_version == self._metadata["model_version"]
-        df_reference = reference.loc[ref_model_id_validation & ref_model_version_validation]
+        if isinstance(reference, StoredReference):
+            # Stored references are filtered on the model version when they are stored
+            if (str(reference.model_id), str(reference.model_version)) != (
+                str(self._metadata["model_id"]),
+                str(self._metadata["model_version"]),
+            ):
+                raise error_msg(
+                    value=None,
+                    message=f'{"Wrong model metadata for reference dataset."}',
+                )
+            df_reference = reference.frame
+        elif isinstance(reference, DecayedReference):
+            df_reference = reference
+        else:
+            ref_model_id_validation = reference.model_id == self._metadata["model_id"]
+            ref_model_version_validation = reference.model_version == self._metadata["model_version"]
+            df_reference = reference.loc[ref_model_id_validation & ref_model_version_validation]
 
         cur_model_id_validation = current.model_id == self._metadata["model_id"]
         cur_model_version_validation = current.model_version == self._metadata["model_version"]
         df_current = current.loc[cur_model_id_validation & cur_model_version_validation]
 
+        if (self._precision != "float64") and isinstance(df_reference, pd.DataFrame):
+            # The storage dtypes of the schema spare the inference of the compact dtypes
+            compact = (
+                self._schema.compact
+                if self._schema is not None
+                else lambda data: compact_dataframe(data, precision=self._precision)
+            )
+            df_reference = compact(df_reference)
+            df_current = compact(df_current)
+
         df_current["pred_timestamp"] = pd.to_datetime(df_current["pred_timestamp"])
 
         self._metadata.update(
@@ -202,7 +394,7 @@ class Analyzer(AbstractAnalyzer):
                 value=None,
                 message=f'{"The metrics list for the analyzer is empty."}',
             )
-        elif df_reference.shape[0] == 0:
+        elif len(df_reference) == 0:
             raise error_msg(
                 value=None,
                 message=f'{"Wrong model metadata for reference dataset."}',
@@ -212,27 +404,248 @@ class Analyzer(AbstractAnalyzer):
                 value=None,
                 message=f'{"Wrong model metadata for current dataset."}',
             )
-        else:
+        if (self._schema is None) and not isinstance(df_reference, DecayedReference):
+            # The schema is inferred once, from the first reference (or stored with it)
+            stored = reference.schema if isinstance(reference, StoredReference) else None
+            self._schema = Schema.infer(df_reference) if stored is None else stored
+        return df_current, df_reference
+
+    def run(
+        self,
+        current: pd.DataFrame,
+        reference: pd.DataFrame,
+        options: dict = {},
+        sampling: Union[dict, Sampler] = None,
+        history: MetricHistory = None,
+        memory_limit: Union[int, str] = None,
+        cascade: Union[dict, Cascade] = None,
+        thresholds: ThresholdCalibration = None,
+    ):
+        """Method run() in analyzer from the list of metrics
+
+        Parameters
+        ----------
+        current : DataFrame
+            The input current (pandas DataFrame)
+        reference : Union[DataFrame, StoredReference, DecayedReference]
+            The input reference (pandas DataFrame), the reference attached from a ReferenceStore whose stored nodes
+            (sorted values and moments) are used instead of being computed, or an incrementally maintained reference
+            the drift metrics are computed from (without summary statistics, cascade nor memory budget)
+        options : dict,optional
+            List of performance metrics names
+        sampling : Union[dict, Sampler], optional
+            Sampler (or its parameters) shared by the drift metrics without a sampling option. No sampling if None
+        history : MetricHistory, optional
+            Metric history store the results are appended to
+        memory_limit : Union[int, str], optional
+            Memory budget of the run (bytes or a string such as "2GB"). Metrics over the budget are chunked or sampled,
+            intermediates are held one feature at a time and spilled to memory-mapped files, and the memory report
+            (get_memory_report()) gives the estimated and actual peaks. No budget if None
+        cascade : Union[dict, Cascade], optional
+            Cascaded screening (or its parameters): the expensive metrics are only computed on the features flagged
+            by a cheap screen, the skipped metrics being reported with no value and in get_cascade_report(). All the
+            metrics are computed if None
+        thresholds : ThresholdCalibration, optional
+            Thresholds calibrated per feature replacing the thresholds of the options of the calibrated drift metrics.
+            The thresholds of the analyzer (see calibrate()), or the ones stored with a StoredReference, if None
+        """
+
+        df_current, df_reference = self._prepare(current, reference, options)
+        options = self._sampling_options(options, sampling)
+        budget = None if memory_limit is None else MemoryBudget(memory_limit)
+        # The stored nodes hold the float64 values of the reference
+        stored = isinstance(reference, StoredReference) and (self._precision == "float64")
+        reference_nodes = reference.nodes() if stored else None
+
+        try:
+            if isinstance(df_reference, DecayedReference):
+                # Without the rows of the reference, the metrics are computed from its states (no summary statistics)
+                self._results = [
+                    evaluate_metric(metric, df_current, df_reference, **options.get(metric._name, {}))
+                    for metric in self._metrics_list
+                ]
+                self._results = [result for result in self._results if result is not None]
+                self._apply_thresholds(reference, thresholds, options)
+                if history is not None:
+                    history.append(self.results_to_pandas(), analyzer_name=self._name)
+                return
+
+            metrics_list, skipped = self._metrics_list, []
+            if cascade is not None:
+                cascade = cascade if isinstance(cascade, Cascade) else Cascade(**cascade)
+                metrics_list, skipped = cascade.screen(self._metrics_list, df_current, df_reference, options)
+                self._cascade_report = cascade.report()
+
+            # Summary statistics. Recommended all features for users (by default) otherwise configurable based on perferences
+            self._plan = MetricPlan(metrics_list, summary_features=df_current.columns, schema=self._schema).compile(
+                df_current, df_reference, options
+            )
+            if budget is None:
+                self._results = self._plan.execute(df_current, df_reference, options, reference_nodes=reference_nodes)
+            else:
+                self._plan, options = budget.fit(self._plan, df_current, df_reference, options)
+                with budget.track():
+                    self._results = self._plan.execute(
+                        df_current,
+                        df_reference,
+                        options,
+                        bounded=True,
+                        spill_threshold=budget.spill_threshold,
+                        reference_nodes=reference_nodes,
+                    )
+                self._memory_report = budget.report()
+            self._results += Cascade.skipped_results(skipped)
+            self._apply_thresholds(reference, thresholds, options)
+            if history is not None:
+                history.append(self.results_to_pandas(), analyzer_name=self._name)
+        except Exception as e:
+            print(f"Exception in run() in the analyzers class (base): {str(e)}")
+
+    async def arun(
+        self,
+        current: pd.DataFrame,
+        reference: pd.DataFrame,
+        options: dict = {},
+        sampling: Union[dict, Sampler] = None,
+        history: MetricHistory = None,
+        executor: Union[str, Executor] = "thread",
+        batch_size: int = constant.ASYNC_BATCH_SIZE,
+        timeout: float = None,
+        limiter: asyncio.Semaphore = None,
+        thresholds: ThresholdCalibration = None,
+    ):
+        """Method arun() running the analyzer in an executor without blocking the event loop
+
+        The metrics are computed in batches of steps of the plan sharing their intermediate nodes, the event loop
+        running its other tasks between two batches. A cancelled or timed out run does not submit its next batches
+        (the running batch finishes in its worker) and raises CancelledError or TimeoutError.
+
+        Parameters
+        ----------
+        current : DataFrame
+            The input current (pandas DataFrame)
+        reference : DataFrame
+            The input reference (pandas DataFrame)
+        options : dict,optional
+            List of performance metrics names
+        sampling : Union[dict, Sampler], optional
+            Sampler (or its parameters) shared by the drift metrics without a sampling option. No sampling if None
+        history : MetricHistory, optional
+            Metric history store the results are appended to (from the event loop thread)
+        executor : Union[str, Executor], optional
+            "thread" for the default executor of the event loop, "process" for a process pool created for the run,
+            or an executor. Custom metrics defined in closures cannot be sent to processes
+        batch_size : int, optional
+            Target number of steps of a batch
+        timeout : float, optional
+            Timeout in seconds of the run, waiting for the limiter excluded. No timeout if None
+        limiter : asyncio.Semaphore, optional
+            Semaphore shared by analyzers to limit the number of concurrent runs
+        thresholds : ThresholdCalibration, optional
+            Thresholds calibrated per feature (see run())
+        """
+        if limiter is not None:
+            async with limiter:
+                return await self.arun(
+                    current, reference, options, sampling, history, executor, batch_size, timeout, thresholds=thresholds
+                )
+
+        async def run():
+            loop = asyncio.get_running_loop()
+            df_current, df_reference = await loop.run_in_executor(None, self._prepare, current, reference, options)
+            run_options = self._sampling_options(options, sampling)
+
             try:
-                self._results = []
-                # Summary statistics. Recommended all features for users (by default) otherwise configurable based on perferences
-                for feature_name in current.columns:
-                    statistics = FeatureSummary(feature_name=feature_name)
-                    statistics.evaluate(current, reference)
-                    self._results += statistics._result
-                for metric in tqdm(self._metrics_list):
-                    kwargs = options.get(metric._name, {})
-                    if isinstance(metric, (DriftMetric, DriftTestMetric)):
-                        metric.evaluate(current=df_current, reference=df_reference, **kwargs)
-                    elif isinstance(metric, PerformanceMetric):
-                        if (metric._y_name in df_current.columns) and (df_current[metric._y_name].isnull().sum() == 0):
-                            metric.evaluate(current=df_current, reference=df_reference, **kwargs)
-                        else:
-                            raise error_msg(
-                                value=None,
-                                message=f'{"Dataset has no ground truth for performance assessment"}',
-                            )
-
-                    self._results.append(metric._result)
+                plan = MetricPlan(self._metrics_list, summary_features=df_current.columns, schema=self._schema)
+                self._plan = await loop.run_in_executor(None, plan.compile, df_current, df_reference, run_options)
+                self._results = await execute_async(
+                    self._plan, df_current, df_reference, run_options, executor=executor, batch_size=batch_size
+                )
+                self._apply_thresholds(reference, thresholds, run_options)
+                if history is not None:
+                    history.append(self.results_to_pandas(), analyzer_name=self._name)
             except Exception as e:
-                print(f"Exception in run() in the analyzers class (base): {str(e)}")
+                print(f"Exception in arun() in the analyzers class (base): {str(e)}")
+
+        await asyncio.wait_for(run(), timeout)
+
+    def _sampling_options(self, options: dict, sampling: Union[dict, Sampler] = None) -> dict:
+        """Add a sampler shared by all the drift metrics to the options"""
+        if sampling is None:
+            return options
+        sampler = sampling if isinstance(sampling, Sampler) else Sampler(**sampling)
+        options = dict(options)
+        for metric in self._metrics_list:
+            if isinstance(metric, (DriftMetric, DriftTestMetric)):
+                options[metric._name] = {"sampling": sampler, **options.get(metric._name, {})}
+        return options
+
+    def explain(
+        self,
+        current: pd.DataFrame = None,
+        reference: pd.DataFrame = None,
+        options: dict = {},
+        sampling: Union[dict, Sampler] = None,
+    ) -> pd.DataFrame:
+        """Method explain() showing the plan of shared intermediate nodes of the analyzer and its estimated cost
+
+        Parameters
+        ----------
+        current : DataFrame, optional
+            The input current (pandas DataFrame). The plan of the last run is shown if None
+        reference : DataFrame, optional
+            The input reference (pandas DataFrame)
+        options : dict,optional
+            List of performance metrics names
+        sampling : Union[dict, Sampler], optional
+            Sampler (or its parameters) shared by the drift metrics. Sampled metrics are evaluated directly
+
+        Returns
+        -------
+        DataFrame
+            one row per shared node or direct evaluation, with its consumers and estimated cost
+        """
+        if current is not None:
+            df_current, df_reference = self._prepare(current, reference, options)
+            options = self._sampling_options(options, sampling)
+            self._plan = MetricPlan(self._metrics_list, summary_features=df_current.columns, schema=self._schema).compile(
+                df_current, df_reference, options
+            )
+        elif self._plan is None:
+            raise error_msg(
+                value=None,
+                message=f'{"No plan to explain, run the analyzer or give the datasets to explain()."}',
+            )
+        return self._plan.explain()
+
+    def run_partitioned(
+        self, current: pd.DataFrame, reference: pd.DataFrame, n_partitions: int = 4, processes: int = None, options: dict = {}
+    ):
+        """Method run_partitioned() computing the metrics of the analyzer over partitions of the data in worker processes
+
+        Each metric computes a compact partial state per partition, the states are then merged and finalized.
+        Summary statistics are not computed in this mode.
+
+        Parameters
+        ----------
+        current : DataFrame
+            The input current (pandas DataFrame)
+        reference : DataFrame
+            The input reference (pandas DataFrame)
+        n_partitions : int, optional
+            Number of row partitions
+        processes : int, optional
+            Number of worker processes
+        options : dict,optional
+            List of performance metrics names
+        """
+
+        df_current, df_reference = self._prepare(current, reference, options)
+
+        try:
+            self._results = run_partitioned(
+                self._metrics_list, df_current, df_reference, n_partitions=n_partitions, processes=processes, options=options
+            )
+            self._apply_thresholds(reference, options=options)
+        except Exception as e:
+            print(f"Exception in run_partitioned() in the analyzers class (base): {str(e)}")
@@ -0,0 +1,231 @@
+#  Author:   Adel Benlagra  <abenlagra@rocketscience.one>
+import json
+from concurrent.futures import Executor, ThreadPoolExecutor
+from functools import partial
+from typing import Union
+
+import constant
+import numpy as np
+import pandas as pd
+
+from ..exceptions import CustomExceptionPulsarMetric as error_msg
+from ..metrics.drift import DriftMetric, DriftTestMetric
+from ..metrics.enums import DriftMetricsFuncs, DriftTestMetricsFuncs, MetricsType
+from ..utils import compare_to_threshold
+from .asynchronous import _WORKER_DATA, EXECUTORS, make_executor
+from .plan import MetricPlan
+
+# Options of the metrics that do not change their values under the null distribution
+_IGNORED_OPTIONS = {"threshold", "upper_bound", "alpha", "sampling", "bootstrap", "n_bootstrap", "seed"}
+
+
+def _evaluate_split(reference: pd.DataFrame, metrics: list, options: dict, current_size: int, order: np.ndarray) -> list:
+    """Null values of the metrics on a split of the reference (NaN for the metrics without a value)"""
+    # Metrics are instantiated per split, as their results are held by the instances
+    split_metrics = [(DriftTestMetric if test else DriftMetric)(name, feature) for name, feature, test in metrics]
+    current, rest = reference.iloc[order[:current_size]], reference.iloc[order[current_size:]]
+    plan = MetricPlan(split_metrics).compile(current, rest, options)
+    results = plan.execute_steps(current, rest, options, progress=False)
+    return [step[0].metric_value if step and (step[0] is not None) else np.nan for step in results]
+
+
+def _evaluate_attached_split(metrics: list, current_size: int, order: np.ndarray) -> list:
+    """Evaluate a split of the reference attached to the worker of a process pool"""
+    return _evaluate_split(_WORKER_DATA["reference"], metrics, _WORKER_DATA["options"], current_size, order)
+
+
+class ThresholdCalibration:
+    """Thresholds of the drift metrics calibrated feature by feature on the reference
+
+    The null distribution of every metric on every feature is estimated by splitting the reference against itself:
+    each split draws a random current of current_size rows and compares it to the other rows of the reference. The
+    splits are evaluated with the metric plans (the nodes of a feature and the histograms of all the features being
+    shared by the metrics) in parallel worker processes. The threshold of a drift metric is the 1 - alpha quantile of
+    its null values, the threshold of a drift test the alpha quantile of its null p-values, so that about a fraction
+    alpha of the runs without drift is flagged whatever the number of bins or rows of the feature.
+
+    The thresholds are looked up by (metric name, feature) when they are applied to the results of a run, and the
+    drift statuses are the ones the metrics give with the calibrated threshold as their threshold option: a drift
+    metric compares its value to the threshold according to its upper_bound option (True when the value is below the
+    threshold with the default upper_bound, above it with upper_bound False), a test is True when its p-value is below
+    the threshold.
+    """
+
+    def __init__(self, thresholds: dict = {}, alpha: float = constant.SIGNIFICANCE_LEVEL, n_splits: int = None):
+        """Constructor of the ThresholdCalibration class
+
+        Parameters
+        ----------
+        thresholds : dict
+            Calibrated threshold of every metric, keyed by (metric name, feature)
+        alpha : float, optional
+            Target rate of drift statuses without drift
+        n_splits : int, optional
+            Number of splits of the reference the thresholds were calibrated on
+        """
+        self._thresholds = dict(thresholds)
+        self.alpha = alpha
+        self.n_splits = n_splits
+
+    @classmethod
+    def fit(
+        cls,
+        reference: pd.DataFrame,
+        metrics_list: list,
+        options: dict = {},
+        n_splits: int = constant.CALIBRATION_SPLITS,
+        alpha: float = constant.SIGNIFICANCE_LEVEL,
+        current_size: int = None,
+        n_jobs: int = 1,
+        seed: int = constant.SEED_SIZE,
+        executor: Union[str, Executor] = "process",
+    ) -> "ThresholdCalibration":
+        """Calibrate the thresholds of drift metrics on splits of the reference
+
+        Parameters
+        ----------
+        reference : DataFrame
+            The input reference (pandas DataFrame)
+        metrics_list : list
+            List of metrics, the built-in drift metrics and tests being calibrated
+        options : dict, optional
+            Options of the metrics, keyed by metric name
+        n_splits : int, optional
+            Number of splits of the reference
+        alpha : float, optional
+            Target rate of drift statuses without drift
+        current_size : int, optional
+            Number of rows of the current side of a split (half of the reference if None), ideally the size of the
+            current datasets the thresholds are applied to
+        n_jobs : int, optional
+            Number of workers evaluating the splits
+        seed : int, optional
+            seed value for random number generator
+        executor : Union[str, Executor], optional
+            "process" for a pool of n_jobs processes receiving the reference once per worker, "thread" for n_jobs
+            threads sharing it, or an executor (used whatever n_jobs)
+
+        Returns
+        -------
+        ThresholdCalibration
+            the calibrated thresholds
+        """
+        builtin = DriftMetricsFuncs._member_names_ + DriftTestMetricsFuncs._member_names_
+        metrics = list(
+            dict.fromkeys(
+                (metric._name, metric._feature_name, isinstance(metric, DriftTestMetric))
+                for metric in metrics_list
+                if isinstance(metric, (DriftMetric, DriftTestMetric)) and (metric._name in builtin)
+                if metric._feature_name in reference.columns
+            )
+        )
+        if not isinstance(executor, Executor) and (executor not in EXECUTORS):
+            raise error_msg(
+                value=executor,
+                message=f"InvalidInput: executor should be an Executor or one of {EXECUTORS}",
+            )
+        current_size = len(reference) // 2 if current_size is None else current_size
+        if not (0 < current_size < len(reference)):
+            raise error_msg(
+                value=current_size,
+                message=f'{"InvalidInput: current_size should be between 1 and the number of reference rows minus 1"}',
+            )
+        options = {
+            name: {key: value for key, value in metric_options.items() if key not in _IGNORED_OPTIONS}
+            for name, metric_options in options.items()
+        }
+        orders = [np.random.default_rng(seed + split).permutation(len(reference)) for split in range(n_splits)]
+
+        evaluate = partial(_evaluate_split, reference, metrics, options, current_size)
+        if isinstance(executor, Executor):
+            null_values = list(executor.map(evaluate, orders))
+        elif n_jobs > 1:
+            if executor == "process":
+                pool, _ = make_executor("process", reference=reference, options=options, max_workers=n_jobs)
+                evaluate = partial(_evaluate_attached_split, metrics, current_size)
+            else:
+                pool = ThreadPoolExecutor(max_workers=n_jobs)
+            with pool:
+                null_values = list(pool.map(evaluate, orders))
+        else:
+            null_values = [evaluate(order) for order in orders]
+
+        null_values = np.array(null_values, dtype=float).reshape(n_splits, len(metrics))
+        thresholds = {}
+        for column, (name, feature, test) in enumerate(metrics):
+            values = null_values[:, column]
+            if np.isnan(values).all():
+                continue
+            # Quantiles on the values, as null values may be infinite (psi of empty bins)
+            quantile = np.nanquantile(values, alpha if test else 1 - alpha, method="lower" if test else "higher")
+            thresholds[(name, feature)] = float(quantile)
+        return cls(thresholds, alpha=alpha, n_splits=n_splits)
+
+    def __len__(self) -> int:
+        return len(self._thresholds)
+
+    def __contains__(self, key) -> bool:
+        return key in self._thresholds
+
+    def threshold(self, metric_name: str, feature: str) -> float:
+        """Calibrated threshold of a metric on a feature (None if it is not calibrated)"""
+        return self._thresholds.get((metric_name, feature))
+
+    def apply(self, results: list, options: dict = {}) -> list:
+        """Replace the thresholds and drift statuses of the results of the calibrated metrics
+
+        Parameters
+        ----------
+        results : list
+            Results of a run (MetricResults)
+        options : dict, optional
+            Options of the metrics of the run, keyed by metric name (giving the upper_bound of the drift metrics)
+
+        Returns
+        -------
+        list
+            the results, updated in place
+        """
+        for result in results:
+            if result.metric_type != MetricsType.drift.value:
+                continue
+            threshold = self._thresholds.get((result.metric_name, result.feature_name))
+            if (threshold is None) or (result.metric_value is None):
+                continue
+            result.threshold = threshold
+            if result.metric_name in DriftTestMetricsFuncs._member_names_:
+                result.drift_status = bool(result.metric_value < threshold)
+            else:
+                upper_bound = options.get(result.metric_name, {}).get("upper_bound", True)
+                result.drift_status = bool(compare_to_threshold(result.metric_value, threshold, upper_bound=upper_bound))
+        return results
+
+    def to_dict(self) -> dict:
+        return {
+            "alpha": self.alpha,
+            "n_splits": self.n_splits,
+            "thresholds": [
+                {"metric_name": name, "feature": feature, "threshold": threshold}
+                for (name, feature), threshold in self._thresholds.items()
+            ],
+        }
+
+    @staticmethod
+    def from_dict(data: dict) -> "ThresholdCalibration":
+        thresholds = {(row["metric_name"], row["feature"]): row["threshold"] for row in data["thresholds"]}
+        return ThresholdCalibration(thresholds, alpha=data["alpha"], n_splits=data["n_splits"])
+
+    def save(self, path: str):
+        """Save the thresholds to a JSON file"""
+        with open(path, "w") as file:
+            json.dump(self.to_dict(), file, indent=2)
+
+    @staticmethod
+    def load(path: str) -> "ThresholdCalibration":
+        """Load thresholds from a JSON file"""
+        with open(path) as file:
+            return ThresholdCalibration.from_dict(json.load(file))
+
+    def to_pandas(self) -> pd.DataFrame:
+        """The thresholds as a DataFrame, one row per metric and feature"""
+        return pd.DataFrame(self.to_dict()["thresholds"], columns=["metric_name", "feature", "threshold"])
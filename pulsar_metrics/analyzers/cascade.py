@@ -0,0 +1,176 @@
+#  Author:   Adel Benlagra  <abenlagra@rocketscience.one>
+import constant
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_numeric_dtype
+
+from ..exceptions import CustomExceptionPulsarMetric as error_msg
+from ..metrics.base import MetricResults
+from ..metrics.drift import DriftMetric, DriftTestMetric
+from ..metrics.embeddings import is_vector_column
+from ..metrics.enums import MetricsType
+from ..metrics.histograms import FrozenBinning, psi_from_binned
+
+SCREENS = ("psi", "moments")
+# Metrics only computed on the features flagged by the screen: rank tests, kernel and variance tests
+EXPENSIVE_METRICS = ("CvM", "manwu", "mmd", "levene", "bftest")
+
+_SCREEN_THRESHOLDS = {"psi": constant.CASCADE_PSI_THRESHOLD, "moments": constant.CASCADE_SHIFT_THRESHOLD}
+
+
+def _quantile_counts(current: pd.DataFrame, reference: pd.DataFrame, features: list, n_bins: int) -> tuple:
+    """Counts of numeric features on bins between the quantiles of the reference, with the mask of the bins"""
+    counts = np.zeros((2, len(features), n_bins))
+    mask = np.zeros((len(features), n_bins), dtype=bool)
+    for row, feature in enumerate(features):
+        ref = reference[feature].to_numpy(dtype=float)
+        ref = ref[~np.isnan(ref)]
+        edges = np.unique(np.quantile(ref, np.linspace(0, 1, n_bins + 1)[1:-1])) if len(ref) else np.array([])
+        mask[row, : len(edges) + 1] = True
+        for side, data in enumerate((current, reference)):
+            values = data[feature].to_numpy(dtype=float)
+            values = values[~np.isnan(values)]
+            counts[side, row, : len(edges) + 1] = np.bincount(
+                np.searchsorted(edges, values, side="right"), minlength=len(edges) + 1
+            )
+    return counts[0], counts[1], mask
+
+
+def psi_screen(current: pd.DataFrame, reference: pd.DataFrame, features: list) -> pd.Series:
+    """PSI of every feature (smoothed) on bins frozen on the reference: between the reference deciles for the
+    numeric features, one per reference category for the others"""
+    numeric = [feature for feature in features if is_numeric_dtype(current[feature]) and is_numeric_dtype(reference[feature])]
+    categorical = [feature for feature in features if feature not in numeric]
+    current_counts, reference_counts, mask = _quantile_counts(current, reference, numeric, constant.CASCADE_SCREEN_BINS)
+    scores = pd.Series(psi_from_binned(current_counts, reference_counts, mask=mask), index=numeric, dtype=float)
+    if categorical:
+        binning = FrozenBinning(reference, categorical)
+        psi = psi_from_binned(binning.counts(current), binning.counts(reference), mask=binning.mask)
+        scores = pd.concat([scores, pd.Series(psi, index=categorical)])
+    return scores.reindex(features)
+
+
+def moments_screen(current: pd.DataFrame, reference: pd.DataFrame, features: list) -> pd.Series:
+    """Largest of the mean shift and of the relative change of the standard deviation, both in reference standard
+    deviations, of every numeric feature (NaN for the other features)"""
+    numeric = [feature for feature in features if is_numeric_dtype(current[feature]) and is_numeric_dtype(reference[feature])]
+    cur, ref = current[numeric], reference[numeric]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scale = ref.std().to_numpy()
+        shift = np.abs(cur.mean().to_numpy() - ref.mean().to_numpy()) / scale
+        spread = np.abs(cur.std().to_numpy() / scale - 1)
+    # A constant reference gives an infinite score to any change and no score to none
+    scores = pd.Series(np.fmax(shift, spread), index=numeric)
+    return scores.reindex(features)
+
+
+_SCREENS = {"psi": psi_screen, "moments": moments_screen}
+
+
+class Cascade:
+    """Cascaded screening of the drift metrics of an analyzer
+
+    A cheap screening score (the PSI on reference-frozen bins, or the mean and standard deviation shifts from the
+    moments) is computed for all the features at once. The expensive metrics (rank and kernel tests, and the
+    metrics with a bootstrap confidence interval) are then only computed on the features whose score crosses the
+    screening threshold, a looser threshold than the alerting one. The skipped metrics are reported with no value
+    and listed by feature in the report of the screen. Features the screen cannot score (missing from a dataset,
+    embedding columns, non-numeric features for the moments screen) are always fully computed.
+    """
+
+    def __init__(self, screen: str = "psi", threshold: float = None, expensive: list = EXPENSIVE_METRICS):
+        """Constructor of the Cascade class
+
+        Parameters
+        ----------
+        screen : str, optional
+            "psi" or "moments"
+        threshold : float, optional
+            Screening score above which a feature is suspect (a default per screen if None)
+        expensive : list, optional
+            Names of the metrics only computed on the suspect features
+        """
+        if screen not in SCREENS:
+            raise error_msg(
+                value=screen,
+                message=f"InvalidInput: cascade screen should be one of {SCREENS}",
+            )
+        self._screen = screen
+        self._threshold = _SCREEN_THRESHOLDS[screen] if threshold is None else threshold
+        self._expensive = tuple(expensive)
+        self._report = None
+
+    def is_expensive(self, metric, options: dict = {}) -> bool:
+        """Whether a metric is only computed on the suspect features"""
+        if getattr(metric, "_feature_name", None) is None:
+            return False
+        metric_options = options.get(metric._name, {})
+        return (metric._name in self._expensive) or ("sampling" in metric_options) or bool(metric_options.get("bootstrap"))
+
+    def scores(self, current: pd.DataFrame, reference: pd.DataFrame, features: list) -> pd.Series:
+        """Screening scores of the features, NaN for the features the screen cannot score"""
+        scorable = [
+            feature
+            for feature in features
+            if (feature in current.columns) and (feature in reference.columns) and not is_vector_column(current[feature])
+        ]
+        scores = _SCREENS[self._screen](current, reference, scorable) if scorable else pd.Series(dtype=float)
+        return scores.reindex(features)
+
+    def screen(self, metrics_list: list, current: pd.DataFrame, reference: pd.DataFrame, options: dict = {}) -> tuple:
+        """Split the metrics into the metrics to compute and the metrics skipped on stable features
+
+        Parameters
+        ----------
+        metrics_list : list
+            List of metrics
+        current : DataFrame
+            The input current (pandas DataFrame)
+        reference : DataFrame
+            The input reference (pandas DataFrame)
+        options : dict, optional
+            Options of the metrics, keyed by metric name
+
+        Returns
+        -------
+        tuple
+            the list of metrics to compute and the list of skipped metrics
+        """
+        expensive = [metric for metric in metrics_list if self.is_expensive(metric, options)]
+        features = list(dict.fromkeys(metric._feature_name for metric in expensive))
+        scores = self.scores(current, reference, features)
+        # Unscored features are suspect
+        suspect = ~(scores <= self._threshold)
+
+        skipped = [metric for metric in expensive if not suspect[metric._feature_name]]
+        skipped_ids = set(map(id, skipped))
+        self._report = pd.DataFrame(
+            {
+                "feature_name": features,
+                "screen": self._screen,
+                "score": scores.to_numpy(),
+                "threshold": self._threshold,
+                "suspect": suspect.to_numpy(),
+                "skipped": [[metric._name for metric in skipped if metric._feature_name == feature] for feature in features],
+            }
+        )
+        return [metric for metric in metrics_list if id(metric) not in skipped_ids], skipped
+
+    @staticmethod
+    def skipped_results(skipped: list) -> list:
+        """Results of the skipped metrics, with no value and no drift status"""
+        return [
+            MetricResults(
+                metric_type=MetricsType.drift.value
+                if isinstance(metric, (DriftMetric, DriftTestMetric))
+                else MetricsType.custom.value,
+                metric_name=metric._name,
+                feature_name=metric._feature_name,
+                metric_value=None,
+            )
+            for metric in skipped
+        ]
+
+    def report(self) -> pd.DataFrame:
+        """Screening score, suspect status and skipped metrics of the screened features of the last screen"""
+        return self._report
@@ -0,0 +1,126 @@
+#  Author:   Adel Benlagra  <abenlagra@rocketscience.one>
+from functools import reduce
+from multiprocessing import Pool
+
+import numpy as np
+import pandas as pd
+
+from ..metrics.base import AbstractMetrics, MetricResults
+from .plan import evaluate_metric
+
+
+def _partition_options(options: dict, index: int) -> dict:
+    """Give each partition its index, drawing its Poisson bootstrap replicates from its own child of the seed"""
+    return {**options, "partition": index}
+
+
+def compute_partials(
+    metrics_list: list, current: pd.DataFrame, reference: pd.DataFrame = None, options: dict = {}, index: int = 0
+):
+    """Compute the partial states of a list of metrics on one partition of the data
+
+    Parameters
+    ----------
+    metrics_list : list
+        List of metrics implementing the compute_partial/merge/finalize protocol
+    current : DataFrame
+        The partition of the current data (pandas DataFrame)
+    reference : DataFrame, optional
+        The partition of the reference data (pandas DataFrame)
+    options : dict, optional
+        Options of the metrics, keyed by metric name
+    index : int, optional
+        Index of the partition
+
+    Returns
+    -------
+    list
+        the partial states of the metrics
+    """
+    return [
+        metric.compute_partial(current, reference, **_partition_options(options.get(metric._name, {}), index))
+        for metric in metrics_list
+    ]
+
+
+def _compute_partials(args):
+    return compute_partials(*args)
+
+
+def run_partitioned(
+    metrics_list: list,
+    current: pd.DataFrame,
+    reference: pd.DataFrame = None,
+    n_partitions: int = 4,
+    processes: int = None,
+    options: dict = {},
+) -> list:
+    """Local multiprocessing driver computing a list of metrics over partitions of the data
+
+    The current and reference datasets are split into n_partitions row partitions. Each worker process
+    computes the partial states of every metric on its partition, the parent process merges the states
+    and finalizes the results. Exact states give the same results as a single node, sketch-based states
+    give approximate results. The metrics without a partial state (such as chi2, custom metrics or drift metrics
+    of embedding columns) are evaluated directly on the full data by the parent process.
+
+    Parameters
+    ----------
+    metrics_list : list
+        List of metrics implementing the compute_partial/merge/finalize protocol
+    current : DataFrame
+        The input current (pandas DataFrame)
+    reference : DataFrame, optional
+        The input reference (pandas DataFrame)
+    n_partitions : int, optional
+        Number of row partitions
+    processes : int, optional
+        Number of worker processes (os.cpu_count() if None). No pool is started if equal to 1
+    options : dict, optional
+        Options of the metrics, keyed by metric name
+
+    Returns
+    -------
+    list
+        the MetricResults of the metrics
+    """
+    partitioned = [metric for metric in metrics_list if metric.has_partial_state(current)]
+    current_partitions = np.array_split(current, n_partitions)
+    reference_partitions = np.array_split(reference, n_partitions) if reference is not None else [None] * n_partitions
+    tasks = [(partitioned, cur, ref, options, i) for i, (cur, ref) in enumerate(zip(current_partitions, reference_partitions))]
+
+    if (processes == 1) or not partitioned:
+        partials = [_compute_partials(task) for task in tasks]
+    else:
+        with Pool(processes) as pool:
+            partials = pool.map(_compute_partials, tasks)
+
+    results = {
+        id(metric): finalize_partials(metric, [states[i] for states in partials], options.get(metric._name, {}))
+        for i, metric in enumerate(partitioned)
+    }
+    return [
+        results[id(metric)]
+        if id(metric) in results
+        else evaluate_metric(metric, current, reference, **options.get(metric._name, {}))
+        for metric in metrics_list
+    ]
+
+
+def finalize_partials(metric: AbstractMetrics, states: list, options: dict = {}) -> MetricResults:
+    """Merge the partial states of a metric and finalize its result
+
+    Parameters
+    ----------
+    metric : AbstractMetrics
+        A metric implementing the compute_partial/merge/finalize protocol
+    states : list
+        The partial states of the metric
+    options : dict, optional
+        Options of the metric
+
+    Returns
+    -------
+    MetricResults
+        the result of the metric
+    """
+    return metric.finalize(reduce(metric.merge, states), **options)
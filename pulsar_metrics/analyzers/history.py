@@ -0,0 +1,314 @@
+#  Author:   Adel Benlagra  <abenlagra@rocketscience.one>
+import json
+import sqlite3
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from ..exceptions import CustomExceptionPulsarMetric as error_msg
+
+# Bucket length in seconds of the downsampled roll-ups. Weeks start on Monday (the epoch is a Thursday)
+ROLLUP_RESOLUTIONS = {"hour": 3600, "day": 86400, "week": 604800}
+_ROLLUP_OFFSETS = {"hour": 0, "day": 0, "week": 345600}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS metrics (
+    period_start INTEGER,
+    period_end INTEGER NOT NULL,
+    eval_timestamp INTEGER,
+    analyzer TEXT,
+    model_id TEXT NOT NULL,
+    model_version TEXT NOT NULL,
+    metric_type TEXT,
+    metric_name TEXT NOT NULL,
+    feature_name TEXT NOT NULL DEFAULT '',
+    metric_value NUMERIC,
+    drift_status INTEGER,
+    threshold TEXT,
+    conf_low REAL,
+    conf_high REAL,
+    sample_size INTEGER
+);
+CREATE INDEX IF NOT EXISTS metrics_series
+    ON metrics (metric_name, feature_name, model_id, model_version, period_end);
+CREATE INDEX IF NOT EXISTS metrics_period
+    ON metrics (model_id, model_version, period_end);
+CREATE TABLE IF NOT EXISTS rollups (
+    resolution TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    model_id TEXT NOT NULL,
+    model_version TEXT NOT NULL,
+    metric_type TEXT,
+    metric_name TEXT NOT NULL,
+    feature_name TEXT NOT NULL,
+    n INTEGER NOT NULL,
+    total REAL,
+    minimum REAL,
+    maximum REAL,
+    n_drift INTEGER NOT NULL,
+    PRIMARY KEY (resolution, metric_name, feature_name, model_id, model_version, bucket)
+) WITHOUT ROWID;
+"""
+
+# Roll-ups of the raw rows appended after a given rowid, merged into the existing buckets
+_ROLLUP_UPSERT = """
+INSERT INTO rollups
+SELECT ?, period_end - ((period_end - ?) % ?), model_id, model_version, MAX(metric_type), metric_name, feature_name,
+       COUNT(*), SUM(metric_value), MIN(metric_value), MAX(metric_value), COALESCE(SUM(drift_status = 1), 0)
+FROM metrics
+WHERE rowid > ? AND typeof(metric_value) IN ('integer', 'real')
+GROUP BY 2, model_id, model_version, metric_name, feature_name
+ON CONFLICT (resolution, metric_name, feature_name, model_id, model_version, bucket) DO UPDATE SET
+    n = n + excluded.n,
+    total = total + excluded.total,
+    minimum = MIN(minimum, excluded.minimum),
+    maximum = MAX(maximum, excluded.maximum),
+    n_drift = n_drift + excluded.n_drift
+"""
+
+_COLUMNS = [
+    "period_start",
+    "period_end",
+    "eval_timestamp",
+    "analyzer",
+    "model_id",
+    "model_version",
+    "metric_type",
+    "metric_name",
+    "feature_name",
+    "metric_value",
+    "drift_status",
+    "threshold",
+    "conf_low",
+    "conf_high",
+    "sample_size",
+]
+
+
+def _to_epoch(value) -> int:
+    """Epoch seconds of a date, a timestamp or a string"""
+    if value is None or (not isinstance(value, str) and pd.isnull(value)):
+        return None
+    return int(pd.Timestamp(value).value // 10**9)
+
+
+def _to_sql(value):
+    """Python scalar of a numpy/pandas value, None for missing values"""
+    if value is None or (np.ndim(value) == 0 and not isinstance(value, str) and pd.isnull(value)):
+        return None
+    return value.item() if isinstance(value, np.generic) else value
+
+
+class MetricHistory:
+    """Local history of metric results in a SQLite database
+
+    Raw results are stored with indexes on the (metric, feature, model, period) series and on the model periods,
+    so that trend and top-k queries only read the rows of the requested range. Hourly, daily and weekly roll-ups
+    (count, sum, min, max and number of drifts of each series) are maintained incrementally at append time,
+    which lets old raw rows be compacted away while long-range trends stay available.
+    """
+
+    def __init__(self, path: str = ":memory:"):
+        """Constructor of the MetricHistory class
+
+        Parameters
+        ----------
+        path : str, optional
+            Path of the SQLite database file (an in-memory database if ":memory:")
+        """
+        self._path = path
+        self._connection = sqlite3.connect(path)
+        self._connection.executescript(_SCHEMA)
+
+    def close(self):
+        self._connection.close()
+
+    def append(self, results: pd.DataFrame, analyzer_name: str = None) -> int:
+        """Append metric results to the history and update the roll-ups
+
+        Parameters
+        ----------
+        results : DataFrame
+            Results of an analyzer (Analyzer.results_to_pandas()), with the model_id, model_version and
+            period_end columns
+        analyzer_name : str, optional
+            Name of the analyzer
+
+        Returns
+        -------
+        int
+            the number of appended rows
+        """
+        if results is None or len(results) == 0:
+            return 0
+        for column in ["model_id", "model_version", "metric_name"]:
+            if column not in results.columns:
+                raise error_msg(
+                    value=column,
+                    message=f'{"InvalidInput: the results to append have no model metadata"}',
+                )
+
+        period_end = results["period_end"] if "period_end" in results.columns else pd.Series(datetime.now(), results.index)
+        conf_int = results["conf_int"] if "conf_int" in results.columns else pd.Series(None, results.index, dtype=object)
+        rows = [
+            (
+                _to_epoch(row.get("period_start")),
+                _to_epoch(end),
+                _to_epoch(row.get("eval_timestamp")),
+                analyzer_name,
+                str(row["model_id"]),
+                str(row["model_version"]),
+                row.get("metric_type"),
+                row["metric_name"],
+                _to_sql(row.get("feature_name")) or "",
+                _to_sql(row.get("metric_value")),
+                _to_sql(row.get("drift_status")),
+                json.dumps(_to_sql(row.get("threshold")), default=float),
+                _to_sql(interval[0]) if isinstance(interval, (list, tuple)) else None,
+                _to_sql(interval[1]) if isinstance(interval, (list, tuple)) else None,
+                _to_sql(row.get("sample_size")),
+            )
+            for row, end, interval in zip(results.to_dict("records"), period_end, conf_int)
+        ]
+
+        with self._connection:
+            last_rowid = self._connection.execute("SELECT COALESCE(MAX(rowid), 0) FROM metrics").fetchone()[0]
+            self._connection.executemany(
+                f"INSERT INTO metrics ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})", rows
+            )
+            for resolution, seconds in ROLLUP_RESOLUTIONS.items():
+                self._connection.execute(_ROLLUP_UPSERT, (resolution, _ROLLUP_OFFSETS[resolution], seconds, last_rowid))
+        return len(rows)
+
+    @staticmethod
+    def _filters(column: str, model_id=None, model_version=None, start=None, end=None, **equals) -> tuple:
+        """SQL conditions and parameters of a range query"""
+        conditions, parameters = [], []
+        for name, value in [("model_id", model_id), ("model_version", model_version), *equals.items()]:
+            if value is not None:
+                conditions.append(f"{name} = ?")
+                parameters.append(str(value) if name in ("model_id", "model_version") else value)
+        if start is not None:
+            conditions.append(f"{column} >= ?")
+            parameters.append(_to_epoch(start))
+        if end is not None:
+            conditions.append(f"{column} < ?")
+            parameters.append(_to_epoch(end))
+        return (" WHERE " + " AND ".join(conditions)) if conditions else "", parameters
+
+    def query(
+        self,
+        metric_name: str = None,
+        feature_name: str = None,
+        model_id=None,
+        model_version=None,
+        start=None,
+        end=None,
+        resolution: str = "raw",
+    ) -> pd.DataFrame:
+        """Range query of the history of a metric
+
+        Parameters
+        ----------
+        metric_name : str, optional
+            Name of the metric (all the metrics if None)
+        feature_name : str, optional
+            Name of the feature (all the features if None)
+        model_id : optional
+            Model id (all the models if None)
+        model_version : optional
+            Model version (all the versions if None)
+        start : optional
+            Start (included) of the range of period ends
+        end : optional
+            End (excluded) of the range of period ends
+        resolution : str, optional
+            "raw" for the raw results, or one of "hour", "day" and "week" for the roll-ups
+
+        Returns
+        -------
+        DataFrame
+            the results (or the roll-ups) sorted by period
+        """
+        equals = {"metric_name": metric_name, "feature_name": feature_name}
+        if resolution == "raw":
+            where, parameters = self._filters("period_end", model_id, model_version, start, end, **equals)
+            history = pd.read_sql_query(f"SELECT * FROM metrics{where} ORDER BY period_end", self._connection, params=parameters)
+            for column in ["period_start", "period_end", "eval_timestamp"]:
+                history[column] = pd.to_datetime(history[column], unit="s")
+            return history
+
+        if resolution not in ROLLUP_RESOLUTIONS:
+            raise error_msg(
+                value=resolution,
+                message=f"InvalidInput: resolution should be raw or one of {list(ROLLUP_RESOLUTIONS)}",
+            )
+        where, parameters = self._filters("bucket", model_id, model_version, start, end, resolution=resolution, **equals)
+        rollups = pd.read_sql_query(
+            "SELECT bucket, model_id, model_version, metric_type, metric_name, feature_name, n, total * 1.0 / n AS mean, "
+            f"minimum, maximum, n_drift FROM rollups{where} ORDER BY bucket",
+            self._connection,
+            params=parameters,
+        )
+        rollups["bucket"] = pd.to_datetime(rollups["bucket"], unit="s")
+        return rollups
+
+    def top_drifting(
+        self, k: int = 10, metric_name: str = None, model_id=None, model_version=None, start=None, end=None
+    ) -> pd.DataFrame:
+        """Features with the highest drift rate over a range of periods
+
+        Parameters
+        ----------
+        k : int, optional
+            Number of features
+        metric_name : str, optional
+            Name of the metric (all the drift metrics if None)
+        model_id : optional
+            Model id (all the models if None)
+        model_version : optional
+            Model version (all the versions if None)
+        start : optional
+            Start (included) of the range of period ends
+        end : optional
+            End (excluded) of the range of period ends
+
+        Returns
+        -------
+        DataFrame
+            the k features with their number of results, number of drifts and drift rate
+        """
+        where, parameters = self._filters(
+            "period_end", model_id, model_version, start, end, metric_name=metric_name, metric_type="drift"
+        )
+        # Results without a drift status (no threshold) are not counted
+        where += " AND drift_status IS NOT NULL"
+        return pd.read_sql_query(
+            "SELECT model_id, model_version, feature_name, COUNT(*) AS n, SUM(drift_status = 1) AS n_drift, "
+            f"AVG(drift_status = 1) AS drift_rate FROM metrics{where} "
+            "GROUP BY model_id, model_version, feature_name ORDER BY drift_rate DESC, n_drift DESC LIMIT ?",
+            self._connection,
+            params=parameters + [k],
+        )
+
+    def compact(self, before, vacuum: bool = True) -> int:
+        """Delete the raw results of the periods ending before a date, their roll-ups being kept
+
+        Parameters
+        ----------
+        before :
+            Raw results with a period end strictly before this date are deleted
+        vacuum : bool, optional
+            Rebuild the database file to reclaim the space of the deleted rows
+
+        Returns
+        -------
+        int
+            the number of deleted rows
+        """
+        with self._connection:
+            deleted = self._connection.execute("DELETE FROM metrics WHERE period_end < ?", (_to_epoch(before),)).rowcount
+        if vacuum:
+            self._connection.execute("VACUUM")
+        return deleted
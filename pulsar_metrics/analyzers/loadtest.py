@@ -0,0 +1,369 @@
+#  Author:   Adel Benlagra  <abenlagra@rocketscience.one>
+import json
+import os
+import platform
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from ..exceptions import CustomExceptionPulsarMetric as error_msg
+from .base import Analyzer
+from .schema import Schema
+
+try:
+    import resource
+except ImportError:  # pragma: no cover (not available on Windows)
+    resource = None
+
+# Bundled datasets the synthetic streams are sampled from
+DATASETS = {"california": "california_ref.csv", "kidney": "kidney_ref.csv", "client": "dataframe_client.csv"}
+SHIFTS = ("mean", "variance", "category")
+
+# Standard deviation of the noise of the synthetic copies of the features, in standard deviations of the feature
+_COPY_NOISE = 0.1
+
+
+def peak_rss() -> int:
+    """Peak resident set size of the process in bytes (None where it cannot be measured)"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return int(peak) if sys.platform == "darwin" else int(peak) * 1024
+
+
+class Scenario:
+    """Scenario of a load test: the synthetic stream, the analyzers it drives and the injected drifts
+
+    Scenarios are read from JSON files, so that the results of a fixed scenario are comparable between releases.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        dataset: str = "california",
+        rows: int = 5000,
+        reference_rows: int = None,
+        features: int = None,
+        model_versions: int = 1,
+        windows: int = 10,
+        duration: float = None,
+        metrics: list = ["ks_2samp"],
+        options: dict = {},
+        drifts: list = [],
+        seed: int = 123,
+        precision: str = "float64",
+    ):
+        """Constructor of the Scenario class
+
+        Parameters
+        ----------
+        name : str
+            Name of the scenario
+        dataset : str, optional
+            Bundled dataset the rows are sampled from, one of the keys of DATASETS
+        rows : int, optional
+            Number of rows of a window of a model version
+        reference_rows : int, optional
+            Number of rows of the reference of a model version (rows if None)
+        features : int, optional
+            Number of monitored features: the features of the dataset are completed with noisy copies (all the
+            features of the dataset if None)
+        model_versions : int, optional
+            Number of model versions, each with its analyzer, reference and stream
+        windows : int, optional
+            Number of windows of the stream
+        duration : float, optional
+            Minimum duration of the test in seconds: the stream goes on past its windows until it is reached
+        metrics : list, optional
+            Drift metrics computed on every feature
+        options : dict, optional
+            Options of the metrics, keyed by metric name
+        drifts : list, optional
+            Injected drifts, dicts with the feature, the kind of shift ("mean", "variance" or "category"), its
+            magnitude (in reference standard deviations, relative change of the spread, or fraction of the rows moved
+            to the rarest category) and the start window
+        seed : int, optional
+            seed value for random number generator
+        precision : str, optional
+            Compute mode of the analyzers ("float64" or "float32")
+        """
+        if dataset not in DATASETS:
+            raise error_msg(value=dataset, message=f"InvalidInput: dataset should be one of {list(DATASETS)}")
+        for drift in drifts:
+            if drift.get("kind") not in SHIFTS:
+                raise error_msg(value=drift, message=f"InvalidInput: the kind of an injected drift should be one of {SHIFTS}")
+        self.name = name
+        self.dataset = dataset
+        self.rows = rows
+        self.reference_rows = rows if reference_rows is None else reference_rows
+        self.features = features
+        self.model_versions = model_versions
+        self.windows = windows
+        self.duration = duration
+        self.metrics = list(metrics)
+        self.options = options
+        self.drifts = [{"magnitude": 1.0, "start": 0, **drift} for drift in drifts]
+        self.seed = seed
+        self.precision = precision
+
+    def to_dict(self) -> dict:
+        return dict(vars(self))
+
+    @staticmethod
+    def from_dict(data: dict) -> "Scenario":
+        return Scenario(**data)
+
+    @staticmethod
+    def load(path: str) -> list:
+        """Load the scenarios of a JSON file (a scenario or a list of scenarios under the "scenarios" key)"""
+        with open(path) as file:
+            data = json.load(file)
+        return [Scenario.from_dict(scenario) for scenario in data.get("scenarios", [data])]
+
+
+class SyntheticStream:
+    """Synthetic prediction stream of the model versions of a scenario
+
+    The rows of the references and of the windows are sampled with replacement from the same bundled dataset, so
+    that the stream only drifts where a drift is injected. Features are scaled with noisy copies of the numeric
+    features (copies of the other ones), named after the copied feature.
+    """
+
+    def __init__(self, scenario: Scenario, data_dir: str = "data"):
+        """Constructor of the SyntheticStream class
+
+        Parameters
+        ----------
+        scenario : Scenario
+            The scenario of the stream
+        data_dir : str, optional
+            Directory of the bundled datasets
+        """
+        base = pd.read_csv(os.path.join(data_dir, DATASETS[scenario.dataset]))
+        schema = Schema.infer(base)
+        # Constant columns cannot drift
+        features = [feature for feature in schema.features if base[feature].nunique() > 1]
+        base = base[features].dropna().reset_index(drop=True)
+
+        n_features = len(features) if scenario.features is None else scenario.features
+        columns = {}
+        for index in range(n_features):
+            feature = features[index % len(features)]
+            name = feature if index < len(features) else f"{feature}_{index // len(features)}"
+            columns[name] = feature
+        self._scenario = scenario
+        self._base = base
+        self._columns = columns
+        self._schema = schema
+        self._rng = np.random.default_rng(scenario.seed)
+        self._scale = base.std(numeric_only=True)
+        self._references = {}
+
+    @property
+    def features(self) -> list:
+        return list(self._columns)
+
+    def _sample(self, size: int, model_version: int, start: datetime) -> pd.DataFrame:
+        rows = self._base.iloc[self._rng.integers(0, len(self._base), size)].reset_index(drop=True)
+        data = {}
+        for name, feature in self._columns.items():
+            values = rows[feature].to_numpy()
+            if (name != feature) and self._schema.kind(feature) == "continuous":
+                values = values + self._rng.normal(scale=_COPY_NOISE * self._scale[feature], size=size)
+            data[name] = values
+        data = pd.DataFrame(data)
+        data["pred_timestamp"] = pd.date_range(start, periods=size, freq="s")
+        data["model_id"] = 1
+        data["model_version"] = model_version
+        return data
+
+    def _inject(self, data: pd.DataFrame, drift: dict) -> pd.DataFrame:
+        feature, magnitude = drift["feature"], drift["magnitude"]
+        if feature not in data.columns:
+            raise error_msg(value=feature, message=f'{"The feature of the injected drift is not in the stream."}')
+        values = data[feature]
+        if drift["kind"] == "mean":
+            data[feature] = values + magnitude * self._scale.get(self._columns[feature], values.std())
+        elif drift["kind"] == "variance":
+            data[feature] = values.mean() + (values - values.mean()) * (1 + magnitude)
+        else:
+            # A fraction of the rows moves to the rarest category of the reference
+            rarest = self._base[self._columns[feature]].value_counts().idxmin()
+            moved = self._rng.random(len(data)) < magnitude
+            data[feature] = values.where(~moved, rarest)
+        return data
+
+    def reference(self, model_version: int) -> pd.DataFrame:
+        """Reference of a model version (sampled once)"""
+        if model_version not in self._references:
+            self._references[model_version] = self._sample(self._scenario.reference_rows, model_version, datetime(2020, 1, 1))
+        return self._references[model_version]
+
+    def window(self, index: int, model_version: int) -> pd.DataFrame:
+        """Window of a model version with the drifts started at this window injected"""
+        data = self._sample(self._scenario.rows, model_version, datetime(2020, 1, 2) + pd.Timedelta(hours=index))
+        for drift in self._scenario.drifts:
+            if index >= drift["start"]:
+                data = self._inject(data, drift)
+        return data
+
+
+class LoadTestReport:
+    """Results of a load test: throughput, run latencies, peak memory and detection delays"""
+
+    def __init__(self, scenario: Scenario, runs: pd.DataFrame, flags: pd.DataFrame, elapsed: float, label: str = None):
+        """Constructor of the LoadTestReport class
+
+        Parameters
+        ----------
+        scenario : Scenario
+            The scenario of the load test
+        runs : DataFrame
+            One row per run: window, model version, rows, features, latency in seconds and failure status
+        flags : DataFrame
+            One row per flagged metric: feature, metric, window and model version
+        elapsed : float
+            Wall time of the load test in seconds
+        label : str, optional
+            Label of the report (a release for instance)
+        """
+        self.scenario = scenario
+        self.runs = runs
+        self.flags = flags
+        self.elapsed = elapsed
+        self.label = label
+        self.peak_rss = peak_rss()
+
+    def detections(self) -> pd.DataFrame:
+        """First window flagging every injected drift, by model version, and its delay in windows (NaN if missed)"""
+        rows = []
+        for drift in self.scenario.drifts:
+            for model_version in range(1, self.scenario.model_versions + 1):
+                flagged = self.flags.loc[(self.flags.feature_name == drift["feature"]) & (self.flags.window >= drift["start"])]
+                windows = flagged.window[flagged.model_version == model_version]
+                detected = windows.min() if len(windows) else np.nan
+                rows.append(
+                    {
+                        "model_version": model_version,
+                        "feature_name": drift["feature"],
+                        "kind": drift["kind"],
+                        "start": drift["start"],
+                        "detected": detected,
+                        "delay": detected - drift["start"],
+                    }
+                )
+        return pd.DataFrame(rows, columns=["model_version", "feature_name", "kind", "start", "detected", "delay"])
+
+    def false_alarms(self) -> int:
+        """Number of flags on features and windows without an injected drift"""
+        drifted = pd.Series(False, index=self.flags.index)
+        for drift in self.scenario.drifts:
+            drifted |= (self.flags.feature_name == drift["feature"]) & (self.flags.window >= drift["start"])
+        return int((~drifted).sum())
+
+    def summary(self) -> dict:
+        """Throughput of a worker (over the time spent in the runs), latency percentiles in seconds, peak RSS in
+        bytes and detection statistics"""
+        latencies = self.runs.latency.to_numpy()
+        busy = latencies.sum()
+        detections = self.detections()
+        return {
+            "scenario": self.scenario.name,
+            "label": self.label,
+            "runs": len(self.runs),
+            "failed_runs": int(self.runs.failed.sum()),
+            "elapsed": self.elapsed,
+            "runs_per_hour": 3600 * len(self.runs) / busy,
+            "features_per_hour": 3600 * self.runs.features.sum() / busy,
+            "rows_per_second": self.runs.rows.sum() / busy,
+            "latency_p50": float(np.percentile(latencies, 50)),
+            "latency_p99": float(np.percentile(latencies, 99)),
+            "peak_rss": self.peak_rss,
+            "detected": int(detections.detected.notnull().sum()),
+            "missed": int(detections.detected.isnull().sum()),
+            "mean_delay": float(detections.delay.mean()) if detections.delay.notnull().any() else None,
+            "false_alarms": self.false_alarms(),
+        }
+
+    def to_dict(self) -> dict:
+        return {
+            "summary": self.summary(),
+            "scenario": self.scenario.to_dict(),
+            "platform": {"python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count()},
+            "detections": json.loads(self.detections().to_json(orient="records")),
+        }
+
+    def save(self, path: str):
+        """Save the report to a JSON file"""
+        with open(path, "w") as file:
+            json.dump(self.to_dict(), file, indent=2, default=float)
+
+
+def run_load_test(scenario: Scenario, data_dir: str = "data", label: str = None) -> LoadTestReport:
+    """Drive the analyzers of the model versions of a scenario over its synthetic stream
+
+    Every window of every model version is a run of Analyzer.run() against the reference of the model version,
+    timed from the call to its return (the generation of the windows is not timed).
+
+    Parameters
+    ----------
+    scenario : Scenario
+        The scenario of the load test
+    data_dir : str, optional
+        Directory of the bundled datasets
+    label : str, optional
+        Label of the report (a release for instance)
+
+    Returns
+    -------
+    LoadTestReport
+        the report of the load test
+    """
+    stream = SyntheticStream(scenario, data_dir=data_dir)
+    analyzers = {}
+    for model_version in range(1, scenario.model_versions + 1):
+        analyzer = Analyzer(
+            name=f"{scenario.name}_{model_version}", model_id=1, model_version=model_version, precision=scenario.precision
+        )
+        analyzer.add_drift_metrics(scenario.metrics, stream.features)
+        analyzers[model_version] = (analyzer, stream.reference(model_version))
+
+    runs, flags = [], []
+    started = time.perf_counter()
+    index = 0
+    while (index < scenario.windows) or ((scenario.duration is not None) and (time.perf_counter() - started < scenario.duration)):
+        for model_version, (analyzer, reference) in analyzers.items():
+            window = stream.window(index, model_version)
+            # A failed run reports its error and keeps no results
+            analyzer._results = None
+            start = time.perf_counter()
+            analyzer.run(window, reference, options=scenario.options)
+            latency = time.perf_counter() - start
+
+            results = analyzer.results_to_pandas()
+            if results is not None:
+                flagged = results.loc[results.drift_status.eq(True), ["feature_name", "metric_name"]]
+                flags.append(flagged.assign(window=index, model_version=model_version))
+            runs.append(
+                {
+                    "window": index,
+                    "model_version": model_version,
+                    "rows": len(window),
+                    "features": len(stream.features),
+                    "latency": latency,
+                    "failed": results is None,
+                }
+            )
+        index += 1
+    elapsed = time.perf_counter() - started
+
+    flags = (
+        pd.concat(flags, ignore_index=True)
+        if flags
+        else pd.DataFrame(columns=["feature_name", "metric_name", "window", "model_version"])
+    )
+    return LoadTestReport(scenario, pd.DataFrame(runs), flags, elapsed, label=label)
@@ -0,0 +1,322 @@
+#  Author:   Adel Benlagra  <abenlagra@rocketscience.one>
+import copy
+import re
+import tracemalloc
+from contextlib import contextmanager
+from typing import Union
+
+import constant
+import pandas as pd
+
+from ..exceptions import CustomExceptionPulsarMetric as error_msg
+from ..metrics.drift import DriftMetric, DriftTestMetric
+from ..metrics.performance import PerformanceMetric
+from ..metrics.ranking import MAX_BATCH_CELLS, RANKING_METRICS
+from ..metrics.sampling import Sampler
+from .plan import SUMMARY, MetricPlan
+
+_UNITS = {
+    "": 1,
+    "B": 1,
+    "KB": 10**3,
+    "MB": 10**6,
+    "GB": 10**9,
+    "TB": 10**12,
+    "KIB": 2**10,
+    "MIB": 2**20,
+    "GIB": 2**30,
+    "TIB": 2**40,
+}
+
+# Node arrays larger than this fraction of the memory limit are spilled to memory-mapped files
+SPILL_FRACTION = 0.125
+
+# Bytes of a float64 value
+_ITEM = 8
+
+# Transient memory of the metric functions in values per row of the two datasets (concatenations, sort buffers and
+# ranks of the scipy tests), measured on their evaluation from the sorted nodes of the plan
+_TRANSIENTS = {
+    "wasserstein": 9,
+    "ks_2samp": 5,
+    "CvM": 10,
+    "manwu": 9,
+    "levene": 2,
+    "bftest": 2,
+    "ttest": 0,
+    "mmd": 0,
+    "psi": 0,
+    "kl": 0,
+    "js": 0,
+    "missing_rate": 0,
+    "missing_rate_drift": 0,
+    "null_rate": 0,
+    "out_of_range_rate": 0,
+    "unseen_category_rate": 0,
+    "constant_column": 0,
+    "duplicate_rows": 0,
+}
+_DEFAULT_TRANSIENT = 4
+
+# Memory of the intermediate nodes of a plan in values per row (and per feature of batched nodes): memory held by
+# the node and transient memory of its computation
+_NODE_FOOTPRINTS = {
+    "values": (1, 0),
+    "mask": (0.125, 0),
+    "moments": (0, 3),
+    "sorted": (1, 0),
+    "histogram": (0, 0),
+    "binned": (0, 4),
+    "ranking": (6, 2),
+    "vectorized": (0, 2),
+    "categories": (0, 1),
+    "row_hashes": (1, 2),
+}
+
+# Memory of a sampler in values per row: order and strata held for the run, transient memory of a sample
+_SAMPLER_FOOTPRINT = (2, 3)
+
+# Bytes per cell of the bootstrap weight matrices of the ranking kernel (weights, cumulative sums and curves)
+_BOOTSTRAP_CELL = 10 * _ITEM
+
+
+def parse_memory(value: Union[int, str]) -> int:
+    """Number of bytes of a memory size given as a number of bytes or a string such as "2GB" or "512 MiB"
+
+    Parameters
+    ----------
+    value : Union[int, str]
+        The memory size
+
+    Returns
+    -------
+    int
+        the number of bytes
+    """
+    if isinstance(value, (int, float)) and value > 0:
+        return int(value)
+    match = re.fullmatch(r"\s*([0-9]*\.?[0-9]+)\s*([KMGT]?I?B?)\s*", str(value), flags=re.IGNORECASE)
+    if (match is None) or (match.group(2).upper() not in _UNITS) or float(match.group(1)) <= 0:
+        raise error_msg(
+            value=value,
+            message=f'{"InvalidInput: memory size should be a number of bytes or a string such as 2GB or 512MiB"}',
+        )
+    return int(float(match.group(1)) * _UNITS[match.group(2).upper()])
+
+
+def _bootstrap_footprint(metric: PerformanceMetric, n: int, kwargs: dict) -> int:
+    """Estimated memory of the bootstrap confidence interval of a performance metric"""
+    if not kwargs.get("bootstrap", False):
+        return 0
+    if metric._name in RANKING_METRICS:
+        cells = min(kwargs.get("max_batch_cells", MAX_BATCH_CELLS), kwargs.get("n_bootstrap", constant.BOOTSTRAP_SIZE) * n)
+        return _BOOTSTRAP_CELL * max(n, cells)
+    return 3 * _ITEM * n
+
+
+def _sampled_footprint(n: int, m: int, kwargs: dict) -> tuple:
+    """Sizes of the data a metric is evaluated on, with the memory of its sampler"""
+    sampler = kwargs.get("sampling")
+    if sampler is None:
+        return n, m, 0
+    size = sampler._size if isinstance(sampler, Sampler) else sampler.get("size", constant.SAMPLE_SIZE)
+    if size is None:
+        return n, m, 0
+    return min(n, size), min(m, size), sum(_SAMPLER_FOOTPRINT) * _ITEM * (n + m)
+
+
+def _direct_footprint(metric, n: int, m: int, options: dict) -> int:
+    """Estimated peak memory of the direct evaluation of a metric (a summary if metric is SUMMARY)"""
+    if metric == SUMMARY:
+        return (2 + _DEFAULT_TRANSIENT) * _ITEM * (n + m)
+    kwargs = options.get(metric._name, {})
+    if isinstance(metric, PerformanceMetric):
+        if metric._name in RANKING_METRICS:
+            footprint = sum(_NODE_FOOTPRINTS["ranking"]) * _ITEM * n
+        else:
+            footprint = _DEFAULT_TRANSIENT * _ITEM * n
+        return footprint + _bootstrap_footprint(metric, n, kwargs)
+
+    n, m, sampler = _sampled_footprint(n, m, kwargs)
+    if metric._name == "mmd":
+        # Kernel matrices, computed one after the other (by blocks of rows if block_size is given)
+        block_size = kwargs.get("block_size")
+        return sampler + _ITEM * max(n, m) * (max(n, m) if block_size is None else 2 * block_size)
+    # Copies of the columns and the sort of the values, with the transient memory of the metric function
+    return sampler + (3 + _TRANSIENTS.get(metric._name, _DEFAULT_TRANSIENT)) * _ITEM * (n + m)
+
+
+def _kernel_footprint(metric, n: int, m: int, options: dict) -> int:
+    """Estimated transient memory of a metric evaluated from the shared nodes"""
+    if metric == SUMMARY:
+        return 0
+    if isinstance(metric, PerformanceMetric):
+        return _bootstrap_footprint(metric, n, options.get(metric._name, {}))
+    return _TRANSIENTS.get(metric._name, _DEFAULT_TRANSIENT) * _ITEM * (n + m)
+
+
+def _node_footprint(node: tuple, n: int, m: int) -> tuple:
+    """Estimated memory held by a node and transient memory of its computation"""
+    kind, feature, side = node
+    rows = {"current": n, "reference": m, "pair": n + m}[side]
+    if kind in ("binned", "row_hashes"):
+        rows *= len(feature)
+    elif kind == "vectorized":
+        rows *= len(feature[1])
+    held, transient = _NODE_FOOTPRINTS[kind]
+    return held * _ITEM * rows, transient * _ITEM * rows
+
+
+def _footprint(steps: list, n: int, m: int, options: dict) -> int:
+    """Estimated peak memory of a group of steps sharing their nodes (or of a direct evaluation)"""
+    if steps[0][2] is None:
+        return _direct_footprint(steps[0][0], n, m, options)
+    nodes = [_node_footprint(node, n, m) for node in {node for _, _, consumed in steps for node in consumed}]
+    transient = max([transient for _, transient in nodes] + [_kernel_footprint(metric, n, m, options) for metric, _, _ in steps])
+    return sum(held for held, _ in nodes) + transient
+
+
+class MemoryBudget:
+    """Memory budget of an analyzer run
+
+    The footprint of every group of steps of the plan (the shared nodes of a feature, or a direct evaluation) is
+    estimated from the row counts of the datasets. Metrics over the budget get a chunked kernel when one exists
+    (blocks of the mmd kernel matrices, batches of the bootstrap replicates of the ranking metrics), otherwise an
+    approximation on a sample of the size fitting the budget. The plan is then executed one group at a time with
+    its large node arrays spilled to memory-mapped files, and the actual peak of the run is measured.
+
+    The budget covers the memory allocated by the run, the input datasets excluded.
+    """
+
+    def __init__(self, memory_limit: Union[int, str]):
+        """Constructor of the MemoryBudget class
+
+        Parameters
+        ----------
+        memory_limit : Union[int, str]
+            Memory limit as a number of bytes or a string such as "2GB"
+        """
+        self._limit = parse_memory(memory_limit)
+        self._adjustments = {}
+        self._estimated_peak = None
+        self._peak = None
+
+    @property
+    def limit(self) -> int:
+        return self._limit
+
+    @property
+    def spill_threshold(self) -> int:
+        return int(self._limit * SPILL_FRACTION)
+
+    def estimate(self, plan: MetricPlan, options: dict = {}) -> int:
+        """Estimated peak memory in bytes of the execution of a compiled plan one group of steps at a time"""
+        n, m = plan._sizes
+        return max((_footprint([plan._steps[index] for index in group], n, m, options) for group in plan._groups()), default=0)
+
+    def _sample_size(self, metric, n: int, m: int) -> int:
+        """Largest sample size of a metric fitting the budget (bisection on the estimated footprint), None if none"""
+
+        def fits(size):
+            return _direct_footprint(metric, n, m, {metric._name: {"sampling": {"size": size}}}) <= self._limit
+
+        if not fits(1):
+            return None
+        low, high = 1, max(n, m)
+        while low < high:
+            size = (low + high + 1) // 2
+            low, high = (size, high) if fits(size) else (low, size - 1)
+        return low
+
+    def _adjust(self, metric, consumed: list, n: int, m: int, options: dict) -> str:
+        """Chunk or sample a metric over the budget, returning the description of the adjustment"""
+        kwargs = options[metric._name]
+        if (metric._name == "mmd") and (consumed is None):
+            block_size = self._limit // (2 * _ITEM * max(n, m, 1))
+            if block_size >= 1:
+                kwargs["block_size"] = int(block_size)
+                if _direct_footprint(metric, n, m, options) <= self._limit:
+                    return f"block_size={kwargs['block_size']}"
+        if isinstance(metric, PerformanceMetric):
+            if metric._name in RANKING_METRICS:
+                kwargs["max_batch_cells"] = int(
+                    max(self._limit - sum(_NODE_FOOTPRINTS["ranking"]) * _ITEM * n, 0) // _BOOTSTRAP_CELL
+                )
+                return f"max_batch_cells={kwargs['max_batch_cells']}"
+            return "over budget"
+        if not isinstance(metric, (DriftMetric, DriftTestMetric)):
+            return "over budget"
+
+        size = self._sample_size(metric, n, m)
+        if (size is None) or (size >= max(n, m)):
+            return "over budget"
+        sampler = kwargs.get("sampling")
+        if isinstance(sampler, Sampler):
+            sampler = copy.copy(sampler)
+            sampler._size = size if sampler._size is None else min(sampler._size, size)
+        else:
+            sampler = Sampler(**{**(sampler or {}), "size": min((sampler or {}).get("size", size), size)})
+        kwargs["sampling"] = sampler
+        return f"sampling size={sampler._size}"
+
+    def fit(self, plan: MetricPlan, current: pd.DataFrame, reference: pd.DataFrame, options: dict = {}) -> tuple:
+        """Adjust the options of the metrics of a compiled plan to the budget
+
+        Parameters
+        ----------
+        plan : MetricPlan
+            The compiled plan
+        current : DataFrame
+            The input current (pandas DataFrame)
+        reference : DataFrame
+            The input reference (pandas DataFrame)
+        options : dict, optional
+            Options of the metrics, keyed by metric name
+
+        Returns
+        -------
+        tuple
+            the plan compiled with the adjusted options and the adjusted options
+        """
+        n, m = len(current), len(reference)
+        options = {name: dict(kwargs) for name, kwargs in options.items()}
+        self._adjustments = {}
+        for metric, _, consumed in plan._steps:
+            if (metric == SUMMARY) or (metric._name in self._adjustments):
+                continue
+            if _footprint([(metric, None, consumed)], n, m, options) > self._limit:
+                options.setdefault(metric._name, {})
+                self._adjustments[metric._name] = self._adjust(metric, consumed, n, m, options)
+
+        if self._adjustments:
+            plan = MetricPlan(plan._metrics_list, summary_features=plan._summary_features, schema=plan._schema).compile(
+                current, reference, options
+            )
+        self._estimated_peak = self.estimate(plan, options)
+        return plan, options
+
+    @contextmanager
+    def track(self):
+        """Measure the peak of the memory allocated in the block (with tracemalloc)"""
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        else:
+            tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        try:
+            yield self
+        finally:
+            self._peak = tracemalloc.get_traced_memory()[1] - baseline
+            if started:
+                tracemalloc.stop()
+
+    def report(self) -> dict:
+        """Memory limit, estimated and measured peaks in bytes, and adjustments of the metrics"""
+        return {
+            "memory_limit": self._limit,
+            "estimated_peak": self._estimated_peak,
+            "peak": self._peak,
+            "within_limit": None if self._peak is None else self._peak <= self._limit,
+            "adjustments": dict(self._adjustments),
+        }
@@ -0,0 +1,805 @@
+#  Author:   Adel Benlagra  <abenlagra@rocketscience.one>
+import os
+import tempfile
+
+import constant
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_bool_dtype, is_numeric_dtype
+from scipy.stats import (
+    cramervonmises_2samp,
+    f,
+    ks_2samp,
+    ttest_ind_from_stats,
+    wasserstein_distance,
+)
+from tqdm import tqdm
+
+from ..exceptions import CustomExceptionPulsarMetric as error_msg
+from ..metrics.backends import select_implementation
+from ..metrics.drift import (
+    MISSING_METRICS,
+    DriftMetric,
+    DriftTestMetric,
+    evaluate_vectorized,
+)
+from ..metrics.embeddings import is_vector_column
+from ..metrics.histograms import FrozenBinning, js_from_counts, kl_from_counts
+from ..metrics.performance import PerformanceMetric
+from ..metrics.quality import DATASET_CHECKS, DataQualityMetric
+from ..metrics.ranking import RANKING_METRICS, ProbabilisticKernel
+from ..metrics.states import TestResult
+from ..metrics.statistics import FeatureSummary
+from ..metrics.utils import is_categorical, psi_from_counts, sturges_edges
+from .schema import Schema
+
+SUMMARY = "summary"
+DIRECT = "direct"
+# Metrics computed together for all the features from histograms on reference-frozen bins
+BINNED_METRICS = ("kl", "js")
+PERCENTILES = [0.25, 0.95]
+
+# Shared intermediate nodes consumed by each metric (and by the summary statistics)
+NODE_REQUIREMENTS = {
+    "ttest": ["moments"],
+    "mmd": ["moments"],
+    "levene": ["moments"],
+    "bftest": ["sorted"],
+    "ks_2samp": ["sorted"],
+    "CvM": ["sorted"],
+    "manwu": ["sorted"],
+    "wasserstein": ["sorted"],
+    "psi": ["sorted", "histogram"],
+    "kl": ["binned"],
+    "js": ["binned"],
+    **{metric_name: ["mask"] for metric_name in MISSING_METRICS},
+    SUMMARY: ["moments", "sorted"],
+    **{metric_name: ["ranking"] for metric_name in RANKING_METRICS},
+}
+
+# Nodes computed for a single feature: the steps consuming them are kept in the same batch
+_FEATURE_NODES = ("values", "mask", "moments", "sorted", "histogram", "categories")
+
+# Metric function arguments supported by the shared kernels. Other arguments go through evaluate()
+_SUPPORTED_KWARGS = {"ttest": {"equal_var"}, "mmd": {"kernel", "block_size"}, "kl": {"smoothing"}, "js": {"smoothing"}}
+_RESULT_KWARGS = {"threshold", "upper_bound", "alpha"}
+_PERFORMANCE_KWARGS = {"threshold", "upper_bound", "alpha", "bootstrap", "n_bootstrap", "seed", "max_batch_cells"}
+
+# Estimated number of elementary operations of each node / direct metric for n current and m reference rows
+_NODE_COSTS = {
+    "mask": lambda n: n,
+    "moments": lambda n: 5 * n,
+    "sorted": lambda n: n * np.log2(max(n, 2)),
+    "histogram": lambda n: np.log2(max(n, 2)) ** 2,
+    "binned": lambda n: n,
+    "vectorized": lambda n: n,
+    "ranking": lambda n: n * np.log2(max(n, 2)),
+    "categories": lambda n: n,
+    "row_hashes": lambda n: n,
+}
+_DIRECT_COSTS = {
+    "mmd": lambda n, m: (n + m) ** 2,
+    "levene": lambda n, m: 3 * (n + m),
+    "psi": lambda n, m: (n + m) * np.log2(max(n + m, 2)),
+    "kl": lambda n, m: n + m,
+    "js": lambda n, m: n + m,
+    "chi2": lambda n, m: n + m,
+}
+
+
+class Intermediates:
+    """Lazily computed and memoized intermediate nodes of a metric plan
+
+    Node arrays larger than spill_threshold bytes are moved to memory-mapped temporary files, whose pages can be
+    evicted by the operating system instead of being held in the memory of the process. Precomputed nodes (such as
+    the reference nodes of a stored reference) are given by key and kept when the nodes are released.
+    """
+
+    def __init__(
+        self,
+        current: pd.DataFrame,
+        reference: pd.DataFrame,
+        binned_features: tuple = (),
+        spill_threshold: int = None,
+        nodes: dict = None,
+    ):
+        self._data = {"current": current, "reference": reference}
+        self._binned_features = binned_features
+        self._spill_threshold = spill_threshold
+        self._spill_dir = None
+        self._precomputed = dict(nodes or {})
+        self._cache = dict(self._precomputed)
+
+    def get(self, kind: str, feature, side: str = "current"):
+        """Return the intermediate node, computing it on first access"""
+        key = (kind, feature, side)
+        if key not in self._cache:
+            self._cache[key] = self._spill(getattr(self, f"_compute_{kind}")(feature, side))
+        return self._cache[key]
+
+    def _spill(self, node):
+        # Views (the values of a column) share the memory of the datasets and are not spilled
+        if (self._spill_threshold is None) or not isinstance(node, np.ndarray) or (node.base is not None):
+            return node
+        if node.nbytes <= self._spill_threshold:
+            return node
+        if self._spill_dir is None:
+            self._spill_dir = tempfile.TemporaryDirectory(prefix="pulsar_metrics_")
+        spilled = np.lib.format.open_memmap(
+            os.path.join(self._spill_dir.name, f"node_{len(os.listdir(self._spill_dir.name))}.npy"),
+            mode="w+",
+            dtype=node.dtype,
+            shape=node.shape,
+        )
+        spilled[:] = node
+        spilled.flush()
+        return spilled
+
+    def clear(self):
+        """Release all the nodes but the precomputed ones"""
+        self._cache = dict(self._precomputed)
+
+    def close(self):
+        """Release all the nodes and delete the spill files"""
+        self._cache.clear()
+        if self._spill_dir is not None:
+            self._spill_dir.cleanup()
+            self._spill_dir = None
+
+    def _compute_values(self, feature: str, side: str) -> np.ndarray:
+        column = self._data[side][feature]
+        # Float columns keep their precision (views of float32 columns of compact datasets), the others become float64
+        dtype = column.dtype if isinstance(column.dtype, np.dtype) else getattr(column.dtype, "numpy_dtype", None)
+        dtype = dtype if (dtype is not None) and (dtype.kind == "f") else np.dtype(float)
+        if isinstance(column.dtype, np.dtype):
+            return column.to_numpy(dtype=dtype)
+        # Missing values of nullable dtypes become NaN
+        return column.to_numpy(dtype=dtype, na_value=np.nan)
+
+    def _compute_mask(self, feature: str, side: str) -> np.ndarray:
+        """Validity mask of a feature, None if it has no missing value"""
+        column = self._data[side][feature]
+        if is_numeric_dtype(column) and not is_bool_dtype(column):
+            mask = ~np.isnan(self.get("values", feature, side))
+        else:
+            mask = column.notna().to_numpy()
+        return None if mask.all() else mask
+
+    def _compute_moments(self, feature: str, side: str) -> dict:
+        # Missing values are skipped by the masked reductions, without copying the valid values
+        # The reductions of float32 values are accumulated in float64
+        values, mask = self.get("values", feature, side), self.get("mask", feature, side)
+        where = True if mask is None else mask
+        mean = values.mean(where=where, dtype=np.float64)
+        deviations = values - mean
+        squared = deviations**2
+        return {
+            "n": len(values) if mask is None else int(np.count_nonzero(mask)),
+            "mean": mean,
+            "m2": squared.mean(where=where, dtype=np.float64),
+            "m3": (squared * deviations).mean(where=where, dtype=np.float64),
+            "m4": (squared**2).mean(where=where, dtype=np.float64),
+        }
+
+    def _compute_sorted(self, feature: str, side: str) -> np.ndarray:
+        # Missing values are sorted last: the valid values are a view of the head of the sorted array
+        mask = self.get("mask", feature, side)
+        sorted_values = np.sort(self.get("values", feature, side))
+        return sorted_values if mask is None else sorted_values[: np.count_nonzero(mask)]
+
+    def _compute_histogram(self, feature: str, side: str = "pair") -> tuple:
+        # Same sturges bins on the combined sample as population_stability_index, counted on the sorted arrays
+        cur, ref = self.get("sorted", feature, "current"), self.get("sorted", feature, "reference")
+        bins = sturges_edges(min(cur[0], ref[0]), max(cur[-1], ref[-1]), len(cur) + len(ref))
+
+        def counts(values):
+            below = np.searchsorted(values, bins, side="right")
+            below[0] = 0
+            return np.diff(below)
+
+        return counts(cur), counts(ref)
+
+    def _compute_binned(self, features: tuple, side: str = "pair") -> tuple:
+        binning = FrozenBinning(self._data["reference"], features)
+        return binning, binning.counts(self._data["current"]), binning.counts(self._data["reference"])
+
+    def divergences(self, divergence, smoothing: float) -> dict:
+        """Divergences of all the binned features, computed in one vectorized pass over their histograms"""
+        key = ("divergences", divergence.__name__, smoothing)
+        if key not in self._cache:
+            binning, current_counts, reference_counts = self.get("binned", self._binned_features, "pair")
+            values = divergence(current_counts, reference_counts, smoothing, binning.mask)
+            self._cache[key] = dict(zip(binning.features, values))
+        return self._cache[key]
+
+    def _compute_categories(self, feature: str, side: str) -> pd.Series:
+        """Counts of the categories of a feature (missing values and unused categories of categorical dtypes excluded)"""
+        counts = self._data[side][feature].value_counts(dropna=True, sort=False)
+        return counts[counts > 0]
+
+    def _compute_row_hashes(self, columns: tuple, side: str) -> np.ndarray:
+        return pd.util.hash_pandas_object(self._data[side][list(columns)], index=False).to_numpy()
+
+    def _compute_ranking(self, columns: tuple, side: str) -> ProbabilisticKernel:
+        try:
+            return ProbabilisticKernel(self._data[side][columns[0]], self._data[side][columns[1]])
+        except Exception:
+            return None
+
+
+def _sorted_quantile(values: np.ndarray, q: float) -> float:
+    """Quantile with linear interpolation (pandas default) of a sorted array"""
+    position = q * (len(values) - 1)
+    low, high = int(np.floor(position)), int(np.ceil(position))
+    return values[low] + (values[high] - values[low]) * (position - low)
+
+
+def _summary_statistics(nodes: Intermediates, feature: str, side: str) -> dict:
+    moments, values = nodes.get("moments", feature, side), nodes.get("sorted", feature, side)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        statistics = {
+            "mean": moments["mean"],
+            "median": _sorted_quantile(values, 0.5),
+            "std": np.sqrt(moments["m2"]),
+            "skewness": moments["m3"] / moments["m2"] ** 1.5,
+            "kurtosis": moments["m4"] / moments["m2"] ** 2 - 3,
+        }
+    for percentile in PERCENTILES:
+        statistics["P" + str(100 * percentile)] = _sorted_quantile(values, percentile)
+    return statistics
+
+
+def _levene(cur: np.ndarray, ref: np.ndarray, cur_center: float, ref_center: float, masks: tuple = (None, None)):
+    """Levene test of two samples, the values outside their validity masks (if any) being skipped"""
+    groups = [np.abs(cur - cur_center), np.abs(ref - ref_center)]
+    wheres = [True if mask is None else mask for mask in masks]
+    sizes = [len(group) if mask is None else np.count_nonzero(mask) for group, mask in zip(groups, masks)]
+    n = sum(sizes)
+    means = [group.mean(where=where) for group, where in zip(groups, wheres)]
+    grand_mean = sum(size * mean for size, mean in zip(sizes, means)) / n
+    between = sum(size * (mean - grand_mean) ** 2 for size, mean in zip(sizes, means))
+    within = sum(((group - mean) ** 2).sum(where=where) for group, mean, where in zip(groups, means, wheres))
+    statistic = (n - 2) * between / within
+    return TestResult(statistic, f.sf(statistic, 1, n - 2))
+
+
+def _pair(nodes: Intermediates, kind: str, feature: str):
+    return nodes.get(kind, feature, "current"), nodes.get(kind, feature, "reference")
+
+
+def _selected(metric_name: str, *samples):
+    """Metric function of the backend selected for the size of the samples"""
+    return select_implementation(metric_name, sum(map(len, samples)))(*samples)
+
+
+def _missing_rate(nodes: Intermediates, feature: str, side: str) -> float:
+    mask = nodes.get("mask", feature, side)
+    return 0.0 if mask is None else 1 - np.count_nonzero(mask) / len(mask)
+
+
+# Kernels computing the metric functions from the shared intermediates
+_KERNELS = {
+    "ttest": lambda nodes, feature, equal_var=False: ttest_ind_from_stats(
+        *[
+            statistic
+            for moments in _pair(nodes, "moments", feature)
+            for statistic in (moments["mean"], np.sqrt(moments["m2"] * moments["n"] / (moments["n"] - 1)), moments["n"])
+        ],
+        equal_var=equal_var,
+    ),
+    "mmd": lambda nodes, feature, kernel="linear", block_size=None: np.square(
+        nodes.get("moments", feature, "current")["mean"] - nodes.get("moments", feature, "reference")["mean"]
+    ),
+    "levene": lambda nodes, feature: _levene(
+        *_pair(nodes, "values", feature),
+        *[moments["mean"] for moments in _pair(nodes, "moments", feature)],
+        masks=_pair(nodes, "mask", feature),
+    ),
+    "bftest": lambda nodes, feature: _levene(
+        *_pair(nodes, "sorted", feature), *[_sorted_quantile(values, 0.5) for values in _pair(nodes, "sorted", feature)]
+    ),
+    "ks_2samp": lambda nodes, feature: ks_2samp(*_pair(nodes, "sorted", feature)),
+    "CvM": lambda nodes, feature: cramervonmises_2samp(*_pair(nodes, "sorted", feature)),
+    "manwu": lambda nodes, feature: _selected("manwu", *_pair(nodes, "sorted", feature)),
+    "wasserstein": lambda nodes, feature: wasserstein_distance(*_pair(nodes, "sorted", feature)),
+    "psi": lambda nodes, feature: psi_from_counts(*nodes.get("histogram", feature, "pair")),
+    "kl": lambda nodes, feature, smoothing=constant.HISTOGRAM_SMOOTHING: float(
+        nodes.divergences(kl_from_counts, smoothing)[feature]
+    ),
+    "js": lambda nodes, feature, smoothing=constant.HISTOGRAM_SMOOTHING: float(
+        nodes.divergences(js_from_counts, smoothing)[feature]
+    ),
+    "missing_rate": lambda nodes, feature: _missing_rate(nodes, feature, "current"),
+    "missing_rate_drift": lambda nodes, feature: abs(
+        _missing_rate(nodes, feature, "current") - _missing_rate(nodes, feature, "reference")
+    ),
+}
+
+
+def _out_of_range_rate(nodes: Intermediates, feature: str) -> float:
+    """Fraction of the current values outside the reference range, from the sorted (valid) values"""
+    current, reference = _pair(nodes, "sorted", feature)
+    if not len(current):
+        return 0.0
+    below = np.searchsorted(current, reference[0], side="left")
+    above = len(current) - np.searchsorted(current, reference[-1], side="right")
+    return float((below + above) / len(current))
+
+
+def _unseen_category_rate(nodes: Intermediates, feature: str) -> float:
+    current, reference = _pair(nodes, "categories", feature)
+    total = current.sum()
+    return float(current[~current.index.isin(reference.index)].sum() / total) if total else 0.0
+
+
+# Kernels computing the data quality checks from the shared intermediates, keyed by check and node
+_QUALITY_KERNELS = {
+    ("null_rate", "mask"): lambda nodes, feature: _missing_rate(nodes, feature, "current"),
+    ("out_of_range_rate", "sorted"): _out_of_range_rate,
+    ("unseen_category_rate", "categories"): _unseen_category_rate,
+    ("constant_column", "sorted"): lambda nodes, feature: float(
+        (lambda values: (len(values) == 0) or (values[0] == values[-1]))(nodes.get("sorted", feature, "current"))
+    ),
+    ("constant_column", "categories"): lambda nodes, feature: float(len(nodes.get("categories", feature, "current")) <= 1),
+    ("out_of_range_rate", "categories"): lambda nodes, feature: None,
+    ("unseen_category_rate", "sorted"): lambda nodes, feature: None,
+    ("duplicate_rows", "row_hashes"): lambda nodes, columns: (
+        lambda hashes: 1 - len(pd.unique(hashes)) / len(hashes) if len(hashes) else 0.0
+    )(nodes.get("row_hashes", columns, "current")),
+}
+
+
+# Checks comparing the current values to the reference, by node
+_REFERENCE_CHECKS = (("out_of_range_rate", "sorted"), ("unseen_category_rate", "categories"))
+
+
+def _is_shareable(feature: str, current: pd.DataFrame, reference: pd.DataFrame, schema: Schema = None) -> bool:
+    """Shared nodes need numeric columns (of a numeric kind in the schema) with at least two valid values in both
+    datasets, the missing values being skipped by the kernels through validity masks"""
+    numeric = None if schema is None else schema.is_numeric(feature)
+    if numeric is False:
+        return False
+    for data in (current, reference):
+        if feature not in data.columns or data[feature].count() < 2:
+            return False
+        if (numeric is None) and not is_numeric_dtype(data[feature]):
+            return False
+    return True
+
+
+def _node_width(kind: str, feature) -> int:
+    """Number of features covered by a node"""
+    if kind in ("binned", "row_hashes"):
+        return len(feature)
+    if kind == "vectorized":
+        return len(feature[1])
+    return 1
+
+
+def _is_binnable(metric, current: pd.DataFrame, reference: pd.DataFrame, schema: Schema = None) -> bool:
+    """Frozen bins of kl and js metrics need the (scalar) feature in both datasets, numeric in both or in none"""
+    if not isinstance(metric, DriftMetric) or (metric._name not in BINNED_METRICS):
+        return False
+    feature = metric._feature_name
+    if (feature is None) or (feature not in current.columns) or (feature not in reference.columns):
+        return False
+    if (schema is not None) and (feature in schema):
+        # The kind of the schema holds for both datasets
+        return schema.kind(feature) != "vector"
+    if is_vector_column(current[feature]):
+        return False
+    return is_numeric_dtype(current[feature]) == is_numeric_dtype(reference[feature])
+
+
+def evaluate_metric(metric, current: pd.DataFrame, reference: pd.DataFrame, **kwargs):
+    """Evaluate a single metric directly on the datasets
+
+    Parameters
+    ----------
+    metric : AbstractMetrics
+        The metric to evaluate
+    current : DataFrame
+        The input current (pandas DataFrame)
+    reference : DataFrame
+        The input reference (pandas DataFrame)
+    kwargs :
+        keyworded variable length of arguments to a function
+
+    Returns
+    -------
+    MetricResults
+        the result of the metric
+    """
+    if isinstance(metric, PerformanceMetric):
+        if (metric._y_name not in current.columns) or (current[metric._y_name].isnull().sum() > 0):
+            raise error_msg(
+                value=None,
+                message=f'{"Dataset has no ground truth for performance assessment"}',
+            )
+    metric.evaluate(current=current, reference=reference, **kwargs)
+    return metric._result
+
+
+class MetricPlan:
+    """Plan of a list of metrics as a DAG of shared intermediate nodes per feature
+
+    Each metric (and the summary statistics of each feature) is routed either to a kernel consuming shared
+    intermediate nodes (moments, sorted arrays, histograms, ranking kernels) or to its direct evaluate()
+    method. Every node is computed once and given to all the metrics that need it.
+    """
+
+    def __init__(self, metrics_list: list, summary_features: list = [], schema: Schema = None):
+        """Constructor of the MetricPlan class
+
+        Parameters
+        ----------
+        metrics_list : list
+            List of metrics
+        summary_features : list, optional
+            List of features profiled with summary statistics
+        schema : Schema, optional
+            Schema of the datasets: the columns are routed on their kinds and only the features, targets and
+            predictions are profiled. Columns are routed on their dtypes if None
+        """
+        self._metrics_list = metrics_list
+        self._summary_features = list(summary_features)
+        self._schema = schema
+        self._steps = []
+        self._sizes = (0, 0)
+        self._binned_features = ()
+        self._vectorized_features = {}
+
+    def _is_scalar(self, feature: str, current: pd.DataFrame, reference: pd.DataFrame) -> bool:
+        """Whether a feature is a scalar column of both datasets"""
+        if (feature is None) or (feature not in current.columns) or (feature not in reference.columns):
+            return False
+        if (self._schema is not None) and (feature in self._schema):
+            return self._schema.kind(feature) != "vector"
+        return not is_vector_column(current[feature])
+
+    def _route(self, metric, options: dict, shareable: dict, current: pd.DataFrame, reference: pd.DataFrame) -> list:
+        """Return the nodes consumed by a metric, None if it is evaluated directly"""
+        kwargs = set(options.get(metric._name, {}))
+        if getattr(metric, "_vectorized", False):
+            # Vectorized custom metrics are evaluated once on all their features
+            return [("vectorized", (metric._name, self._vectorized_features[metric._name]), "pair")]
+        if isinstance(metric, PerformanceMetric):
+            if (metric._name in RANKING_METRICS) and (kwargs <= _PERFORMANCE_KWARGS):
+                return [("ranking", (metric._y_name, metric._pred_name), "current")]
+        elif isinstance(metric, DataQualityMetric):
+            if not kwargs - _RESULT_KWARGS:
+                return self._quality_nodes(metric, shareable, current, reference)
+        elif isinstance(metric, DriftMetric) and (metric._name in MISSING_METRICS):
+            # The validity masks of scalar features of any dtype are shared with the numeric kernels
+            if (not kwargs - _RESULT_KWARGS) and self._is_scalar(metric._feature_name, current, reference):
+                return self._feature_nodes(metric._name, metric._feature_name)
+        elif isinstance(metric, (DriftMetric, DriftTestMetric)) and (metric._name in _KERNELS):
+            function_kwargs = kwargs - _RESULT_KWARGS
+            supported = function_kwargs <= _SUPPORTED_KWARGS.get(metric._name, set())
+            if (metric._name == "mmd") and (options.get("mmd", {}).get("kernel", "linear") != "linear"):
+                supported = False
+            if metric._name in BINNED_METRICS:
+                if supported and (metric._feature_name in self._binned_features):
+                    return [("binned", self._binned_features, "pair")]
+            elif supported and shareable.get(metric._feature_name, False):
+                return self._feature_nodes(metric._name, metric._feature_name)
+        return None
+
+    def _is_categorical(self, feature: str, current: pd.DataFrame) -> bool:
+        if (self._schema is not None) and (feature in self._schema):
+            return self._schema.kind(feature) == "categorical"
+        return is_categorical(current[feature])
+
+    def _quality_nodes(self, metric, shareable: dict, current: pd.DataFrame, reference: pd.DataFrame) -> list:
+        """Nodes of a data quality check: the nodes of the profiling of the feature (validity masks and sorted values
+        of numeric features, counts of the categories of categorical features) or the hashes of the rows"""
+        if metric._name in DATASET_CHECKS:
+            columns = tuple(current.columns if metric._columns is None else metric._columns)
+            return [("row_hashes", columns, "current")] if set(columns) <= set(current.columns) else None
+        feature = metric._feature_name
+        if not self._is_scalar(feature, current, reference):
+            return None
+        if metric._name == "null_rate":
+            return [("mask", feature, "current")]
+        if shareable.get(feature, False):
+            kind = "sorted"
+        elif self._is_categorical(feature, current) and self._is_categorical(feature, reference):
+            kind = "categories"
+        else:
+            return None
+        # Checks not applicable to the kind of the feature only consume its current node, without result
+        sides = ["current", "reference"] if (metric._name, kind) in _REFERENCE_CHECKS else ["current"]
+        return [(kind, feature, side) for side in sides]
+
+    def _summary_nodes(self, feature: str, shareable: dict, current: pd.DataFrame, reference: pd.DataFrame) -> list:
+        """Nodes of the summary statistics of a feature: moments and sorted values of numeric features, counts of the
+        categories of categorical features (whose summary is their count), None if evaluated directly"""
+        if shareable.get(feature, False):
+            return self._feature_nodes(SUMMARY, feature)
+        if self._is_scalar(feature, current, reference) and self._is_categorical(feature, current):
+            return [("categories", feature, "current")]
+        return None
+
+    @staticmethod
+    def _feature_nodes(consumer: str, feature: str) -> list:
+        nodes = []
+        for kind in NODE_REQUIREMENTS[consumer]:
+            sides = ["pair"] if kind == "histogram" else ["current", "reference"]
+            nodes += [(kind, feature, side) for side in sides]
+        return nodes
+
+    def _is_profiled(self, feature: str, current: pd.DataFrame) -> bool:
+        """Summary statistics describe scalar features, embedding columns are monitored through their projections"""
+        if (self._schema is not None) and (feature in self._schema):
+            return self._schema.is_profiled(feature)
+        return (feature not in current.columns) or not is_vector_column(current[feature])
+
+    def compile(self, current: pd.DataFrame, reference: pd.DataFrame, options: dict = {}) -> "MetricPlan":
+        """Route every metric to shared intermediate nodes or to a direct evaluation
+
+        Parameters
+        ----------
+        current : DataFrame
+            The input current (pandas DataFrame)
+        reference : DataFrame
+            The input reference (pandas DataFrame)
+        options : dict, optional
+            Options of the metrics, keyed by metric name
+
+        Returns
+        -------
+        MetricPlan
+            the compiled plan
+        """
+        features = set(self._summary_features) | {
+            metric._feature_name
+            for metric in self._metrics_list
+            if isinstance(metric, (DriftMetric, DriftTestMetric, DataQualityMetric))
+        }
+        schema = self._schema
+        shareable = {feature: _is_shareable(feature, current, reference, schema) for feature in features if feature is not None}
+        # The histograms of all the features of kl and js metrics are counted together
+        binned = [metric._feature_name for metric in self._metrics_list if _is_binnable(metric, current, reference, schema)]
+        self._binned_features = tuple(dict.fromkeys(binned))
+        self._vectorized_features = {}
+        for metric in self._metrics_list:
+            if getattr(metric, "_vectorized", False):
+                self._vectorized_features.setdefault(metric._name, [])
+                self._vectorized_features[metric._name].append(metric._feature_name)
+        self._vectorized_features = {name: tuple(features) for name, features in self._vectorized_features.items()}
+
+        self._sizes = (len(current), len(reference))
+        self._steps = [
+            (SUMMARY, feature, self._summary_nodes(feature, shareable, current, reference))
+            for feature in self._summary_features
+            if self._is_profiled(feature, current)
+        ]
+        self._steps += [
+            (metric, getattr(metric, "_feature_name", None), self._route(metric, options, shareable, current, reference))
+            for metric in self._metrics_list
+        ]
+        return self
+
+    def explain(self) -> pd.DataFrame:
+        """Return the nodes of the compiled plan with their consumers and estimated cost
+
+        Returns
+        -------
+        DataFrame
+            one row per shared node or direct evaluation, with its consumers and estimated cost
+        """
+        n_current, n_reference = self._sizes
+        sizes = {"current": n_current, "reference": n_reference, "pair": n_current + n_reference}
+        nodes, rows = {}, []
+        for consumer, feature, consumed in self._steps:
+            name = consumer if isinstance(consumer, str) else consumer._name
+            if consumed is None:
+                cost = _DIRECT_COSTS.get(name, lambda n, m: (n + m) * np.log2(max(n + m, 2)))(n_current, n_reference)
+                rows.append({"node": DIRECT, "feature": feature, "side": None, "consumers": [name], "estimated_cost": cost})
+                continue
+            for kind, node_feature, side in consumed:
+                if (kind, node_feature, side) not in nodes:
+                    nodes[(kind, node_feature, side)] = {
+                        "node": kind,
+                        "feature": node_feature,
+                        "side": side,
+                        "consumers": [],
+                        "estimated_cost": _NODE_COSTS[kind](sizes[side]) * _node_width(kind, node_feature),
+                    }
+                    rows.append(nodes[(kind, node_feature, side)])
+                nodes[(kind, node_feature, side)]["consumers"].append(name)
+        return pd.DataFrame(rows, columns=["node", "feature", "side", "consumers", "estimated_cost"])
+
+    def split(self, batch_size: int) -> list:
+        """Split the compiled plan into sub-plans of about batch_size steps
+
+        The steps consuming the same nodes (the nodes of a feature, a batched histogram or vectorized node, a
+        ranking kernel) stay in the same sub-plan, so that every node is still computed once.
+
+        Parameters
+        ----------
+        batch_size : int
+            Target number of steps of a sub-plan
+
+        Returns
+        -------
+        list
+            the sub-plans, their indices attribute giving the positions of their steps in the plan
+        """
+        batches, batch = [], []
+        for indices in self._groups():
+            if batch and (len(batch) + len(indices) > batch_size):
+                batches.append(batch)
+                batch = []
+            batch += indices
+        if batch:
+            batches.append(batch)
+        return [self._subplan(sorted(indices)) for indices in batches]
+
+    def _groups(self) -> list:
+        """Positions of the steps grouped by the nodes they consume, a direct evaluation being its own group"""
+        groups = {}
+        for index, (_, _, consumed) in enumerate(self._steps):
+            if consumed is None:
+                key = ("direct", index)
+            else:
+                kind, feature, _ = consumed[0]
+                key = ("feature", feature) if kind in _FEATURE_NODES else consumed[0]
+            groups.setdefault(key, []).append(index)
+        return list(groups.values())
+
+    def _subplan(self, indices: list) -> "MetricPlan":
+        steps = [self._steps[i] for i in indices]
+        plan = MetricPlan(
+            [step[0] for step in steps if step[0] != SUMMARY],
+            summary_features=[step[1] for step in steps if step[0] == SUMMARY],
+            schema=self._schema,
+        )
+        plan._steps = steps
+        plan._sizes = self._sizes
+        plan._binned_features = self._binned_features
+        plan._vectorized_features = self._vectorized_features
+        plan.indices = indices
+        return plan
+
+    def execute(
+        self,
+        current: pd.DataFrame,
+        reference: pd.DataFrame,
+        options: dict = {},
+        progress: bool = True,
+        bounded: bool = False,
+        spill_threshold: int = None,
+        reference_nodes: dict = None,
+    ) -> list:
+        """Execute the compiled plan
+
+        Parameters
+        ----------
+        current : DataFrame
+            The input current (pandas DataFrame)
+        reference : DataFrame
+            The input reference (pandas DataFrame)
+        options : dict, optional
+            Options of the metrics, keyed by metric name
+        progress : bool, optional
+            Whether to show a progress bar
+        bounded : bool, optional
+            Whether to hold the nodes of one group of steps at a time (see execute_steps)
+        spill_threshold : int, optional
+            Size in bytes above which node arrays are spilled to memory-mapped temporary files. No spill if None
+        reference_nodes : dict, optional
+            Precomputed nodes of the reference, keyed by (node, feature, "reference"), such as the nodes of a stored
+            reference
+
+        Returns
+        -------
+        list
+            the results of the summary statistics followed by the results of the metrics
+        """
+        steps = self.execute_steps(
+            current,
+            reference,
+            options,
+            progress,
+            bounded=bounded,
+            spill_threshold=spill_threshold,
+            reference_nodes=reference_nodes,
+        )
+        # Metrics failing on the data have no result
+        return [result for results in steps for result in results if result is not None]
+
+    def execute_steps(
+        self,
+        current: pd.DataFrame,
+        reference: pd.DataFrame,
+        options: dict = {},
+        progress: bool = True,
+        bounded: bool = False,
+        spill_threshold: int = None,
+        reference_nodes: dict = None,
+    ) -> list:
+        """Execute the compiled plan, returning the list of results of every step (in the order of the steps)
+
+        With bounded, the groups of steps sharing their nodes are executed one after the other and their nodes are
+        released at the end of the group, so that only the nodes of one group are held at a time. Node arrays larger
+        than spill_threshold bytes are spilled to memory-mapped temporary files. The reference_nodes are used instead of
+        computing the nodes of the reference.
+        """
+        nodes = Intermediates(
+            current, reference, binned_features=self._binned_features, spill_threshold=spill_threshold, nodes=reference_nodes
+        )
+        groups = self._groups() if bounded else [list(range(len(self._steps)))]
+        batches, batch_results = {}, {}
+        for metric, _, consumed in self._steps:
+            if (consumed is not None) and (consumed[0][0] == "vectorized"):
+                batches.setdefault(consumed[0], []).append(metric)
+
+        results = [None] * len(self._steps)
+        try:
+            with tqdm(total=sum(step[0] != SUMMARY for step in self._steps), disable=not progress) as bar:
+                for group in groups:
+                    # Summaries first within a group, as in the order of the steps
+                    for index in group:
+                        results[index] = self._execute_step(
+                            *self._steps[index], nodes, current, reference, options, batches, batch_results
+                        )
+                        bar.update(self._steps[index][0] != SUMMARY)
+                    if bounded:
+                        nodes.clear()
+                        batch_results.clear()
+        finally:
+            nodes.close()
+        return results
+
+    def _execute_step(self, consumer, feature, consumed, nodes, current, reference, options, batches, batch_results) -> list:
+        if consumer == SUMMARY:
+            statistics = FeatureSummary(feature_name=feature)
+            if consumed is None:
+                statistics.evaluate(current, reference, percentiles=PERCENTILES)
+            elif consumed[0][0] == "categories":
+                statistics.evaluate_from_statistics({}, None, int(nodes.get(*consumed[0]).sum()))
+            else:
+                statistics.evaluate_from_statistics(
+                    _summary_statistics(nodes, feature, "current"),
+                    _summary_statistics(nodes, feature, "reference"),
+                    len(current),
+                )
+            return statistics._result
+
+        metric = consumer
+        kwargs = dict(options.get(metric._name, {}))
+        if consumed is None:
+            return [evaluate_metric(metric, current, reference, **kwargs)]
+        if consumed[0][0] == "vectorized":
+            if consumed[0] not in batch_results:
+                batch = batches[consumed[0]]
+                batch_results[consumed[0]] = dict(zip(map(id, batch), evaluate_vectorized(batch, current, reference, **kwargs)))
+            return [batch_results[consumed[0]][id(metric)]]
+        if isinstance(metric, PerformanceMetric):
+            kernel = nodes.get(*consumed[0])
+            return [evaluate_metric(metric, current, reference, kernel=kernel, **kwargs)]
+        if isinstance(metric, DataQualityMetric):
+            return [self._evaluate_quality(metric, consumed[0], nodes, current, reference, **kwargs)]
+        return [self._evaluate_shared(metric, nodes, current, reference, **kwargs)]
+
+    @staticmethod
+    def _evaluate_quality(metric, node: tuple, nodes: Intermediates, current: pd.DataFrame, reference: pd.DataFrame, **kwargs):
+        """Evaluate a data quality check from the shared nodes, falling back on a direct evaluation on failure"""
+        kind, feature, _ = node
+        try:
+            value = _QUALITY_KERNELS[(metric._name, kind)](nodes, feature)
+        except Exception:
+            return evaluate_metric(metric, current, reference, **kwargs)
+        return None if value is None else metric._make_result(value, **kwargs)
+
+    @staticmethod
+    def _evaluate_shared(metric, nodes: Intermediates, current: pd.DataFrame, reference: pd.DataFrame, **kwargs):
+        """Evaluate a drift metric from the shared nodes, falling back on a direct evaluation on failure"""
+        result_kwargs = ["alpha"] if isinstance(metric, DriftTestMetric) else ["threshold", "upper_bound"]
+        function_kwargs = {key: value for key, value in kwargs.items() if key not in result_kwargs}
+        try:
+            value = _KERNELS[metric._name](nodes, metric._feature_name, **function_kwargs)
+        except Exception:
+            return evaluate_metric(metric, current, reference, **kwargs)
+        return metric._make_result(value, **{key: option for key, option in kwargs.items() if key in result_kwargs})
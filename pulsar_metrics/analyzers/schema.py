@@ -0,0 +1,220 @@
+#  Author:   Adel Benlagra  <abenlagra@rocketscience.one>
+import json
+import re
+from collections import namedtuple
+
+import constant
+import numpy as np
+import pandas as pd
+from pandas.api.types import (
+    is_bool_dtype,
+    is_datetime64_any_dtype,
+    is_integer_dtype,
+    is_numeric_dtype,
+)
+
+from ..exceptions import CustomExceptionPulsarMetric as error_msg
+from ..metrics.embeddings import is_vector_column
+from ..utils import compact_dataframe
+
+ROLES = ("feature", "target", "prediction", "id", "timestamp")
+KINDS = ("continuous", "discrete", "categorical", "vector", "datetime")
+# Columns profiled with summary statistics, and kinds of the columns computed with the numeric kernels
+PROFILED_ROLES = ("feature", "target", "prediction")
+NUMERIC_KINDS = ("continuous", "discrete")
+
+# Role of a column inferred from its name, in order of precedence
+_ROLE_PATTERNS = (
+    ("timestamp", re.compile(r"(^|_)(timestamp|date|datetime)$")),
+    ("id", re.compile(r"^(id|identifier|model_id|model_version)$|_id$")),
+    ("target", re.compile(r"^(y_true|target|label)$|_target$")),
+    ("prediction", re.compile(r"^(y_pred|prediction)")),
+)
+
+
+ColumnSchema = namedtuple("ColumnSchema", ["role", "kind", "dtype"])
+
+
+def infer_role(name) -> str:
+    """Role of a column inferred from its name (a feature if no pattern matches)"""
+    for role, pattern in _ROLE_PATTERNS:
+        if pattern.search(str(name)):
+            return role
+    return "feature"
+
+
+def infer_kind(column: pd.Series, role: str = "feature", max_discrete: int = constant.DISCRETE_MAX_VALUES) -> str:
+    """Kind of a column: vector for embeddings, datetime for timestamps, categorical for non-numeric and boolean
+    columns, discrete for integer columns with at most max_discrete distinct values, continuous otherwise"""
+    if is_vector_column(column):
+        return "vector"
+    if (role == "timestamp") or is_datetime64_any_dtype(column):
+        return "datetime"
+    if is_bool_dtype(column) or not is_numeric_dtype(column):
+        return "categorical"
+    if is_integer_dtype(column) and (column.nunique() <= max_discrete):
+        return "discrete"
+    return "continuous"
+
+
+def _fits(column: pd.Series, dtype: np.dtype) -> bool:
+    """Whether the values of a numeric column are stored exactly by an integer dtype"""
+    if not is_numeric_dtype(column) or column.isnull().any():
+        return False
+    if len(column) == 0:
+        return True
+    values = column.to_numpy()
+    if (values.dtype.kind == "f") and not np.array_equal(values, np.floor(values)):
+        return False
+    info = np.iinfo(dtype)
+    return bool((info.min <= values.min()) and (values.max() <= info.max))
+
+
+class Schema:
+    """Schema of the datasets of a model, inferred once from the reference
+
+    Every column has a role (feature, target, prediction, id or timestamp), a kind (continuous, discrete,
+    categorical, vector or datetime) and the compact dtype it is stored with (see pulsar_metrics.utils.compact_dataframe).
+    Metric plans use the schema to route the features to the numeric or categorical kernels without checking their
+    dtypes on every run, and only profile the features, targets and predictions. Columns missing from the schema
+    are handled from their dtypes.
+    """
+
+    def __init__(self, columns: dict):
+        """Constructor of the Schema class
+
+        Parameters
+        ----------
+        columns : dict
+            ColumnSchema (or dict with role, kind and dtype) of every column, keyed by column name
+        """
+        self._columns = {}
+        for name, column in columns.items():
+            column = ColumnSchema(**column) if isinstance(column, dict) else ColumnSchema(*column)
+            if (column.role not in ROLES) or (column.kind not in KINDS):
+                raise error_msg(
+                    value=(name, column.role, column.kind),
+                    message=f"InvalidInput: column roles should be one of {ROLES} and kinds one of {KINDS}",
+                )
+            self._columns[name] = column
+
+    @classmethod
+    def infer(
+        cls,
+        reference: pd.DataFrame,
+        roles: dict = {},
+        precision: str = "float32",
+        max_discrete: int = constant.DISCRETE_MAX_VALUES,
+    ) -> "Schema":
+        """Infer the schema of a reference
+
+        Parameters
+        ----------
+        reference : DataFrame
+            The input reference (pandas DataFrame)
+        roles : dict, optional
+            Roles of the columns, keyed by column name, overriding the roles inferred from the names
+        precision : str, optional
+            Floating precision of the storage dtypes, one of float32 or float64
+        max_discrete : int, optional
+            Maximum number of distinct values of a discrete integer column
+
+        Returns
+        -------
+        Schema
+            the schema of the columns of the reference
+        """
+        columns = {}
+        kinds = {}
+        for name, column in reference.items():
+            role = roles.get(name, infer_role(name))
+            kinds[name] = (role, infer_kind(column, role=role, max_discrete=max_discrete))
+        scalars = [name for name, (_, kind) in kinds.items() if kind not in ("vector", "datetime")]
+        compact = compact_dataframe(reference[scalars], precision=precision, timestamp_columns=[])
+        for name, (role, kind) in kinds.items():
+            dtype = {"vector": "float32", "datetime": "int64"}.get(kind) or str(compact[name].dtype)
+            columns[name] = ColumnSchema(role, kind, dtype)
+        return cls(columns)
+
+    def __contains__(self, name) -> bool:
+        return name in self._columns
+
+    def __getitem__(self, name) -> ColumnSchema:
+        return self._columns[name]
+
+    def __len__(self) -> int:
+        return len(self._columns)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Schema) and (self._columns == other._columns)
+
+    @property
+    def columns(self) -> list:
+        return list(self._columns)
+
+    @property
+    def features(self) -> list:
+        """Columns with the feature role"""
+        return self.with_role("feature")
+
+    def with_role(self, role: str) -> list:
+        return [name for name, column in self._columns.items() if column.role == role]
+
+    def role(self, name) -> str:
+        return self._columns[name].role if name in self._columns else None
+
+    def kind(self, name) -> str:
+        return self._columns[name].kind if name in self._columns else None
+
+    def is_numeric(self, name) -> bool:
+        """Whether a column is computed with the numeric kernels (None if the column is not in the schema)"""
+        return (self._columns[name].kind in NUMERIC_KINDS) if name in self._columns else None
+
+    def is_profiled(self, name) -> bool:
+        """Whether a column is profiled with summary statistics (scalar features, targets and predictions, and
+        the columns missing from the schema)"""
+        if name not in self._columns:
+            return True
+        return (self._columns[name].role in PROFILED_ROLES) and (self._columns[name].kind != "vector")
+
+    def compact(self, data: pd.DataFrame) -> pd.DataFrame:
+        """Return a copy of the data stored with the dtypes of the schema (the other columns unchanged)"""
+        columns = {}
+        for name, column in data.items():
+            schema = self._columns.get(name)
+            if (schema is None) or (schema.kind == "vector") or (str(column.dtype) == schema.dtype):
+                columns[name] = column
+            elif schema.kind == "datetime":
+                columns[name] = pd.to_datetime(column).astype("int64")
+            elif (np.dtype(schema.dtype).kind in "iu") and not _fits(column, np.dtype(schema.dtype)):
+                # The integer dtype downcast on the reference cannot hold the missing, fractional or out-of-range
+                # values of a new dataset
+                columns[name] = column
+            else:
+                columns[name] = column.astype(schema.dtype)
+        return pd.DataFrame(columns, index=data.index)
+
+    def to_dict(self) -> dict:
+        return {"columns": {str(name): column._asdict() for name, column in self._columns.items()}}
+
+    @staticmethod
+    def from_dict(data: dict) -> "Schema":
+        return Schema(data["columns"])
+
+    def save(self, path: str):
+        """Save the schema to a JSON file"""
+        with open(path, "w") as file:
+            json.dump(self.to_dict(), file, indent=2)
+
+    @staticmethod
+    def load(path: str) -> "Schema":
+        """Load a schema from a JSON file"""
+        with open(path) as file:
+            return Schema.from_dict(json.load(file))
+
+    def to_pandas(self) -> pd.DataFrame:
+        """The schema as a DataFrame, one row per column"""
+        return pd.DataFrame(
+            [{"column": name, **column._asdict()} for name, column in self._columns.items()],
+            columns=["column", "role", "kind", "dtype"],
+        )
@@ -0,0 +1,259 @@
+#  Author:   Adel Benlagra  <abenlagra@rocketscience.one>
+from itertools import combinations
+
+import constant
+import numpy as np
+import pandas as pd
+
+from ..exceptions import CustomExceptionPulsarMetric as error_msg
+from ..metrics.backends import _binary_labels
+from ..metrics.histograms import FrozenBinning
+
+# Performance metrics computed on slices, and whether higher values are better
+SLICE_METRICS = {"accuracy": True, "precision": True, "recall": True, "f1": True, "mae": False, "mse": False}
+CLASSIFICATION_METRICS = ("accuracy", "precision", "recall", "f1")
+SLICE_COLUMNS = [
+    "metric_name",
+    "slice",
+    "features",
+    "depth",
+    "support",
+    "metric_value",
+    "complement_value",
+    "gap",
+    "p_value",
+    "significant",
+]
+
+
+def _metric_values(metric_name: str, stats: np.ndarray) -> np.ndarray:
+    """Metric of every row of the aggregated statistics: tn, fp, fn, tp counts of the classification metrics, count
+    and sums of the losses (absolute or squared errors) and of their squares of the regression metrics"""
+    if metric_name in CLASSIFICATION_METRICS:
+        tn, fp, fn, tp = np.moveaxis(stats, -1, 0)
+        numerator, denominator = {
+            "accuracy": (tp + tn, tp + tn + fp + fn),
+            "precision": (tp, tp + fp),
+            "recall": (tp, tp + fn),
+            "f1": (2 * tp, 2 * tp + fp + fn),
+        }[metric_name]
+    else:
+        numerator, denominator = stats[..., 1], stats[..., 0]
+    # Undefined ratios are 0, as sklearn with zero_division="warn"
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(denominator > 0, numerator / denominator, 0.0)
+
+
+def _support(stats: np.ndarray) -> np.ndarray:
+    """Number of rows of every row of the aggregated statistics"""
+    return stats.sum(axis=-1) if stats.shape[-1] == 4 else stats[..., 0]
+
+
+def _gaps(metric_name: str, stats: np.ndarray, total: np.ndarray) -> tuple:
+    """Metric of the slices and of their complements, and gap (positive when the slices underperform)"""
+    values, complement = _metric_values(metric_name, stats), _metric_values(metric_name, total - stats)
+    return values, complement, (complement - values) if SLICE_METRICS[metric_name] else (values - complement)
+
+
+class SliceFinder:
+    """Finder of the slices of a dataset on which a model underperforms
+
+    A slice is a conjunction of bins of up to max_depth features: the numeric features are binned on equal-width bins
+    and the categorical features on their categories, both frozen on the reference (see FrozenBinning), so that the
+    slices of successive windows are the same. The statistics of the metric (confusion counts of the classification
+    metrics, error sums of the regression metrics) are aggregated for all the slices of a combination of features
+    with a single bincount on the mixed-radix key of their bins, the rows with a missing value of the combination
+    being left out. Slices with less than min_support rows are pruned, and the others are ranked by their gap, the
+    difference between the metric of the rows outside and inside the slice (positive when the slice underperforms).
+
+    The significance of the gaps of the top slices is estimated by bootstrap: the confusion counts of a slice and of
+    its complement are resampled from multinomial distributions, which is the bootstrap of their rows, and the mean
+    errors from their normal approximation. The p-values are not corrected for the number of slices.
+    """
+
+    def __init__(self, reference: pd.DataFrame, features: list, bins=constant.SLICE_BINS):
+        """Constructor of the SliceFinder class
+
+        Parameters
+        ----------
+        reference : DataFrame
+            The input reference (pandas DataFrame) the bins are frozen on
+        features : list
+            List of features to slice on
+        bins : int, str, optional
+            Number of bins or binning rule of numpy.histogram_bin_edges for the numeric features
+        """
+        self._binning = FrozenBinning(reference, features, bins=bins)
+        self._labels = [self._binning.labels(feature) for feature in self._binning.features]
+
+    @property
+    def features(self) -> list:
+        return self._binning.features
+
+    @staticmethod
+    def _row_statistics(metric_name: str, y_true: np.ndarray, y_pred: np.ndarray) -> tuple:
+        """Confusion cell (tn, fp, fn, tp) of every row of a classification, or loss and squared loss of a regression"""
+        if metric_name in CLASSIFICATION_METRICS:
+            true_labels, predicted_labels = _binary_labels(y_true), _binary_labels(y_pred)
+            if (true_labels is not None) and (predicted_labels is not None):
+                return 2 * true_labels + predicted_labels, None
+            if metric_name != "accuracy":
+                raise error_msg(
+                    value=metric_name,
+                    message=f'{"Slices of precision, recall and f1 need binary (0/1) labels and predictions."}',
+                )
+            # Correct predictions counted as true positives and wrong ones as false positives
+            return np.where(y_true == y_pred, 3, 1), None
+        errors = y_pred.astype(float) - y_true.astype(float)
+        loss = np.abs(errors) if metric_name == "mae" else errors**2
+        return None, np.stack([loss, loss**2])
+
+    @staticmethod
+    def _aggregate(keys: np.ndarray, n_keys: int, cells: np.ndarray, weights: np.ndarray) -> np.ndarray:
+        """(n_keys / 4, 4) confusion counts of keys holding the confusion cell in their highest digit, or (n_keys, 3)
+        counts and loss sums of the keys"""
+        if weights is None:
+            return np.bincount(keys, minlength=n_keys).reshape(4, -1).T.astype(float)
+        sums = [np.bincount(keys, minlength=n_keys)] + [np.bincount(keys, weights=w, minlength=n_keys) for w in weights]
+        return np.column_stack(sums).astype(float)
+
+    @staticmethod
+    def _replicates(metric_name: str, stats: np.ndarray, rng, n_bootstrap: int) -> np.ndarray:
+        """(n_bootstrap, n_slices) bootstrap replicates of the metric of slices"""
+        n = _support(stats)
+        if metric_name in CLASSIFICATION_METRICS:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                probabilities = np.where(n[:, None] > 0, stats / n[:, None], 0.25)
+            counts = rng.multinomial(n.astype(np.int64), probabilities, size=(n_bootstrap, len(stats)))
+            return _metric_values(metric_name, counts.astype(float))
+        # Mean and variance of the losses, from their sums and the sums of their squares
+        mean = stats[:, 1] / np.maximum(n, 1)
+        variance = np.maximum(stats[:, 2] / np.maximum(n, 1) - mean**2, 0)
+        return rng.normal(mean, np.sqrt(variance / np.maximum(n, 1)), size=(n_bootstrap, len(stats)))
+
+    def find(
+        self,
+        current: pd.DataFrame,
+        metric_name: str = "accuracy",
+        y_name: str = "y_true",
+        pred_name: str = "y_pred",
+        max_depth: int = constant.SLICE_MAX_DEPTH,
+        min_support: float = constant.SLICE_MIN_SUPPORT,
+        n_slices: int = 20,
+        n_bootstrap: int = constant.BOOTSTRAP_SIZE,
+        alpha: float = constant.SIGNIFICANCE_LEVEL,
+        seed: int = constant.SEED_SIZE,
+    ) -> pd.DataFrame:
+        """Find the slices of a dataset with the largest performance gaps
+
+        Parameters
+        ----------
+        current : DataFrame
+            The input current (pandas DataFrame)
+        metric_name : str, optional
+            Name of the performance metric, one of SLICE_METRICS
+        y_name : str, optional
+            Name of the column of the labels
+        pred_name : str, optional
+            Name of the column of the predictions
+        max_depth : int, optional
+            Maximum number of features of a slice
+        min_support : float, optional
+            Minimum number of rows of a slice, as a fraction of the rows of the dataset if below 1
+        n_slices : int, optional
+            Number of slices returned, ranked by gap
+        n_bootstrap : int, optional
+            Number of bootstrap replicates of the gaps (no p-value if 0)
+        alpha : float, optional
+            Significance level of the gaps
+        seed : int, optional
+            seed value for random number generator
+
+        Returns
+        -------
+        DataFrame
+            one row per slice: its description, features, depth, support, metric value inside and outside the slice,
+            gap, p-value and significance of the gap
+        """
+        if metric_name not in SLICE_METRICS:
+            raise error_msg(value=metric_name, message=f"InvalidInput: metric_name should be one of {list(SLICE_METRICS)}")
+        valid = (current[y_name].notna() & current[pred_name].notna()).to_numpy()
+        current = current[valid] if not valid.all() else current
+        cells, weights = self._row_statistics(metric_name, current[y_name].to_numpy(), current[pred_name].to_numpy())
+        n_bins = self._binning._n_bins
+        # One row per feature, the missing values in an extra last bin of every feature
+        codes = np.ascontiguousarray(self._binning.codes(current).T)
+        missing = codes < 0
+        codes[missing] = np.broadcast_to(n_bins[:, None], codes.shape)[missing]
+        radices = n_bins.astype(np.int64) + 1
+        n_cells = 1 if cells is None else 4
+        min_rows = max(min_support * len(current) if min_support < 1 else min_support, 1)
+        rows = np.zeros(len(current), dtype=np.int64) if cells is None else cells.astype(np.int64)
+        total = self._aggregate(rows, n_cells, cells, weights)[0]
+
+        candidates = []
+        keys = np.empty(len(current), dtype=np.int64)
+        for depth in range(1, max_depth + 1):
+            for prefix in combinations(range(len(self.features)), depth - 1):
+                # Mixed-radix key of the bins of the prefix features (the first one in the highest digit), shared by
+                # the combinations extending the prefix
+                prefix_keys = np.zeros(len(current), dtype=np.int64)
+                for column in prefix:
+                    prefix_keys *= radices[column]
+                    prefix_keys += codes[column]
+                prefix_size = int(np.prod(radices[list(prefix)]))
+                for last in range(prefix[-1] + 1 if prefix else 0, len(self.features)):
+                    # The bin of the last feature and the confusion cell in the highest digits of the key
+                    size = prefix_size * int(radices[last])
+                    np.multiply(rows, size, out=keys)
+                    keys += codes[last].astype(np.int64) * prefix_size
+                    keys += prefix_keys
+                    stats = self._aggregate(keys, n_cells * size, cells, weights)
+                    # Slices of the rows without missing values of the features, in the order of the features
+                    columns = prefix + (last,)
+                    shape = tuple(int(n_bins[column]) for column in columns)
+                    stats = stats.reshape(
+                        (int(radices[last]),) + tuple(int(radices[column]) for column in prefix) + stats.shape[-1:]
+                    )
+                    stats = np.moveaxis(stats, 0, depth - 1)[tuple(slice(0, n) for n in shape)]
+                    stats = stats.reshape(-1, stats.shape[-1])
+                    supported = np.flatnonzero(_support(stats) >= min_rows)
+                    if len(supported):
+                        candidates.append((columns, shape, supported, stats[supported]))
+
+        if not candidates:
+            return pd.DataFrame(columns=SLICE_COLUMNS)
+        stats = np.concatenate([candidate[3] for candidate in candidates])
+        origin = np.concatenate([np.full(len(candidate[2]), i) for i, candidate in enumerate(candidates)])
+        indexes = np.concatenate([candidate[2] for candidate in candidates])
+        values, complement, gaps = _gaps(metric_name, stats, total)
+        top = np.argsort(-gaps, kind="stable")[:n_slices]
+
+        p_values = np.full(len(top), np.nan)
+        if n_bootstrap > 0:
+            rng = np.random.default_rng(seed)
+            inside = self._replicates(metric_name, stats[top], rng, n_bootstrap)
+            outside = self._replicates(metric_name, total - stats[top], rng, n_bootstrap)
+            replicate_gaps = (outside - inside) if SLICE_METRICS[metric_name] else (inside - outside)
+            p_values = (1 + (replicate_gaps <= 0).sum(axis=0)) / (n_bootstrap + 1)
+
+        records = []
+        for rank, index in enumerate(top):
+            columns, shape, _, _ = candidates[origin[index]]
+            bins = np.unravel_index(indexes[index], shape)
+            features = tuple(self.features[column] for column in columns)
+            records.append(
+                {
+                    "metric_name": metric_name,
+                    "slice": " & ".join(f"{self.features[column]}={self._labels[column][b]}" for column, b in zip(columns, bins)),
+                    "features": features,
+                    "depth": len(features),
+                    "support": int(_support(stats[index])),
+                    "metric_value": float(values[index]),
+                    "complement_value": float(complement[index]),
+                    "gap": float(gaps[index]),
+                    "p_value": float(p_values[rank]),
+                    "significant": bool(p_values[rank] < alpha),
+                }
+            )
+        return pd.DataFrame(records, columns=SLICE_COLUMNS)
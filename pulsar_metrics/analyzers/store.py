@@ -0,0 +1,361 @@
+#  Author:   Adel Benlagra  <abenlagra@rocketscience.one>
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from ..exceptions import CustomExceptionPulsarMetric as error_msg
+from .calibration import ThresholdCalibration
+from .plan import Intermediates
+from .schema import Schema
+
+# Name of the file pointing to the current version of the reference of a model version
+_CURRENT = "CURRENT"
+_MANIFEST = "manifest.json"
+_THRESHOLDS = "thresholds.json"
+
+
+def _filter_model(reference: pd.DataFrame, model_id, model_version) -> pd.DataFrame:
+    """Rows of the reference of a model version (all the rows if the dataset has no model metadata columns)"""
+    mask = np.ones(len(reference), dtype=bool)
+    if "model_id" in reference.columns:
+        mask &= (reference["model_id"] == model_id).to_numpy()
+    if "model_version" in reference.columns:
+        mask &= (reference["model_version"] == model_version).to_numpy()
+    return reference.loc[mask]
+
+
+def _is_mappable(column: pd.Series) -> bool:
+    """Columns of numpy numeric, boolean or datetime dtypes are stored as raw arrays, the others as codes"""
+    return isinstance(column.dtype, np.dtype) and column.dtype.kind in "biufcmM"
+
+
+def _save(path: str, array: np.ndarray, digest):
+    np.save(path, array, allow_pickle=array.dtype == object)
+    digest.update(os.path.basename(path).encode())
+    digest.update(np.ascontiguousarray(array).view(np.uint8) if array.dtype != object else repr(array.tolist()).encode())
+
+
+class StoredReference:
+    """Reference of a model version attached from a reference store
+
+    The columns are memory-mapped from the files of the store: the pages are shared by all the processes attaching
+    the same reference through the page cache of the operating system, and are only read when accessed. Numeric,
+    boolean and datetime columns are zero-copy views of the files, other columns are decoded from their codes.
+    The sorted values and the moments of the numeric features are stored along with the columns and given to the
+    metric plans as precomputed reference nodes.
+    """
+
+    def __init__(self, path: str):
+        """Constructor of the StoredReference class
+
+        Parameters
+        ----------
+        path : str
+            Directory of the stored reference
+        """
+        with open(os.path.join(path, _MANIFEST)) as file:
+            self._manifest = json.load(file)
+        self._path = path
+        self._frame = None
+        self._nodes = None
+
+    def __getstate__(self):
+        # Workers attach the files again instead of receiving a copy of the mapped arrays
+        return {"_path": self._path, "_manifest": self._manifest, "_frame": None, "_nodes": None}
+
+    @property
+    def model_id(self):
+        return self._manifest["model_id"]
+
+    @property
+    def model_version(self):
+        return self._manifest["model_version"]
+
+    @property
+    def fingerprint(self) -> str:
+        return self._manifest["fingerprint"]
+
+    def __len__(self) -> int:
+        return self._manifest["rows"]
+
+    @property
+    def schema(self) -> Schema:
+        """Schema of the reference, inferred when it was stored"""
+        return Schema.from_dict(self._manifest["schema"]) if "schema" in self._manifest else None
+
+    @property
+    def thresholds(self) -> ThresholdCalibration:
+        """Thresholds calibrated on the reference (None if none were stored)"""
+        path = os.path.join(self._path, _THRESHOLDS)
+        return ThresholdCalibration.load(path) if os.path.exists(path) else None
+
+    def _load(self, name: str) -> np.ndarray:
+        return np.load(os.path.join(self._path, name), mmap_mode="r")
+
+    @property
+    def frame(self) -> pd.DataFrame:
+        """The reference as a DataFrame (columns grouped by dtype)"""
+        if self._frame is None:
+            frames = [
+                pd.DataFrame(self._load(group["file"]).T, columns=group["columns"], copy=False)
+                for group in self._manifest["groups"]
+            ]
+            for column, coded in self._manifest["coded"].items():
+                categories = np.load(os.path.join(self._path, coded["categories"]), allow_pickle=True)
+                codes = self._load(coded["codes"])
+                values = (
+                    np.where(codes < 0, None, categories[np.maximum(codes, 0)]) if len(categories) else np.full(len(codes), None)
+                )
+                frames.append(pd.DataFrame({column: values}))
+            self._frame = pd.concat(frames, axis=1, copy=False) if frames else pd.DataFrame()
+        return self._frame
+
+    def nodes(self) -> dict:
+        """Precomputed reference nodes of a metric plan (sorted values and moments of the numeric features)"""
+        if self._nodes is None:
+            sorted_values = self._load(self._manifest["sorted"]["file"])
+            self._nodes = {}
+            for row, feature in enumerate(self._manifest["sorted"]["features"]):
+                self._nodes[("sorted", feature, "reference")] = sorted_values[row]
+                # numpy scalars, as computed by the plan (a constant feature has infinite or undefined moment ratios)
+                moments = self._manifest["moments"][feature]
+                self._nodes[("moments", feature, "reference")] = {
+                    key: value if key == "n" else np.float64(value) for key, value in moments.items()
+                }
+        return self._nodes
+
+    def is_current(self) -> bool:
+        """Whether the reference is still the current version of its model version in the store"""
+        pointer = os.path.join(os.path.dirname(self._path), _CURRENT)
+        if not os.path.exists(pointer):
+            return False
+        with open(pointer) as file:
+            return file.read().strip() == self.fingerprint
+
+
+class ReferenceStore:
+    """Store of the filtered references of model versions, attached zero-copy by any process
+
+    Every model version has its own directory holding the versions of its reference, named by the fingerprint of
+    their content, and a pointer to the current one. Writing a reference never modifies the files of a previous
+    version: the new version is written to a temporary directory, moved in place and the pointer is replaced
+    atomically, so that workers attached to the previous version keep reading consistent data. Superseded versions
+    are kept (references attached to them, or pickled to other processes, can still load their files) until they are
+    removed by `gc`. Invalidating a model version removes its directory (mapped files stay readable by the processes
+    holding them).
+    """
+
+    def __init__(self, root: str):
+        """Constructor of the ReferenceStore class
+
+        Parameters
+        ----------
+        root : str
+            Root directory of the store
+        """
+        self._root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _model_path(self, model_id, model_version) -> str:
+        return os.path.join(self._root, str(model_id), str(model_version))
+
+    def put(self, reference: pd.DataFrame, model_id, model_version, schema: Schema = None) -> StoredReference:
+        """Store the reference of a model version (its rows being filtered on the model metadata columns) with its schema
+
+        Parameters
+        ----------
+        reference : DataFrame
+            The input reference (pandas DataFrame)
+        model_id : str
+            The model id
+        model_version : str
+            The model version
+        schema : Schema, optional
+            Schema of the reference (inferred from the reference if None)
+
+        Returns
+        -------
+        StoredReference
+            the stored reference, current version of the model version
+        """
+        reference = _filter_model(reference, model_id, model_version)
+        schema = Schema.infer(reference) if schema is None else schema
+        model_path = self._model_path(model_id, model_version)
+        os.makedirs(model_path, exist_ok=True)
+        staging = tempfile.mkdtemp(prefix=".staging_", dir=model_path)
+        try:
+            manifest = self._write(reference, staging, schema)
+            manifest.update({"model_id": model_id, "model_version": model_version, "created": datetime.now().isoformat()})
+            path = os.path.join(model_path, manifest["fingerprint"])
+            if os.path.exists(path):
+                shutil.rmtree(staging)
+            else:
+                with open(os.path.join(staging, _MANIFEST), "w") as file:
+                    json.dump(manifest, file)
+                os.replace(staging, path)
+        except Exception:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+
+        pointer = os.path.join(model_path, _CURRENT)
+        with open(pointer + ".tmp", "w") as file:
+            file.write(manifest["fingerprint"])
+        os.replace(pointer + ".tmp", pointer)
+        return StoredReference(path)
+
+    @staticmethod
+    def _write(reference: pd.DataFrame, path: str, schema: Schema) -> dict:
+        """Write the columns and the reference nodes of a reference, returning its manifest"""
+        digest = hashlib.blake2b(digest_size=8)
+        manifest = {"rows": len(reference), "groups": [], "coded": {}, "schema": schema.to_dict()}
+        digest.update(json.dumps(manifest["schema"], sort_keys=True).encode())
+
+        groups = {}
+        for column in reference.columns:
+            if _is_mappable(reference[column]):
+                groups.setdefault(reference[column].dtype.str, []).append(column)
+            else:
+                codes, categories = pd.factorize(reference[column])
+                index = len(manifest["coded"])
+                manifest["coded"][column] = {"codes": f"codes_{index}.npy", "categories": f"categories_{index}.npy"}
+                _save(os.path.join(path, manifest["coded"][column]["codes"]), codes.astype(np.int32), digest)
+                _save(os.path.join(path, manifest["coded"][column]["categories"]), np.asarray(categories, dtype=object), digest)
+        for index, (dtype, columns) in enumerate(groups.items()):
+            # One row per column, so that every column is a contiguous view of the file
+            group = {"file": f"group_{index}.npy", "columns": columns, "dtype": dtype}
+            _save(os.path.join(path, group["file"]), reference[columns].to_numpy(dtype=np.dtype(dtype)).T.copy(), digest)
+            manifest["groups"].append(group)
+
+        numeric = [
+            column
+            for column in reference.columns
+            if _is_mappable(reference[column]) and reference[column].dtype.kind in "biuf" and reference[column].notnull().all()
+        ]
+        nodes = Intermediates(None, reference)
+        sorted_values = np.empty((len(numeric), len(reference)))
+        for row, feature in enumerate(numeric):
+            sorted_values[row] = nodes.get("sorted", feature, "reference")
+        _save(os.path.join(path, "sorted.npy"), sorted_values, digest)
+        manifest["sorted"] = {"file": "sorted.npy", "features": numeric}
+        manifest["moments"] = {feature: nodes.get("moments", feature, "reference") for feature in numeric}
+        manifest["fingerprint"] = digest.hexdigest()
+        return manifest
+
+    def get(self, model_id, model_version) -> StoredReference:
+        """Attach the current version of the reference of a model version
+
+        Parameters
+        ----------
+        model_id : str
+            The model id
+        model_version : str
+            The model version
+
+        Returns
+        -------
+        StoredReference
+            the stored reference
+        """
+        pointer = os.path.join(self._model_path(model_id, model_version), _CURRENT)
+        if not os.path.exists(pointer):
+            raise error_msg(
+                value=(model_id, model_version),
+                message=f'{"No reference stored for this model version."}',
+            )
+        with open(pointer) as file:
+            return StoredReference(os.path.join(self._model_path(model_id, model_version), file.read().strip()))
+
+    def put_thresholds(self, thresholds: ThresholdCalibration, model_id, model_version) -> StoredReference:
+        """Store thresholds calibrated on the current reference of a model version alongside its files
+
+        The thresholds belong to the version of the reference they were calibrated on, and are removed with it.
+
+        Parameters
+        ----------
+        thresholds : ThresholdCalibration
+            The calibrated thresholds
+        model_id : str
+            The model id
+        model_version : str
+            The model version
+
+        Returns
+        -------
+        StoredReference
+            the stored reference
+        """
+        reference = self.get(model_id, model_version)
+        path = os.path.join(reference._path, _THRESHOLDS)
+        thresholds.save(path + ".tmp")
+        os.replace(path + ".tmp", path)
+        return reference
+
+    def versions(self) -> pd.DataFrame:
+        """Model versions with a stored reference, with the fingerprint, rows and creation time of the reference"""
+        rows = []
+        for model_id in sorted(os.listdir(self._root)):
+            for model_version in sorted(os.listdir(os.path.join(self._root, model_id))):
+                try:
+                    reference = self.get(model_id, model_version)
+                except error_msg:
+                    continue
+                rows.append(
+                    {
+                        "model_id": reference.model_id,
+                        "model_version": reference.model_version,
+                        "fingerprint": reference.fingerprint,
+                        "rows": len(reference),
+                        "created": reference._manifest["created"],
+                    }
+                )
+        return pd.DataFrame(rows, columns=["model_id", "model_version", "fingerprint", "rows", "created"])
+
+    def gc(self, model_id=None, model_version=None) -> list:
+        """Remove the superseded versions of the references, keeping the current version of every model version
+
+        References attached to a removed version can no longer load the columns they have not read yet (the columns
+        already mapped stay readable by the processes holding them).
+
+        Parameters
+        ----------
+        model_id : str, optional
+            The model id (all the models if None)
+        model_version : str, optional
+            The model version (all the versions of the model if None)
+
+        Returns
+        -------
+        list
+            the fingerprints of the removed versions
+        """
+        model_ids = sorted(os.listdir(self._root)) if model_id is None else [str(model_id)]
+        removed = []
+        for model in model_ids:
+            if not os.path.isdir(os.path.join(self._root, model)):
+                continue
+            model_versions = (
+                sorted(os.listdir(os.path.join(self._root, model))) if model_version is None else [str(model_version)]
+            )
+            for version in model_versions:
+                model_path = self._model_path(model, version)
+                pointer = os.path.join(model_path, _CURRENT)
+                if not os.path.exists(pointer):
+                    continue
+                with open(pointer) as file:
+                    current = file.read().strip()
+                for name in os.listdir(model_path):
+                    if name not in (current, _CURRENT) and not name.startswith("."):
+                        shutil.rmtree(os.path.join(model_path, name), ignore_errors=True)
+                        removed.append(name)
+        return removed
+
+    def invalidate(self, model_id, model_version=None):
+        """Remove the stored references of a model version (of all the versions of the model if model_version is None)"""
+        path = os.path.join(self._root, str(model_id)) if model_version is None else self._model_path(model_id, model_version)
+        shutil.rmtree(path, ignore_errors=True)
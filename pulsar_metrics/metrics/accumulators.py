@@ -0,0 +1,415 @@
+#  Author:   Adel Benlagra  <abenlagra@rocketscience.one>
+from abc import ABC, abstractmethod
+
+import constant
+import numpy as np
+
+from ..exceptions import CustomExceptionPulsarMetric as error_msg
+from .states import SerializableState
+
+
+class AbstractAccumulator(SerializableState, ABC):
+    """AbstractAccumulator class for mergeable sufficient statistics of performance metrics
+
+    The state of every accumulator is stored with a leading replicate axis of size ``1 + n_bootstrap``.
+    The first replicate holds the point estimate (unit weights) while the other replicates hold
+    Poisson(1) bootstrap weights, which allows streaming confidence intervals to be merged as well.
+    """
+
+    metrics = ()
+
+    def __init__(self, n_bootstrap: int = 0, seed: int = constant.SEED_SIZE, partition: int = 0):
+        """Constructor of the AbstractAccumulator class
+
+        Parameters
+        ----------
+        n_bootstrap : int, optional
+            Number of Poisson bootstrap replicates kept alongside the point estimate
+        seed : int, optional
+            seed value for random number generator, shared by the accumulators of all the partitions
+        partition : int, optional
+            Index of the partition (or chunk) of the data. The weights of every partition are drawn from its own
+            child of the seed (as spawned by numpy.random.SeedSequence), so accumulators that are merged later on
+            should be created with the same seed and distinct partitions
+        """
+        self._n_bootstrap = n_bootstrap
+        self._seed = seed
+        self._partition = partition
+        self._rng = np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(partition,)))
+        self._n_sample = 0
+
+    @property
+    def n_sample(self) -> int:
+        return self._n_sample
+
+    @property
+    def n_replicates(self) -> int:
+        return 1 + self._n_bootstrap
+
+    def _replicate_weights(self, n: int, sample_weight=None) -> np.ndarray:
+        """Return the (n_replicates, n) matrix of weights for a chunk of n rows"""
+        weights = np.ones((self.n_replicates, n))
+        if self._n_bootstrap > 0:
+            weights[1:] = self._rng.poisson(1.0, size=(self._n_bootstrap, n))
+        if sample_weight is not None:
+            weights *= np.asarray(sample_weight, dtype=float)
+        return weights
+
+    def _check_mergeable(self, other: "AbstractAccumulator"):
+        if type(self) is not type(other) or self._n_bootstrap != other._n_bootstrap:
+            raise error_msg(
+                value=None,
+                message=f'{"Accumulators should have the same type and number of bootstrap replicates to be merged"}',
+            )
+
+    def _check_metric_name(self, metric_name: str):
+        if metric_name not in self.metrics:
+            raise error_msg(
+                value=metric_name,
+                message=f"Metric {metric_name} cannot be finalized from a {type(self).__name__}",
+            )
+
+    @abstractmethod
+    def update(self, y_true, y_pred, sample_weight=None) -> "AbstractAccumulator":
+        raise error_msg(
+            value=None,
+            message=f'{"NotImplementedError in update() in AbstractAccumulator class (accumulators)"}',
+        )
+
+    @abstractmethod
+    def merge(self, other: "AbstractAccumulator") -> "AbstractAccumulator":
+        raise error_msg(
+            value=None,
+            message=f'{"NotImplementedError in merge() in AbstractAccumulator class (accumulators)"}',
+        )
+
+    @abstractmethod
+    def _replicate_values(self, metric_name: str, **kwargs) -> np.ndarray:
+        raise error_msg(
+            value=None,
+            message=f'{"NotImplementedError in _replicate_values() in AbstractAccumulator class (accumulators)"}',
+        )
+
+    def finalize(self, metric_name: str, alpha: float = constant.SIGNIFICANCE_LEVEL, **kwargs):
+        """Compute a metric value (and its confidence interval) from the accumulated state
+
+        Parameters
+        ----------
+        metric_name : str
+            Name of the performance metric to finalize
+        alpha : float
+            Value to define significance level
+        kwargs :
+            keyworded variable length of arguments to a function
+
+        Returns
+        -------
+        tuple
+            the metric value and the confidence interval (None when no bootstrap replicates are kept)
+        """
+        self._check_metric_name(metric_name)
+        values = self._replicate_values(metric_name, **kwargs)
+        conf_int = None
+        if self._n_bootstrap > 0:
+            conf_int = [np.quantile(values[1:], alpha / 2), np.quantile(values[1:], 1 - alpha / 2)]
+        return float(values[0]), conf_int
+
+
+class ConfusionAccumulator(AbstractAccumulator):
+    """Confusion matrix counts for accuracy, precision, recall and f1"""
+
+    metrics = ("accuracy", "precision", "recall", "f1")
+
+    def __init__(self, n_bootstrap: int = 0, seed: int = constant.SEED_SIZE, partition: int = 0):
+        super().__init__(n_bootstrap, seed, partition)
+        self._labels = np.array([])
+        self._counts = np.zeros((self.n_replicates, 0, 0))
+
+    def _reindex(self, labels: np.ndarray):
+        """Expand the confusion matrices to a (sorted) superset of the known labels"""
+        if np.array_equal(labels, self._labels):
+            return
+        index = np.searchsorted(labels, self._labels)
+        counts = np.zeros((self.n_replicates, len(labels), len(labels)))
+        counts[:, index[:, None], index[None, :]] = self._counts
+        self._labels, self._counts = labels, counts
+
+    def update(self, y_true, y_pred, sample_weight=None) -> "ConfusionAccumulator":
+        y_true, y_pred = np.asarray(y_true), np.asarray(y_pred)
+        labels = np.union1d(y_true, y_pred)
+        self._reindex(labels if self._labels.size == 0 else np.union1d(self._labels, labels))
+
+        n_labels = len(self._labels)
+        cells = np.searchsorted(self._labels, y_true) * n_labels + np.searchsorted(self._labels, y_pred)
+        weights = self._replicate_weights(len(cells), sample_weight)
+        # A single bincount over all replicates, shifting the cells of each replicate by n_labels ** 2
+        offsets = np.arange(self.n_replicates)[:, None] * n_labels**2
+        counts = np.bincount(
+            (cells[None, :] + offsets).ravel(), weights=weights.ravel(), minlength=self.n_replicates * n_labels**2
+        )
+
+        self._counts += counts.reshape(self.n_replicates, n_labels, n_labels)
+        self._n_sample += len(cells)
+        return self
+
+    def merge(self, other: "ConfusionAccumulator") -> "ConfusionAccumulator":
+        self._check_mergeable(other)
+        merged = ConfusionAccumulator(self._n_bootstrap, self._seed)
+        merged._reindex(other._labels if self._labels.size == 0 else np.union1d(self._labels, other._labels))
+        for accumulator in (self, other):
+            index = np.searchsorted(merged._labels, accumulator._labels)
+            merged._counts[:, index[:, None], index[None, :]] += accumulator._counts
+        merged._n_sample = self._n_sample + other._n_sample
+        return merged
+
+    def _replicate_values(self, metric_name: str, average: str = "binary", pos_label=1, **kwargs) -> np.ndarray:
+        tp = np.diagonal(self._counts, axis1=1, axis2=2)
+        total = self._counts.sum(axis=(1, 2))
+
+        if metric_name == "accuracy":
+            return _safe_divide(tp.sum(axis=1), total)
+
+        pred_count = self._counts.sum(axis=1)
+        true_count = self._counts.sum(axis=2)
+        if average == "micro":
+            tp, pred_count, true_count = (
+                tp.sum(axis=1, keepdims=True),
+                pred_count.sum(axis=1, keepdims=True),
+                true_count.sum(axis=1, keepdims=True),
+            )
+        elif average == "binary":
+            if len(self._labels) > 2:
+                raise error_msg(
+                    value=average,
+                    message=f'{"Target is multiclass but average=binary. Please choose another average setting."}',
+                )
+            index = np.searchsorted(self._labels, pos_label)
+            if index == len(self._labels) or self._labels[index] != pos_label:
+                return np.zeros(self.n_replicates)
+            tp, pred_count, true_count = tp[:, [index]], pred_count[:, [index]], true_count[:, [index]]
+
+        if metric_name == "precision":
+            scores = _safe_divide(tp, pred_count)
+        elif metric_name == "recall":
+            scores = _safe_divide(tp, true_count)
+        else:
+            scores = _safe_divide(2 * tp, pred_count + true_count)
+
+        if average == "weighted":
+            return _safe_divide((scores * true_count).sum(axis=1), true_count.sum(axis=1))
+        return scores.mean(axis=1)
+
+
+class ProbabilisticAccumulator(AbstractAccumulator):
+    """Running sums of the log-loss and Brier score of a binary probabilistic classifier"""
+
+    metrics = ("log_loss", "brier")
+
+    def __init__(self, n_bootstrap: int = 0, seed: int = constant.SEED_SIZE, pos_label=1, partition: int = 0):
+        super().__init__(n_bootstrap, seed, partition)
+        self._pos_label = pos_label
+        self._weight_sum = np.zeros(self.n_replicates)
+        self._log_loss_sum = np.zeros(self.n_replicates)
+        self._brier_sum = np.zeros(self.n_replicates)
+
+    def update(self, y_true, y_pred, sample_weight=None) -> "ProbabilisticAccumulator":
+        y = (np.asarray(y_true) == self._pos_label).astype(float)
+        proba = np.asarray(y_pred, dtype=float)
+        eps = np.finfo(proba.dtype).eps
+        clipped = np.clip(proba, eps, 1 - eps)
+        weights = self._replicate_weights(len(y), sample_weight)
+
+        self._weight_sum += weights.sum(axis=1)
+        self._log_loss_sum += weights @ -(y * np.log(clipped) + (1 - y) * np.log(1 - clipped))
+        self._brier_sum += weights @ (y - proba) ** 2
+        self._n_sample += len(y)
+        return self
+
+    def merge(self, other: "ProbabilisticAccumulator") -> "ProbabilisticAccumulator":
+        self._check_mergeable(other)
+        merged = ProbabilisticAccumulator(self._n_bootstrap, self._seed, self._pos_label)
+        merged._weight_sum = self._weight_sum + other._weight_sum
+        merged._log_loss_sum = self._log_loss_sum + other._log_loss_sum
+        merged._brier_sum = self._brier_sum + other._brier_sum
+        merged._n_sample = self._n_sample + other._n_sample
+        return merged
+
+    def _replicate_values(self, metric_name: str, **kwargs) -> np.ndarray:
+        sums = self._log_loss_sum if metric_name == "log_loss" else self._brier_sum
+        return _safe_divide(sums, self._weight_sum)
+
+
+class RegressionAccumulator(AbstractAccumulator):
+    """Running sums of errors and squares for mse, mae, mape and r2"""
+
+    metrics = ("mse", "mae", "mape", "r2")
+
+    def __init__(self, n_bootstrap: int = 0, seed: int = constant.SEED_SIZE, partition: int = 0):
+        super().__init__(n_bootstrap, seed, partition)
+        self._weight_sum = np.zeros(self.n_replicates)
+        self._abs_error_sum = np.zeros(self.n_replicates)
+        self._squared_error_sum = np.zeros(self.n_replicates)
+        # Weighted mean and sum of squared deviations of the targets, which do not cancel for large offsets
+        self._y_mean = np.zeros(self.n_replicates)
+        self._y_m2 = np.zeros(self.n_replicates)
+
+    def update(self, y_true, y_pred, sample_weight=None) -> "RegressionAccumulator":
+        y = np.asarray(y_true, dtype=float)
+        error = y - np.asarray(y_pred, dtype=float)
+        weights = self._replicate_weights(len(y), sample_weight)
+
+        weight_sum = weights.sum(axis=1)
+        # Moments of the chunk computed on the targets shifted by their mean, merged into the running moments
+        offset = y.mean() if len(y) else 0.0
+        shifted_mean = _safe_divide(weights @ (y - offset), weight_sum)
+        m2 = np.maximum(weights @ (y - offset) ** 2 - weight_sum * shifted_mean**2, 0.0)
+        self._y_mean, self._y_m2 = _merge_moments(
+            self._weight_sum, self._y_mean, self._y_m2, weight_sum, offset + shifted_mean, m2
+        )
+        self._weight_sum += weight_sum
+        self._abs_error_sum += weights @ np.abs(error)
+        self._squared_error_sum += weights @ error**2
+        self._n_sample += len(y)
+        return self
+
+    def merge(self, other: "RegressionAccumulator") -> "RegressionAccumulator":
+        self._check_mergeable(other)
+        merged = RegressionAccumulator(self._n_bootstrap, self._seed)
+        for name in ["_weight_sum", "_abs_error_sum", "_squared_error_sum"]:
+            setattr(merged, name, getattr(self, name) + getattr(other, name))
+        merged._y_mean, merged._y_m2 = _merge_moments(
+            self._weight_sum, self._y_mean, self._y_m2, other._weight_sum, other._y_mean, other._y_m2
+        )
+        merged._n_sample = self._n_sample + other._n_sample
+        return merged
+
+    def _replicate_values(self, metric_name: str, **kwargs) -> np.ndarray:
+        # mape mirrors the mean_absolute_error entry of PerformanceMetricsFuncs
+        if metric_name in ["mae", "mape"]:
+            return _safe_divide(self._abs_error_sum, self._weight_sum)
+        mse = _safe_divide(self._squared_error_sum, self._weight_sum)
+        if metric_name == "mse":
+            return mse
+
+        r2 = 1 - _safe_divide(self._squared_error_sum, self._y_m2)
+        # Same convention as sklearn for constant targets, whose sum of squares is only the rounding of their mean
+        tolerance = self._weight_sum * (16 * np.finfo(float).eps * np.abs(self._y_mean)) ** 2
+        constant_target = self._y_m2 <= tolerance
+        r2[constant_target] = np.where(self._squared_error_sum[constant_target] <= tolerance[constant_target], 1.0, 0.0)
+        return r2
+
+
+class ScoreHistogramAccumulator(AbstractAccumulator):
+    """Approximate sketch of auc and aucpr as per-class counts of the scores on a fixed grid of [0, 1]
+
+    Scores falling in the same bin are treated as ties, so the metrics are exact when the scores take
+    at most one distinct value per bin (e.g. rounded probabilities).
+    """
+
+    metrics = ("auc", "aucpr")
+
+    def __init__(
+        self,
+        n_bootstrap: int = 0,
+        seed: int = constant.SEED_SIZE,
+        pos_label=1,
+        n_bins: int = constant.SCORE_BINS,
+        partition: int = 0,
+    ):
+        super().__init__(n_bootstrap, seed, partition)
+        self._pos_label = pos_label
+        self._n_bins = n_bins
+        self._positives = np.zeros((self.n_replicates, n_bins))
+        self._negatives = np.zeros((self.n_replicates, n_bins))
+
+    def update(self, y_true, y_pred, sample_weight=None) -> "ScoreHistogramAccumulator":
+        y = np.asarray(y_true) == self._pos_label
+        bins = np.clip((np.asarray(y_pred, dtype=float) * self._n_bins).astype(int), 0, self._n_bins - 1)
+        weights = self._replicate_weights(len(bins), sample_weight)
+        offsets = np.arange(self.n_replicates)[:, None] * self._n_bins
+        cells = (bins[None, :] + offsets).ravel()
+        size = self.n_replicates * self._n_bins
+
+        self._positives += np.bincount(cells, weights=(weights * y).ravel(), minlength=size).reshape(self.n_replicates, -1)
+        self._negatives += np.bincount(cells, weights=(weights * ~y).ravel(), minlength=size).reshape(self.n_replicates, -1)
+        self._n_sample += len(bins)
+        return self
+
+    def merge(self, other: "ScoreHistogramAccumulator") -> "ScoreHistogramAccumulator":
+        self._check_mergeable(other)
+        merged = ScoreHistogramAccumulator(self._n_bootstrap, self._seed, self._pos_label, self._n_bins)
+        merged._positives = self._positives + other._positives
+        merged._negatives = self._negatives + other._negatives
+        merged._n_sample = self._n_sample + other._n_sample
+        return merged
+
+    def _replicate_values(self, metric_name: str, **kwargs) -> np.ndarray:
+        # Cumulative counts by decreasing score, each bin being a threshold
+        tps = np.cumsum(self._positives[:, ::-1], axis=1)
+        fps = np.cumsum(self._negatives[:, ::-1], axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            if metric_name == "auc":
+                tpr = np.hstack([np.zeros((len(tps), 1)), tps]) / tps[:, [-1]]
+                fpr = np.hstack([np.zeros((len(fps), 1)), fps]) / fps[:, [-1]]
+                return (np.diff(fpr, axis=1) * (tpr[:, 1:] + tpr[:, :-1]) / 2).sum(axis=1)
+            precision = _safe_divide(tps, tps + fps)
+            return (np.diff(tps / tps[:, [-1]], axis=1, prepend=0) * precision).sum(axis=1)
+
+
+_ACCUMULATORS = {
+    metric_name: accumulator
+    for accumulator in [ConfusionAccumulator, ProbabilisticAccumulator, RegressionAccumulator, ScoreHistogramAccumulator]
+    for metric_name in accumulator.metrics
+}
+
+
+def get_accumulator(
+    metric_name: str, n_bootstrap: int = 0, seed: int = constant.SEED_SIZE, partition: int = 0, **kwargs
+) -> AbstractAccumulator:
+    """Return an empty accumulator able to finalize the given performance metric
+
+    Parameters
+    ----------
+    metric_name : str
+        Name of the performance metric
+    n_bootstrap : int, optional
+        Number of Poisson bootstrap replicates
+    seed : int, optional
+        seed value for random number generator
+    partition : int, optional
+        Index of the partition of the data, drawing its bootstrap weights from its own child of the seed
+    kwargs :
+        keyworded variable length of arguments passed to the accumulator (e.g. pos_label)
+
+    Returns
+    -------
+    AbstractAccumulator
+        an empty accumulator
+    """
+    if metric_name not in _ACCUMULATORS:
+        raise error_msg(
+            value=metric_name,
+            message=f"No sufficient-statistics accumulator for the metric {metric_name}",
+        )
+    accumulator = _ACCUMULATORS[metric_name]
+    if accumulator in [ProbabilisticAccumulator, ScoreHistogramAccumulator]:
+        return accumulator(n_bootstrap=n_bootstrap, seed=seed, pos_label=kwargs.get("pos_label", 1), partition=partition)
+    return accumulator(n_bootstrap=n_bootstrap, seed=seed, partition=partition)
+
+
+def _merge_moments(n_a, mean_a, m2_a, n_b, mean_b, m2_b) -> tuple:
+    """Weighted means and sums of squared deviations of the union of two samples, per replicate
+
+    Chan et al. parallel update, as MomentsState.merge in states.py
+    """
+    n = n_a + n_b
+    delta = mean_b - mean_a
+    mean = mean_a + delta * _safe_divide(n_b, n)
+    m2 = m2_a + m2_b + delta**2 * _safe_divide(n_a * n_b, n)
+    return mean, m2
+
+
+def _safe_divide(numerator, denominator):
+    """Elementwise division returning 0 where the denominator is 0 (sklearn zero_division default)"""
+    numerator, denominator = np.asarray(numerator, dtype=float), np.asarray(denominator, dtype=float)
+    return np.divide(numerator, denominator, out=np.zeros(np.broadcast(numerator, denominator).shape), where=denominator != 0)
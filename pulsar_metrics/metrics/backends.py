@@ -0,0 +1,280 @@
+#  Author:   Adel Benlagra  <abenlagra@rocketscience.one>
+from collections import namedtuple
+from functools import partial
+from typing import Callable
+
+import constant
+import numpy as np
+from pandas.api.types import is_bool_dtype, is_numeric_dtype
+from scipy.stats import mannwhitneyu, norm
+
+from ..exceptions import CustomExceptionPulsarMetric as error_msg
+from .enums import DriftMetricsFuncs, DriftTestMetricsFuncs, PerformanceMetricsFuncs
+from .states import TestResult
+from .utils import population_stability_index, psi_from_counts, sturges_bin_edges
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# Backends in order of preference: compiled loops, vectorized numpy, scipy / sklearn functions
+BACKENDS = ("numba", "numpy", "reference")
+
+# Implementation of a metric function: the function, the input size (rows of both samples) from which it is
+# selected automatically and its supported keyword arguments (any argument if None)
+Implementation = namedtuple("Implementation", ["func", "min_size", "kwargs"])
+
+_IMPLEMENTATIONS = {}
+
+
+def register_implementation(metric_name: str, backend: str, func: Callable, min_size: int = 0, kwargs: tuple = ()):
+    """Register an implementation of a metric function
+
+    Parameters
+    ----------
+    metric_name : str
+        Name of the metric
+    backend : str
+        Name of the backend, one of BACKENDS
+    func : Callable
+        The implementation, with the arguments of the reference function
+    min_size : int, optional
+        Input size from which the implementation is selected automatically
+    kwargs : tuple, optional
+        Keyword arguments supported by the implementation (any argument if None)
+    """
+    if backend not in BACKENDS:
+        raise error_msg(value=backend, message=f"InvalidInput: backend should be one of {BACKENDS}")
+    _IMPLEMENTATIONS.setdefault(metric_name, {})[backend] = Implementation(
+        func, min_size, None if kwargs is None else frozenset(kwargs)
+    )
+
+
+def implementations(metric_name: str) -> dict:
+    """Registered implementations of a metric function, keyed by backend"""
+    return dict(_IMPLEMENTATIONS.get(metric_name, {}))
+
+
+def select_implementation(metric_name: str, size: int = 0, kwargs: dict = {}, backend: str = "auto") -> Callable:
+    """Select the implementation of a metric function
+
+    With backend="auto", the preferred backend whose minimum input size is reached and which supports the keyword
+    arguments is selected (the reference function otherwise).
+
+    Parameters
+    ----------
+    metric_name : str
+        Name of the metric
+    size : int, optional
+        Input size (rows of both samples)
+    kwargs : dict, optional
+        Keyword arguments given to the function
+    backend : str, optional
+        "auto" or the name of a registered backend
+
+    Returns
+    -------
+    Callable
+        the metric function
+    """
+    registered = _IMPLEMENTATIONS.get(metric_name, {})
+    if backend != "auto":
+        if backend not in registered:
+            raise error_msg(
+                value=(metric_name, backend),
+                message=f"InvalidInput: no {backend} backend for the metric {metric_name}, available: {list(registered)}",
+            )
+        return registered[backend].func
+    for name in BACKENDS:
+        implementation = registered.get(name)
+        if (implementation is None) or (size < implementation.min_size):
+            continue
+        if (implementation.kwargs is None) or (set(kwargs) <= implementation.kwargs):
+            return implementation.func
+    raise error_msg(value=metric_name, message=f'{"No implementation registered for the metric."}')
+
+
+# Kernels of the hot loops, vectorized with numpy. The loop versions are compiled with numba where it is installed
+# ==============================================================================================================
+
+
+def _bin_counts(values: np.ndarray, edges: np.ndarray) -> np.ndarray:
+    """Counts of values on the bins of edges (the first bin closed, the values outside the edges clipped)"""
+    return np.bincount(np.clip(np.searchsorted(edges, values, side="left") - 1, 0, len(edges) - 2), minlength=len(edges) - 1)
+
+
+def _groups(values: np.ndarray) -> tuple:
+    """Distinct values of a sorted sample and their counts"""
+    starts = np.flatnonzero(np.r_[True, values[1:] != values[:-1]])
+    return values[starts], np.diff(np.r_[starts, len(values)])
+
+
+def _u_statistic(x: np.ndarray, y: np.ndarray) -> tuple:
+    """Mann-Whitney U statistic of x (the pairs with a tie counting half) and tie term of the merged samples"""
+    (x_values, x_counts), (y_values, y_counts) = _groups(np.sort(x)), _groups(np.sort(y))
+    y_cumulative = np.r_[0, np.cumsum(y_counts)]
+    position = np.searchsorted(y_values, x_values, side="left")
+    common = position < len(y_values)
+    common[common] = y_values[position[common]] == x_values[common]
+    equal = np.zeros(len(x_values))
+    equal[common] = y_counts[position[common]]
+    u1 = (x_counts * (y_cumulative[position] + 0.5 * equal)).sum()
+    # Sum of t ** 3 - t over the groups of ties t of the merged samples, from the groups of each sample
+    x_counts, y_counts = x_counts.astype(float), y_counts.astype(float)
+    tie_term = (x_counts**3 - x_counts).sum() + (y_counts**3 - y_counts).sum()
+    tie_term += (3 * x_counts[common] * equal[common] * (x_counts[common] + equal[common])).sum()
+    return u1, tie_term
+
+
+def _confusion_counts(y_true: np.ndarray, y_pred: np.ndarray) -> np.ndarray:
+    """Counts of the (true, predicted) pairs of binary labels: tn, fp, fn, tp"""
+    return np.bincount(2 * y_true + y_pred, minlength=4)
+
+
+def _loop_bin_counts(values, edges):
+    n_bins = len(edges) - 1
+    counts = np.zeros(n_bins, dtype=np.int64)
+    for value in values:
+        # Binary search of the first edge not below the value
+        low, high = 0, len(edges)
+        while low < high:
+            middle = (low + high) // 2
+            if edges[middle] < value:
+                low = middle + 1
+            else:
+                high = middle
+        counts[min(max(low - 1, 0), n_bins - 1)] += 1
+    return counts
+
+
+def _loop_u_statistic(x, y):
+    x, y = np.sort(x), np.sort(y)
+    n1, n2 = len(x), len(y)
+    u1, tie_term = 0.0, 0.0
+    i, j = 0, 0
+    # Walk of the groups of equal values of the merged samples: the y values below a group are already walked
+    while (i < n1) or (j < n2):
+        value = x[i] if (j >= n2) or ((i < n1) and (x[i] <= y[j])) else y[j]
+        start_x, start_y = i, j
+        while (i < n1) and (x[i] == value):
+            i += 1
+        while (j < n2) and (y[j] == value):
+            j += 1
+        u1 += (i - start_x) * (start_y + 0.5 * (j - start_y))
+        ties = float((i - start_x) + (j - start_y))
+        tie_term += ties**3 - ties
+    return u1, tie_term
+
+
+def _loop_confusion_counts(y_true, y_pred):
+    counts = np.zeros(4, dtype=np.int64)
+    for i in range(len(y_true)):
+        counts[2 * y_true[i] + y_pred[i]] += 1
+    return counts
+
+
+# Metric functions built on the kernels, falling back to the reference functions outside their domain
+# ===================================================================================================
+
+
+def _numeric_values(values) -> np.ndarray:
+    """Float values of a numeric sample, None for boolean and non-numeric samples"""
+    if is_bool_dtype(values) or not is_numeric_dtype(values):
+        return None
+    return np.asarray(values, dtype=float)
+
+
+def _psi(new, reference, binned: bool = False, bin_counts: Callable = _bin_counts) -> float:
+    """Population stability index on the Sturges bins of both samples, counted without building the percentages table"""
+    new_values, reference_values = _numeric_values(new), _numeric_values(reference)
+    if binned or (new_values is None) or (reference_values is None):
+        return population_stability_index(new, reference, binned=binned)
+    new_values, reference_values = new_values[~np.isnan(new_values)], reference_values[~np.isnan(reference_values)]
+    edges = sturges_bin_edges(reference_values, new_values)
+    return psi_from_counts(bin_counts(new_values, edges), bin_counts(reference_values, edges))
+
+
+def _mannwhitneyu(x, y, use_continuity: bool = True, alternative: str = "two-sided", u_statistic: Callable = _u_statistic):
+    """Mann-Whitney U test with the normal approximation (as scipy for samples of more than 8 values)"""
+    x_values, y_values = _numeric_values(x), _numeric_values(y)
+    samples = [values for values in (x_values, y_values) if values is not None]
+    # scipy may compute the exact distribution of small samples, and propagates missing values
+    asymptotic = (len(samples) == 2) and all((len(values) > 8) and not np.isnan(values).any() for values in samples)
+    if not asymptotic or (alternative not in ("two-sided", "greater", "less")):
+        return mannwhitneyu(x, y, use_continuity=use_continuity, alternative=alternative)
+    n1, n2 = len(x_values), len(y_values)
+    u1, tie_term = u_statistic(x_values, y_values)
+    u2 = n1 * n2 - u1
+    u, factor = {"greater": (u1, 1), "less": (u2, 1)}.get(alternative, (max(u1, u2), 2))
+
+    n = n1 + n2
+    scale = np.sqrt(n1 * n2 / 12 * ((n + 1) - tie_term / (n * (n - 1))))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = (u - n1 * n2 / 2 - (0.5 if use_continuity else 0)) / scale
+    return TestResult(u1, float(np.clip(norm.sf(z) * factor, 0, 1)))
+
+
+def _binary_labels(labels) -> np.ndarray:
+    """Integer labels of a binary (0/1) sample, None otherwise"""
+    values = np.asarray(labels)
+    if (len(values) == 0) or not is_numeric_dtype(values.dtype):
+        return None
+    integers = values.astype(np.int64)
+    if (integers.min() < 0) or (integers.max() > 1) or not np.array_equal(integers, values):
+        return None
+    return integers
+
+
+def _from_confusion(counts: np.ndarray, metric_name: str) -> float:
+    tn, fp, fn, tp = counts
+    numerator, denominator = {
+        "accuracy": (tp + tn, tp + tn + fp + fn),
+        "precision": (tp, tp + fp),
+        "recall": (tp, tp + fn),
+        "f1": (2 * tp, 2 * tp + fp + fn),
+    }[metric_name]
+    # Undefined ratios are 0, as sklearn with zero_division="warn"
+    return float(numerator / denominator) if denominator else 0.0
+
+
+def _confusion_metric(y_true, y_pred, metric_name: str = "accuracy", confusion_counts: Callable = _confusion_counts) -> float:
+    """Classification metric of binary labels from their confusion counts"""
+    true_labels, predicted_labels = _binary_labels(y_true), _binary_labels(y_pred)
+    if (true_labels is None) or (predicted_labels is None):
+        return PerformanceMetricsFuncs[metric_name].value(y_true, y_pred)
+    return _from_confusion(confusion_counts(true_labels, predicted_labels), metric_name)
+
+
+CONFUSION_METRICS = ("accuracy", "precision", "recall", "f1")
+
+for _functions in (DriftMetricsFuncs, DriftTestMetricsFuncs, PerformanceMetricsFuncs):
+    for _name in _functions._member_names_:
+        register_implementation(_name, "reference", _functions[_name].value, kwargs=None)
+
+register_implementation("psi", "numpy", _psi, kwargs=("binned",))
+register_implementation("manwu", "numpy", _mannwhitneyu, min_size=18, kwargs=("use_continuity", "alternative"))
+for _name in CONFUSION_METRICS:
+    register_implementation(_name, "numpy", partial(_confusion_metric, metric_name=_name))
+
+if numba is not None:
+    _compiled_bin_counts = numba.njit(cache=True)(_loop_bin_counts)
+    _compiled_u_statistic = numba.njit(cache=True)(_loop_u_statistic)
+    _compiled_confusion_counts = numba.njit(cache=True)(_loop_confusion_counts)
+    register_implementation(
+        "psi", "numba", partial(_psi, bin_counts=_compiled_bin_counts), min_size=constant.NUMBA_MIN_SIZE, kwargs=("binned",)
+    )
+    register_implementation(
+        "manwu",
+        "numba",
+        partial(_mannwhitneyu, u_statistic=_compiled_u_statistic),
+        min_size=constant.NUMBA_MIN_SIZE,
+        kwargs=("use_continuity", "alternative"),
+    )
+    for _name in CONFUSION_METRICS:
+        register_implementation(
+            _name,
+            "numba",
+            partial(_confusion_metric, metric_name=_name, confusion_counts=_compiled_confusion_counts),
+            min_size=constant.NUMBA_MIN_SIZE,
+        )
@@ -11,6 +11,7 @@ from pydantic import BaseModel, validator
 from ..exceptions import CustomExceptionPulsarMetric as error_msg
 from ..utils import compare_to_threshold
 from .enums import (
+    DataQualityMetricsFuncs,
     DriftMetricsFuncs,
     DriftTestMetricsFuncs,
     MetricsType,
@@ -28,6 +29,7 @@ class MetricResults(BaseModel):
     drift_status: bool = None
     threshold: Union[float, int, str, list] = None
     conf_int: list = None
+    sample_size: int = None
 
     # TODO: validators for model id's, model's version, data_id, and metrics type
     @validator("metric_type", always=True)
@@ -41,9 +43,12 @@ class MetricResults(BaseModel):
 
     @validator("metric_name", always=True)
     def metric_name_is_invalid(cls, v, values, **kwargs):
-        metric_names = (
-            PerformanceMetricsFuncs._member_names_ + DriftMetricsFuncs._member_names_ + DriftTestMetricsFuncs._member_names_
-        )
+        metric_names = [
+            *PerformanceMetricsFuncs._member_names_,
+            *DriftMetricsFuncs._member_names_,
+            *DriftTestMetricsFuncs._member_names_,
+            *DataQualityMetricsFuncs._member_names_,
+        ]
         if (v not in metric_names) and (values["metric_type"] not in [MetricsType.custom.value, MetricsType.statistics.value]):
             raise error_msg(
                 value=None,
@@ -64,6 +69,7 @@ class AbstractMetrics(ABC):
             The input value for metric_name
         """
         self._name = metric_name
+        self._result = None
 
     @property
     @abstractmethod
@@ -79,6 +85,28 @@ class AbstractMetrics(ABC):
     def get_result(self):
         return self._result
 
+    def has_partial_state(self, current=None) -> bool:
+        """Whether the metric implements the compute_partial/merge/finalize protocol (for the columns of current)"""
+        return False
+
+    def compute_partial(self, current, reference=None, **kwargs):
+        """Compute the partial state of the metric on a partition of the data"""
+        raise error_msg(
+            value=self._name,
+            message=f'{"NotImplementedError in compute_partial() in AbstractMetrics class (base)"}',
+        )
+
+    def merge(self, left, right):
+        """Merge two partial states of the metric"""
+        return left.merge(right)
+
+    def finalize(self, state, **kwargs) -> MetricResults:
+        """Compute the result of the metric from a (merged) partial state"""
+        raise error_msg(
+            value=self._name,
+            message=f'{"NotImplementedError in finalize() in AbstractMetrics class (base)"}',
+        )
+
 
 # TODO: method to compare the metrics value to single value or interval thresholds
 def CustomMetric(func):
@@ -0,0 +1,305 @@
+#  Author:   Adel Benlagra  <abenlagra@rocketscience.one>
+from typing import Callable
+
+import constant
+import numpy as np
+import pandas as pd
+from scipy.stats import kstwo, kstwobign, ttest_ind_from_stats
+
+from ..exceptions import CustomExceptionPulsarMetric as error_msg
+from .backends import _groups, _numeric_values
+from .enums import DriftTestMetricsFuncs
+from .histograms import FrozenBinning, js_from_counts, kl_from_counts
+from .utils import sturges_bin_edges
+
+# Keyword arguments supported by the batched replicates of every metric (other arguments resample the rows)
+BATCHED_METRICS = {
+    "psi": ("binned",),
+    "kl": ("bins", "smoothing"),
+    "js": ("bins", "smoothing"),
+    "wasserstein": (),
+    "mmd": ("kernel",),
+    "ks_2samp": ("alternative",),
+    "ttest": ("equal_var", "alternative"),
+}
+_HISTOGRAM_METRICS = ("psi", "kl", "js")
+_KS_EXACT_SIZE = 10000
+
+
+def _is_batched(metric_name: str, kwargs: dict) -> bool:
+    if (metric_name not in BATCHED_METRICS) or not (set(kwargs) <= set(BATCHED_METRICS[metric_name])):
+        return False
+    # Binned psi inputs, non-linear kernels and one-sided ks_2samp resample the rows
+    one_sided = (metric_name == "ks_2samp") and (kwargs.get("alternative", "two-sided") != "two-sided")
+    return not (kwargs.get("binned", False) or (kwargs.get("kernel", "linear") != "linear") or one_sided)
+
+
+def _resample_counts(rng, counts: np.ndarray, n_bootstrap: int) -> np.ndarray:
+    """(n_bootstrap, n_groups) counts of the groups of a sample resampled with replacement
+
+    The counts of the groups of a resampled sample follow the multinomial distribution of the observed
+    frequencies, so they are drawn without resampling the rows.
+    """
+    n = int(counts.sum())
+    return rng.multinomial(n, counts / n, size=n_bootstrap)
+
+
+def _psi_rows(new_counts: np.ndarray, reference_counts: np.ndarray) -> np.ndarray:
+    """Population Stability Index of histograms on identical bins, one per row (as psi_from_counts)"""
+    new_counts, reference_counts = np.atleast_2d(new_counts), np.atleast_2d(reference_counts)
+    new = new_counts / new_counts.sum(axis=1, keepdims=True)
+    ref = reference_counts / reference_counts.sum(axis=1, keepdims=True)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.nansum((new - ref) * np.log(new / ref), axis=1)
+
+
+def _histogram_counts(metric_name: str, new: pd.Series, reference: pd.Series, kwargs: dict) -> tuple:
+    """Counts of both samples on the bins of a histogram metric, and the metric of counts matrices"""
+    if metric_name != "psi":
+        new, reference = pd.Series(new).rename("feature"), pd.Series(reference).rename("feature")
+        binning = FrozenBinning(reference.to_frame(), ["feature"], bins=kwargs.get("bins", "sturges"))
+        divergence = {"kl": kl_from_counts, "js": js_from_counts}[metric_name]
+        smoothing = kwargs.get("smoothing", constant.HISTOGRAM_SMOOTHING)
+        return (
+            binning.counts(new.to_frame())[0],
+            binning.counts(reference.to_frame())[0],
+            lambda new_counts, reference_counts: divergence(new_counts, reference_counts, smoothing, binning.mask[0]),
+        )
+
+    new_values, reference_values = _numeric_values(new), _numeric_values(reference)
+    if (new_values is None) or (reference_values is None):
+        categories = pd.Index(pd.concat([pd.Series(new), pd.Series(reference)]).dropna().unique())
+        counts = [
+            np.bincount(categories.get_indexer(pd.Series(values).dropna()), minlength=len(categories))
+            for values in (new, reference)
+        ]
+    else:
+        new_values, reference_values = new_values[~np.isnan(new_values)], reference_values[~np.isnan(reference_values)]
+        edges = sturges_bin_edges(reference_values, new_values)
+        counts = [
+            np.bincount(np.clip(np.searchsorted(edges, values, side="left") - 1, 0, len(edges) - 2), minlength=len(edges) - 1)
+            for values in (new_values, reference_values)
+        ]
+    return counts[0], counts[1], _psi_rows
+
+
+def _ecdf_replicates(metric_name: str, new: np.ndarray, reference: np.ndarray, rng, n_bootstrap: int, grid_size: int) -> tuple:
+    """Replicates and observed statistic of ks_2samp or wasserstein from the ECDFs of the resampled groups
+
+    The merged samples are sorted once. The groups are their distinct values (the replicates are then those of the
+    resampled rows), or quantile groups for continuous features, whose number grows as the square root of the sample
+    size (the resolution of the ECDFs staying below their sampling error) up to grid_size. ks_2samp compares the
+    ECDFs at the edges of the groups. For wasserstein, the values of a group are placed at their mean in each sample:
+    the area between the ECDFs is integrated between the means of the groups instead of across the width of the
+    groups (wide in the tails of skewed samples), the means being kept by the replicates, which only resample the
+    counts of the groups.
+    """
+    merged = np.sort(np.concatenate([new, reference]))
+    edges = _groups(merged)[0]
+    grid_size = min(grid_size, int(np.ceil(4 * np.sqrt(len(merged)))))
+    if len(edges) > grid_size:
+        ranks = np.ceil(np.linspace(0, 1, grid_size + 1)[1:] * len(merged)).astype(np.int64) - 1
+        edges = np.unique(merged[ranks])
+
+    # Counts of the groups (edges[k-1], edges[k]] of both samples
+    indexes = [np.searchsorted(edges, values) for values in (new, reference)]
+    new_counts, reference_counts = [np.bincount(index, minlength=len(edges)) for index in indexes]
+
+    if metric_name == "ks_2samp":
+
+        def statistic(new_counts, reference_counts):
+            new_ecdf = np.cumsum(new_counts, axis=1) / new_counts.sum(axis=1, keepdims=True)
+            return np.abs(new_ecdf - np.cumsum(reference_counts, axis=1) / reference_counts.sum(axis=1, keepdims=True)).max(
+                axis=1
+            )
+
+    else:
+        # Means of the groups of both samples (the edge of the group if it is empty, it then weighs nothing), sorted once
+        locations = np.concatenate(
+            [
+                np.where(counts > 0, np.bincount(index, weights=values, minlength=len(edges)) / np.maximum(counts, 1), edges)
+                for index, counts, values in zip(indexes, (new_counts, reference_counts), (new, reference))
+            ]
+        )
+        order = np.argsort(locations, kind="stable")
+        steps = np.diff(locations[order])
+
+        def statistic(new_counts, reference_counts):
+            weights = np.concatenate(
+                [
+                    new_counts / new_counts.sum(axis=1, keepdims=True),
+                    -reference_counts / reference_counts.sum(axis=1, keepdims=True),
+                ],
+                axis=1,
+            )
+            return (np.abs(np.cumsum(weights[:, order], axis=1)[:, :-1]) * steps).sum(axis=1)
+
+    replicates = statistic(_resample_counts(rng, new_counts, n_bootstrap), _resample_counts(rng, reference_counts, n_bootstrap))
+    return replicates, statistic(new_counts[None], reference_counts[None])[0]
+
+
+def _moments_replicates(
+    metric_name: str, new: np.ndarray, reference: np.ndarray, rng, n_bootstrap: int, grid_size: int, kwargs: dict
+) -> np.ndarray:
+    """Replicates of ttest or the linear mmd from the moments of the resampled groups
+
+    The samples are grouped on equal-width bins of their range in one pass. The sum of the values drawn from a
+    group is the count times the mean of the group, plus a normal deviation of the variance of the group.
+    """
+    low, high = min(new.min(), reference.min()), max(new.max(), reference.max())
+    n_groups = min(grid_size, int(np.ceil(4 * np.sqrt(len(new) + len(reference)))))
+    scale = n_groups / (high - low) if high > low else 0
+
+    moments = []
+    for values in (new, reference):
+        index = np.minimum(((values - low) * scale).astype(np.int64), n_groups - 1)
+        counts = np.bincount(index, minlength=n_groups)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            means = np.where(counts > 0, np.bincount(index, weights=values, minlength=n_groups) / counts, 0)
+            squares = np.where(counts > 0, np.bincount(index, weights=values**2, minlength=n_groups) / counts, 0)
+        resampled = _resample_counts(rng, counts, n_bootstrap)
+        deviations = (np.sqrt(resampled * np.maximum(squares - means**2, 0)) * rng.standard_normal(resampled.shape)).sum(axis=1)
+        mean = (resampled @ means + deviations) / len(values)
+        variance = (resampled @ squares / len(values) - mean**2) * len(values) / (len(values) - 1)
+        moments.append((mean, np.sqrt(np.maximum(variance, 0)), len(values)))
+
+    (mean1, std1, n1), (mean2, std2, n2) = moments
+    if metric_name == "mmd":
+        # The linear kernel MMD of scalar samples is the squared difference of their means
+        return (mean1 - mean2) ** 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return ttest_ind_from_stats(
+            mean1,
+            std1,
+            n1,
+            mean2,
+            std2,
+            n2,
+            equal_var=kwargs.get("equal_var", False),
+            alternative=kwargs.get("alternative", "two-sided"),
+        ).pvalue
+
+
+def _resampled_replicates(func: Callable, new, reference, rng, n_bootstrap: int, test: bool, kwargs: dict) -> np.ndarray:
+    """Replicates of a metric evaluated on resampled arrays of both samples (for the metrics without batched replicates)"""
+    new, reference = np.asarray(new), np.asarray(reference)
+    replicates = np.empty(n_bootstrap)
+    for b in range(n_bootstrap):
+        result = func(
+            pd.Series(new[rng.integers(0, len(new), len(new))]),
+            pd.Series(reference[rng.integers(0, len(reference), len(reference))]),
+            **kwargs,
+        )
+        replicates[b] = result.pvalue if test else result
+    return replicates
+
+
+def bootstrap_replicates(
+    metric_name: str,
+    new: pd.Series,
+    reference: pd.Series,
+    statistic: float = None,
+    func: Callable = None,
+    n_bootstrap: int = constant.BOOTSTRAP_SIZE,
+    seed: int = constant.SEED_SIZE,
+    grid_size: int = constant.BOOTSTRAP_GRID_SIZE,
+    **kwargs,
+) -> np.ndarray:
+    """Compute bootstrap replicates of a drift metric without resampling the rows of the datasets
+
+    The replicates are computed in batch from the counts of resampled samples, drawn from the multinomial
+    distribution of the observed frequencies:
+
+    - psi, kl and js from the resampled counts of their histograms,
+    - wasserstein and ks_2samp from the ECDFs of the resampled counts of the groups of the merged samples (sorted
+      once): the distinct values of the samples, or at most grid_size quantile groups of continuous samples (the
+      values of a group being placed at their mean for wasserstein),
+    - ttest and the linear mmd from the moments of the resampled groups of equal-width bins (one pass, no sort).
+
+    Besides one pass (or one sort) of the samples, the cost is n_bootstrap times the number of bins or groups.
+    Histogram and ECDF replicates are shifted by the difference between the statistic of the samples and the one
+    of their bins or groups. Missing
+    values are ignored, and ks_2samp p-values are asymptotic. The other metrics, and the batched ones with other
+    keyword arguments, are evaluated with func on resampled arrays of the samples.
+
+    Parameters
+    ----------
+    metric_name : str
+        Name of the drift metric (or drift test)
+    new : pd.Series
+        The input pandas Series of the new population
+    reference : pd.Series
+        The input pandas Series of the reference population
+    statistic : float, optional
+        The metric value (test statistic for ks_2samp) of the samples, the replicates not being shifted if None
+    func : Callable, optional
+        Metric function of the metrics without batched replicates
+    n_bootstrap : int, optional
+        Number of bootstrap replicates
+    seed : int, optional
+        seed value for random number generator
+    grid_size : int, optional
+        Maximum number of groups of the ECDFs and moments of the merged samples
+    kwargs :
+        keyworded variable length of arguments to the metric function
+
+    Returns
+    -------
+    np.ndarray
+        the n_bootstrap replicates of the metric value (p-values of the tests)
+    """
+    rng = np.random.default_rng(seed)
+    test = metric_name in DriftTestMetricsFuncs._member_names_
+    if not _is_batched(metric_name, kwargs):
+        if func is None:
+            raise error_msg(value=metric_name, message=f'{"InvalidInput: a metric function is required for this metric."}')
+        return _resampled_replicates(func, new, reference, rng, n_bootstrap, test, kwargs)
+
+    if metric_name in _HISTOGRAM_METRICS:
+        new_counts, reference_counts, divergence = _histogram_counts(metric_name, new, reference, kwargs)
+        if (new_counts.sum() == 0) or (reference_counts.sum() == 0):
+            return np.full(n_bootstrap, np.nan)
+        observed = divergence(new_counts, reference_counts)[0]
+        replicates = divergence(
+            _resample_counts(rng, new_counts, n_bootstrap), _resample_counts(rng, reference_counts, n_bootstrap)
+        )
+    else:
+        new_values, reference_values = _numeric_values(new), _numeric_values(reference)
+        if (new_values is None) or (reference_values is None):
+            raise error_msg(value=metric_name, message=f'{"InvalidInput: the metric requires numeric samples."}')
+        new_values, reference_values = new_values[~np.isnan(new_values)], reference_values[~np.isnan(reference_values)]
+        if (len(new_values) < 2) or (len(reference_values) < 2):
+            return np.full(n_bootstrap, np.nan)
+        if metric_name in ("ttest", "mmd"):
+            # The moments of the groups give the moments of the samples, the replicates need no shift
+            return _moments_replicates(metric_name, new_values, reference_values, rng, n_bootstrap, grid_size, kwargs)
+        replicates, observed = _ecdf_replicates(metric_name, new_values, reference_values, rng, n_bootstrap, grid_size)
+
+    if (statistic is not None) and np.isfinite(statistic) and np.isfinite(observed):
+        replicates = replicates + (statistic - observed)
+    if metric_name == "ks_2samp":
+        n = np.round(len(new_values) * len(reference_values) / (len(new_values) + len(reference_values)))
+        # Limiting Kolmogorov distribution for large samples, as the exact one is slow to evaluate
+        replicates = np.clip(replicates, 0, 1)
+        return kstwo.sf(replicates, n) if n <= _KS_EXACT_SIZE else kstwobign.sf(replicates * np.sqrt(n))
+    return replicates
+
+
+def bootstrap_conf_int(
+    metric_name: str,
+    new: pd.Series,
+    reference: pd.Series,
+    statistic: float = None,
+    func: Callable = None,
+    n_bootstrap: int = constant.BOOTSTRAP_SIZE,
+    seed: int = constant.SEED_SIZE,
+    alpha: float = constant.SIGNIFICANCE_LEVEL,
+    grid_size: int = constant.BOOTSTRAP_GRID_SIZE,
+    **kwargs,
+) -> list:
+    """Bootstrap confidence interval of a drift metric (see bootstrap_replicates), None if it is undefined"""
+    replicates = bootstrap_replicates(metric_name, new, reference, statistic, func, n_bootstrap, seed, grid_size, **kwargs)
+    if np.isnan(replicates).all():
+        return None
+    # Replicates may be infinite (empty bins of psi), the bounds are observed replicates instead of interpolations
+    return [np.nanquantile(replicates, alpha / 2, method="lower"), np.nanquantile(replicates, 1 - alpha / 2, method="higher")]
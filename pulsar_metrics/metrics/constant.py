@@ -3,3 +3,28 @@ BOOTSTRAP_SIZE = 100
 SEED_SIZE = 123
 SIGNIFICANCE_LEVEL = 0.05
 HUNDRED = 100
+SKETCH_SIZE = 2048
+SCORE_BINS = 1000
+SAMPLE_SIZE = 100000
+TIME_STRATA = 24
+SAMPLING_BOOTSTRAP_SIZE = 20
+SAMPLING_PILOT_SIZE = 1000
+HISTOGRAM_SMOOTHING = 0.5
+ASYNC_BATCH_SIZE = 16
+MAX_CONCURRENT_ANALYZERS = 4
+EMBEDDING_COMPONENTS = 10
+EMBEDDING_FIT_SIZE = 20000
+EMBEDDING_CHUNK_SIZE = 65536
+PROJECTION_CACHE_SIZE = 8
+CASCADE_PSI_THRESHOLD = 0.01
+CASCADE_SHIFT_THRESHOLD = 0.05
+CASCADE_SCREEN_BINS = 10
+DISCRETE_MAX_VALUES = 20
+NUMBA_MIN_SIZE = 100000
+BOOTSTRAP_GRID_SIZE = 1024
+CALIBRATION_SPLITS = 50
+SLICE_BINS = 10
+SLICE_MAX_DEPTH = 2
+SLICE_MIN_SUPPORT = 0.01
+QUALITY_THRESHOLD = 0.0
+HISTOGRAM_CHUNK_SIZE = 65536
@@ -1,13 +1,45 @@
 #  Author:   Adel Benlagra  <abenlagra@rocketscience.one>
+from concurrent.futures import ThreadPoolExecutor
 from typing import Union
 
 import constant
+import numpy as np
 import pandas as pd
 
 from ..exceptions import CustomExceptionPulsarMetric as error_msg
 from ..utils import compare_to_threshold
+from .backends import select_implementation
 from .base import AbstractMetrics, MetricResults, MetricsType
+from .bootstrap import bootstrap_conf_int
+from .embeddings import embedding_drift, embedding_function, is_vector_column
 from .enums import DriftMetricsFuncs, DriftTestMetricsFuncs
+from .reference import DecayedReference
+from .sampling import Sampler
+from .states import (
+    _STATES_REQUIREMENTS,
+    DriftState,
+    compute_drift_state,
+    finalize_drift_state,
+)
+
+# Metrics of the missing values of a feature, computed from its validity masks
+MISSING_METRICS = ("missing_rate", "missing_rate_drift")
+# Metrics whose functions mask the missing values of their samples themselves (when binning or counting them)
+_MASKED_METRICS = MISSING_METRICS + ("psi", "kl", "js")
+
+
+def _valid(column: pd.Series) -> pd.Series:
+    """Values of a column without its missing values (the column itself if it has none)"""
+    mask = column.notna().to_numpy()
+    # Only the valid values are copied, the index of the column is not
+    return column if mask.all() else pd.Series(column.array[mask], name=column.name)
+
+
+def _select_function(metric_name: str, column, ref_column, backend: str = "auto", kwargs: dict = {}):
+    """Implementation of a drift function for the input size, the reference function for embedding columns"""
+    if is_vector_column(column):
+        return select_implementation(metric_name, backend="reference")
+    return select_implementation(metric_name, len(column) + len(ref_column), kwargs, backend=backend)
 
 
 class DriftMetric(AbstractMetrics):
@@ -28,6 +60,7 @@ class DriftMetric(AbstractMetrics):
 
         self._check_metrics_name(metric_name)
         self._feature_name = feature_name
+        self._components = None
 
     def _check_metrics_name(self, name: str):
         if name not in DriftMetricsFuncs._member_names_:
@@ -42,6 +75,11 @@ class DriftMetric(AbstractMetrics):
         reference: pd.DataFrame,
         threshold: Union[list, float, int] = None,
         upper_bound: bool = True,
+        sampling: Union[dict, Sampler] = None,
+        backend: str = "auto",
+        bootstrap: bool = False,
+        n_bootstrap: int = constant.BOOTSTRAP_SIZE,
+        seed: int = constant.SEED_SIZE,
         **kwargs,
     ) -> MetricResults:
         """Method evaluate() to evaluate the DriftMetric
@@ -50,12 +88,22 @@ class DriftMetric(AbstractMetrics):
         ----------
         current : DataFrame
                 The input current (pandas DataFrame)
-        reference : DataFrame
-                The input reference (pandas DataFrame)
+        reference : Union[DataFrame, DecayedReference]
+                The input reference (pandas DataFrame), or an incrementally maintained reference
         threshold : Union[list, float, int]
                 Threshold values to validate the input value
         upper_bound : bool, optional
                 A flag used to set the upper_bound param
+        sampling : Union[dict, Sampler], optional
+                Sampler (or its parameters) of the datasets. The metric is computed on the full datasets if None
+        backend : str, optional
+                Implementation of the metric function (see pulsar_metrics.metrics.backends), selected by input size if "auto"
+        bootstrap : bool, optional
+                Whether to compute a bootstrap confidence interval (see pulsar_metrics.metrics.bootstrap) of scalar features
+        n_bootstrap : int, optional
+                Number of bootstrap replicates
+        seed : int, optional
+                seed value for random number generator
         kwargs :
                 keyworded variable length of arguments to a function
 
@@ -64,29 +112,119 @@ class DriftMetric(AbstractMetrics):
         list
                 returns the result of the calculated DriftMetric
         """
+        self._result = None
         try:
+            if isinstance(reference, DecayedReference):
+                state = reference.drift_state(self._name, current[self._feature_name])
+                return self.finalize(state, threshold, upper_bound, **kwargs)
+
             ref_column = reference[self._feature_name] if self._feature_name is not None else reference
             self._column = current[self._feature_name] if self._feature_name is not None else current
+            # The scipy functions propagate missing values or fail on them
+            skip_missing = (self._name not in _MASKED_METRICS) and not is_vector_column(self._column)
+            func = _select_function(self._name, self._column, ref_column, backend, kwargs)
+
+            if sampling is not None:
+                sampler = sampling if isinstance(sampling, Sampler) else Sampler(**sampling)
+                if is_vector_column(self._column):
+                    func = embedding_function(func, self._name)
+                value, sample_size, conf_int = sampler.evaluate(
+                    self._name, func, current, reference, self._feature_name, skip_missing=skip_missing, **kwargs
+                )
+                return self._make_result(value, threshold, upper_bound, conf_int=conf_int, sample_size=sample_size)
 
-            value = DriftMetricsFuncs[self._name].value(self._column, ref_column, **kwargs)
-
-            status = compare_to_threshold(value, threshold, upper_bound)
+            if skip_missing:
+                self._column, ref_column = _valid(self._column), _valid(ref_column)
 
-            self._result = MetricResults(
-                metric_name=self._name,
-                metric_type=MetricsType.drift.value,
-                feature_name=self._feature_name,
-                metric_value=value,
-                conf_int=None,
-                drift_status=status,
-                threshold=threshold,
-            )
+            if is_vector_column(self._column):
+                value, self._components = embedding_drift(func, self._name, self._column, ref_column, **kwargs)
+            else:
+                value = func(self._column, ref_column, **kwargs)
+                if bootstrap:
+                    conf_int = bootstrap_conf_int(self._name, self._column, ref_column, value, func, n_bootstrap, seed, **kwargs)
+                    return self._make_result(value, threshold, upper_bound, conf_int=conf_int)
 
-            return self._result
+            return self._make_result(value, threshold, upper_bound)
 
         except Exception as e:
             print(f"Exception in evaluate() in the DriftMetric class (drift): {str(e)}")
 
+    def _make_result(
+        self,
+        value: float,
+        threshold: Union[list, float, int] = None,
+        upper_bound: bool = True,
+        conf_int: list = None,
+        sample_size: int = None,
+    ) -> MetricResults:
+        status = compare_to_threshold(value, threshold, upper_bound)
+
+        self._result = MetricResults(
+            metric_name=self._name,
+            metric_type=MetricsType.drift.value,
+            feature_name=self._feature_name,
+            metric_value=value,
+            conf_int=conf_int,
+            drift_status=status,
+            threshold=threshold,
+            sample_size=sample_size,
+        )
+
+        return self._result
+
+    def get_components(self) -> pd.DataFrame:
+        """Per-component results of the last evaluation on an embedding column (None for scalar features)"""
+        return self._components
+
+    def has_partial_state(self, current: pd.DataFrame = None) -> bool:
+        """Whether the metric has a partial state (not the case of chi2, the missing values and embedding columns)"""
+        if self._name not in _STATES_REQUIREMENTS:
+            return False
+        return (current is None) or not is_vector_column(current[self._feature_name])
+
+    def compute_partial(self, current: pd.DataFrame, reference: pd.DataFrame = None, **kwargs) -> DriftState:
+        """Method compute_partial() to compute the partial state of the DriftMetric on a partition
+
+        Parameters
+        ----------
+        current : DataFrame
+                The partition of the current data (pandas DataFrame)
+        reference : DataFrame, optional
+                The partition of the reference data (pandas DataFrame)
+        kwargs :
+                keyworded variable length of arguments to a function
+
+        Returns
+        -------
+        DriftState
+                returns the partial state of the DriftMetric
+        """
+        ref_column = reference[self._feature_name] if reference is not None else None
+        return compute_drift_state(self._name, current[self._feature_name], ref_column)
+
+    def finalize(
+        self, state: DriftState, threshold: Union[list, float, int] = None, upper_bound: bool = True, **kwargs
+    ) -> MetricResults:
+        """Method finalize() to compute the DriftMetric from a merged partial state
+
+        Parameters
+        ----------
+        state : DriftState
+                The merged partial state of the metric
+        threshold : Union[list, float, int]
+                Threshold values to validate the input value
+        upper_bound : bool, optional
+                A flag used to set the upper_bound param
+        kwargs :
+                keyworded variable length of arguments to a function
+
+        Returns
+        -------
+        MetricResults
+                returns the result of the calculated DriftMetric
+        """
+        return self._make_result(finalize_drift_state(self._name, state, **kwargs), threshold, upper_bound)
+
 
 class DriftTestMetric(AbstractMetrics):
     def __init__(self, metric_name: str, feature_name: str, **kwargs):
@@ -108,6 +246,7 @@ class DriftTestMetric(AbstractMetrics):
 
         try:
             self._feature_name = feature_name
+            self._components = None
 
         except Exception as e:
             print(f"Exception in DriftTestMetric() in the DriftMetric class(drift): {str(e)}")
@@ -124,6 +263,11 @@ class DriftTestMetric(AbstractMetrics):
         current: pd.DataFrame,
         reference: pd.DataFrame,
         alpha: float = constant.SIGNIFICANCE_LEVEL,
+        sampling: Union[dict, Sampler] = None,
+        backend: str = "auto",
+        bootstrap: bool = False,
+        n_bootstrap: int = constant.BOOTSTRAP_SIZE,
+        seed: int = constant.SEED_SIZE,
         **kwargs,
     ) -> MetricResults:
         """Method  evaluate() to evaluate in DriftTestMetric
@@ -132,10 +276,21 @@ class DriftTestMetric(AbstractMetrics):
                 ----------
                 current : DataFrame
                         The input current (pandas DataFrame)
-                reference : DataFrame
-                        The input reference (pandas DataFrame)
+                reference : Union[DataFrame, DecayedReference]
+                        The input reference (pandas DataFrame), or an incrementally maintained reference
         alpha : float
             Value to define significance level
+        sampling : Union[dict, Sampler], optional
+            Sampler (or its parameters) of the datasets. The test is computed on the full datasets if None
+        backend : str, optional
+            Implementation of the test function (see pulsar_metrics.metrics.backends), selected by input size if "auto"
+        bootstrap : bool, optional
+            Whether to compute a bootstrap confidence interval of the p-value (see pulsar_metrics.metrics.bootstrap) of
+            scalar features, at the confidence level 1 - alpha
+        n_bootstrap : int, optional
+            Number of bootstrap replicates
+        seed : int, optional
+            seed value for random number generator
                 kwargs :
                         keyworded variable length of arguments to a function
 
@@ -144,58 +299,262 @@ class DriftTestMetric(AbstractMetrics):
                 list
                          returns the result of the calculated DriftMetric
         """
+        self._result = None
         try:
+            if isinstance(reference, DecayedReference):
+                return self.finalize(reference.drift_state(self._name, current[self._feature_name]), alpha, **kwargs)
+
             ref_column = reference[self._feature_name] if self._feature_name is not None else reference
             self._column = current[self._feature_name] if self._feature_name is not None else current
+            # The scipy functions propagate missing values or fail on them
+            skip_missing = (self._name not in _MASKED_METRICS) and not is_vector_column(self._column)
+            func = _select_function(self._name, self._column, ref_column, backend, kwargs)
+
+            if sampling is not None:
+                sampler = sampling if isinstance(sampling, Sampler) else Sampler(**sampling)
+                if is_vector_column(self._column):
+                    func = embedding_function(func, self._name, test=True)
+                test_result, sample_size, conf_int = sampler.evaluate(
+                    self._name,
+                    func,
+                    current,
+                    reference,
+                    self._feature_name,
+                    statistic=lambda result: result.pvalue,
+                    skip_missing=skip_missing,
+                    **kwargs,
+                )
+                return self._make_result(test_result, alpha, conf_int=conf_int, sample_size=sample_size)
+
+            if skip_missing:
+                self._column, ref_column = _valid(self._column), _valid(ref_column)
+
+            if is_vector_column(self._column):
+                test_result, self._components = embedding_drift(func, self._name, self._column, ref_column, test=True, **kwargs)
+            else:
+                test_result = func(self._column, ref_column, **kwargs)
+                if bootstrap:
+                    conf_int = bootstrap_conf_int(
+                        self._name,
+                        self._column,
+                        ref_column,
+                        getattr(test_result, "statistic", None),
+                        func,
+                        n_bootstrap,
+                        seed,
+                        alpha,
+                        **kwargs,
+                    )
+                    return self._make_result(test_result, alpha, conf_int=conf_int)
+
+            return self._make_result(test_result, alpha)
 
-            test_result = DriftTestMetricsFuncs[self._name].value(self._column, ref_column, **kwargs)
+        except Exception as e:
+            print(f"Exception in evaluate() in the DriftMetric class (drift): {str(e)}")
 
-            status = test_result.pvalue < alpha if isinstance(alpha, (int, float)) else None
+    def _make_result(
+        self, test_result, alpha: float = constant.SIGNIFICANCE_LEVEL, conf_int: list = None, sample_size: int = None
+    ) -> MetricResults:
+        status = test_result.pvalue < alpha if isinstance(alpha, (int, float)) else None
+
+        self._result = MetricResults(
+            metric_name=self._name,
+            metric_type=MetricsType.drift.value,
+            feature_name=self._feature_name,
+            metric_value=test_result.pvalue,
+            conf_int=conf_int,
+            drift_status=status,
+            threshold=alpha,
+            sample_size=sample_size,
+        )
+
+        return self._result
+
+    def get_components(self) -> pd.DataFrame:
+        """Per-component results of the last evaluation on an embedding column (None for scalar features)"""
+        return self._components
+
+    def has_partial_state(self, current: pd.DataFrame = None) -> bool:
+        """Whether the metric has a partial state (not the case of chi2, the missing values and embedding columns)"""
+        if self._name not in _STATES_REQUIREMENTS:
+            return False
+        return (current is None) or not is_vector_column(current[self._feature_name])
+
+    def compute_partial(self, current: pd.DataFrame, reference: pd.DataFrame = None, **kwargs) -> DriftState:
+        """Method compute_partial() to compute the partial state of the DriftTestMetric on a partition
 
-            self._result = MetricResults(
-                metric_name=self._name,
-                metric_type=MetricsType.drift.value,
-                feature_name=self._feature_name,
-                metric_value=test_result.pvalue,
-                conf_int=None,
-                drift_status=status,
-                threshold=alpha,
-            )
+        Parameters
+        ----------
+        current : DataFrame
+                The partition of the current data (pandas DataFrame)
+        reference : DataFrame, optional
+                The partition of the reference data (pandas DataFrame)
+        kwargs :
+                keyworded variable length of arguments to a function
 
-            return self._result
+        Returns
+        -------
+        DriftState
+                returns the partial state of the DriftTestMetric
+        """
+        ref_column = reference[self._feature_name] if reference is not None else None
+        return compute_drift_state(self._name, current[self._feature_name], ref_column)
 
-        except Exception as e:
-            print(f"Exception in evaluate() in the DriftMetric class (drift): {str(e)}")
+    def finalize(self, state: DriftState, alpha: float = constant.SIGNIFICANCE_LEVEL, **kwargs) -> MetricResults:
+        """Method finalize() to compute the DriftTestMetric from a merged partial state
 
+        Rank-based tests are computed from approximate sketches with asymptotic p-values.
 
-def CustomDriftMetric(func):
-    """Decorator for custom metrics"""
+        Parameters
+        ----------
+        state : DriftState
+                The merged partial state of the metric
+        alpha : float
+                Value to define significance level
+        kwargs :
+                keyworded variable length of arguments to a function
 
-    def inner(metric_name: str, feature_name: str) -> AbstractMetrics:
-        class CustomClass(AbstractMetrics):
-            def __init__(self, metric_name, feature_name):
-                super().__init__(metric_name)
-                self._feature_name = feature_name
+        Returns
+        -------
+        MetricResults
+                returns the result of the calculated DriftTestMetric
+        """
+        return self._make_result(finalize_drift_state(self._name, state, **kwargs), alpha)
 
-            def evaluate(self, current: pd.DataFrame, reference: pd.DataFrame, **kwargs):
-                value = func(current[self._feature_name], reference[self._feature_name], **kwargs)
-                threshold = kwargs.get("threshold", None)
-                upper_bound = kwargs.get("upper_bound", True)
 
-                status = compare_to_threshold(value, threshold, upper_bound)
+# Registry of the custom drift metrics by name, used by Analyzer.add_drift_metrics
+CUSTOM_DRIFT_METRICS = {}
 
-                self._result = MetricResults(
-                    metric_name=self._name,
-                    metric_type=MetricsType.custom.value,
-                    feature_name=self._feature_name,
-                    metric_value=value,
-                    conf_int=None,
-                    drift_status=status,
-                    threshold=threshold,
-                )
 
-                return self._result
+def CustomDriftMetric(func=None, vectorized: bool = False, name: str = None, n_jobs: int = 1):
+    """Decorator for custom metrics
+
+    Used as @CustomDriftMetric, the function receives the current and reference columns of one feature and returns
+    a value. Used as @CustomDriftMetric(vectorized=True), the function receives 2D numpy arrays (rows x features)
+    of the current and reference data and returns a vector with one value per feature, so that an analyzer
+    evaluates the metric on all its features at once. The metric is registered under its name (the name of the
+    function by default).
+
+    Parameters
+    ----------
+    func : Callable, optional
+        The metric function
+    vectorized : bool, optional
+        Whether the function takes 2D arrays of several features
+    name : str, optional
+        Name of the metric in the registry
+    n_jobs : int, optional
+        Number of threads evaluating blocks of features of a vectorized function
+    """
 
-        return CustomClass(metric_name=metric_name, feature_name=feature_name)
+    def decorator(func):
+        registered_name = name if name is not None else func.__name__
+        if registered_name in DriftMetricsFuncs._member_names_ + DriftTestMetricsFuncs._member_names_:
+            raise error_msg(
+                value=registered_name,
+                message=f'{"InvalidInput: the name of a custom metric should not be the name of a drift metric"}',
+            )
 
-    return inner
+        def inner(metric_name: str = registered_name, feature_name: str = None) -> AbstractMetrics:
+            class CustomClass(AbstractMetrics):
+                def __init__(self, metric_name, feature_name):
+                    super().__init__(metric_name)
+                    self._feature_name = feature_name
+                    self._func = func
+                    self._vectorized = vectorized
+                    self._n_jobs = n_jobs
+
+                def evaluate(self, current: pd.DataFrame, reference: pd.DataFrame, **kwargs):
+                    if self._vectorized:
+                        return evaluate_vectorized([self], current, reference, **kwargs)[0]
+
+                    value = func(current[self._feature_name], reference[self._feature_name], **kwargs)
+                    threshold = kwargs.get("threshold", None)
+                    upper_bound = kwargs.get("upper_bound", True)
+
+                    status = compare_to_threshold(value, threshold, upper_bound)
+
+                    self._result = MetricResults(
+                        metric_name=self._name,
+                        metric_type=MetricsType.custom.value,
+                        feature_name=self._feature_name,
+                        metric_value=value,
+                        conf_int=None,
+                        drift_status=status,
+                        threshold=threshold,
+                    )
+
+                    return self._result
+
+            return CustomClass(metric_name=metric_name, feature_name=feature_name)
+
+        CUSTOM_DRIFT_METRICS[registered_name] = inner
+        return inner
+
+    return decorator if func is None else decorator(func)
+
+
+def evaluate_vectorized(
+    metrics_list: list,
+    current: pd.DataFrame,
+    reference: pd.DataFrame,
+    threshold: Union[list, float, int] = None,
+    upper_bound: bool = True,
+    **kwargs,
+) -> list:
+    """Evaluate a vectorized custom drift metric on the features of several metrics with batched function calls
+
+    Parameters
+    ----------
+    metrics_list : list
+        Custom metrics sharing the same vectorized function, one per feature
+    current : DataFrame
+        The input current (pandas DataFrame)
+    reference : DataFrame
+        The input reference (pandas DataFrame)
+    threshold : Union[list, float, int]
+        Threshold values to validate the values
+    upper_bound : bool, optional
+        A flag used to set the upper_bound param
+    kwargs :
+        keyworded variable length of arguments to a function
+
+    Returns
+    -------
+    list
+        the MetricResults of the metrics
+    """
+    features = [metric._feature_name for metric in metrics_list]
+    func, n_jobs = metrics_list[0]._func, metrics_list[0]._n_jobs
+
+    def evaluate_block(block):
+        columns = [features[i] for i in block]
+        values = np.asarray(func(current[columns].to_numpy(), reference[columns].to_numpy(), **kwargs), dtype=float)
+        if values.shape != (len(columns),):
+            raise error_msg(
+                value=values.shape,
+                message=f'{"InvalidOutput: a vectorized custom metric should return one value per feature"}',
+            )
+        return values
+
+    blocks = np.array_split(np.arange(len(features)), max(1, min(n_jobs, len(features))))
+    if len(blocks) == 1:
+        values = evaluate_block(blocks[0])
+    else:
+        with ThreadPoolExecutor(max_workers=len(blocks)) as executor:
+            values = np.concatenate(list(executor.map(evaluate_block, blocks)))
+
+    statuses = compare_to_threshold(values, threshold, upper_bound)
+    statuses = [None] * len(values) if statuses is None else np.broadcast_to(statuses, values.shape).tolist()
+
+    for metric, value, status in zip(metrics_list, values.tolist(), statuses):
+        metric._result = MetricResults(
+            metric_name=metric._name,
+            metric_type=MetricsType.custom.value,
+            feature_name=metric._feature_name,
+            metric_value=value,
+            conf_int=None,
+            drift_status=status,
+            threshold=threshold,
+        )
+    return [metric._result for metric in metrics_list]
@@ -0,0 +1,313 @@
+#  Author:   Adel Benlagra  <abenlagra@rocketscience.one>
+import hashlib
+import inspect
+import weakref
+from collections import OrderedDict, namedtuple
+from typing import Callable
+
+import constant
+import numpy as np
+import pandas as pd
+
+from ..exceptions import CustomExceptionPulsarMetric as error_msg
+
+PROJECTION_METHODS = ("pca", "random")
+# Statistical tests of the components (batched along the rows axis), chi2 compares categorical frequencies
+EMBEDDING_TESTS = ("ttest", "manwu", "ks_2samp", "CvM", "levene", "bftest")
+
+# Aggregate test of the components of an embedding, with the statistics and p-values of every component
+EmbeddingTestResult = namedtuple("EmbeddingTestResult", ["statistic", "pvalue", "statistics", "pvalues"])
+
+# Projections fitted on reference embeddings, with the projected reference, by fingerprint of the reference
+_PROJECTIONS = OrderedDict()
+# Fingerprints of embeddings by address of their values, with a weak reference to the array owning the values
+_FINGERPRINTS = OrderedDict()
+
+
+def is_vector_column(column) -> bool:
+    """Whether a column holds vectors (lists, tuples or arrays) instead of scalars"""
+    if isinstance(column, np.ndarray):
+        return column.ndim == 2
+    if not isinstance(column, pd.Series) or (column.dtype != object):
+        return False
+    index = column.first_valid_index()
+    return (index is not None) and isinstance(column[index], (list, tuple, np.ndarray))
+
+
+def to_matrix(column, dtype=np.float32) -> np.ndarray:
+    """Stack a vector column into a (rows x dimensions) matrix"""
+    if isinstance(column, np.ndarray) and column.ndim == 2:
+        return column.astype(dtype, copy=False)
+    values = column.to_numpy() if isinstance(column, pd.Series) else np.asarray(column, dtype=object)
+    if len(values) == 0:
+        return np.empty((0, 0), dtype=dtype)
+    return np.stack(values).astype(dtype, copy=False)
+
+
+def valid_rows(embeddings):
+    """Embeddings without their missing rows (None in vector columns, rows with NaN in 2D arrays)"""
+    if isinstance(embeddings, np.ndarray):
+        mask = ~np.isnan(embeddings).any(axis=1)
+        return embeddings if mask.all() else embeddings[mask]
+    mask = embeddings.notna().to_numpy()
+    return embeddings if mask.all() else pd.Series(embeddings.array[mask], name=embeddings.name)
+
+
+class EmbeddingProjection:
+    """Low-dimensional projection of embeddings fitted on the reference
+
+    The principal components are computed from the covariance of a sample of the reference embeddings (the
+    dimension of the embeddings being much smaller than the number of rows), the random projection is a seeded
+    gaussian matrix. Embeddings are projected by chunks of rows, so that the full (rows x dimensions) matrix is
+    never materialized.
+    """
+
+    def __init__(
+        self,
+        reference,
+        n_components: int = constant.EMBEDDING_COMPONENTS,
+        method: str = "pca",
+        fit_size: int = constant.EMBEDDING_FIT_SIZE,
+        seed: int = constant.SEED_SIZE,
+    ):
+        """Constructor of the EmbeddingProjection class
+
+        Parameters
+        ----------
+        reference : pd.Series, np.ndarray
+            The reference embeddings (a vector column or a 2D array)
+        n_components : int, optional
+            Number of components of the projection
+        method : str, optional
+            "pca" for the principal components, "random" for a gaussian random projection
+        fit_size : int, optional
+            Number of reference rows the principal components are fitted on
+        seed : int, optional
+            seed value for random number generator
+        """
+        if method not in PROJECTION_METHODS:
+            raise error_msg(
+                value=method,
+                message=f"InvalidInput: projection method should be one of {PROJECTION_METHODS}",
+            )
+        rng = np.random.default_rng(seed)
+        self._fit_rows = np.sort(rng.choice(len(reference), size=min(fit_size, len(reference)), replace=False))
+        rows = self._fit_rows
+        sample = to_matrix(reference[rows] if isinstance(reference, np.ndarray) else reference.iloc[rows], dtype=float)
+        dimension = sample.shape[1]
+        n_components = min(n_components, dimension)
+
+        self._method = method
+        self._mean = sample.mean(axis=0)
+        if method == "pca":
+            centered = sample - self._mean
+            variances, vectors = np.linalg.eigh(centered.T @ centered / max(len(sample) - 1, 1))
+            order = np.argsort(variances)[::-1][:n_components]
+            vectors = vectors[:, order]
+            # Deterministic signs: the largest loading of every component is positive
+            signs = np.sign(vectors[np.abs(vectors).argmax(axis=0), np.arange(n_components)])
+            self._components = vectors * np.where(signs == 0, 1, signs)
+            self._explained_variance_ratio = variances[order] / max(variances.sum(), np.finfo(float).tiny)
+        else:
+            self._components = rng.normal(size=(dimension, n_components)) / np.sqrt(n_components)
+            self._explained_variance_ratio = None
+
+    @property
+    def n_components(self) -> int:
+        return self._components.shape[1]
+
+    @property
+    def fit_rows(self) -> np.ndarray:
+        return self._fit_rows
+
+    @property
+    def explained_variance_ratio(self) -> np.ndarray:
+        return self._explained_variance_ratio
+
+    def transform(self, embeddings, chunk_size: int = constant.EMBEDDING_CHUNK_SIZE) -> np.ndarray:
+        """Project embeddings on the components
+
+        Parameters
+        ----------
+        embeddings : pd.Series, np.ndarray
+            The embeddings (a vector column or a 2D array)
+        chunk_size : int, optional
+            Number of rows stacked and projected at once
+
+        Returns
+        -------
+        np.ndarray
+            (rows x n_components) projections
+        """
+        components, mean = self._components.astype(np.float32), self._mean.astype(np.float32)
+        projections = np.empty((len(embeddings), self.n_components))
+        for start in range(0, len(embeddings), chunk_size):
+            stop = min(start + chunk_size, len(embeddings))
+            chunk = embeddings[start:stop] if isinstance(embeddings, np.ndarray) else embeddings.iloc[start:stop]
+            projections[start:stop] = (to_matrix(chunk) - mean) @ components
+        return projections
+
+
+def _owner(values: np.ndarray) -> np.ndarray:
+    """Array owning the memory of a view"""
+    while isinstance(values.base, np.ndarray):
+        values = values.base
+    return values
+
+
+def fingerprint(embeddings, chunk_size: int = constant.EMBEDDING_CHUNK_SIZE) -> str:
+    """Digest of the content of the valid rows of embeddings, stacked by chunks of rows
+
+    The digest is memoized by address of the values of the embeddings, so that the same column selected again from
+    its frame is not hashed again (embeddings are not expected to be modified in place).
+    """
+    values = embeddings if isinstance(embeddings, np.ndarray) else embeddings.to_numpy()
+    owner = _owner(values)
+    key = (id(owner), values.__array_interface__["data"][0], values.shape, values.strides)
+    if (key in _FINGERPRINTS) and (_FINGERPRINTS[key][0]() is owner):
+        _FINGERPRINTS.move_to_end(key)
+        return _FINGERPRINTS[key][1]
+
+    embeddings = valid_rows(embeddings)
+    digest = hashlib.blake2b(digest_size=16)
+    for start in range(0, len(embeddings), chunk_size):
+        stop = min(start + chunk_size, len(embeddings))
+        chunk = embeddings[start:stop] if isinstance(embeddings, np.ndarray) else embeddings.iloc[start:stop]
+        matrix = np.ascontiguousarray(to_matrix(chunk))
+        digest.update(str(matrix.shape[1:]).encode())
+        digest.update(matrix)
+    _FINGERPRINTS[key] = (weakref.ref(owner), digest.hexdigest())
+    if len(_FINGERPRINTS) > constant.PROJECTION_CACHE_SIZE:
+        _FINGERPRINTS.popitem(last=False)
+    return _FINGERPRINTS[key][1]
+
+
+def get_projection(
+    reference,
+    n_components: int = constant.EMBEDDING_COMPONENTS,
+    method: str = "pca",
+    seed: int = constant.SEED_SIZE,
+) -> tuple:
+    """Projection fitted on reference embeddings and the projected reference, cached by content of the reference
+
+    The principal components overfit the rows they are fitted on (their variance along the components is
+    inflated), so the rows of the fit sample are left out of the projected reference when at least as many
+    other rows remain. The cache holds the last constant.PROJECTION_CACHE_SIZE projections, keyed by the
+    fingerprint of the reference so that copies of the same reference (filtered again on every run) share their
+    projection. The missing rows of the reference are left out.
+
+    Returns
+    -------
+    tuple
+        the EmbeddingProjection and the (rows x n_components) projected reference
+    """
+    key = (fingerprint(reference), n_components, method, seed)
+    if key in _PROJECTIONS:
+        _PROJECTIONS.move_to_end(key)
+    else:
+        reference = valid_rows(reference)
+        projection = EmbeddingProjection(reference, n_components=n_components, method=method, seed=seed)
+        held_out = np.setdiff1d(np.arange(len(reference)), projection.fit_rows, assume_unique=True)
+        if (method == "pca") and (len(held_out) >= len(projection.fit_rows)):
+            reference = reference[held_out] if isinstance(reference, np.ndarray) else reference.iloc[held_out]
+        _PROJECTIONS[key] = (projection, projection.transform(reference))
+        if len(_PROJECTIONS) > constant.PROJECTION_CACHE_SIZE:
+            _PROJECTIONS.popitem(last=False)
+    return _PROJECTIONS[key]
+
+
+def _accepts_axis(func: Callable) -> bool:
+    """Whether a test function is vectorized along an axis argument"""
+    try:
+        return "axis" in inspect.signature(func).parameters
+    except (TypeError, ValueError):
+        return False
+
+
+def embedding_drift(
+    func: Callable,
+    metric_name: str,
+    new,
+    reference,
+    test: bool = False,
+    n_components: int = constant.EMBEDDING_COMPONENTS,
+    projection: str = "pca",
+    seed: int = constant.SEED_SIZE,
+    **kwargs,
+) -> tuple:
+    """Drift of an embedding column from the drift of its projections on components fitted on the reference
+
+    Statistical tests are run on all the components at once (along the rows axis) and aggregated with a Bonferroni
+    correction: the p-value of the embedding is the smallest p-value of the components times their number. Drift
+    metrics are averaged over the components, except mmd which is computed on the projections jointly.
+    Missing rows (None in vector columns) are left out of both samples.
+
+    Parameters
+    ----------
+    func : Callable
+        The drift function of a scalar feature
+    metric_name : str
+        Name of the metric
+    new : pd.Series, np.ndarray
+        The new embeddings
+    reference : pd.Series, np.ndarray
+        The reference embeddings
+    test : bool, optional
+        Whether func is a statistical test (returning a statistic and a p-value)
+    n_components : int, optional
+        Number of components of the projection
+    projection : str, optional
+        "pca" or "random"
+    seed : int, optional
+        seed value for random number generator
+    kwargs :
+        keyworded variable length of arguments to a function
+
+    Returns
+    -------
+    tuple
+        the aggregate value (an EmbeddingTestResult for tests) and the DataFrame of the components
+    """
+    if test and (metric_name not in EMBEDDING_TESTS):
+        raise error_msg(
+            value=metric_name,
+            message=f"InvalidInput: statistical tests of embedding columns should be one of {EMBEDDING_TESTS}",
+        )
+    model, reference_projections = get_projection(reference, n_components=n_components, method=projection, seed=seed)
+    projections = model.transform(valid_rows(new))
+    components = pd.Index(range(model.n_components), name="component")
+
+    if metric_name == "mmd":
+        value = func(pd.DataFrame(projections), pd.DataFrame(reference_projections), **kwargs)
+        return value, pd.DataFrame({"metric_value": [value]})
+
+    if not test:
+        values = np.array(
+            [func(pd.Series(projections[:, j]), pd.Series(reference_projections[:, j]), **kwargs) for j in components]
+        )
+        return float(values.mean()), pd.DataFrame({"metric_value": values}, index=components)
+
+    if _accepts_axis(func):
+        result = func(projections, reference_projections, axis=0, **kwargs)
+        statistics, pvalues = np.atleast_1d(result.statistic), np.atleast_1d(result.pvalue)
+    else:
+        # Tests without an axis argument in older scipy versions are run component by component
+        results = [func(projections[:, j], reference_projections[:, j], **kwargs) for j in components]
+        statistics = np.array([result.statistic for result in results], dtype=float)
+        pvalues = np.array([result.pvalue for result in results], dtype=float)
+    aggregate = EmbeddingTestResult(
+        statistic=float(statistics.max()),
+        pvalue=float(min(1.0, pvalues.min() * len(pvalues))),
+        statistics=statistics,
+        pvalues=pvalues,
+    )
+    return aggregate, pd.DataFrame({"statistic": statistics, "pvalue": pvalues}, index=components)
+
+
+def embedding_function(func: Callable, metric_name: str, test: bool = False) -> Callable:
+    """Drift function of embedding columns (returning the aggregate value) built on the function of scalar features"""
+
+    def evaluate(new, reference, **kwargs):
+        return embedding_drift(func, metric_name, new, reference, test=test, **kwargs)[0]
+
+    return evaluate
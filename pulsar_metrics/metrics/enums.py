@@ -3,7 +3,6 @@
 from enum import Enum
 from functools import partial
 
-from scipy.special import kl_div
 from scipy.stats import (
     chisquare,
     cramervonmises_2samp,
@@ -27,7 +26,17 @@ from sklearn.metrics import (
     roc_auc_score,
 )
 
-from .utils import max_mean_discrepency, population_stability_index
+from .histograms import js_divergence, kl_divergence
+from .utils import (
+    constant_column,
+    duplicate_rows,
+    max_mean_discrepency,
+    missing_rate,
+    missing_rate_drift,
+    out_of_range_rate,
+    population_stability_index,
+    unseen_category_rate,
+)
 
 
 class MetricsType(Enum):
@@ -38,13 +47,17 @@ class MetricsType(Enum):
     drift = "drift"
     custom = "custom"
     statistics = "statistics"
+    quality = "quality"
 
 
 class DriftMetricsFuncs(Enum):
-    kl = partial(kl_div)
+    kl = partial(kl_divergence)
+    js = partial(js_divergence)
     psi = partial(population_stability_index)
     wasserstein = partial(wasserstein_distance)
     mmd = partial(max_mean_discrepency)
+    missing_rate = partial(missing_rate)
+    missing_rate_drift = partial(missing_rate_drift)
 
 
 class DriftTestMetricsFuncs(Enum):
@@ -57,6 +70,18 @@ class DriftTestMetricsFuncs(Enum):
     chi2 = partial(chisquare)
 
 
+class DataQualityMetricsFuncs(Enum):
+
+    """Set of data quality checks functions"""
+
+    null_rate = partial(missing_rate)
+    out_of_range_rate = partial(out_of_range_rate)
+    unseen_category_rate = partial(unseen_category_rate)
+    constant_column = partial(constant_column)
+    # Check of the rows of the dataset (not of a feature)
+    duplicate_rows = partial(duplicate_rows)
+
+
 class PerformanceMetricsFuncs(Enum):
 
     """Set of performance metrics functions"""
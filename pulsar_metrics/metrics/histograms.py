@@ -0,0 +1,274 @@
+#  Author:   Adel Benlagra  <abenlagra@rocketscience.one>
+import constant
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_numeric_dtype
+
+
+class FrozenBinning:
+    """Bins of several features frozen on the reference dataset
+
+    Numeric features get equal-width bins fitted on the reference (current values outside the reference range
+    fall into the outer bins), categorical features get one bin per reference category plus a last bin for the
+    unseen categories. The histograms of all the features are counted together into a 2D matrix with one row
+    per feature, padded with empty bins up to the largest number of bins.
+    """
+
+    def __init__(self, reference: pd.DataFrame, features: list, bins="sturges"):
+        """Constructor of the FrozenBinning class
+
+        Parameters
+        ----------
+        reference : DataFrame
+            The input reference (pandas DataFrame)
+        features : list
+            List of features to bin
+        bins : int, str, optional
+            Number of bins or binning rule of numpy.histogram_bin_edges for the numeric features
+        """
+        self._features = list(features)
+        self._numeric = [feature for feature in self._features if is_numeric_dtype(reference[feature])]
+        self._categories = {
+            feature: pd.Index(reference[feature].dropna().unique()) for feature in self._features if feature not in self._numeric
+        }
+
+        edges = [
+            np.histogram_bin_edges(reference[feature].dropna().to_numpy(dtype=float), bins=bins) for feature in self._numeric
+        ]
+        self._low = np.array([edge[0] for edge in edges])
+        self._n_numeric_bins = np.array([len(edge) - 1 for edge in edges], dtype=np.int64)
+        self._width = np.array([(edge[-1] - edge[0]) / (len(edge) - 1) for edge in edges])
+
+        n_bins = dict(zip(self._numeric, self._n_numeric_bins))
+        n_bins.update({feature: len(categories) + 1 for feature, categories in self._categories.items()})
+        self._n_bins = np.array([n_bins[feature] for feature in self._features], dtype=np.int64)
+        self._rows = {feature: i for i, feature in enumerate(self._features)}
+
+    @property
+    def features(self) -> list:
+        return self._features
+
+    @property
+    def mask(self) -> np.ndarray:
+        """(n_features, max_bins) mask of the bins of every feature"""
+        return np.arange(self._n_bins.max(initial=0)) < self._n_bins[:, None]
+
+    def row(self, feature: str) -> int:
+        return self._rows[feature]
+
+    def codes(self, data: pd.DataFrame) -> np.ndarray:
+        """Bin index of the values of all the features of a dataset
+
+        Parameters
+        ----------
+        data : DataFrame
+            The dataset (pandas DataFrame)
+
+        Returns
+        -------
+        np.ndarray
+            (n_rows, n_features) matrix of bin indexes (int32), -1 for the missing values
+        """
+        # Computed feature by feature (the returned matrix being Fortran-ordered), the numeric features by chunks of
+        # rows scaled in a float64 buffer written into the codes
+        codes = np.empty((len(self._features), len(data)), dtype=np.int32)
+        scaled = np.empty(min(constant.HISTOGRAM_CHUNK_SIZE, len(data)))
+        for i, feature in enumerate(self._numeric):
+            column = data[feature]
+            # Numpy columns are not copied, missing values of nullable dtypes become NaN
+            values = column.to_numpy() if isinstance(column.dtype, np.dtype) else column.to_numpy(dtype=float, na_value=np.nan)
+            row = codes[self._rows[feature]]
+            for start in range(0, len(values), constant.HISTOGRAM_CHUNK_SIZE):
+                stop = min(start + constant.HISTOGRAM_CHUNK_SIZE, len(values))
+                chunk, out = values[start:stop], scaled[: stop - start]
+                np.subtract(chunk, self._low[i], out=out, dtype=float)
+                if self._width[i] > 0:
+                    out /= self._width[i]
+                else:
+                    out *= 0
+                np.floor(out, out=out)
+                np.clip(out, 0, self._n_numeric_bins[i] - 1, out=out)
+                out[np.isnan(out)] = -1
+                row[start:stop] = out
+
+        for feature, categories in self._categories.items():
+            column = data[feature]
+            index = categories.get_indexer(column)
+            codes[self._rows[feature]] = np.where(column.isna(), -1, np.where(index < 0, len(categories), index))
+        return codes.T
+
+    def labels(self, feature: str) -> list:
+        """Labels of the bins of a feature: intervals of the numeric bins (the outer bins being open), categories and
+        "<unseen>" for the categorical bins"""
+        if feature in self._categories:
+            return [str(category) for category in self._categories[feature]] + ["<unseen>"]
+        row = self._numeric.index(feature)
+        edges = self._low[row] + self._width[row] * np.arange(self._n_numeric_bins[row] + 1)
+        lows = ["-inf"] + [f"{edge:.4g}" for edge in edges[1:-1]]
+        highs = [f"{edge:.4g}" for edge in edges[1:-1]] + ["inf"]
+        return [f"[{low}, {high})" for low, high in zip(lows, highs)]
+
+    def counts(self, data: pd.DataFrame) -> np.ndarray:
+        """Count the histograms of all the features of a dataset in one pass
+
+        Parameters
+        ----------
+        data : DataFrame
+            The dataset (pandas DataFrame)
+
+        Returns
+        -------
+        np.ndarray
+            (n_features, max_bins) matrix of counts, missing values being ignored
+        """
+        max_bins = self._n_bins.max(initial=0)
+        codes = self.codes(data)
+        valid = codes >= 0
+        # Offsetting the bin index of each feature gives all the histograms from a single bincount
+        flat = (codes + np.arange(len(self._features)) * max_bins)[valid]
+        counts = np.bincount(flat, minlength=len(self._features) * max_bins).reshape(len(self._features), max_bins)
+        return counts.astype(float)
+
+
+def _smoothed_probabilities(counts: np.ndarray, smoothing: float, mask: np.ndarray) -> np.ndarray:
+    counts = np.atleast_2d(counts) + smoothing * mask
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return counts / counts.sum(axis=1, keepdims=True)
+
+
+def _relative_entropy(p: np.ndarray, q: np.ndarray) -> np.ndarray:
+    with np.errstate(divide="ignore", invalid="ignore"):
+        terms = np.where(p > 0, p * np.log(p / q), 0.0)
+    return terms.sum(axis=1)
+
+
+def kl_from_counts(
+    new_counts: np.ndarray, reference_counts: np.ndarray, smoothing: float = constant.HISTOGRAM_SMOOTHING, mask=None
+) -> np.ndarray:
+    """Kullback-Leibler divergence D(new || reference) of histograms on identical bins, one per row
+
+    Parameters
+    ----------
+    new_counts : np.ndarray
+        (n_features, n_bins) counts of the new population
+    reference_counts : np.ndarray
+        (n_features, n_bins) counts of the reference population
+    smoothing : float, optional
+        Pseudo-count added to every bin. Empty reference bins give an infinite divergence if 0
+    mask : np.ndarray, optional
+        (n_features, n_bins) mask of the bins of every feature (all the bins if None)
+
+    Returns
+    -------
+    np.ndarray
+        the divergence of every row
+    """
+    mask = np.ones_like(np.atleast_2d(new_counts), dtype=bool) if mask is None else mask
+    return _relative_entropy(
+        _smoothed_probabilities(new_counts, smoothing, mask), _smoothed_probabilities(reference_counts, smoothing, mask)
+    )
+
+
+def js_from_counts(
+    new_counts: np.ndarray, reference_counts: np.ndarray, smoothing: float = constant.HISTOGRAM_SMOOTHING, mask=None
+) -> np.ndarray:
+    """Jensen-Shannon divergence (natural logarithm) of histograms on identical bins, one per row
+
+    Parameters
+    ----------
+    new_counts : np.ndarray
+        (n_features, n_bins) counts of the new population
+    reference_counts : np.ndarray
+        (n_features, n_bins) counts of the reference population
+    smoothing : float, optional
+        Pseudo-count added to every bin
+    mask : np.ndarray, optional
+        (n_features, n_bins) mask of the bins of every feature (all the bins if None)
+
+    Returns
+    -------
+    np.ndarray
+        the divergence of every row
+    """
+    mask = np.ones_like(np.atleast_2d(new_counts), dtype=bool) if mask is None else mask
+    p = _smoothed_probabilities(new_counts, smoothing, mask)
+    q = _smoothed_probabilities(reference_counts, smoothing, mask)
+    m = (p + q) / 2
+    return (_relative_entropy(p, m) + _relative_entropy(q, m)) / 2
+
+
+def psi_from_binned(
+    new_counts: np.ndarray, reference_counts: np.ndarray, smoothing: float = constant.HISTOGRAM_SMOOTHING, mask=None
+) -> np.ndarray:
+    """Population Stability Index of histograms on identical bins, one per row
+
+    Parameters
+    ----------
+    new_counts : np.ndarray
+        (n_features, n_bins) counts of the new population
+    reference_counts : np.ndarray
+        (n_features, n_bins) counts of the reference population
+    smoothing : float, optional
+        Pseudo-count added to every bin. Bins empty in one population only give an infinite index if 0
+    mask : np.ndarray, optional
+        (n_features, n_bins) mask of the bins of every feature (all the bins if None)
+
+    Returns
+    -------
+    np.ndarray
+        the index of every row
+    """
+    mask = np.ones_like(np.atleast_2d(new_counts), dtype=bool) if mask is None else mask
+    p = _smoothed_probabilities(new_counts, smoothing, mask)
+    q = _smoothed_probabilities(reference_counts, smoothing, mask)
+    return _relative_entropy(p, q) + _relative_entropy(q, p)
+
+
+def _divergence(divergence, new: pd.Series, reference: pd.Series, bins, smoothing) -> float:
+    new, reference = pd.Series(new).rename("feature"), pd.Series(reference).rename("feature")
+    binning = FrozenBinning(reference.to_frame(), ["feature"], bins=bins)
+    return float(divergence(binning.counts(new.to_frame()), binning.counts(reference.to_frame()), smoothing, binning.mask)[0])
+
+
+def kl_divergence(new: pd.Series, reference: pd.Series, bins="sturges", smoothing: float = constant.HISTOGRAM_SMOOTHING) -> float:
+    """Calculate the Kullback-Leibler divergence D(new || reference) on bins frozen on the reference
+
+    Parameters
+    ----------
+    new : pd.Series
+        The input pandas Series of the new population
+    reference : pd.Series
+        The input pandas Series of the reference population
+    bins : int, str, optional
+        Number of bins or binning rule of numpy.histogram_bin_edges for numeric features
+    smoothing : float, optional
+        Pseudo-count added to every bin
+
+    Returns
+    -------
+    float
+        returns the Kullback-Leibler divergence of the two pandas series (new,reference)
+    """
+    return _divergence(kl_from_counts, new, reference, bins, smoothing)
+
+
+def js_divergence(new: pd.Series, reference: pd.Series, bins="sturges", smoothing: float = constant.HISTOGRAM_SMOOTHING) -> float:
+    """Calculate the Jensen-Shannon divergence on bins frozen on the reference
+
+    Parameters
+    ----------
+    new : pd.Series
+        The input pandas Series of the new population
+    reference : pd.Series
+        The input pandas Series of the reference population
+    bins : int, str, optional
+        Number of bins or binning rule of numpy.histogram_bin_edges for numeric features
+    smoothing : float, optional
+        Pseudo-count added to every bin
+
+    Returns
+    -------
+    float
+        returns the Jensen-Shannon divergence of the two pandas series (new,reference)
+    """
+    return _divergence(js_from_counts, new, reference, bins, smoothing)
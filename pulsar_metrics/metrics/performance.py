@@ -1,5 +1,5 @@
 #  Author:   Adel Benlagra  <abenlagra@rocketscience.one>
-from typing import Union
+from typing import Callable, Union
 
 import constant
 import numpy as np
@@ -7,8 +7,11 @@ import pandas as pd
 
 from ..exceptions import CustomExceptionPulsarMetric as error_msg
 from ..utils import compare_to_threshold
+from .accumulators import _ACCUMULATORS, AbstractAccumulator, get_accumulator
+from .backends import select_implementation
 from .base import AbstractMetrics, MetricResults, MetricsType
 from .enums import PerformanceMetricsFuncs
+from .ranking import MAX_BATCH_CELLS, RANKING_METRICS, ProbabilisticKernel
 
 
 class PerformanceMetric(AbstractMetrics):
@@ -56,6 +59,9 @@ class PerformanceMetric(AbstractMetrics):
         seed: int = constant.SEED_SIZE,
         threshold: Union[float, int, list] = None,
         upper_bound: bool = True,
+        kernel: ProbabilisticKernel = None,
+        max_batch_cells: int = MAX_BATCH_CELLS,
+        backend: str = "auto",
         **kwargs,
     ) -> MetricResults:
         """Method evaluate() to evaluate the metrics performance
@@ -76,6 +82,12 @@ class PerformanceMetric(AbstractMetrics):
             seed value for random number generator
         threshold : Union[list, float, int]
             Threshold values to validate the input value
+        kernel : ProbabilisticKernel, optional
+            A sort-once kernel shared between the auc, aucpr, log_loss and brier metrics of the same columns
+        max_batch_cells : int, optional
+            Upper bound on the number of cells of the bootstrap weight matrices of the kernel held in memory at once
+        backend : str, optional
+            Implementation of the metric function (see pulsar_metrics.metrics.backends), selected by input size if "auto"
         kwargs :
             keyworded variable length of arguments to a function
 
@@ -85,12 +97,31 @@ class PerformanceMetric(AbstractMetrics):
              returns the result of the calculated metric
         """
 
+        self._result = None
         try:
+            valid = (current[self._y_name].notna() & current[self._pred_name].notna()).to_numpy()
+            if not valid.all():
+                # The sklearn scorers fail on missing labels or predictions: only their two columns are copied
+                current = current.loc[valid, [self._y_name, self._pred_name]]
+                kernel = None
             self._n_sample = current.shape[0]
-            value = PerformanceMetricsFuncs[self._name].value(current[self._y_name], current[self._pred_name], **kwargs)
             conf_int = None
-            if bootstrap:
-                conf_int = self._bootstrap(current=current, n_bootstrap=n_bootstrap, alpha=alpha, seed=seed, **kwargs)
+            # The sort-once kernel covers the default binary setting, other options go through sklearn
+            if (self._name in RANKING_METRICS) and not kwargs:
+                if kernel is None:
+                    kernel = ProbabilisticKernel(current[self._y_name], current[self._pred_name])
+                value = kernel.evaluate()[self._name]
+                if bootstrap:
+                    conf_int = kernel.conf_int(
+                        self._name, n_bootstrap=n_bootstrap, seed=seed, alpha=alpha, max_batch_cells=max_batch_cells
+                    )
+            else:
+                func = select_implementation(self._name, self._n_sample, kwargs, backend=backend)
+                value = func(current[self._y_name], current[self._pred_name], **kwargs)
+                if bootstrap:
+                    conf_int = self._bootstrap(
+                        current=current, n_bootstrap=n_bootstrap, alpha=alpha, seed=seed, func=func, **kwargs
+                    )
 
             status = compare_to_threshold(value, threshold, upper_bound)
 
@@ -115,6 +146,7 @@ class PerformanceMetric(AbstractMetrics):
         n_bootstrap: int = constant.BOOTSTRAP_SIZE,
         seed: int = constant.SEED_SIZE,
         alpha: float = constant.SIGNIFICANCE_LEVEL,
+        func: Callable = None,
         **kwargs,
     ):
         """Method to bootstrap the metrics for confidence interval evaluation
@@ -129,17 +161,130 @@ class PerformanceMetric(AbstractMetrics):
             seed value for random number generator
         alpha : float
             value to define significance level
+        func : Callable, optional
+            Implementation of the metric function (the reference function if None)
         kwargs :
             keyworded variable length of arguments to a function
         """
 
+        func = PerformanceMetricsFuncs[self._name].value if func is None else func
         values = []
         rng = np.random.default_rng(seed)
+        # Resampling the two columns as arrays avoids materializing copies of the whole frame
+        y_true, y_pred = current[self._y_name].to_numpy(), current[self._pred_name].to_numpy()
         for i in range(n_bootstrap):
             indices = rng.integers(low=0, high=self._n_sample, size=self._n_sample)
-            values.append(
-                PerformanceMetricsFuncs[self._name].value(
-                    current.iloc[indices][self._y_name], current.iloc[indices][self._pred_name], **kwargs
-                )
-            )
+            values.append(func(y_true[indices], y_pred[indices], **kwargs))
         return [np.quantile(values, alpha / 2), np.quantile(values, 1 - alpha / 2)]
+
+    def accumulate(
+        self,
+        current: pd.DataFrame,
+        accumulator: AbstractAccumulator = None,
+        n_bootstrap: int = 0,
+        seed: int = constant.SEED_SIZE,
+        sample_weight=None,
+        partition: int = 0,
+        **kwargs,
+    ) -> AbstractAccumulator:
+        """Method accumulate() to update the sufficient statistics of the metric with a chunk of data
+
+        Parameters
+        ----------
+        current : DataFrame
+            The input chunk (pandas DataFrame)
+        accumulator : AbstractAccumulator, optional
+            The accumulator to update. A new one is created if None
+        n_bootstrap : int
+            Number of Poisson bootstrap replicates of a newly created accumulator
+        seed : int
+            seed value for random number generator of a newly created accumulator
+        sample_weight : array-like, optional
+            Weights of the rows of the chunk
+        partition : int, optional
+            Index of the chunk of a newly created accumulator. Accumulators merged later on share their seed and
+            have distinct partitions, so that their bootstrap weights are independent
+        kwargs :
+            keyworded variable length of arguments to a function
+
+        Returns
+        -------
+        AbstractAccumulator
+             returns the updated accumulator
+        """
+        if accumulator is None:
+            accumulator = get_accumulator(self._name, n_bootstrap=n_bootstrap, seed=seed, partition=partition, **kwargs)
+        return accumulator.update(current[self._y_name], current[self._pred_name], sample_weight=sample_weight)
+
+    def has_partial_state(self, current: pd.DataFrame = None) -> bool:
+        """Whether the metric has an accumulator"""
+        return self._name in _ACCUMULATORS
+
+    def compute_partial(self, current: pd.DataFrame, reference: pd.DataFrame = None, **kwargs) -> AbstractAccumulator:
+        """Method compute_partial() to compute the partial state (accumulator) of the metric on a partition
+
+        Parameters
+        ----------
+        current : DataFrame
+            The partition of the current data (pandas DataFrame)
+        reference : DataFrame, optional
+            Unused, kept for the common protocol of the metrics
+        kwargs :
+            keyworded variable length of arguments to a function (bootstrap, n_bootstrap, seed, partition, pos_label)
+
+        Returns
+        -------
+        AbstractAccumulator
+             returns the partial state of the metric
+        """
+        n_bootstrap = kwargs.get("n_bootstrap", constant.BOOTSTRAP_SIZE) if kwargs.get("bootstrap", False) else 0
+        seed = kwargs.get("seed", constant.SEED_SIZE)
+        pos_label = kwargs.get("pos_label", 1)
+        return self.accumulate(
+            current, n_bootstrap=n_bootstrap, seed=seed, partition=kwargs.get("partition", 0), pos_label=pos_label
+        )
+
+    def finalize(
+        self,
+        accumulator: AbstractAccumulator,
+        alpha: float = constant.SIGNIFICANCE_LEVEL,
+        threshold: Union[float, int, list] = None,
+        upper_bound: bool = True,
+        **kwargs,
+    ) -> MetricResults:
+        """Method finalize() to compute the metric from accumulated sufficient statistics
+
+        Parameters
+        ----------
+        accumulator : AbstractAccumulator
+            The accumulator holding the (possibly merged) state of the metric
+        alpha : float
+            Value to define significance level
+        threshold : Union[list, float, int]
+            Threshold values to validate the input value
+        upper_bound : bool, optional
+            A flag used to set the upper_bound param
+        kwargs :
+            keyworded variable length of arguments to a function (e.g. average, pos_label)
+
+        Returns
+        -------
+        MetricResults
+             returns the result of the calculated metric
+        """
+        value, conf_int = accumulator.finalize(self._name, alpha=alpha, **kwargs)
+        self._n_sample = accumulator.n_sample
+
+        status = compare_to_threshold(value, threshold, upper_bound)
+
+        self._result = MetricResults(
+            metric_name=self._name,
+            metric_type=MetricsType.performance.value,
+            metric_value=value,
+            feature_name="prediction",
+            conf_int=conf_int,
+            drift_status=status,
+            threshold=threshold,
+        )
+
+        return self._result
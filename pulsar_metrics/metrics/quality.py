@@ -0,0 +1,112 @@
+#  Author:   Adel Benlagra  <abenlagra@rocketscience.one>
+from typing import Union
+
+import constant
+import pandas as pd
+
+from ..exceptions import CustomExceptionPulsarMetric as error_msg
+from ..utils import compare_to_threshold
+from .base import AbstractMetrics, MetricResults, MetricsType
+from .enums import DataQualityMetricsFuncs
+
+# Checks of the rows of a dataset, the other checks being checks of a feature
+DATASET_CHECKS = ("duplicate_rows",)
+
+
+class DataQualityMetric(AbstractMetrics):
+    """Data quality check of a feature (or of the rows of a dataset) of the current data
+
+    The checks are rates: null_rate (missing values), out_of_range_rate (values outside the range of the reference,
+    numeric features), unseen_category_rate (values absent from the reference, categorical features), constant_column
+    (1.0 if the feature has at most one distinct value) and duplicate_rows (rows duplicating a previous row on the
+    given columns). The status of a check is True when its value is above the threshold (0 by default, any issue).
+    Checks not applicable to the kind of a feature have no result.
+    """
+
+    def __init__(self, metric_name: str, feature_name: str = None, columns: list = None, **kwargs):
+        """Constructor of the DataQualityMetric class
+
+        Parameters
+        ----------
+        metric_name : str
+            The input value for metric_name
+        feature_name : str, optional
+            The input value for feature_name (None for the checks of the rows of a dataset)
+        columns : list, optional
+            Columns the rows are compared on by the checks of the rows of a dataset (all the columns if None)
+        kwargs :
+            keyworded variable length of arguments to a function
+        """
+        # Call the constructor of the parent class
+        super().__init__(metric_name)
+
+        self._check_metrics_name(metric_name)
+        self._feature_name = None if metric_name in DATASET_CHECKS else feature_name
+        self._columns = None if columns is None else list(columns)
+
+    def _check_metrics_name(self, name: str):
+        if name not in DataQualityMetricsFuncs._member_names_:
+            raise error_msg(
+                value=None,
+                message=f'{"unknown data quality metric key {name} given"}',
+            )
+
+    def evaluate(
+        self,
+        current: pd.DataFrame,
+        reference: pd.DataFrame = None,
+        threshold: Union[list, float, int] = constant.QUALITY_THRESHOLD,
+        upper_bound: bool = False,
+        **kwargs,
+    ) -> MetricResults:
+        """Method evaluate() to evaluate the data quality check
+
+        Parameters
+        ----------
+        current : DataFrame
+            The input current (pandas DataFrame)
+        reference : DataFrame, optional
+            The input reference (pandas DataFrame), giving the range and categories of the features
+        threshold : Union[list, float, int], optional
+            Threshold values to validate the input value
+        upper_bound : bool, optional
+            A flag used to set the upper_bound param (the status is True above the threshold if False)
+        kwargs :
+            keyworded variable length of arguments to a function
+
+        Returns
+        -------
+        MetricResults
+             returns the result of the check (None for a check not applicable to the feature)
+        """
+        self._result = None
+        try:
+            func = DataQualityMetricsFuncs[self._name].value
+            if self._feature_name is None:
+                columns = list(current.columns) if self._columns is None else self._columns
+                value = func(current[columns])
+            else:
+                ref_column = reference[self._feature_name] if reference is not None else None
+                value = func(current[self._feature_name], ref_column)
+            if value is None:
+                return None
+            return self._make_result(value, threshold, upper_bound)
+
+        except Exception as e:
+            print(f"Exception in evaluate() in the DataQualityMetric class (quality): {str(e)}")
+
+    def _make_result(
+        self, value: float, threshold: Union[list, float, int] = constant.QUALITY_THRESHOLD, upper_bound: bool = False
+    ) -> MetricResults:
+        status = compare_to_threshold(value, threshold, upper_bound)
+
+        self._result = MetricResults(
+            metric_name=self._name,
+            metric_type=MetricsType.quality.value,
+            feature_name=self._feature_name,
+            metric_value=value,
+            drift_status=status,
+            threshold=threshold,
+        )
+
+        return self._result
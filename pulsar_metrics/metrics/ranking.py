@@ -0,0 +1,150 @@
+#  Author:   Adel Benlagra  <abenlagra@rocketscience.one>
+import constant
+import numpy as np
+
+from ..exceptions import CustomExceptionPulsarMetric as error_msg
+
+RANKING_METRICS = ("auc", "aucpr", "log_loss", "brier")
+
+# Upper bound on the number of cells of a (replicates x rows) weight matrix held in memory at once
+MAX_BATCH_CELLS = 10_000_000
+
+
+class ProbabilisticKernel:
+    """Sort-once kernel computing auc, aucpr, log_loss and brier of a binary probabilistic classifier
+
+    The scores are sorted once at construction. The ROC and PR curves are then obtained from a single
+    cumulative pass over the sorted scores, the log-loss and Brier terms are aggregated in the same pass,
+    and bootstrap replicates reuse the sorted order through weighted counts instead of re-sorting
+    resampled data.
+    """
+
+    def __init__(self, y_true, y_score, pos_label=None):
+        """Constructor of the ProbabilisticKernel class
+
+        Parameters
+        ----------
+        y_true : array-like
+            The binary ground truth
+        y_score : array-like
+            The predicted probabilities of the positive class
+        pos_label : int, str, optional
+            The positive label. Defaults to 1 for {0, 1} or {-1, 1} targets, to the greater label otherwise
+        """
+        y_true, y_score = np.asarray(y_true), np.asarray(y_score)
+        if not np.issubdtype(y_score.dtype, np.floating):
+            y_score = y_score.astype(float)
+        labels = np.unique(y_true)
+        if len(labels) > 2:
+            raise error_msg(
+                value=None,
+                message=f'{"ProbabilisticKernel only supports binary targets"}',
+            )
+        if pos_label is None:
+            pos_label = 1 if set(labels.tolist()) <= {0, 1, -1} else labels.max()
+
+        self._n_sample = len(y_true)
+        # Stable sort by decreasing score, as in sklearn
+        self._order = np.argsort(y_score, kind="mergesort")[::-1]
+        self._y = (y_true[self._order] == pos_label).astype(float)
+        score = y_score[self._order]
+        self._threshold_idxs = np.r_[np.where(np.diff(score))[0], self._n_sample - 1]
+
+        eps = np.finfo(score.dtype).eps
+        clipped = np.clip(score, eps, 1 - eps)
+        self._log_loss_terms = -(self._y * np.log(clipped) + (1 - self._y) * np.log(1 - clipped))
+        self._brier_terms = (self._y - score) ** 2
+        self._bootstrap_cache = {}
+
+    @property
+    def n_sample(self) -> int:
+        return self._n_sample
+
+    def evaluate(self, weights: np.ndarray = None) -> dict:
+        """Compute the four metrics for one or several sets of row weights
+
+        Parameters
+        ----------
+        weights : np.ndarray, optional
+            (n_replicates, n_sample) row weights in the sorted order. Unit weights if None
+
+        Returns
+        -------
+        dict
+            metric name -> array of n_replicates values (a float if weights is None)
+        """
+        squeeze = weights is None
+        weights = np.ones((1, self._n_sample)) if weights is None else np.atleast_2d(weights)
+
+        tps = np.cumsum(weights * self._y, axis=1)[:, self._threshold_idxs]
+        fps = np.cumsum(weights * (1 - self._y), axis=1)[:, self._threshold_idxs]
+        total_weight = weights.sum(axis=1)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            tpr = np.hstack([np.zeros((len(tps), 1)), tps]) / tps[:, [-1]]
+            fpr = np.hstack([np.zeros((len(fps), 1)), fps]) / fps[:, [-1]]
+            recall = tps / tps[:, [-1]]
+            predicted = tps + fps
+            precision = np.divide(tps, predicted, out=np.zeros_like(tps), where=predicted > 0)
+            results = {
+                "auc": (np.diff(fpr, axis=1) * (tpr[:, 1:] + tpr[:, :-1]) / 2).sum(axis=1),
+                "aucpr": (np.diff(recall, axis=1, prepend=0) * precision).sum(axis=1),
+                "log_loss": weights @ self._log_loss_terms / total_weight,
+                "brier": weights @ self._brier_terms / total_weight,
+            }
+
+        if squeeze:
+            return {name: float(values[0]) for name, values in results.items()}
+        return results
+
+    def bootstrap(
+        self, n_bootstrap: int = constant.BOOTSTRAP_SIZE, seed: int = constant.SEED_SIZE, max_batch_cells: int = MAX_BATCH_CELLS
+    ) -> dict:
+        """Compute bootstrap replicates of the four metrics from weighted counts on the sorted scores
+
+        The resampled indices are drawn as in PerformanceMetric._bootstrap, so the replicates are identical
+        to the ones obtained by re-evaluating sklearn on resampled data. Replicates are cached by
+        (n_bootstrap, seed) so that several metrics share them.
+
+        Parameters
+        ----------
+        n_bootstrap : int
+            Number of bootstrapping samples
+        seed : int
+            seed value for random number generator
+        max_batch_cells : int, optional
+            Upper bound on the number of cells of the (replicates x rows) weight matrices held in memory at once
+
+        Returns
+        -------
+        dict
+            metric name -> array of n_bootstrap values
+        """
+        key = (n_bootstrap, seed)
+        if key not in self._bootstrap_cache:
+            rng = np.random.default_rng(seed)
+            batch_size = max(1, max_batch_cells // max(self._n_sample, 1))
+            batches = []
+            for start in range(0, n_bootstrap, batch_size):
+                n_batch = min(batch_size, n_bootstrap - start)
+                counts = np.vstack(
+                    [
+                        np.bincount(rng.integers(low=0, high=self._n_sample, size=self._n_sample), minlength=self._n_sample)
+                        for _ in range(n_batch)
+                    ]
+                )
+                batches.append(self.evaluate(weights=counts[:, self._order]))
+            self._bootstrap_cache[key] = {name: np.concatenate([batch[name] for batch in batches]) for name in RANKING_METRICS}
+        return self._bootstrap_cache[key]
+
+    def conf_int(
+        self,
+        metric_name: str,
+        n_bootstrap: int = constant.BOOTSTRAP_SIZE,
+        seed: int = constant.SEED_SIZE,
+        alpha: float = constant.SIGNIFICANCE_LEVEL,
+        max_batch_cells: int = MAX_BATCH_CELLS,
+    ) -> list:
+        """Bootstrap confidence interval of one of the four metrics"""
+        values = self.bootstrap(n_bootstrap=n_bootstrap, seed=seed, max_batch_cells=max_batch_cells)[metric_name]
+        return [np.nanquantile(values, alpha / 2), np.nanquantile(values, 1 - alpha / 2)]
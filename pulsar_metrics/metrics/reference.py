@@ -0,0 +1,173 @@
+#  Author:   Adel Benlagra  <abenlagra@rocketscience.one>
+from functools import reduce
+
+import constant
+import pandas as pd
+from pandas.api.types import is_numeric_dtype
+
+from ..exceptions import CustomExceptionPulsarMetric as error_msg
+from .states import (
+    _CATEGORICAL_METRICS,
+    _STATES_REQUIREMENTS,
+    CountsState,
+    DriftState,
+    MomentsState,
+    QuantileSketch,
+    SerializableState,
+    _merge_sides,
+)
+
+
+class DecayedReference(SerializableState):
+    """Reference maintained incrementally from windows of data
+
+    Every feature keeps mergeable states instead of raw rows: the moments and a quantile sketch (weighted
+    centroids, the histogram of the feature at the resolution of the sketch) of the numeric features, the counts
+    of the categories of the others. Each window updates the states in O(window) time:
+
+    - with exponential decay, the weights of the previous windows are multiplied by decay (0.5 ** (1 / half_life)
+      for a half-life given in windows) before the new window is merged,
+    - with a fixed horizon, the states of the last horizon windows are kept and merged when the reference is read.
+
+    Drift metrics with a partial state (see pulsar_metrics.metrics.states) read the reference directly, the
+    decayed weights being used as effective sample sizes by the statistical tests.
+    """
+
+    def __init__(
+        self,
+        decay: float = None,
+        half_life: float = None,
+        horizon: int = None,
+        sketch_size: int = constant.SKETCH_SIZE,
+    ):
+        """Constructor of the DecayedReference class
+
+        Parameters
+        ----------
+        decay : float, optional
+            Factor in (0, 1] applied to the weights of the reference at every window
+        half_life : float, optional
+            Number of windows after which the weight of a window is halved (instead of decay)
+        horizon : int, optional
+            Number of windows of the reference, with equal weights (instead of decay)
+        sketch_size : int, optional
+            Maximum number of centroids of the quantile sketches
+        """
+        if sum(option is not None for option in (decay, half_life, horizon)) != 1:
+            raise error_msg(
+                value=(decay, half_life, horizon),
+                message=f'{"InvalidInput: exactly one of decay, half_life and horizon should be given"}',
+            )
+        if half_life is not None:
+            decay = 0.5 ** (1 / half_life)
+        if (decay is not None) and not (0 < decay <= 1):
+            raise error_msg(value=decay, message=f'{"InvalidInput: decay should be in (0, 1]"}')
+        if (horizon is not None) and horizon < 1:
+            raise error_msg(value=horizon, message=f'{"InvalidInput: horizon should be a positive number of windows"}')
+
+        self.decay = decay
+        self.horizon = horizon
+        self.sketch_size = sketch_size
+        self.n_windows = 0
+        # Decayed states by feature, or the states of the last windows with a fixed horizon
+        self.states = {}
+        self.windows = []
+
+    def _window_states(self, window: pd.DataFrame, features: list) -> dict:
+        states = {}
+        for feature in features:
+            values = window[feature].dropna()
+            if is_numeric_dtype(window[feature]):
+                states[feature] = {"moments": MomentsState(values), "sketch": QuantileSketch(values, max_size=self.sketch_size)}
+            else:
+                states[feature] = {"counts": CountsState(values.astype(str))}
+        return states
+
+    def update(self, window: pd.DataFrame, features: list = None) -> "DecayedReference":
+        """Add a window of data to the reference
+
+        Parameters
+        ----------
+        window : DataFrame
+            The window of data (pandas DataFrame)
+        features : list, optional
+            Features of the reference (all the columns if None)
+
+        Returns
+        -------
+        DecayedReference
+            the updated reference
+        """
+        features = list(window.columns) if features is None else features
+        states = self._window_states(window, features)
+        if self.horizon is not None:
+            self.windows.append(states)
+            del self.windows[: -self.horizon]
+        else:
+            for sides in self.states.values():
+                for state in sides.values():
+                    state.scale(self.decay)
+            self.states = {
+                feature: _merge_sides(self.states.get(feature, {}), states.get(feature, {}))
+                for feature in {**self.states, **states}
+            }
+        self.n_windows += 1
+        return self
+
+    def __len__(self) -> int:
+        """Number of windows held by the reference (with a fixed horizon) or merged into it (with decay)"""
+        return len(self.windows) if self.horizon is not None else self.n_windows
+
+    @property
+    def features(self) -> list:
+        if self.horizon is not None:
+            return list(dict.fromkeys(feature for states in self.windows for feature in states))
+        return list(self.states)
+
+    def side_state(self, feature: str) -> dict:
+        """States of a feature in the reference (merged over the windows of the horizon)"""
+        if feature not in self.features:
+            raise error_msg(value=feature, message=f'{"The feature is not in the decayed reference."}')
+        if self.horizon is not None:
+            return reduce(_merge_sides, [states[feature] for states in self.windows if feature in states])
+        return self.states[feature]
+
+    def size(self, feature: str) -> float:
+        """Effective number of reference rows of a feature (sum of the decayed weights)"""
+        side = self.side_state(feature)
+        return side["counts"].counts.sum() if "counts" in side else side["moments"].n
+
+    def drift_state(self, metric_name: str, current: pd.Series) -> DriftState:
+        """State of a drift metric comparing a current sample to the reference
+
+        Parameters
+        ----------
+        metric_name : str
+            Name of the drift metric
+        current : pd.Series
+            The current sample of the feature
+
+        Returns
+        -------
+        DriftState
+            the state of the metric, to be finalized
+        """
+        if metric_name not in _STATES_REQUIREMENTS:
+            raise error_msg(
+                value=metric_name,
+                message=f"The drift metric {metric_name} cannot be computed from a decayed reference",
+            )
+        reference = self.side_state(current.name)
+        requirements = _STATES_REQUIREMENTS[metric_name]
+        if ("counts" in reference) and (metric_name in _CATEGORICAL_METRICS):
+            requirements = ["counts"]
+        sides = self._window_states(current.to_frame(), [current.name])[current.name]
+        if any((name not in reference) or (name not in sides) for name in requirements):
+            raise error_msg(
+                value=metric_name,
+                message=f"The drift metric {metric_name} cannot be computed on the feature {current.name}",
+            )
+        return DriftState(
+            current={name: sides[name] for name in requirements},
+            reference={name: reference[name] for name in requirements},
+        )
@@ -0,0 +1,250 @@
+#  Author:   Adel Benlagra  <abenlagra@rocketscience.one>
+from time import perf_counter
+from typing import Callable
+
+import constant
+import numpy as np
+import pandas as pd
+
+from ..exceptions import CustomExceptionPulsarMetric as error_msg
+
+SAMPLING_METHODS = ("reservoir", "time", "segment")
+
+# Growth exponent of the cost of a metric with the sample size, used to turn a time budget into a sample size
+_COST_EXPONENTS = {"mmd": 2.0}
+
+
+def _n_rows(data, mask: np.ndarray = None) -> int:
+    """Number of (valid) rows of a dataset"""
+    return len(data) if mask is None else int(mask.sum())
+
+
+class Sampler:
+    """Reproducible row sampler for drift metrics on large windows
+
+    Every row receives a uniform random key drawn from the seed, and a sample of size k keeps the k smallest
+    keys (the reservoir of a priority sampling). Stratified samplers keep the smallest keys of each stratum
+    (time buckets or segments) with an allocation proportional to the size of the stratum. Samples of
+    different sizes are therefore nested, and the keys of the last dataset of each stream (current and reference)
+    are drawn once and cached so that all the metrics of an analyzer run share them.
+    """
+
+    def __init__(
+        self,
+        method: str = "reservoir",
+        size: int = constant.SAMPLE_SIZE,
+        time_budget: float = None,
+        time_column: str = "pred_timestamp",
+        segment_column: str = None,
+        n_strata: int = constant.TIME_STRATA,
+        n_bootstrap: int = constant.SAMPLING_BOOTSTRAP_SIZE,
+        seed: int = constant.SEED_SIZE,
+    ):
+        """Constructor of the Sampler class
+
+        Parameters
+        ----------
+        method : str, optional
+            One of "reservoir", "time" (stratified by time buckets) or "segment" (stratified by segment)
+        size : int, optional
+            Target sample size of each dataset. No limit if None
+        time_budget : float, optional
+            Time budget in seconds of the evaluation of one metric, including the confidence interval
+        time_column : str, optional
+            Timestamp column of the stratification by time
+        segment_column : str, optional
+            Segment column of the stratification by segment
+        n_strata : int, optional
+            Number of equal-width time buckets of the stratification by time
+        n_bootstrap : int, optional
+            Number of bootstrap replicates of the sample used for the confidence interval
+        seed : int, optional
+            seed value for random number generator
+        """
+        if method not in SAMPLING_METHODS:
+            raise error_msg(
+                value=method,
+                message=f"InvalidInput: sampling method should be one of {SAMPLING_METHODS}",
+            )
+        if (method == "segment") and (segment_column is None):
+            raise error_msg(
+                value=None,
+                message=f'{"InvalidInput: a segment_column is required for the stratification by segment"}',
+            )
+        self._method = method
+        self._size = size
+        self._time_budget = time_budget
+        self._time_column = time_column
+        self._segment_column = segment_column
+        self._n_strata = n_strata
+        self._n_bootstrap = n_bootstrap
+        self._seed = seed
+        self._cache = {}
+
+    def _strata(self, data: pd.DataFrame) -> np.ndarray:
+        """Stratum code of every row"""
+        if self._method == "reservoir":
+            return np.zeros(len(data), dtype=np.int64)
+
+        column = self._time_column if self._method == "time" else self._segment_column
+        if not isinstance(data, pd.DataFrame) or (column not in data.columns):
+            raise error_msg(
+                value=column,
+                message=f'{"InvalidInput: the stratification column is missing from the data"}',
+            )
+        if self._method == "segment":
+            codes, _ = pd.factorize(data[column])
+            return np.where(codes < 0, codes.max() + 1, codes)
+
+        timestamps = data[column]
+        if not pd.api.types.is_numeric_dtype(timestamps):
+            timestamps = pd.to_datetime(timestamps).astype("int64")
+        timestamps = timestamps.to_numpy()
+        edges = np.linspace(timestamps.min(), timestamps.max(), self._n_strata + 1)
+        return np.clip(np.searchsorted(edges, timestamps, side="right") - 1, 0, self._n_strata - 1)
+
+    def _keys(self, data, stream: int) -> tuple:
+        """Rows ordered by (stratum, random key), with the stratum of every ordered row. Cached per stream"""
+        # Only the last dataset of each stream is kept, so that the datasets of previous runs are released
+        if (stream not in self._cache) or (self._cache[stream][0] is not data):
+            keys = np.random.default_rng(self._seed + stream).random(len(data))
+            strata = self._strata(data)
+            order = np.lexsort((keys, strata))
+            self._cache[stream] = (data, order, strata[order])
+        return self._cache[stream][1:]
+
+    def sample_index(self, data, size: int, stream: int = 0, mask: np.ndarray = None) -> np.ndarray:
+        """Positions (in increasing order) of the rows of a sample of the dataset
+
+        Parameters
+        ----------
+        data : DataFrame, Series
+            The dataset to sample
+        size : int
+            Target sample size
+        stream : int, optional
+            Random stream of the dataset (0 for the current data, 1 for the reference)
+        mask : np.ndarray, optional
+            Validity mask of the rows: only the valid rows are sampled, with the keys of the dataset
+
+        Returns
+        -------
+        np.ndarray
+            positions of the sampled rows
+        """
+        n_rows = _n_rows(data, mask)
+        if (size is None) or (size >= n_rows):
+            return np.arange(n_rows) if mask is None else np.flatnonzero(mask)
+
+        order, strata = self._keys(data, stream)
+        if mask is not None:
+            # The valid rows keep their order by (stratum, random key)
+            valid = mask[order]
+            order, strata = order[valid], strata[valid]
+        counts = np.bincount(strata)
+        # Proportional allocation rounded with the largest remainders
+        quotas = counts * size / n_rows
+        allocation = np.floor(quotas).astype(np.int64)
+        remainders = np.argsort(allocation - quotas, kind="stable")[: size - allocation.sum()]
+        allocation[remainders] += 1
+
+        starts = np.r_[0, np.cumsum(counts)[:-1]]
+        rank = np.arange(n_rows) - starts[strata]
+        return np.sort(order[rank < allocation[strata]])
+
+    def sample(self, data, size: int = None, stream: int = 0, mask: np.ndarray = None):
+        """Sample of the (valid rows of the) dataset, with the target size of the sampler if size is None"""
+        return data.iloc[self.sample_index(data, self._size if size is None else size, stream, mask)]
+
+    def target_size(self, metric_name: str, func: Callable, current, reference, masks: tuple = (None, None), **kwargs) -> int:
+        """Sample size meeting both the target size and the time budget of the sampler
+
+        The time budget is converted into a sample size by timing the metric on a pilot sample and
+        extrapolating its cost with the growth exponent of the metric.
+        """
+        size = self._size
+        if self._time_budget is not None:
+            pilot = min(constant.SAMPLING_PILOT_SIZE, _n_rows(current, masks[0]), _n_rows(reference, masks[1]))
+            start = perf_counter()
+            func(self.sample(current, pilot, 0, masks[0]), self.sample(reference, pilot, 1, masks[1]), **kwargs)
+            elapsed = max(perf_counter() - start, 1e-6) * (1 + self._n_bootstrap)
+            budget_size = int(pilot * (self._time_budget / elapsed) ** (1 / _COST_EXPONENTS.get(metric_name, 1.0)))
+            size = max(pilot, budget_size) if size is None else min(size, max(pilot, budget_size))
+        return size
+
+    def evaluate(
+        self,
+        metric_name: str,
+        func: Callable,
+        current,
+        reference,
+        feature_name: str = None,
+        statistic: Callable = float,
+        alpha: float = constant.SIGNIFICANCE_LEVEL,
+        skip_missing: bool = False,
+        **kwargs,
+    ) -> tuple:
+        """Evaluate a drift metric function on samples of the datasets
+
+        Parameters
+        ----------
+        metric_name : str
+            Name of the metric
+        func : Callable
+            The metric function of the feature columns
+        current : DataFrame
+            The input current (pandas DataFrame)
+        reference : DataFrame
+            The input reference (pandas DataFrame)
+        feature_name : str, optional
+            Feature of the metric. The datasets are given to func if None
+        statistic : Callable, optional
+            Function extracting the metric value of the output of func
+        alpha : float, optional
+            Value to define the confidence level of the interval
+        skip_missing : bool, optional
+            Whether the rows with a missing value of the feature are left out of the samples
+        kwargs :
+            keyworded variable length of arguments to a function
+
+        Returns
+        -------
+        tuple
+            the output of func on the samples, the current sample size and the bootstrap confidence interval
+            of the metric value (None if the samples are the full datasets)
+        """
+
+        def column(data):
+            return data[feature_name] if feature_name is not None else data
+
+        def evaluate(cur, ref):
+            return func(column(cur), column(ref), **kwargs)
+
+        def valid(data):
+            if not skip_missing:
+                return None
+            mask = column(data).notna().to_numpy()
+            return None if mask.all() else mask
+
+        masks = (valid(current), valid(reference))
+        size = self.target_size(metric_name, evaluate, current, reference, masks)
+        # Only the feature column of the sampled rows is copied
+        cur = column(current).iloc[self.sample_index(current, size, 0, masks[0])]
+        ref = column(reference).iloc[self.sample_index(reference, size, 1, masks[1])]
+        result = func(cur, ref, **kwargs)
+
+        conf_int = None
+        if (len(cur) < _n_rows(current, masks[0])) or (len(ref) < _n_rows(reference, masks[1])):
+            rng = np.random.default_rng(self._seed + 2)
+            replicates = [
+                statistic(
+                    func(
+                        cur.iloc[rng.integers(low=0, high=len(cur), size=len(cur))],
+                        ref.iloc[rng.integers(low=0, high=len(ref), size=len(ref))],
+                        **kwargs,
+                    )
+                )
+                for _ in range(self._n_bootstrap)
+            ]
+            conf_int = [np.nanquantile(replicates, alpha / 2), np.nanquantile(replicates, 1 - alpha / 2)]
+        return result, len(cur), conf_int
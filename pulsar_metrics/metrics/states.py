@@ -0,0 +1,471 @@
+#  Author:   Adel Benlagra  <abenlagra@rocketscience.one>
+from collections import namedtuple
+
+import constant
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_numeric_dtype
+from scipy.special import gammaln, kv
+from scipy.stats import f, kstwo, norm, ttest_ind_from_stats, wasserstein_distance
+from sklearn.metrics.pairwise import pairwise_kernels
+
+from ..exceptions import CustomExceptionPulsarMetric as error_msg
+from .histograms import js_from_counts, kl_from_counts
+from .utils import psi_from_counts, sturges_edges
+
+TestResult = namedtuple("TestResult", ["statistic", "pvalue"])
+
+
+class SerializableState:
+    """Mixin giving a compact JSON compatible representation of the attributes of a metric state"""
+
+    _registry = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        SerializableState._registry[cls.__name__] = cls
+
+    def to_dict(self) -> dict:
+        """Return a JSON compatible dictionary of the state"""
+        return {"state_type": type(self).__name__, **{key: _encode(value) for key, value in self.__dict__.items()}}
+
+    @staticmethod
+    def from_dict(data: dict) -> "SerializableState":
+        """Rebuild a state from the output of to_dict()"""
+        data = dict(data)
+        state_type = SerializableState._registry[data.pop("state_type")]
+        state = state_type.__new__(state_type)
+        state.__dict__.update({key: _decode(value) for key, value in data.items()})
+        return state
+
+
+def _encode(value):
+    if isinstance(value, SerializableState):
+        return value.to_dict()
+    elif isinstance(value, np.ndarray):
+        return {"ndarray": value.tolist(), "dtype": str(value.dtype)}
+    elif isinstance(value, np.random.Generator):
+        return {"generator": value.bit_generator.state}
+    elif isinstance(value, np.generic):
+        return value.item()
+    elif isinstance(value, dict):
+        return {"dict": {key: _encode(item) for key, item in value.items()}}
+    elif isinstance(value, list):
+        return [_encode(item) for item in value]
+    return value
+
+
+def _decode(value):
+    if isinstance(value, dict) and "state_type" in value:
+        return SerializableState.from_dict(value)
+    elif isinstance(value, dict) and "ndarray" in value:
+        return np.array(value["ndarray"], dtype=value["dtype"])
+    elif isinstance(value, dict) and "generator" in value:
+        rng = np.random.default_rng()
+        rng.bit_generator.state = value["generator"]
+        return rng
+    elif isinstance(value, dict) and "dict" in value:
+        return {key: _decode(item) for key, item in value["dict"].items()}
+    elif isinstance(value, list):
+        return [_decode(item) for item in value]
+    return value
+
+
+class MomentsState(SerializableState):
+    """Exact mergeable count, mean and sum of squared deviations of a numeric sample"""
+
+    def __init__(self, values=None):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        if values is not None:
+            self.update(values)
+
+    def update(self, values) -> "MomentsState":
+        values = np.asarray(values, dtype=float)
+        if len(values):
+            other = MomentsState()
+            other.n, other.mean = len(values), values.mean()
+            other.m2 = ((values - other.mean) ** 2).sum()
+            merged = self.merge(other)
+            self.n, self.mean, self.m2 = merged.n, merged.mean, merged.m2
+        return self
+
+    def merge(self, other: "MomentsState") -> "MomentsState":
+        # Chan et al. parallel update of the mean and of the sum of squared deviations
+        merged = MomentsState()
+        merged.n = self.n + other.n
+        if merged.n > 0:
+            delta = other.mean - self.mean
+            merged.mean = self.mean + delta * other.n / merged.n
+            merged.m2 = self.m2 + other.m2 + delta**2 * self.n * other.n / merged.n
+        return merged
+
+    def var(self, ddof: int = 0) -> float:
+        return self.m2 / (self.n - ddof) if self.n > ddof else np.nan
+
+    def scale(self, factor: float) -> "MomentsState":
+        """Scale the weight of the sample (exponential decay), the mean being unchanged"""
+        self.n, self.m2 = self.n * factor, self.m2 * factor
+        return self
+
+
+class CountsState(SerializableState):
+    """Exact mergeable counts of the categories of a sample"""
+
+    def __init__(self, values=None):
+        self.categories = np.array([])
+        self.counts = np.array([])
+        if values is not None:
+            self.update(values)
+
+    def update(self, values) -> "CountsState":
+        categories, counts = np.unique(np.asarray(values), return_counts=True)
+        other = CountsState()
+        other.categories, other.counts = categories, counts.astype(float)
+        merged = self.merge(other)
+        self.categories, self.counts = merged.categories, merged.counts
+        return self
+
+    def merge(self, other: "CountsState") -> "CountsState":
+        merged = CountsState()
+        states = [state for state in (self, other) if state.categories.size > 0]
+        if states:
+            merged.categories = np.unique(np.concatenate([state.categories for state in states]))
+            merged.counts = np.zeros(len(merged.categories))
+            for state in states:
+                merged.counts[np.searchsorted(merged.categories, state.categories)] += state.counts
+        return merged
+
+    def scale(self, factor: float) -> "CountsState":
+        """Scale the counts of the categories (exponential decay)"""
+        self.counts = self.counts * factor
+        return self
+
+    def reindex(self, categories: np.ndarray) -> np.ndarray:
+        """Return the counts of the given categories (0 for unseen categories)"""
+        counts = np.zeros(len(categories))
+        if self.categories.size > 0:
+            index = np.searchsorted(self.categories, categories).clip(max=len(self.categories) - 1)
+            found = self.categories[index] == categories
+            counts[found] = self.counts[index[found]]
+        return counts
+
+
+class QuantileSketch(SerializableState):
+    """Approximate mergeable summary of a numeric sample as weighted centroids
+
+    Duplicated values are always merged, so the sketch is exact as long as the sample has less than
+    max_size distinct values. Beyond that, adjacent values are merged into max_size centroids of equal
+    weight, the exact minimum and maximum being kept aside.
+    """
+
+    def __init__(self, values=None, max_size: int = constant.SKETCH_SIZE):
+        self.max_size = max_size
+        self.values = np.array([])
+        self.weights = np.array([])
+        self.min = np.inf
+        self.max = -np.inf
+        self.exact = True
+        if values is not None:
+            self.update(values)
+
+    @property
+    def n(self) -> float:
+        return self.weights.sum()
+
+    def update(self, values, weights=None) -> "QuantileSketch":
+        values = np.asarray(values, dtype=float)
+        weights = np.ones(len(values)) if weights is None else np.asarray(weights, dtype=float)
+        if len(values):
+            self.min, self.max = min(self.min, values.min()), max(self.max, values.max())
+            self._compress(np.concatenate([self.values, values]), np.concatenate([self.weights, weights]))
+        return self
+
+    def merge(self, other: "QuantileSketch") -> "QuantileSketch":
+        merged = QuantileSketch(max_size=max(self.max_size, other.max_size))
+        merged.min, merged.max = min(self.min, other.min), max(self.max, other.max)
+        merged.exact = self.exact and other.exact
+        merged._compress(np.concatenate([self.values, other.values]), np.concatenate([self.weights, other.weights]))
+        return merged
+
+    def scale(self, factor: float) -> "QuantileSketch":
+        """Scale the weights of the centroids (exponential decay)"""
+        self.weights = self.weights * factor
+        return self
+
+    def _compress(self, values: np.ndarray, weights: np.ndarray):
+        values, inverse = np.unique(values, return_inverse=True)
+        weights = np.bincount(inverse, weights=weights, minlength=len(values))
+        if len(values) > self.max_size:
+            cumulative = np.cumsum(weights) - weights
+            buckets = np.minimum((cumulative / weights.sum() * self.max_size).astype(int), self.max_size - 1)
+            bucket_weights = np.bincount(buckets, weights=weights)
+            values = np.bincount(buckets, weights=values * weights)[bucket_weights > 0] / bucket_weights[bucket_weights > 0]
+            weights = bucket_weights[bucket_weights > 0]
+            self.exact = False
+        self.values, self.weights = values, weights
+
+    def cdf(self, x) -> np.ndarray:
+        """Weighted empirical cumulative distribution function"""
+        cumulative = np.concatenate([[0.0], np.cumsum(self.weights)])
+        return cumulative[np.searchsorted(self.values, x, side="right")] / self.n
+
+    def median(self) -> float:
+        """Weighted median (same convention as np.median on the underlying sample when exact)"""
+        cumulative = np.cumsum(self.weights)
+        positions = [np.floor((self.n - 1) / 2), np.ceil((self.n - 1) / 2)]
+        return self.values[np.searchsorted(cumulative, positions, side="right")].mean()
+
+
+class DriftState(SerializableState):
+    """Partial state of a drift metric: the states of the current and reference samples"""
+
+    def __init__(self, current: dict, reference: dict):
+        self.current = current
+        self.reference = reference
+
+    def merge(self, other: "DriftState") -> "DriftState":
+        return DriftState(
+            current=_merge_sides(self.current, other.current),
+            reference=_merge_sides(self.reference, other.reference),
+        )
+
+
+def _merge_sides(left: dict, right: dict) -> dict:
+    return {name: left[name].merge(right[name]) if name in left else right[name] for name in {**left, **right}}
+
+
+# States required to finalize each drift metric. chi2 has none: its direct evaluation compares the two columns row by
+# row (as observed and expected frequencies), which does not decompose over row partitions
+_STATES_REQUIREMENTS = {
+    "ttest": ["moments"],
+    "mmd": ["moments", "sketch"],
+    "wasserstein": ["sketch"],
+    "ks_2samp": ["sketch"],
+    "CvM": ["sketch"],
+    "manwu": ["sketch"],
+    "levene": ["sketch"],
+    "bftest": ["sketch"],
+    "psi": ["sketch"],
+    "kl": ["sketch"],
+    "js": ["sketch"],
+}
+
+# Metrics computed from the counts of the categories of non-numeric features
+_CATEGORICAL_METRICS = ("psi", "kl", "js")
+
+_STATES = {"moments": MomentsState, "sketch": QuantileSketch, "counts": CountsState}
+
+
+def compute_drift_state(metric_name: str, current: pd.Series, reference: pd.Series = None) -> DriftState:
+    """Compute the partial state of a drift metric on a partition of the current and reference samples
+
+    Parameters
+    ----------
+    metric_name : str
+        Name of the drift metric
+    current : pd.Series
+        The partition of the current sample
+    reference : pd.Series, optional
+        The partition of the reference sample
+
+    Returns
+    -------
+    DriftState
+        the partial state of the metric
+    """
+    if metric_name not in _STATES_REQUIREMENTS:
+        raise error_msg(
+            value=metric_name,
+            message=f"The drift metric {metric_name} has no partial state",
+        )
+    requirements = _STATES_REQUIREMENTS[metric_name]
+    if (metric_name in _CATEGORICAL_METRICS) and not is_numeric_dtype(current):
+        requirements = ["counts"]
+
+    def side_state(values):
+        if values is None:
+            return {}
+        values = values.dropna()
+        return {name: _STATES[name](values) for name in requirements}
+
+    return DriftState(current=side_state(current), reference=side_state(reference))
+
+
+def finalize_drift_state(metric_name: str, state: DriftState, **kwargs):
+    """Compute a drift metric (or a statistical test result) from a merged state
+
+    Parameters
+    ----------
+    metric_name : str
+        Name of the drift metric
+    state : DriftState
+        The merged state of the metric
+    kwargs :
+        keyworded variable length of arguments to a function
+
+    Returns
+    -------
+    Union[float, TestResult]
+        the metric value for drift metrics, the statistic and p-value for drift tests
+    """
+    current, reference = state.current, state.reference
+    if metric_name == "ttest":
+        cur, ref = current["moments"], reference["moments"]
+        return ttest_ind_from_stats(
+            cur.mean,
+            np.sqrt(cur.var(ddof=1)),
+            cur.n,
+            ref.mean,
+            np.sqrt(ref.var(ddof=1)),
+            ref.n,
+            equal_var=kwargs.get("equal_var", False),
+        )
+    elif (metric_name == "psi") and ("counts" in current):
+        categories = np.union1d(current["counts"].categories, reference["counts"].categories)
+        return psi_from_counts(current["counts"].reindex(categories), reference["counts"].reindex(categories))
+    elif metric_name in ["kl", "js"]:
+        divergence = kl_from_counts if metric_name == "kl" else js_from_counts
+        smoothing = kwargs.get("smoothing", constant.HISTOGRAM_SMOOTHING)
+        if "counts" in current:
+            return _counts_divergence(divergence, current["counts"], reference["counts"], smoothing)
+        return _sketch_divergence(divergence, current["sketch"], reference["sketch"], smoothing)
+    elif (metric_name == "mmd") and (kwargs.get("kernel", "linear") == "linear"):
+        # With a linear kernel, the MMD of a single feature reduces to the squared difference of the means
+        return (current["moments"].mean - reference["moments"].mean) ** 2
+
+    cur, ref = current["sketch"], reference["sketch"]
+    if metric_name == "wasserstein":
+        return wasserstein_distance(cur.values, ref.values, cur.weights, ref.weights)
+    elif metric_name == "mmd":
+        return _weighted_mmd(cur, ref, **kwargs)
+    elif metric_name == "psi":
+        return _sketch_psi(cur, ref)
+    elif metric_name == "ks_2samp":
+        return _weighted_ks(cur, ref)
+    elif metric_name == "manwu":
+        return _weighted_mannwhitneyu(cur, ref)
+    elif metric_name == "CvM":
+        return _weighted_cramervonmises(cur, ref)
+    elif metric_name in ["levene", "bftest"]:
+        return _weighted_levene(cur, ref, center="mean" if metric_name == "levene" else "median")
+
+
+def _sketch_psi(cur: QuantileSketch, ref: QuantileSketch) -> float:
+    # Same sturges bins on the combined range as population_stability_index
+    edges = sturges_edges(min(cur.min, ref.min), max(cur.max, ref.max), cur.n + ref.n)
+    n_bins = len(edges) - 1
+
+    def binned(sketch):
+        bins = np.clip(np.searchsorted(edges, sketch.values, side="left") - 1, 0, n_bins - 1)
+        return np.bincount(bins, weights=sketch.weights, minlength=n_bins)
+
+    return psi_from_counts(binned(cur), binned(ref))
+
+
+def _sketch_divergence(divergence, cur: QuantileSketch, ref: QuantileSketch, smoothing: float) -> float:
+    # Same sturges bins frozen on the reference range as FrozenBinning, out of range values in the outer bins
+    low, high = ref.min, ref.max
+    n_bins = int(np.ceil(np.log2(ref.n) + 1)) if high > low else 1
+    if high == low:
+        low, high = low - 0.5, high + 0.5
+    width = (high - low) / n_bins
+
+    def binned(sketch):
+        bins = np.clip(np.floor((sketch.values - low) / width), 0, n_bins - 1).astype(np.int64)
+        return np.bincount(bins, weights=sketch.weights, minlength=n_bins)
+
+    return float(divergence(binned(cur), binned(ref), smoothing)[0])
+
+
+def _counts_divergence(divergence, cur: CountsState, ref: CountsState, smoothing: float) -> float:
+    # One bin per reference category and a last bin for the unseen categories, as FrozenBinning
+    current_counts = cur.reindex(ref.categories)
+    counts = np.concatenate([current_counts, [cur.counts.sum() - current_counts.sum()]])
+    return float(divergence(counts, np.concatenate([ref.counts, [0.0]]), smoothing)[0])
+
+
+def _union_weights(cur: QuantileSketch, ref: QuantileSketch):
+    """Weights of both sketches on the sorted union of their centroids"""
+    values = np.union1d(cur.values, ref.values)
+    cur_weights, ref_weights = np.zeros(len(values)), np.zeros(len(values))
+    cur_weights[np.searchsorted(values, cur.values)] = cur.weights
+    ref_weights[np.searchsorted(values, ref.values)] = ref.weights
+    return values, cur_weights, ref_weights
+
+
+def _weighted_ks(cur: QuantileSketch, ref: QuantileSketch) -> TestResult:
+    values, cur_weights, ref_weights = _union_weights(cur, ref)
+    statistic = np.abs(np.cumsum(cur_weights) / cur.n - np.cumsum(ref_weights) / ref.n).max()
+    # Asymptotic two-sided p-value, as in ks_2samp(method="asymp")
+    en = cur.n * ref.n / (cur.n + ref.n)
+    return TestResult(statistic, float(np.clip(kstwo.sf(statistic, np.round(en)), 0, 1)))
+
+
+def _weighted_mannwhitneyu(cur: QuantileSketch, ref: QuantileSketch) -> TestResult:
+    values, cur_weights, ref_weights = _union_weights(cur, ref)
+    ties = cur_weights + ref_weights
+    ranks = np.cumsum(ties) - ties + (ties + 1) / 2
+    n1, n2 = cur.n, ref.n
+    n = n1 + n2
+    u1 = (cur_weights * ranks).sum() - n1 * (n1 + 1) / 2
+    # Asymptotic two-sided p-value with tie and continuity corrections, as in mannwhitneyu
+    mu = n1 * n2 / 2
+    sigma = np.sqrt(n1 * n2 / 12 * ((n + 1) - (ties**3 - ties).sum() / (n * (n - 1))))
+    z = (max(u1, n1 * n2 - u1) - mu - 0.5) / sigma
+    return TestResult(u1, float(np.clip(2 * norm.sf(z), 0, 1)))
+
+
+def _cdf_cvm_inf(x: float, max_terms: int = 100) -> float:
+    """Cumulative distribution function of the asymptotic Cramer-von Mises statistic (Anderson & Darling 1962)"""
+    if not np.isfinite(x):
+        return np.nan
+    total = 0.0
+    for k in range(max_terms):
+        y = 4 * k + 1
+        q = y**2 / (16 * x)
+        term = np.exp(gammaln(k + 0.5) - gammaln(k + 1)) / (np.pi**1.5 * np.sqrt(x)) * np.sqrt(y) * np.exp(-q) * kv(0.25, q)
+        total += term
+        if not np.abs(term) >= 1e-7:
+            break
+    return total
+
+
+def _weighted_cramervonmises(cur: QuantileSketch, ref: QuantileSketch) -> TestResult:
+    values, cur_weights, ref_weights = _union_weights(cur, ref)
+    nx, ny = cur.n, ref.n
+    n, k = nx + ny, nx * ny
+    with np.errstate(divide="ignore", invalid="ignore"):
+        differences = np.cumsum(cur_weights) / nx - np.cumsum(ref_weights) / ny
+        statistic = k / n * (differences**2 * (cur_weights + ref_weights) / n).sum()
+        # Asymptotic p-value, as in cramervonmises_2samp(method="asymptotic")
+        et = (1 + 1 / n) / 6
+        vt = (n + 1) * (4 * k * n - 3 * (nx**2 + ny**2) - 2 * k) / (45 * n**2 * 4 * k)
+        tn = 1 / 6 + (statistic - et) / np.sqrt(45 * vt)
+    # Undefined statistics (empty windows) have no p-value
+    pvalue = np.nan if not np.isfinite(tn) else 1.0 if tn < 0.003 else max(0.0, 1.0 - _cdf_cvm_inf(tn))
+    return TestResult(statistic, pvalue)
+
+
+def _weighted_levene(cur: QuantileSketch, ref: QuantileSketch, center: str = "mean") -> TestResult:
+    groups = []
+    for sketch in (cur, ref):
+        location = np.average(sketch.values, weights=sketch.weights) if center == "mean" else sketch.median()
+        deviations = np.abs(sketch.values - location)
+        groups.append((deviations, sketch.weights, np.average(deviations, weights=sketch.weights)))
+    n = cur.n + ref.n
+    grand_mean = sum((weights * deviations).sum() for deviations, weights, _ in groups) / n
+    between = sum(weights.sum() * (mean - grand_mean) ** 2 for _, weights, mean in groups)
+    within = sum((weights * (deviations - mean) ** 2).sum() for deviations, weights, mean in groups)
+    statistic = (n - 2) * between / within
+    return TestResult(statistic, float(f.sf(statistic, 1, n - 2)))
+
+
+def _weighted_mmd(cur: QuantileSketch, ref: QuantileSketch, kernel: str = "linear", **kwargs) -> float:
+    x, y = cur.values[:, None], ref.values[:, None]
+    wx, wy = cur.weights / cur.n, ref.weights / ref.n
+    kxx = pairwise_kernels(x, x, metric=kernel, **kwargs)
+    kyy = pairwise_kernels(y, y, metric=kernel, **kwargs)
+    kxy = pairwise_kernels(x, y, metric=kernel, **kwargs)
+    return wx @ kxx @ wx + wy @ kyy @ wy - 2 * wx @ kxy @ wy
@@ -126,3 +126,39 @@ class FeatureSummary(FeatureSummaryAbstract):
             self._result.append(count)
         except Exception as e:
             print(f"Exception in evaluate() in the FeatureSummary class( statistics): {str(e)}")
+
+    def evaluate_from_statistics(self, current: dict, reference: dict = None, count: int = None) -> Sequence[MetricResults]:
+        """Build the summary results from precomputed statistics (e.g. shared intermediates of a metric plan)
+
+        Parameters
+        ----------
+        current : dict
+            Statistic name -> value on the current dataset, in the order of the results
+        reference : dict, optional
+            Statistic name -> value on the reference dataset, used as thresholds
+        count : int, optional
+            Number of non-null values of the feature in the current dataset
+
+        Returns
+        -------
+        list
+            returns the summary statistics results
+        """
+        for name, value in current.items():
+            statistics = MetricResults(
+                metric_type="statistics",
+                metric_name=name,
+                feature_name=self._feature_name,
+                metric_value=value,
+                threshold=reference[name] if reference is not None else None,
+            )
+            self._result.append(statistics)
+
+        count = MetricResults(
+            metric_type="statistics",
+            metric_name="count",
+            feature_name=self._feature_name,
+            metric_value=count,
+        )
+        self._result.append(count)
+        return self._result
@@ -2,12 +2,31 @@
 
 import numpy as np
 import pandas as pd
-from pandas.api.types import is_numeric_dtype
+from pandas.api.types import is_bool_dtype, is_numeric_dtype
 from sklearn.metrics.pairwise import pairwise_kernels
 
 from ..exceptions import CustomExceptionPulsarMetric as error_msg
 
 
+def sturges_edges(first, last, n) -> np.ndarray:
+    """Sturges bin edges of n values ranging from first to last (a unit bin around a single value)"""
+    if first == last:
+        first, last, n_bins = first - 0.5, last + 0.5, 1
+    else:
+        n_bins = int(np.ceil(np.log2(n) + 1))
+    return np.linspace(first, last, n_bins + 1, endpoint=True, dtype=np.result_type(first, last, float))
+
+
+def sturges_bin_edges(*samples: np.ndarray) -> np.ndarray:
+    """Sturges bin edges of the union of samples, without concatenating them"""
+    n = sum(len(sample) for sample in samples)
+    if n == 0:
+        return np.histogram_bin_edges(np.empty(0), bins="sturges")
+    first = min(sample.min() for sample in samples if len(sample))
+    last = max(sample.max() for sample in samples if len(sample))
+    return sturges_edges(first, last, n)
+
+
 def get_population_percentages(new: pd.Series, reference: pd.Series, binned: bool = False):
     """Return the population percentages of the two pandas series[new,reference]
 
@@ -36,18 +55,27 @@ def get_population_percentages(new: pd.Series, reference: pd.Series, binned: boo
         if binned:
             percents = pd.concat([new, reference], axis=1, keys=["ref", "new"]).fillna(0)
             percents = percents / percents.sum()
-        elif new.dtype != reference.dtype:
+        elif is_numeric_dtype(new) != is_numeric_dtype(reference):
             raise error_msg(
                 value=None,
                 message=f'{"New and reference series should be numeric or object and should have the same type"}',
             )
+        elif is_numeric_dtype(new):
+            # Binning with searchsorted/bincount instead of pd.cut keeps the compact dtypes of the inputs
+            reference, new = reference.dropna().to_numpy(), new.dropna().to_numpy()
+            bins = sturges_bin_edges(reference, new)
+            counts = {
+                key: np.bincount(
+                    np.clip(np.searchsorted(bins, values, side="left") - 1, 0, len(bins) - 2), minlength=len(bins) - 1
+                )
+                for key, values in [("new", new), ("ref", reference)]
+            }
+            percents = pd.DataFrame(counts, index=pd.IntervalIndex.from_breaks(bins))
+            percents = percents / percents.sum()
         else:
-            if is_numeric_dtype(new):
-                bins = np.histogram_bin_edges(np.concatenate([reference, new]), bins="sturges")
-                reference = pd.cut(reference, bins, include_lowest=True)
-                new = pd.cut(new, bins, include_lowest=True)
-            vector_all = pd.concat([reference, new], keys=["ref", "new"]).reset_index(0)
-            percents = vector_all.groupby("level_0").value_counts(normalize=True).sort_index().unstack().T
+            percents = pd.concat(
+                [values.value_counts(normalize=True) for values in [new, reference]], axis=1, keys=["new", "ref"]
+            ).fillna(0)
 
         return percents
     except Exception as e:
@@ -86,7 +114,164 @@ def population_stability_index(new: pd.Series, reference: pd.Series, binned: boo
     return (percent_diff * np.log(percent_ratio)).sum()
 
 
-def max_mean_discrepency(new: pd.DataFrame, reference: pd.DataFrame, kernel="linear", **kwargs):
+def psi_from_counts(new_counts: np.ndarray, reference_counts: np.ndarray) -> float:
+    """Calculate the Population Stability Index (PSI) from the counts of two samples on identical bins
+
+    Parameters
+    ----------
+    new_counts : np.ndarray
+        The counts of the new population
+    reference_counts : np.ndarray
+        The counts of the reference population
+
+    Returns
+    -------
+    float
+        returns Population Stability Index (PSI), empty bins in both populations being ignored
+    """
+    new, ref = new_counts / new_counts.sum(), reference_counts / reference_counts.sum()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.nansum((new - ref) * np.log(new / ref))
+
+
+def missing_rate(new: pd.Series, reference: pd.Series = None) -> float:
+    """Calculate the fraction of missing values of the new population
+
+    Parameters
+    ----------
+    new : pd.Series
+        The input pandas Series of the new population
+    reference : pd.Series, optional
+        The input pandas Series of the reference population (unused)
+
+    Returns
+    -------
+    float
+        returns the fraction of missing values of the new population
+    """
+    return float(pd.isnull(new).mean()) if len(new) else 0.0
+
+
+def missing_rate_drift(new: pd.Series, reference: pd.Series) -> float:
+    """Calculate the absolute difference between the missing rates of two samples[new,reference]
+
+    Parameters
+    ----------
+    new : pd.Series
+        The input pandas Series of the new population
+    reference : pd.Series
+        The input pandas Series of the reference population
+
+    Returns
+    -------
+    float
+        returns the absolute difference between the missing rates of the two pandas series (new,reference)
+    """
+    return abs(missing_rate(new) - missing_rate(reference))
+
+
+def is_categorical(column: pd.Series) -> bool:
+    """Whether a column holds categories (non-numeric or boolean values)"""
+    return is_bool_dtype(column) or not is_numeric_dtype(column)
+
+
+def out_of_range_rate(new: pd.Series, reference: pd.Series) -> float:
+    """Calculate the fraction of the values of the new population outside the range [min, max] of the reference
+
+    Parameters
+    ----------
+    new : pd.Series
+        The input pandas Series of the new population
+    reference : pd.Series
+        The input pandas Series of the reference population
+
+    Returns
+    -------
+    float
+        returns the fraction of the (non-missing) new values out of the reference range, None for categorical features
+    """
+    if is_categorical(new) or is_categorical(reference):
+        return None
+    new, reference = new.dropna(), reference.dropna()
+    if not len(new):
+        return 0.0
+    if not len(reference):
+        return 1.0
+    return float(((new < reference.min()) | (new > reference.max())).mean())
+
+
+def unseen_category_rate(new: pd.Series, reference: pd.Series) -> float:
+    """Calculate the fraction of the values of the new population among no value of the reference population
+
+    Parameters
+    ----------
+    new : pd.Series
+        The input pandas Series of the new population
+    reference : pd.Series
+        The input pandas Series of the reference population
+
+    Returns
+    -------
+    float
+        returns the fraction of the (non-missing) new values unseen in the reference, None for numeric features
+    """
+    if not (is_categorical(new) or is_categorical(reference)):
+        return None
+    new = new.dropna()
+    if not len(new):
+        return 0.0
+    return float((pd.Index(reference.dropna().unique()).get_indexer(new) < 0).mean())
+
+
+def constant_column(new: pd.Series, reference: pd.Series = None) -> float:
+    """Calculate whether the new population has at most one distinct value
+
+    Parameters
+    ----------
+    new : pd.Series
+        The input pandas Series of the new population
+    reference : pd.Series, optional
+        The input pandas Series of the reference population (unused)
+
+    Returns
+    -------
+    float
+        returns 1.0 if the new population has at most one distinct (non-missing) value, 0.0 otherwise
+    """
+    return float(new.nunique(dropna=True) <= 1)
+
+
+def duplicate_rows(new: pd.DataFrame, reference: pd.DataFrame = None) -> float:
+    """Calculate the fraction of the rows of the new dataset duplicating a previous row
+
+    Parameters
+    ----------
+    new : pd.DataFrame
+        The input pandas DataFrame of the new dataset (restricted to the columns rows are compared on)
+    reference : pd.DataFrame, optional
+        The input pandas DataFrame of the reference dataset (unused)
+
+    Returns
+    -------
+    float
+        returns the fraction of duplicated rows, rows being compared on the 64 bits hashes of their values
+    """
+    if not len(new):
+        return 0.0
+    hashes = pd.util.hash_pandas_object(new, index=False).to_numpy()
+    return 1 - len(pd.unique(hashes)) / len(hashes)
+
+
+def _kernel_mean(x: np.ndarray, y: np.ndarray, kernel, block_size: int = None, **kwargs) -> float:
+    """Mean of the kernel matrix of two samples, computed over blocks of block_size rows of x if given"""
+    if block_size is None:
+        return pairwise_kernels(x, y, metric=kernel, **kwargs).mean()
+    blocks = np.split(x, range(block_size, len(x), block_size))
+    total = sum(pairwise_kernels(block, y, metric=kernel, **kwargs).sum() for block in blocks)
+    return total / (len(x) * len(y))
+
+
+def max_mean_discrepency(new: pd.DataFrame, reference: pd.DataFrame, kernel="linear", block_size: int = None, **kwargs):
     """Calculate the Maximum Mean Discrepency(MMD) between two samples[new,reference]
 
     Parameters
@@ -97,6 +282,8 @@ def max_mean_discrepency(new: pd.DataFrame, reference: pd.DataFrame, kernel="lin
         The input pandas Series of the reference population
     kernel : str, optional
         represent linear transformation
+    block_size : int, optional
+        Number of rows of the blocks of the kernel matrices held in memory at once (the whole matrices if None)
     kwargs :
         keyworded variable length of arguments to a function
 
@@ -115,8 +302,11 @@ def max_mean_discrepency(new: pd.DataFrame, reference: pd.DataFrame, kernel="lin
     new = new.select_dtypes("number")
     reference = reference.select_dtypes("number")
 
-    kxx = pairwise_kernels(new, new, metric=kernel, **kwargs)
-    kyy = pairwise_kernels(reference, reference, metric=kernel, **kwargs)
-    kxy = pairwise_kernels(new, reference, metric=kernel, **kwargs)
+    new = new.to_numpy()
+    reference = reference.to_numpy()
+
+    kxx = _kernel_mean(new, new, kernel, block_size, **kwargs)
+    kyy = _kernel_mean(reference, reference, kernel, block_size, **kwargs)
+    kxy = _kernel_mean(new, reference, kernel, block_size, **kwargs)
 
-    return kxx.mean() + kyy.mean() - 2 * kxy.mean()
+    return kxx + kyy - 2 * kxy
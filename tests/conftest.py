@@ -0,0 +1,50 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root)
+# The metrics modules import their constants as a top level module
+sys.path.append(os.path.join(root, "pulsar_metrics", "metrics"))
+
+
+# Datasets and builders shared by the tests (the datasets are shared by all the tests and not to be modified)
+# ========================================================================================================
+
+
+@pytest.fixture(scope="session")
+def reference() -> pd.DataFrame:
+    """Reference dataset of the California housing models"""
+    return pd.read_csv(os.path.join(root, "data", "california_ref.csv"))
+
+
+@pytest.fixture(scope="session")
+def current() -> pd.DataFrame:
+    """Current dataset of the California housing models"""
+    return pd.read_csv(os.path.join(root, "data", "california_new.csv"))
+
+
+@pytest.fixture
+def make_analyzer():
+    """Builder of analyzers of the model 1 with drift metrics (and tests) on a list of features"""
+    # Imported once the paths of the package are set
+    from pulsar_metrics.analyzers.base import Analyzer
+
+    def make(metrics_list: list, features_list: list, name: str = "california", model_version: int = 2) -> Analyzer:
+        analyzer = Analyzer(name=name, model_id=1, model_version=model_version)
+        analyzer.add_drift_metrics(metrics_list, features_list)
+        return analyzer
+
+    return make
+
+
+@pytest.fixture
+def make_metrics():
+    """Builder of the metrics of a class for every metric name and feature (in this order)"""
+
+    def make(metric_class, metric_names: list, features_list: list) -> list:
+        return [metric_class(metric_name, feature) for metric_name in metric_names for feature in features_list]
+
+    return make
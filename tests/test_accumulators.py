@@ -0,0 +1,90 @@
+from functools import reduce
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.metrics import r2_score
+
+from pulsar_metrics.metrics.accumulators import get_accumulator
+from pulsar_metrics.metrics.enums import PerformanceMetricsFuncs
+from pulsar_metrics.metrics.performance import PerformanceMetric
+
+rng = np.random.default_rng(0)
+n_rows = 1000
+df = pd.DataFrame(
+    {
+        "y_true": rng.integers(0, 2, n_rows),
+        "y_multi": rng.integers(0, 4, n_rows),
+        "y_reg": rng.normal(size=n_rows),
+    }
+)
+df["y_pred"] = np.where(rng.random(n_rows) < 0.8, df["y_true"], 1 - df["y_true"])
+df["y_pred_multi"] = np.where(rng.random(n_rows) < 0.6, df["y_multi"], rng.integers(0, 4, n_rows))
+df["y_pred_proba"] = np.clip(0.3 * df["y_true"] + 0.7 * rng.random(n_rows), 0, 1)
+df["y_pred_reg"] = df["y_reg"] + rng.normal(scale=0.3, size=n_rows)
+
+# Testing chunked accumulation against the single pass sklearn metrics
+# ====================================================================
+
+
+@pytest.mark.parametrize(
+    "metric_name, y_name, pred_name, kwargs",
+    [
+        ("accuracy", "y_true", "y_pred", {}),
+        ("precision", "y_true", "y_pred", {}),
+        ("recall", "y_true", "y_pred", {}),
+        ("f1", "y_true", "y_pred", {}),
+        ("accuracy", "y_multi", "y_pred_multi", {}),
+        ("precision", "y_multi", "y_pred_multi", {"average": "macro"}),
+        ("recall", "y_multi", "y_pred_multi", {"average": "weighted"}),
+        ("f1", "y_multi", "y_pred_multi", {"average": "micro"}),
+        ("log_loss", "y_true", "y_pred_proba", {}),
+        ("brier", "y_true", "y_pred_proba", {}),
+        ("mse", "y_reg", "y_pred_reg", {}),
+        ("mae", "y_reg", "y_pred_reg", {}),
+        ("r2", "y_reg", "y_pred_reg", {}),
+    ],
+)
+def test_chunked_accumulator_matches_sklearn(metric_name, y_name, pred_name, kwargs):
+    metric = PerformanceMetric(metric_name=metric_name, y_name=y_name, pred_name=pred_name)
+    partials = [metric.accumulate(chunk, partition=i) for i, chunk in enumerate(np.array_split(df, 7))]
+    result = metric.finalize(reduce(lambda left, right: left.merge(right), partials), **kwargs)
+
+    expected = PerformanceMetricsFuncs[metric_name].value(df[y_name], df[pred_name], **kwargs)
+    assert result.metric_value == pytest.approx(expected)
+
+
+def test_poisson_bootstrap_confidence_interval():
+    accumulator = get_accumulator("mse", n_bootstrap=200)
+    for chunk in np.array_split(df, 5):
+        accumulator.update(chunk["y_reg"], chunk["y_pred_reg"])
+    value, conf_int = accumulator.finalize("mse")
+
+    assert accumulator.n_sample == n_rows
+    assert conf_int[0] < value < conf_int[1]
+
+
+def test_partitions_draw_independent_weights():
+    weights = {
+        (seed, partition): get_accumulator("mse", n_bootstrap=50, seed=seed, partition=partition)._replicate_weights(100)
+        for seed, partition in [(1, 0), (1, 1), (2, 0)]
+    }
+    # The weights of the second partition of a seed are not those of the first partition of the next seed
+    assert not np.array_equal(weights[(1, 1)], weights[(2, 0)])
+    assert not np.array_equal(weights[(1, 0)], weights[(1, 1)])
+    expected = np.random.default_rng(np.random.SeedSequence(1).spawn(2)[1]).poisson(1.0, size=(50, 100))
+    np.testing.assert_array_equal(weights[(1, 1)][1:], expected)
+
+
+@pytest.mark.parametrize("offset, scale", [(1e7, 1.0), (1e3, 1e-5)])
+def test_r2_with_a_large_offset(offset, scale):
+    rng = np.random.default_rng(5)
+    y_true = offset + rng.normal(0, scale, 100000)
+    y_pred = y_true + rng.normal(0, 0.5 * scale, len(y_true))
+    partials = [
+        get_accumulator("r2", n_bootstrap=20, partition=i).update(y, p)
+        for i, (y, p) in enumerate(zip(np.array_split(y_true, 3), np.array_split(y_pred, 3)))
+    ]
+    value, conf_int = reduce(lambda left, right: left.merge(right), partials).finalize("r2")
+    assert value == pytest.approx(r2_score(y_true, y_pred), rel=1e-6)
+    assert conf_int[0] < value < conf_int[1]
@@ -0,0 +1,187 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from pulsar_metrics.analyzers.alerts import ALERT_COLUMNS, AlertEngine, AlertRule
+from pulsar_metrics.analyzers.base import Analyzer
+from pulsar_metrics.analyzers.history import MetricHistory
+from pulsar_metrics.exceptions import CustomExceptionPulsarMetric
+
+features = ["age", "income", "city", "score"]
+start = pd.Timestamp("2023-01-01")
+
+
+def make_results(values: dict, window: int, metric_name: str = "psi", model_version: int = 2) -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "metric_type": "drift",
+            "metric_name": metric_name,
+            "feature_name": list(values),
+            "metric_value": list(values.values()),
+            "model_id": 1,
+            "model_version": model_version,
+            "period_end": start + pd.Timedelta(days=window),
+        }
+    )
+
+
+def run(engine: AlertEngine, windows: list) -> list:
+    return [engine.evaluate(make_results(values, window)) for window, values in enumerate(windows)]
+
+
+# Testing the conditions
+# ======================
+
+
+def test_threshold_alerts_are_deduplicated():
+    engine = AlertEngine([AlertRule("psi", "psi", 0.2)])
+    alerts = run(engine, [{"age": 0.3, "income": 0.1}, {"age": 0.4, "income": 0.3}, {"age": 0.1}, {"age": 0.5}])
+    assert list(alerts[0].columns) == ALERT_COLUMNS
+    assert list(alerts[0]["feature_name"]) == ["age"]
+    # age still holds: only income is new
+    assert list(alerts[1]["feature_name"]) == ["income"]
+    assert alerts[2].empty
+    # age cleared and holds again
+    assert list(alerts[3]["feature_name"]) == ["age"]
+    assert alerts[3]["metric_value"].iloc[0] == pytest.approx(0.5)
+    # income is absent from the last windows: its condition no longer holds
+    assert set(engine.active()["feature_name"]) == {"age"}
+
+
+def test_consecutive_windows():
+    engine = AlertEngine([AlertRule("psi3", "psi", 0.2, consecutive=3)])
+    alerts = run(engine, [{"age": 0.3, "income": 0.3}, {"age": 0.3, "income": 0.1}, {"age": 0.3, "income": 0.3}])
+    assert alerts[0].empty and alerts[1].empty
+    assert list(alerts[2]["feature_name"]) == ["age"]
+
+
+def test_gaps_break_consecutive_windows():
+    engine = AlertEngine([AlertRule("psi3", "psi", 0.2, consecutive=3)])
+    windows = [{"age": 0.3, "income": 0.3}, {"age": 0.3}, {"age": 0.3, "income": 0.3}, {"income": 0.3}, {"income": 0.3}]
+    alerts = run(engine, windows)
+    assert list(alerts[2]["feature_name"]) == ["age"]
+    # income has a gap in the second window, age in the fourth one
+    assert alerts[3].empty
+    assert list(alerts[4]["feature_name"]) == ["income"]
+    assert set(engine.active()["feature_name"]) == {"income"}
+
+
+def test_gaps_of_other_models_are_ignored():
+    engine = AlertEngine([AlertRule("psi2", "psi", 0.2, consecutive=2)])
+    alerts = [
+        engine.evaluate(make_results({"age": 0.3}, 0, model_version=2)),
+        engine.evaluate(make_results({"age": 0.3}, 0, model_version=3)),
+        engine.evaluate(make_results({"age": 0.3}, 1, model_version=2)),
+    ]
+    assert alerts[0].empty and alerts[1].empty
+    assert list(zip(alerts[2]["feature_name"], alerts[2]["model_version"])) == [("age", "2")]
+
+
+@pytest.mark.parametrize("change, expected", [("absolute", ["income"]), ("relative", ["age"])])
+def test_rate_of_change(change, expected):
+    engine = AlertEngine([AlertRule("jump", "psi", 0.5 if change == "absolute" else 1.0, change=change)])
+    alerts = run(engine, [{"age": 0.1, "income": 1.0}, {"age": 0.3, "income": 1.6}])
+    assert alerts[0].empty
+    assert list(alerts[1]["feature_name"]) == expected
+
+
+def test_lower_bound_rules_and_metric_filter():
+    engine = AlertEngine([AlertRule("ks", "ks_2samp", 0.05, operator="<", model_version=2)])
+    results = pd.concat(
+        [
+            make_results({"age": 0.01, "income": 0.5}, 0, metric_name="ks_2samp"),
+            make_results({"age": 0.01}, 0, metric_name="ks_2samp", model_version=3),
+            make_results({"city": 0.01}, 0),
+        ]
+    )
+    alerts = engine.evaluate(results)
+    assert list(zip(alerts["feature_name"], alerts["model_version"])) == [("age", "2")]
+
+
+# Testing the groups and the suppression
+# ======================================
+
+
+def test_feature_groups():
+    engine = AlertEngine([AlertRule("top", "psi", 0.2, features=["age", "income", "city"], min_features=2)])
+    alerts = run(
+        engine,
+        [
+            {"age": 0.3, "income": 0.1, "score": 0.9},
+            {"age": 0.3, "income": 0.3, "city": 0.1},
+            {"age": 0.3, "income": 0.3, "city": 0.3},
+            {"age": 0.1, "income": 0.1},
+            {"city": 0.1},
+        ],
+    )
+    assert alerts[0].empty
+    assert len(alerts[1]) == 1
+    group = alerts[1].iloc[0]
+    assert group["feature_name"] is None
+    assert group["features"] == ["age", "income"] and group["n_features"] == 2
+    assert group["metric_value"] == pytest.approx(0.3)
+    assert alerts[2].empty and alerts[3].empty
+    assert len(engine.active()) == 0
+
+
+def test_absent_features_leave_groups():
+    engine = AlertEngine([AlertRule("top", "psi", 0.2, min_features=2)])
+    alerts = run(engine, [{"age": 0.3, "income": 0.3}, {"age": 0.3}, {"age": 0.3, "city": 0.3}])
+    assert list(alerts[0]["features"]) == [["age", "income"]]
+    # income is absent from the second window and no longer counts toward min_features
+    assert alerts[1].empty
+    assert list(alerts[2]["features"]) == [["age", "city"]]
+
+
+def test_cooldown_and_silence():
+    engine = AlertEngine([AlertRule("psi", "psi", 0.2, cooldown=2), AlertRule("all", "psi", 0.0)])
+    engine.silence("all", 2)
+    alerts = run(engine, [{"age": 0.3}] * 5 + [{"age": 0.0}, {"age": 0.3}])
+    # The alerts of a silenced rule are dropped, not delayed
+    assert [list(window["rule"]) for window in alerts] == [["psi"], [], ["psi"], [], ["psi"], [], ["psi", "all"]]
+
+
+def test_windows_split_by_period():
+    windows = [{"age": 0.3, "income": 0.1}, {"age": 0.3, "income": 0.3}, {"age": 0.3, "income": 0.3}]
+    rules = [AlertRule("psi2", "psi", 0.2, consecutive=2), AlertRule("group", "psi", 0.2, min_features=2)]
+    incremental = pd.concat(run(AlertEngine(rules), windows), ignore_index=True)
+    rules = [AlertRule("psi2", "psi", 0.2, consecutive=2), AlertRule("group", "psi", 0.2, min_features=2)]
+    batch = AlertEngine(rules).evaluate(pd.concat([make_results(values, window) for window, values in enumerate(windows)]))
+    assert len(batch) == 3
+    pd.testing.assert_frame_equal(batch, incremental, check_dtype=False)
+
+
+def test_warm_start_from_history():
+    history = MetricHistory()
+    history.append(pd.concat([make_results({"age": 0.3, "income": value}, window) for window, value in enumerate([0.1, 0.3])]))
+    engine = AlertEngine([AlertRule("psi", "psi", 0.2), AlertRule("psi3", "psi", 0.2, consecutive=3)])
+    assert engine.warm_start(history, model_id=1) == 2
+    assert set(engine.active()["rule"]) == {"psi"}
+    alerts = engine.evaluate(make_results({"age": 0.3, "income": 0.3}, 2))
+    # Series already holding are not raised again, and the consecutive windows include the replayed ones
+    assert list(zip(alerts["rule"], alerts["feature_name"])) == [("psi3", "age")]
+
+
+def test_invalid_rules():
+    with pytest.raises(CustomExceptionPulsarMetric):
+        AlertRule("psi", "psi", 0.2, operator="!=")
+    with pytest.raises(CustomExceptionPulsarMetric):
+        AlertRule("psi", "psi", 0.2, consecutive=0)
+    with pytest.raises(CustomExceptionPulsarMetric):
+        AlertEngine([AlertRule("psi", "psi", 0.2), AlertRule("psi", "kl", 0.2)])
+
+
+def test_analyzer_results():
+    reference = pd.read_csv("data/california_ref.csv")
+    current = pd.read_csv("data/california_new.csv")
+    analysis = Analyzer(name="alerts", model_id=1, model_version=2)
+    analysis.add_drift_metrics(metrics_list=["wasserstein", "ks_2samp"], features_list=["MedInc", "HouseAge"])
+    analysis.run(current=current, reference=reference)
+    results = analysis.results_to_pandas()
+    engine = AlertEngine([AlertRule("any", "wasserstein", -np.inf), AlertRule("summary", "mean", -np.inf)])
+    alerts = engine.evaluate(results)
+    drift = alerts[alerts["rule"] == "any"]
+    assert set(drift["feature_name"]) == {"MedInc", "HouseAge"}
+    assert set(drift["model_id"]) == {"1"}
+    summary = results[results["metric_name"] == "mean"]
+    assert set(alerts.loc[alerts["rule"] == "summary", "feature_name"]) == set(summary["feature_name"])
@@ -0,0 +1,89 @@
+import asyncio
+import time
+
+import pandas as pd
+import pytest
+
+from pulsar_metrics.analyzers.asynchronous import (
+    _execute_attached,
+    execute_batch,
+    make_executor,
+    run_analyzers,
+)
+from pulsar_metrics.analyzers.plan import MetricPlan
+from pulsar_metrics.metrics.drift import CustomDriftMetric
+
+features = ["MedInc", "HouseAge", "Population", "AveRooms"]
+metrics = ["wasserstein", "psi", "kl", "ks_2samp", "ttest"]
+
+
+@CustomDriftMetric
+def slow_metric(new, reference, **kwargs):
+    time.sleep(0.2)
+    return abs(new.mean() - reference.mean())
+
+
+# Testing the asynchronous analyzer
+# =================================
+
+
+@pytest.mark.parametrize("executor", ["thread", "process"])
+def test_arun_matches_run(executor, current, reference, make_analyzer):
+    expected, analyzer = make_analyzer(metrics, features), make_analyzer(metrics, features)
+    expected.run(current, reference)
+    asyncio.run(analyzer.arun(current, reference, executor=executor, batch_size=3))
+    pd.testing.assert_frame_equal(
+        analyzer.results_to_pandas().drop(columns="eval_timestamp"), expected.results_to_pandas().drop(columns="eval_timestamp")
+    )
+
+
+def test_process_workers_receive_the_data_once(current, reference, make_analyzer):
+    plan = MetricPlan(make_analyzer(metrics, features)._metrics_list).compile(current, reference)
+    batch = plan.split(3)[0]
+    pool, owned = make_executor("process", current, reference)
+    try:
+        # Only the batch is sent to the workers
+        results = pool.submit(_execute_attached, batch).result()
+    finally:
+        pool.shutdown()
+    assert owned
+    expected = execute_batch(batch, current, reference)
+    assert [[r.metric_value for r in step] for step in results] == [[r.metric_value for r in step] for step in expected]
+
+
+def test_arun_does_not_block_the_loop(current, reference, make_analyzer):
+    analyzer = make_analyzer(["slow_metric"], features, name="slow")
+
+    async def main():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        task = asyncio.create_task(ticker())
+        await analyzer.arun(current, reference, batch_size=1)
+        task.cancel()
+        return ticks
+
+    assert asyncio.run(main()) > 40
+    assert len([result for result in analyzer._results if result.metric_name == "slow_metric"]) == len(features)
+
+
+def test_arun_timeout(current, reference, make_analyzer):
+    analyzer = make_analyzer(["slow_metric"], features, name="slow")
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(analyzer.arun(current, reference, batch_size=1, timeout=0.3))
+    assert analyzer._results is None
+
+
+def test_run_analyzers_limits_concurrency(current, reference, make_analyzer):
+    analyzers = [make_analyzer(["slow_metric"], ["MedInc"], name=f"slow_{i}") for i in range(4)]
+
+    start = time.perf_counter()
+    results = asyncio.run(run_analyzers(analyzers, current, reference, max_concurrency=2))
+    elapsed = time.perf_counter() - start
+    assert all(result is not None for result in results)
+    assert elapsed >= 2 * 0.2
@@ -0,0 +1,106 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from pulsar_metrics.exceptions import CustomExceptionPulsarMetric
+from pulsar_metrics.metrics import backends
+from pulsar_metrics.metrics.backends import implementations, select_implementation
+from pulsar_metrics.metrics.drift import DriftTestMetric
+from pulsar_metrics.metrics.performance import PerformanceMetric
+
+reference = pd.read_csv("data/california_ref.csv")
+current = pd.read_csv("data/california_new.csv")
+
+rng = np.random.default_rng(7)
+DRIFT_SAMPLES = {
+    "continuous": (current["MedInc"], reference["MedInc"]),
+    "ties": (current["HouseAge"], reference["HouseAge"]),
+    "shifted": (pd.Series(rng.normal(0.1, 1, 3000)), pd.Series(rng.normal(0, 1.2, 2000))),
+    "small": (pd.Series(rng.normal(size=6)), pd.Series(rng.normal(size=40))),
+    "missing": (pd.Series([1.0, np.nan, 3.0] * 10), pd.Series(np.arange(30.0))),
+    "categorical": (pd.Series(list("aabbc") * 20), pd.Series(list("abbcc") * 20)),
+}
+LABELS = {
+    "binary": (current["clf_target"], current["y_pred"]),
+    "float labels": (current["clf_target"].astype(float), current["y_pred"].astype(float)),
+    "one class": (np.zeros(50, dtype=int), np.zeros(50, dtype=int)),
+    "multiclass": (rng.integers(0, 3, 200), rng.integers(0, 3, 200)),
+}
+
+# Every backend registered for a metric, except the reference one
+ALTERNATIVES = [
+    (metric_name, backend)
+    for metric_name in backends._IMPLEMENTATIONS
+    for backend in implementations(metric_name)
+    if backend != "reference"
+]
+
+
+def call(func, *args):
+    """Result of a function, the exception type if it raises"""
+    try:
+        return func(*args)
+    except Exception as e:
+        return type(e)
+
+
+def assert_same(result, expected):
+    if isinstance(expected, type):
+        assert result is expected
+    elif hasattr(expected, "pvalue"):
+        assert result.statistic == pytest.approx(expected.statistic, nan_ok=True)
+        assert result.pvalue == pytest.approx(expected.pvalue, rel=1e-9, abs=1e-300, nan_ok=True)
+    else:
+        assert result == pytest.approx(expected, rel=1e-9, nan_ok=True)
+
+
+# Testing the parity of the backends with the reference functions
+# ================================================================
+
+
+@pytest.mark.parametrize("metric_name, backend", ALTERNATIVES)
+def test_backend_parity(metric_name, backend):
+    func, expected_func = implementations(metric_name)[backend].func, implementations(metric_name)["reference"].func
+    samples = LABELS if metric_name in backends.CONFUSION_METRICS else DRIFT_SAMPLES
+    for name, (x, y) in samples.items():
+        if (name == "multiclass") and (metric_name != "accuracy"):
+            # Multiclass labels need an average for the other metrics: both functions raise
+            continue
+        assert_same(call(func, x, y), call(expected_func, x, y))
+
+
+@pytest.mark.parametrize("kernel", ["bin_counts", "u_statistic", "confusion_counts"])
+def test_loop_kernels(kernel):
+    # The loops compiled with numba where it is installed, run by the interpreter here
+    values, edges = rng.normal(size=300).round(1), np.linspace(-2, 2, 9)
+    labels = (rng.integers(0, 2, 300), rng.integers(0, 2, 300))
+    args = {"bin_counts": (values, edges), "u_statistic": (values[:120], values[120:]), "confusion_counts": labels}[kernel]
+    result, expected = getattr(backends, f"_loop_{kernel}")(*args), getattr(backends, f"_{kernel}")(*args)
+    for part, expected_part in zip(
+        result if isinstance(result, tuple) else (result,), expected if isinstance(expected, tuple) else (expected,)
+    ):
+        assert np.asarray(part) == pytest.approx(np.asarray(expected_part))
+
+
+def test_select_implementation():
+    assert select_implementation("ks_2samp", 10**6) is implementations("ks_2samp")["reference"].func
+    assert select_implementation("manwu", 10) is implementations("manwu")["reference"].func
+    assert select_implementation("manwu", 1000) is implementations("manwu")["numpy"].func
+    assert select_implementation("manwu", 1000, {"method": "exact"}) is implementations("manwu")["reference"].func
+    assert select_implementation("psi", 1000, backend="reference") is implementations("psi")["reference"].func
+    with pytest.raises(CustomExceptionPulsarMetric):
+        select_implementation("ks_2samp", backend="numpy")
+
+
+def test_metrics_with_backends():
+    results = {
+        backend: DriftTestMetric("manwu", "MedInc").evaluate(current, reference, backend=backend)
+        for backend in ["numpy", "reference"]
+    }
+    assert results["numpy"].metric_value == pytest.approx(results["reference"].metric_value, rel=1e-9)
+    results = {
+        backend: PerformanceMetric("f1", y_name="clf_target").evaluate(current, bootstrap=True, n_bootstrap=20, backend=backend)
+        for backend in ["numpy", "reference"]
+    }
+    assert results["numpy"].metric_value == pytest.approx(results["reference"].metric_value)
+    assert results["numpy"].conf_int == pytest.approx(results["reference"].conf_int)
@@ -0,0 +1,96 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from pulsar_metrics.metrics.bootstrap import bootstrap_conf_int, bootstrap_replicates
+from pulsar_metrics.metrics.drift import DriftMetric, DriftTestMetric
+from pulsar_metrics.metrics.enums import DriftMetricsFuncs, DriftTestMetricsFuncs
+
+reference = pd.read_csv("data/california_ref.csv")
+current = pd.read_csv("data/california_new.csv")
+new, ref = current["MedInc"][:2000], reference["MedInc"][:2000]
+
+
+def _resampled_conf_int(metric_name, new, ref, n_bootstrap=200, seed=3):
+    """Percentile interval of the metric re-evaluated on resampled rows"""
+    test = metric_name in DriftTestMetricsFuncs._member_names_
+    func = (DriftTestMetricsFuncs if test else DriftMetricsFuncs)[metric_name].value
+    rng = np.random.default_rng(seed)
+    values = []
+    for _ in range(n_bootstrap):
+        result = func(
+            pd.Series(new.to_numpy()[rng.integers(0, len(new), len(new))]),
+            pd.Series(ref.to_numpy()[rng.integers(0, len(ref), len(ref))]),
+        )
+        values.append(result.pvalue if test else result)
+    return np.quantile(values, [0.025, 0.975])
+
+
+@pytest.mark.parametrize("metric_name", ["kl", "js", "wasserstein", "mmd"])
+def test_batched_conf_int_matches_resampled_rows(metric_name):
+    value = DriftMetricsFuncs[metric_name].value(new, ref)
+    low, high = bootstrap_conf_int(metric_name, new, ref, value, n_bootstrap=200)
+    expected_low, expected_high = _resampled_conf_int(metric_name, new, ref)
+    width = expected_high - expected_low
+    assert low <= value <= high
+    assert abs(low - expected_low) < 0.3 * width
+    assert abs(high - expected_high) < 0.3 * width
+
+
+@pytest.mark.parametrize("metric_name", ["ks_2samp", "ttest"])
+def test_batched_pvalue_conf_int_matches_resampled_rows(metric_name):
+    result = DriftTestMetricsFuncs[metric_name].value(new, ref)
+    low, high = bootstrap_conf_int(metric_name, new, ref, result.statistic, n_bootstrap=200)
+    expected_low, expected_high = _resampled_conf_int(metric_name, new, ref)
+    # p-values of drifted samples span orders of magnitude
+    assert low <= result.pvalue <= high
+    assert abs(np.log10(low) - np.log10(expected_low)) < 2
+    assert abs(np.log10(high) - np.log10(expected_high)) < 1
+
+
+@pytest.mark.parametrize("n_rows", [500, 5000])
+def test_wasserstein_conf_int_of_skewed_samples(n_rows):
+    # The quantile groups of the tails of lognormal samples are wide, the values of the groups are placed at their means
+    rng = np.random.default_rng(0)
+    new, ref = pd.Series(rng.lognormal(0.1, 1, n_rows)), pd.Series(rng.lognormal(0, 1, n_rows))
+    value = DriftMetricsFuncs["wasserstein"].value(new, ref)
+    low, high = bootstrap_conf_int("wasserstein", new, ref, value, n_bootstrap=400)
+    expected_low, expected_high = _resampled_conf_int("wasserstein", new, ref, n_bootstrap=400)
+    width = expected_high - expected_low
+    assert abs(low - expected_low) < 0.1 * width
+    assert abs(high - expected_high) < 0.1 * width
+
+
+def test_discrete_ecdf_replicates_are_row_resampling():
+    # With few distinct values, the groups are the values themselves: no shift is needed
+    new, ref = current["HouseAge"], reference["HouseAge"]
+    value = DriftMetricsFuncs["wasserstein"].value(new, ref)
+    shifted = bootstrap_replicates("wasserstein", new, ref, value, seed=1)
+    unshifted = bootstrap_replicates("wasserstein", new, ref, None, seed=1)
+    np.testing.assert_allclose(shifted, unshifted)
+
+
+def test_replicates_are_reproducible_and_skip_missing_values():
+    with_missing = pd.concat([new, pd.Series([np.nan] * 50)], ignore_index=True)
+    first = bootstrap_replicates("ks_2samp", with_missing, ref, seed=5)
+    np.testing.assert_array_equal(first, bootstrap_replicates("ks_2samp", new, ref, seed=5))
+    assert not np.isnan(first).any()
+
+
+def test_unbatched_metrics_resample_arrays():
+    result = DriftTestMetricsFuncs["levene"].value(new, ref)
+    replicates = bootstrap_replicates("levene", new, ref, func=DriftTestMetricsFuncs["levene"].value, n_bootstrap=20)
+    assert replicates.shape == (20,)
+    assert np.nanquantile(replicates, 0.025) <= result.pvalue <= np.nanquantile(replicates, 0.975)
+
+
+def test_drift_metrics_bootstrap_option():
+    metric = DriftMetric("wasserstein", "MedInc")
+    result = metric.evaluate(current, reference, bootstrap=True, n_bootstrap=50)
+    assert result.conf_int[0] <= result.metric_value <= result.conf_int[1]
+    assert metric.evaluate(current, reference).conf_int is None
+
+    result = DriftTestMetric("ttest", "MedInc").evaluate(current, reference, bootstrap=True, n_bootstrap=50)
+    assert result.conf_int[0] <= result.metric_value <= result.conf_int[1]
+    result = DriftMetric("psi", "HouseAge").evaluate(current, reference, bootstrap=True)
+    assert len(result.conf_int) == 2
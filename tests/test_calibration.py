@@ -0,0 +1,115 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from pulsar_metrics.analyzers.calibration import ThresholdCalibration
+from pulsar_metrics.analyzers.store import ReferenceStore
+from pulsar_metrics.exceptions import CustomExceptionPulsarMetric
+from pulsar_metrics.metrics.drift import DriftMetric, DriftTestMetric
+
+features = ["MedInc", "HouseAge", "AveOccup"]
+
+
+@pytest.fixture(scope="module")
+def frame(reference) -> pd.DataFrame:
+    """Reference of the model version of the thresholds"""
+    return reference.loc[(reference.model_id == 1) & (reference.model_version == 2)]
+
+
+def calibrated_metrics(make_metrics) -> list:
+    return make_metrics(DriftMetric, ["wasserstein", "kl"], features) + make_metrics(
+        DriftTestMetric, ["ks_2samp", "ttest"], features
+    )
+
+
+# Testing the calibration
+# =======================
+
+
+def test_fit_thresholds(frame, make_metrics):
+    thresholds = ThresholdCalibration.fit(frame, calibrated_metrics(make_metrics), n_splits=20)
+    assert len(thresholds) == 12
+    assert ("wasserstein", "MedInc") in thresholds
+    assert thresholds.threshold("wasserstein", "MedInc") > 0
+    assert 0 <= thresholds.threshold("ks_2samp", "MedInc") <= 1
+    assert thresholds.threshold("psi", "MedInc") is None
+    assert list(thresholds.to_pandas().columns) == ["metric_name", "feature", "threshold"]
+
+
+@pytest.mark.parametrize("executor", ["process", "thread"])
+def test_fit_parallel_parity(executor, frame, make_metrics):
+    sequential = ThresholdCalibration.fit(frame, calibrated_metrics(make_metrics), n_splits=10)
+    parallel = ThresholdCalibration.fit(frame, calibrated_metrics(make_metrics), n_splits=10, n_jobs=4, executor=executor)
+    assert sequential.to_dict() == parallel.to_dict()
+
+
+def test_null_false_alarm_rate(frame, make_metrics):
+    # Splits of the reference other than the calibration splits are flagged at about the target rate
+    thresholds = ThresholdCalibration.fit(frame, calibrated_metrics(make_metrics), n_splits=60, alpha=0.1, seed=1)
+    # The drift metrics flag their values above the thresholds
+    drift_options = {"wasserstein": {"upper_bound": False}, "kl": {"upper_bound": False}}
+    flags = 0
+    for split in range(40):
+        order = np.random.default_rng(5000 + split).permutation(len(frame))
+        half = len(frame) // 2
+        metrics = calibrated_metrics(make_metrics)
+        for metric in metrics:
+            metric.evaluate(current=frame.iloc[order[:half]], reference=frame.iloc[order[half:]])
+        results = thresholds.apply([metric._result for metric in metrics], options=drift_options)
+        flags += sum(result.drift_status for result in results)
+    assert flags / (40 * len(metrics)) < 0.25
+
+
+def test_apply_and_invalid_size(frame, current, reference, make_metrics):
+    thresholds = ThresholdCalibration({("wasserstein", "MedInc"): 1e9, ("ks_2samp", "MedInc"): 0.5})
+    metrics = [DriftMetric("wasserstein", "MedInc"), DriftTestMetric("ks_2samp", "MedInc")]
+    metrics[0].evaluate(current=current, reference=reference, threshold=0.0)
+    metrics[1].evaluate(current=current, reference=reference)
+    results = thresholds.apply([metric._result for metric in metrics])
+    # Same drift statuses as the metrics with the calibrated thresholds as their threshold options
+    assert results[0].threshold == 1e9 and results[0].drift_status
+    assert (
+        results[0].drift_status == DriftMetric("wasserstein", "MedInc").evaluate(current, reference, threshold=1e9).drift_status
+    )
+    assert results[1].threshold == 0.5 and results[1].drift_status
+    results = thresholds.apply([metric._result for metric in metrics], options={"wasserstein": {"upper_bound": False}})
+    assert not results[0].drift_status
+    with pytest.raises(CustomExceptionPulsarMetric):
+        ThresholdCalibration.fit(frame, calibrated_metrics(make_metrics), current_size=len(frame))
+
+
+def test_save_load(tmp_path, frame, make_metrics):
+    thresholds = ThresholdCalibration.fit(frame, calibrated_metrics(make_metrics), n_splits=5)
+    thresholds.save(str(tmp_path / "thresholds.json"))
+    loaded = ThresholdCalibration.load(str(tmp_path / "thresholds.json"))
+    assert loaded.to_dict() == thresholds.to_dict()
+
+
+# Testing the analyzer
+# ====================
+
+
+def test_analyzer_calibrate_and_run(current, reference, make_analyzer):
+    analysis = make_analyzer(["wasserstein", "kl", "ks_2samp", "ttest"], features, name="Calibrated")
+    thresholds = analysis.calibrate(reference, n_splits=20, n_jobs=2)
+    assert analysis.get_thresholds() is thresholds
+    analysis.run(current=current, reference=reference)
+    results = analysis.results_to_pandas()
+    drift = results[results.metric_type == "drift"].set_index(["metric_name", "feature_name"])
+    assert drift.loc[("wasserstein", "MedInc"), "threshold"] == pytest.approx(thresholds.threshold("wasserstein", "MedInc"))
+    assert drift.loc[("ttest", "MedInc"), "drift_status"]
+
+
+def test_stored_thresholds(tmp_path, current, reference, make_analyzer):
+    store = ReferenceStore(str(tmp_path))
+    store.put(reference, 1, 2)
+    analysis = make_analyzer(["wasserstein", "kl", "ks_2samp", "ttest"], features, name="Calibrated")
+    thresholds = analysis.calibrate(store.get(1, 2), n_splits=10)
+    stored = store.put_thresholds(thresholds, 1, 2)
+    assert stored.thresholds.to_dict() == thresholds.to_dict()
+
+    analysis = make_analyzer(["wasserstein", "kl", "ks_2samp", "ttest"], features, name="Calibrated")
+    analysis.run(current=current, reference=store.get(1, 2))
+    results = analysis.results_to_pandas()
+    kl = results[(results.metric_name == "kl") & (results.feature_name == "HouseAge")]
+    assert kl.threshold.iloc[0] == pytest.approx(thresholds.threshold("kl", "HouseAge"))
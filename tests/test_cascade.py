@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from pulsar_metrics.analyzers.cascade import Cascade
+from pulsar_metrics.exceptions import CustomExceptionPulsarMetric
+from pulsar_metrics.metrics.drift import DriftTestMetric
+from pulsar_metrics.metrics.histograms import psi_from_binned
+from pulsar_metrics.metrics.utils import psi_from_counts
+
+features = ["MedInc", "HouseAge", "AveRooms", "AveBedrms", "Population", "AveOccup", "Latitude", "Longitude"]
+metrics = ["psi", "CvM", "manwu", "levene"]
+
+
+def drift_results(analyzer):
+    results = analyzer.results_to_pandas()
+    return results.loc[results.metric_type == "drift"].set_index(["metric_name", "feature_name"])
+
+
+# Testing the cascaded screening
+# ==============================
+
+
+def test_psi_from_binned():
+    rng = np.random.default_rng(0)
+    new, ref = rng.integers(1, 50, size=(3, 8)), rng.integers(1, 50, size=(3, 8))
+    expected = [psi_from_counts(new[i], ref[i]) for i in range(3)]
+    assert psi_from_binned(new, ref, smoothing=0) == pytest.approx(expected)
+
+
+def test_invalid_screen():
+    with pytest.raises(CustomExceptionPulsarMetric):
+        Cascade(screen="median")
+
+
+@pytest.mark.parametrize("screen", ["psi", "moments"])
+def test_cascade_skips_stable_features(screen, reference, make_analyzer):
+    analyzer = make_analyzer(metrics, features)
+    analyzer.run(reference.iloc[::2], reference.iloc[1::2], cascade={"screen": screen, "threshold": 10.0})
+    results = drift_results(analyzer)
+    report = analyzer.get_cascade_report()
+
+    assert not report["suspect"].any()
+    assert report.set_index("feature_name")["skipped"].map(sorted).to_dict() == {
+        feature: ["CvM", "levene", "manwu"] for feature in features
+    }
+    # Skipped metrics are reported with no value, the cheap metrics are still computed
+    assert results.loc[["CvM", "manwu", "levene"], "metric_value"].isnull().all()
+    assert results.loc["psi", "metric_value"].notnull().all()
+
+
+def test_cascade_matches_full_run_on_suspect_features(current, reference, make_analyzer):
+    expected, analyzer = make_analyzer(metrics, features), make_analyzer(metrics, features)
+    expected.run(current, reference)
+    analyzer.run(current, reference, cascade=Cascade(screen="psi"))
+
+    report = analyzer.get_cascade_report().set_index("feature_name")
+    suspect = report.index[report["suspect"]]
+    assert len(suspect) > 0
+    computed, full = drift_results(analyzer), drift_results(expected)
+    for metric_name in ["CvM", "manwu", "levene"]:
+        assert computed.loc[metric_name].loc[suspect, "metric_value"].tolist() == pytest.approx(
+            full.loc[metric_name].loc[suspect, "metric_value"].tolist()
+        )
+    skipped = report.index[~report["suspect"]]
+    assert computed.loc["CvM"].loc[skipped, "metric_value"].isnull().all()
+
+
+def test_sampled_metrics_are_expensive():
+    cascade = Cascade(expensive=[])
+    metric = DriftTestMetric("ks_2samp", "MedInc")
+    assert not cascade.is_expensive(metric)
+    assert cascade.is_expensive(metric, {"ks_2samp": {"sampling": {"size": 1000}}})
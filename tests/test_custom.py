@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from pulsar_metrics.analyzers.base import Analyzer
+from pulsar_metrics.analyzers.plan import MetricPlan
+from pulsar_metrics.exceptions import CustomExceptionPulsarMetric as error_msg
+from pulsar_metrics.metrics.drift import CustomDriftMetric, evaluate_vectorized
+
+reference = pd.read_csv("data/california_ref.csv")
+current = pd.read_csv("data/california_new.csv")
+features = ["MedInc", "HouseAge", "AveRooms", "AveBedrms", "Population", "AveOccup"]
+
+
+@CustomDriftMetric
+def mean_shift(current, reference, **kwargs):
+    return abs(current.mean() - reference.mean()) / reference.std()
+
+
+@CustomDriftMetric(vectorized=True, name="mean_shift_batch", n_jobs=3)
+def mean_shift_vectorized(current, reference, **kwargs):
+    return np.abs(current.mean(axis=0) - reference.mean(axis=0)) / reference.std(axis=0, ddof=1)
+
+
+# Testing vectorized custom metrics
+# =================================
+
+
+def test_vectorized_matches_per_feature():
+    expected = [mean_shift(feature_name=feature).evaluate(current, reference, threshold=0.1) for feature in features]
+    metrics_list = [mean_shift_vectorized(feature_name=feature) for feature in features]
+    results = evaluate_vectorized(metrics_list, current, reference, threshold=0.1)
+    for result, single in zip(results, expected):
+        assert result.metric_value == pytest.approx(single.metric_value)
+        assert result.drift_status == single.drift_status
+        assert result.metric_name == "mean_shift_batch"
+
+
+def test_vectorized_single_metric_and_interval_threshold():
+    result = mean_shift_vectorized(feature_name="MedInc").evaluate(current, reference, threshold=[0.0, 0.1])
+    assert result.drift_status == (0.0 < result.metric_value < 0.1)
+
+
+def test_registry_and_batched_plan():
+    analyzer = Analyzer(name="custom", model_id=1, model_version=2)
+    analyzer.add_drift_metrics(["mean_shift_batch", "mean_shift"], features)
+    assert len(analyzer._metrics_list) == 2 * len(features)
+
+    explanation = MetricPlan(analyzer._metrics_list).compile(current, reference).explain()
+    assert (explanation["node"] == "vectorized").sum() == 1
+    analyzer.run(current, reference, options={"mean_shift_batch": {"threshold": 0.1}})
+    batched = [result for result in analyzer._results if result.metric_name == "mean_shift_batch"]
+    assert [result.feature_name for result in batched] == features
+
+
+def test_vectorized_output_shape_is_checked():
+    @CustomDriftMetric(vectorized=True)
+    def wrong_shape(current, reference, **kwargs):
+        return np.zeros(1)
+
+    with pytest.raises(error_msg):
+        evaluate_vectorized([wrong_shape(feature_name=feature) for feature in features[:2]], current, reference)
+
+
+def test_custom_name_cannot_shadow_drift_metric():
+    with pytest.raises(error_msg):
+        CustomDriftMetric(lambda current, reference: 0, name="psi")
@@ -0,0 +1,88 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from pulsar_metrics.analyzers.base import Analyzer
+from pulsar_metrics.analyzers.distributed import run_partitioned
+from pulsar_metrics.exceptions import CustomExceptionPulsarMetric
+from pulsar_metrics.metrics.drift import DriftMetric, DriftTestMetric
+from pulsar_metrics.metrics.performance import PerformanceMetric
+from pulsar_metrics.metrics.states import SerializableState
+
+rng = np.random.default_rng(2)
+n_rows = 3000
+current = pd.DataFrame(
+    {
+        "age": rng.integers(18, 90, n_rows),
+        "income": rng.lognormal(1.0, 0.5, n_rows),
+        "y_true": rng.integers(0, 2, n_rows),
+        "y_pred": rng.integers(0, 2, n_rows),
+        "y_pred_proba": rng.random(n_rows).round(2),
+    }
+)
+reference = current.assign(age=rng.integers(20, 95, n_rows), income=rng.lognormal(1.1, 0.5, n_rows))
+
+drift_tests = ["ttest", "ks_2samp", "manwu", "CvM", "levene", "bftest"]
+metrics_list = [DriftMetric(metric_name, "age") for metric_name in ["wasserstein", "psi", "mmd"]]
+metrics_list.extend(DriftTestMetric(metric_name, "age") for metric_name in drift_tests)
+metrics_list.append(DriftTestMetric("ttest", "income"))
+metrics_list.extend(PerformanceMetric(metric_name) for metric_name in ["accuracy", "precision", "recall", "f1"])
+metrics_list.extend(
+    PerformanceMetric(metric_name, pred_name="y_pred_proba") for metric_name in ["auc", "aucpr", "log_loss", "brier"]
+)
+
+# Testing the partition/merge/finalize protocol
+# =============================================
+
+
+def test_partitioned_run_matches_single_node():
+    single = run_partitioned(metrics_list, current, reference, n_partitions=1, processes=1)
+    partitioned = run_partitioned(metrics_list, current, reference, n_partitions=4, processes=2)
+    for expected, result in zip(single, partitioned):
+        assert result.metric_value == pytest.approx(expected.metric_value, rel=1e-9, abs=1e-300)
+
+
+def test_partitioned_run_matches_direct_evaluation():
+    partitioned = run_partitioned(metrics_list, current, reference, n_partitions=4, processes=1)
+    for metric, result in zip(metrics_list, partitioned):
+        direct = metric.evaluate(current, reference)
+        # The p-values of ks_2samp and CvM are asymptotic over partitions and exact in the direct evaluation
+        rel = 0.15 if metric._name in ["ks_2samp", "CvM"] else 1e-9
+        assert result.metric_value == pytest.approx(direct.metric_value, rel=rel)
+        assert result.drift_status == direct.drift_status
+
+
+def test_chi2_has_no_partial_state():
+    with pytest.raises(CustomExceptionPulsarMetric):
+        DriftTestMetric("chi2", "age").compute_partial(current, reference)
+
+
+# chi2 compares the two columns as frequencies of the same total
+permuted = reference.assign(age=rng.permutation(current["age"].to_numpy()))
+
+
+def test_metrics_without_partial_state_are_evaluated_directly():
+    direct_metrics = [DriftTestMetric("chi2", "age"), DriftMetric("missing_rate", "income")]
+    assert not any(metric.has_partial_state(current) for metric in direct_metrics)
+    results = run_partitioned([metrics_list[0], *direct_metrics], current, permuted, n_partitions=4, processes=2)
+    assert results[0].metric_value == pytest.approx(metrics_list[0].evaluate(current, permuted).metric_value)
+    for metric, result in zip(direct_metrics, results[1:]):
+        assert result.metric_value == pytest.approx(metric.evaluate(current, permuted).metric_value)
+
+
+def test_analyzer_partitioned_run_with_chi2():
+    analyzer = Analyzer(name="partitioned", model_id=1, model_version=1)
+    analyzer.add_drift_metrics(["wasserstein", "chi2", "ks_2samp"], ["age"])
+    model = {"model_id": 1, "model_version": 1, "pred_timestamp": "2024-01-01"}
+    analyzer.run_partitioned(current.assign(**model), permuted.assign(**model), n_partitions=4, processes=1)
+    results = analyzer.results_to_pandas()
+    assert set(results["metric_name"]) == {"wasserstein", "chi2", "ks_2samp"}
+
+
+@pytest.mark.parametrize("metric", metrics_list)
+def test_state_serialization(metric):
+    state = metric.compute_partial(current, reference)
+    restored = SerializableState.from_dict(json.loads(json.dumps(state.to_dict())))
+    assert metric.finalize(restored).metric_value == pytest.approx(metric.finalize(state).metric_value)
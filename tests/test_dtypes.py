@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from pulsar_metrics.analyzers.plan import Intermediates
+from pulsar_metrics.exceptions import CustomExceptionPulsarMetric as error_msg
+from pulsar_metrics.metrics.enums import DriftMetricsFuncs, DriftTestMetricsFuncs
+from pulsar_metrics.metrics.statistics import FeatureSummary
+from pulsar_metrics.utils import compact_dataframe
+
+# Documented accuracy of the float32 compute mode
+FLOAT32_RTOL = 1e-4
+FLOAT32_PVALUE_RTOL = 1e-3
+
+reference = pd.read_csv("data/california_ref.csv")
+current = pd.read_csv("data/california_new.csv")
+compact_reference = compact_dataframe(reference)
+compact_current = compact_dataframe(current)
+features = ["MedInc", "HouseAge", "AveRooms", "Population", "Latitude"]
+
+# Testing dtype-aware ingestion
+# ==============================
+
+
+def test_compact_dtypes():
+    client = compact_dataframe(pd.read_csv("data/dataframe_client.csv"))
+    assert compact_current["MedInc"].dtype == np.float32
+    assert compact_current["y_pred"].dtype == np.int8
+    assert compact_current["pred_timestamp"].dtype == np.int64
+    assert client["environment_id"].dtype == "category"
+    assert compact_current.memory_usage(deep=True).sum() < current.memory_usage(deep=True).sum() / 2
+
+
+def test_compact_timestamps_round_trip():
+    assert (pd.to_datetime(compact_current["pred_timestamp"]) == pd.to_datetime(current["pred_timestamp"])).all()
+
+
+def test_invalid_precision():
+    with pytest.raises(error_msg):
+        compact_dataframe(current, precision="float16")
+
+
+# Testing the accuracy of the float32 kernels
+# ==========================================
+
+
+@pytest.mark.parametrize("feature", features)
+@pytest.mark.parametrize("metric_name", ["wasserstein", "psi"])
+def test_float32_drift_metrics(metric_name, feature):
+    expected = DriftMetricsFuncs[metric_name].value(current[feature], reference[feature])
+    value = DriftMetricsFuncs[metric_name].value(compact_current[feature], compact_reference[feature])
+    assert value == pytest.approx(expected, rel=FLOAT32_RTOL)
+
+
+@pytest.mark.parametrize("feature", features)
+@pytest.mark.parametrize("metric_name", ["ttest", "ks_2samp", "levene"])
+def test_float32_drift_tests(metric_name, feature):
+    expected = DriftTestMetricsFuncs[metric_name].value(current[feature], reference[feature]).pvalue
+    pvalue = DriftTestMetricsFuncs[metric_name].value(compact_current[feature], compact_reference[feature]).pvalue
+    assert pvalue == pytest.approx(expected, rel=FLOAT32_PVALUE_RTOL, abs=1e-6)
+
+
+@pytest.mark.parametrize("feature", features)
+def test_float32_summary_statistics(feature):
+    expected, summary = FeatureSummary(feature), FeatureSummary(feature)
+    expected.evaluate(current, reference)
+    summary.evaluate(compact_current, compact_reference)
+    for expected_result, result in zip(expected.get_result(), summary.get_result()):
+        assert result.metric_value == pytest.approx(expected_result.metric_value, rel=FLOAT32_RTOL, abs=1e-6)
+
+
+def test_float32_plan_nodes():
+    nodes = Intermediates(compact_current, compact_reference)
+    assert nodes.get("values", "MedInc").dtype == np.float32
+    assert np.shares_memory(nodes.get("values", "MedInc"), compact_current["MedInc"].to_numpy())
+    assert nodes.get("sorted", "MedInc", "reference").dtype == np.float32
+    assert nodes.get("values", "y_pred").dtype == np.float64
+    moments = nodes.get("moments", "MedInc")
+    assert moments["mean"] == pytest.approx(current["MedInc"].mean(), rel=FLOAT32_RTOL)
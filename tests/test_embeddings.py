@@ -0,0 +1,132 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.stats import ks_2samp
+
+from pulsar_metrics.analyzers.base import Analyzer
+from pulsar_metrics.metrics.drift import DriftMetric, DriftTestMetric
+from pulsar_metrics.metrics.embeddings import (
+    _FINGERPRINTS,
+    _PROJECTIONS,
+    EmbeddingProjection,
+    embedding_drift,
+    fingerprint,
+    get_projection,
+    is_vector_column,
+    to_matrix,
+)
+
+reference = pd.read_csv("data/california_ref.csv")
+current = pd.read_csv("data/california_new.csv")
+rng = np.random.default_rng(0)
+# Embeddings with most of their variance on a few directions, shifted along the first one in the current data
+scales = np.r_[np.linspace(5, 2, 8), np.full(24, 0.5)]
+reference["embedding"] = list((rng.normal(size=(len(reference), 32)) * scales).astype(np.float32))
+current["embedding"] = list((rng.normal(size=(len(current), 32)) * scales + np.r_[3.0, np.zeros(31)]).astype(np.float32))
+
+
+# Testing the drift of embedding columns
+# ======================================
+
+
+def test_is_vector_column():
+    assert is_vector_column(reference["embedding"])
+    assert is_vector_column(np.zeros((3, 2)))
+    assert not is_vector_column(reference["MedInc"])
+    assert not is_vector_column(pd.Series(["a", "b"]))
+
+
+def test_chunked_transform():
+    projection = EmbeddingProjection(reference["embedding"], n_components=4, fit_size=2000)
+    matrix = to_matrix(current["embedding"], dtype=float)
+    expected = (matrix - projection._mean) @ projection._components
+    assert projection.transform(current["embedding"], chunk_size=1000) == pytest.approx(expected, rel=1e-4, abs=1e-4)
+    assert projection.explained_variance_ratio[0] > projection.explained_variance_ratio[-1]
+
+
+def test_projection_is_cached():
+    first, projected = get_projection(reference["embedding"], n_components=4)
+    second, _ = get_projection(reference["embedding"], n_components=4)
+    assert first is second
+    assert projected.shape[1] == 4
+    assert get_projection(reference["embedding"], n_components=4, method="random")[0] is not first
+
+
+def test_projection_cache_is_keyed_on_content():
+    _PROJECTIONS.clear()
+    first, _ = get_projection(reference.loc[reference.model_id == 1, "embedding"], n_components=4)
+    second, _ = get_projection(reference.loc[reference.model_id == 1, "embedding"], n_components=4)
+    assert first is second
+    assert len(_PROJECTIONS) == 1
+
+
+def test_fingerprint_is_memoized(monkeypatch):
+    _FINGERPRINTS.clear()
+    digest = fingerprint(reference["embedding"])
+
+    def fail(*args, **kwargs):
+        raise AssertionError("the embeddings were hashed again")
+
+    monkeypatch.setattr("pulsar_metrics.metrics.embeddings.to_matrix", fail)
+    assert fingerprint(reference["embedding"]) == digest
+    assert len(_FINGERPRINTS) == 1
+
+
+def test_missing_embeddings_are_left_out():
+    missing = current.copy()
+    missing.loc[::10, "embedding"] = None
+    missing_reference = reference.copy()
+    missing_reference.loc[::7, "embedding"] = None
+    value, _ = embedding_drift(ks_2samp, "ks_2samp", missing["embedding"], missing_reference["embedding"], test=True)
+    expected, _ = embedding_drift(
+        ks_2samp,
+        "ks_2samp",
+        missing["embedding"].dropna().reset_index(drop=True),
+        missing_reference["embedding"].dropna().reset_index(drop=True),
+        test=True,
+    )
+    assert value.pvalue == pytest.approx(expected.pvalue)
+    assert DriftMetric("wasserstein", "embedding").evaluate(missing, missing_reference).metric_value > 0
+
+
+def test_tests_without_axis_run_by_component():
+    batched, batched_components = embedding_drift(
+        ks_2samp, "ks_2samp", current["embedding"], reference["embedding"], test=True, n_components=4
+    )
+    looped, looped_components = embedding_drift(
+        lambda x, y: ks_2samp(x, y), "ks_2samp", current["embedding"], reference["embedding"], test=True, n_components=4
+    )
+    assert looped.pvalue == pytest.approx(batched.pvalue)
+    pd.testing.assert_frame_equal(looped_components, batched_components)
+
+
+@pytest.mark.parametrize("projection", ["pca", "random"])
+def test_embedding_drift_test(projection):
+    metric = DriftTestMetric("ks_2samp", "embedding")
+    result = metric.evaluate(current, reference, n_components=6, projection=projection)
+    components = metric.get_components()
+    assert result.drift_status
+    assert list(components.columns) == ["statistic", "pvalue"]
+    assert result.metric_value == pytest.approx(min(1.0, components["pvalue"].min() * len(components)))
+
+    stable = current.assign(embedding=list((rng.normal(size=(len(current), 32)) * scales).astype(np.float32)))
+    no_drift = DriftTestMetric("ks_2samp", "embedding").evaluate(stable, reference, n_components=6, projection=projection)
+    assert not no_drift.drift_status
+
+
+def test_embedding_drift_metric():
+    metric = DriftMetric("wasserstein", "embedding")
+    result = metric.evaluate(current, reference, n_components=5)
+    assert result.metric_value == pytest.approx(metric.get_components()["metric_value"].mean())
+    assert DriftMetric("wasserstein", "MedInc").evaluate(current, reference) is not None
+
+
+def test_analyzer_with_embedding_column():
+    analyzer = Analyzer(name="embeddings", model_id=1, model_version=2)
+    analyzer.add_drift_metrics(["wasserstein", "ks_2samp", "kl"], ["embedding", "MedInc"])
+    analyzer.run(current, reference)
+    results = analyzer.results_to_pandas()
+    assert "embedding" not in set(results.loc[results.metric_type == "summary", "feature_name"])
+    drift = results.loc[results.feature_name == "embedding"].set_index("metric_name")
+    assert set(drift.index) == {"wasserstein", "ks_2samp", "kl"}
+    assert drift.loc["ks_2samp", "drift_status"]
@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.spatial.distance import jensenshannon
+from scipy.stats import entropy
+
+from pulsar_metrics.analyzers.plan import MetricPlan, evaluate_metric
+from pulsar_metrics.metrics.drift import DriftMetric
+from pulsar_metrics.metrics.histograms import (
+    FrozenBinning,
+    js_divergence,
+    kl_divergence,
+    kl_from_counts,
+)
+
+reference = pd.read_csv("data/california_ref.csv")
+current = pd.read_csv("data/california_new.csv")
+
+# Testing the frozen binning
+# ==========================
+
+
+def test_numeric_bins_match_numpy_histogram():
+    edges = np.histogram_bin_edges(reference["HouseAge"], bins="sturges")
+    counts = FrozenBinning(reference, ["HouseAge"]).counts(reference)[0]
+    assert (counts == np.histogram(reference["HouseAge"], edges)[0]).all()
+
+
+def test_chunked_codes(monkeypatch):
+    features = ["MedInc", "HouseAge", "y_pred"]
+    data = current.astype({"HouseAge": np.float32, "y_pred": "Int64"})
+    data.loc[::50, "HouseAge"] = np.nan
+    data.loc[::70, "y_pred"] = pd.NA
+    binning = FrozenBinning(reference, features)
+    expected = binning.codes(data)
+    monkeypatch.setattr("constant.HISTOGRAM_CHUNK_SIZE", 1000)
+    codes = binning.codes(data)
+    assert (codes == expected).all()
+    assert (codes[::50, 1] == -1).all() and (codes[::70, 2] == -1).all()
+    reference_codes = binning.codes(reference)
+    for j, feature in enumerate(features):
+        edges = np.histogram_bin_edges(reference[feature], bins="sturges")
+        assert (np.bincount(reference_codes[:, j]) == np.histogram(reference[feature], edges)[0]).all()
+
+
+def test_unseen_categories_bin():
+    binning = FrozenBinning(pd.DataFrame({"color": ["red", "blue", "red", None]}), ["color"])
+    counts = binning.counts(pd.DataFrame({"color": ["red", "green", "green"]}))[0]
+    assert counts.tolist() == [1, 0, 2]
+
+
+# Testing the divergences
+# =======================
+
+
+@pytest.mark.parametrize("feature", ["MedInc", "HouseAge", "y_pred"])
+def test_divergences_match_scipy(feature):
+    binning = FrozenBinning(reference, [feature])
+    new, ref = binning.counts(current)[0] + 0.5, binning.counts(reference)[0] + 0.5
+    assert kl_divergence(current[feature], reference[feature]) == pytest.approx(entropy(new, ref))
+    assert js_divergence(current[feature], reference[feature]) == pytest.approx(jensenshannon(new, ref) ** 2)
+
+
+def test_no_smoothing_gives_infinite_divergence():
+    assert np.isinf(kl_from_counts(np.array([1, 1]), np.array([2, 0]), smoothing=0))[0]
+
+
+def test_batched_divergences_match_single_features():
+    metrics_list = [
+        DriftMetric(metric_name, feature) for metric_name in ["kl", "js"] for feature in ["MedInc", "AveRooms", "pred_timestamp"]
+    ]
+    plan = MetricPlan(metrics_list).compile(current, reference)
+    assert plan.explain()["node"].tolist() == ["binned"]
+    for metric, result in zip(metrics_list, plan.execute(current, reference)):
+        assert result.metric_value == pytest.approx(evaluate_metric(metric, current, reference).metric_value)
@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from pulsar_metrics.analyzers.base import Analyzer
+from pulsar_metrics.analyzers.history import MetricHistory
+
+rng = np.random.default_rng(5)
+features = ["age", "income", "city"]
+periods = pd.date_range("2022-01-01", periods=24 * 100, freq="H")
+daily_results = pd.DataFrame(
+    [
+        {
+            "metric_type": "drift",
+            "metric_name": "wasserstein",
+            "feature_name": feature,
+            "metric_value": rng.random(),
+            "drift_status": bool(rng.random() < rate),
+            "threshold": 0.5,
+            "conf_int": None,
+            "model_id": 1,
+            "model_version": 2,
+            "period_end": period,
+        }
+        for period in periods
+        for feature, rate in zip(features, [0.1, 0.5, 0.9])
+    ]
+)
+
+
+@pytest.fixture
+def history():
+    history = MetricHistory()
+    for _, chunk in daily_results.groupby(daily_results["period_end"].dt.date):
+        history.append(chunk, analyzer_name="hourly")
+    return history
+
+
+# Testing the metric history store
+# ================================
+
+
+def test_range_query(history):
+    series = history.query("wasserstein", "income", model_id=1, start="2022-02-01", end="2022-03-01")
+    expected = daily_results[
+        (daily_results["feature_name"] == "income") & (daily_results["period_end"].between("2022-02-01", "2022-02-28 23:00"))
+    ]
+    assert len(series) == len(expected) == 28 * 24
+    assert series["metric_value"].to_numpy() == pytest.approx(expected["metric_value"].to_numpy())
+
+
+def test_rollups(history):
+    weekly = history.query("wasserstein", "age", resolution="week")
+    assert weekly["n"].sum() == len(periods)
+    assert (weekly["bucket"].dt.dayofweek == 0).all()
+
+    daily = history.query("wasserstein", "age", resolution="day")
+    expected = daily_results[daily_results["feature_name"] == "age"].groupby(daily_results["period_end"].dt.date)
+    assert daily["mean"].to_numpy() == pytest.approx(expected["metric_value"].mean().to_numpy())
+    assert daily["n_drift"].to_numpy() == pytest.approx(expected["drift_status"].sum().to_numpy())
+
+
+def test_top_drifting(history):
+    top = history.top_drifting(k=2, start="2022-03-01", end="2022-03-08")
+    assert top["feature_name"].tolist() == ["city", "income"]
+    assert top["n"].tolist() == [7 * 24, 7 * 24]
+
+
+def test_compaction_keeps_rollups(history):
+    before = history.query("wasserstein", resolution="day")
+    deleted = history.compact(before="2022-03-01")
+    assert deleted == 59 * 24 * len(features)
+    assert history.query(start="2022-01-01", end="2022-03-01").empty
+    pd.testing.assert_frame_equal(history.query("wasserstein", resolution="day"), before)
+
+
+def test_analyzer_appends_results():
+    reference = pd.read_csv("data/california_ref.csv")
+    current = pd.read_csv("data/california_new.csv")
+    history = MetricHistory()
+    analyzer = Analyzer(name="california", model_id=1, model_version=2)
+    analyzer.add_drift_metrics(["ks_2samp"], ["MedInc", "HouseAge"])
+    analyzer.run(current, reference, history=history)
+    stored = history.query("ks_2samp")
+    assert sorted(stored["feature_name"]) == ["HouseAge", "MedInc"]
+    assert (stored["analyzer"] == "california").all()
+    assert (stored["period_end"] == pd.to_datetime(current["pred_timestamp"]).max()).all()
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from pulsar_metrics.analyzers.loadtest import Scenario, SyntheticStream, run_load_test
+from pulsar_metrics.exceptions import CustomExceptionPulsarMetric
+
+
+def make_scenario(**kwargs):
+    parameters = {
+        "name": "test",
+        "rows": 500,
+        "features": 10,
+        "windows": 3,
+        "metrics": ["ks_2samp"],
+        "drifts": [{"feature": "MedInc", "kind": "mean", "magnitude": 1.0, "start": 1}],
+    }
+    return Scenario(**{**parameters, **kwargs})
+
+
+# Testing the load-test harness
+# =============================
+
+
+def test_load_scenarios():
+    scenarios = Scenario.load("benchmarks/scenario.json")
+    assert [scenario.dataset for scenario in scenarios] == ["california", "kidney"]
+    assert Scenario.from_dict(scenarios[0].to_dict()).to_dict() == scenarios[0].to_dict()
+    with pytest.raises(CustomExceptionPulsarMetric):
+        Scenario("test", drifts=[{"feature": "MedInc", "kind": "skew"}])
+
+
+def test_synthetic_stream():
+    stream = SyntheticStream(make_scenario(model_versions=2))
+    assert len(stream.features) == 10
+    assert stream.features[8:] == ["MedInc_1", "HouseAge_1"]
+    reference, before, after = stream.reference(2), stream.window(0, 2), stream.window(1, 2)
+    assert len(before) == 500 and (after.model_version == 2).all()
+    assert reference is stream.reference(2)
+    shift = (after.MedInc.mean() - before.MedInc.mean()) / reference.MedInc.std()
+    assert shift == pytest.approx(1.0, abs=0.25)
+    assert after.HouseAge.mean() == pytest.approx(before.HouseAge.mean(), rel=0.1)
+
+
+@pytest.mark.parametrize(
+    "drift", [{"kind": "variance", "magnitude": 1.0}, {"kind": "category", "magnitude": 0.5}], ids=lambda d: d["kind"]
+)
+def test_injected_shifts(drift):
+    stream = SyntheticStream(make_scenario(drifts=[{"feature": "HouseAge", "start": 1, **drift}]))
+    before, after = stream.window(0, 1).HouseAge, stream.window(1, 1).HouseAge
+    if drift["kind"] == "variance":
+        assert after.std() / before.std() == pytest.approx(2.0, rel=0.2)
+    else:
+        rarest = stream._base.HouseAge.value_counts().idxmin()
+        assert np.mean(after == rarest) == pytest.approx(0.5, abs=0.1)
+
+
+def test_run_load_test():
+    report = run_load_test(make_scenario(model_versions=2), label="dev")
+    summary = report.summary()
+    assert summary["runs"] == 6 and summary["failed_runs"] == 0
+    assert 0 < summary["latency_p50"] <= summary["latency_p99"]
+    assert summary["runs_per_hour"] > 0 and summary["features_per_hour"] == pytest.approx(10 * summary["runs_per_hour"])
+    detections = report.detections()
+    assert detections.detected.tolist() == [1, 1]
+    assert detections.delay.tolist() == [0, 0]
+    assert report.to_dict()["summary"]["label"] == "dev"
@@ -0,0 +1,101 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from pulsar_metrics.analyzers.memory import parse_memory
+from pulsar_metrics.analyzers.plan import Intermediates
+from pulsar_metrics.exceptions import CustomExceptionPulsarMetric
+from pulsar_metrics.metrics.ranking import ProbabilisticKernel
+from pulsar_metrics.metrics.utils import (
+    max_mean_discrepency,
+    sturges_bin_edges,
+    sturges_edges,
+)
+
+features = ["MedInc", "HouseAge", "Population"]
+metrics = ["wasserstein", "ks_2samp", "psi", "kl", "mmd"]
+
+
+# Testing the memory-budgeted runs
+# ================================
+
+
+def test_parse_memory():
+    assert parse_memory("2GB") == 2 * 10**9
+    assert parse_memory("512 MiB") == 512 * 2**20
+    assert parse_memory("1.5kb") == 1500
+    assert parse_memory(4096) == 4096
+    with pytest.raises(CustomExceptionPulsarMetric):
+        parse_memory("2 parsecs")
+
+
+@pytest.mark.parametrize(
+    "samples",
+    [
+        (np.random.default_rng(1).normal(size=1000), np.random.default_rng(2).normal(1, 2, size=321)),
+        (np.arange(50), np.arange(20, 90)),
+        (np.full(10, 3.0), np.full(5, 3.0)),
+    ],
+)
+def test_sturges_bin_edges(samples):
+    assert sturges_bin_edges(*samples) == pytest.approx(np.histogram_bin_edges(np.concatenate(samples), bins="sturges"))
+
+
+@pytest.mark.parametrize("n, n_bins", [(1, 1), (1000, 11), (1024, 11), (1025, 12)])
+def test_sturges_edges(n, n_bins):
+    assert len(sturges_edges(-1.0, 2.0, n)) == n_bins + 1
+    assert sturges_edges(3.0, 3.0, n) == pytest.approx([2.5, 3.5])
+
+
+def test_blocked_mmd(current, reference):
+    new, ref = current[features].iloc[:700], reference[features].iloc[:500]
+    expected = max_mean_discrepency(new, ref, kernel="rbf")
+    assert max_mean_discrepency(new, ref, kernel="rbf", block_size=64) == pytest.approx(expected, rel=1e-9)
+
+
+def test_batched_ranking_bootstrap():
+    rng = np.random.default_rng(3)
+    y_true, y_score = rng.integers(0, 2, 2000), rng.random(2000)
+    expected = ProbabilisticKernel(y_true, y_score).bootstrap(n_bootstrap=30)
+    batched = ProbabilisticKernel(y_true, y_score).bootstrap(n_bootstrap=30, max_batch_cells=5000)
+    for name, values in expected.items():
+        assert batched[name] == pytest.approx(values)
+
+
+def test_spilled_nodes(current, reference):
+    nodes = Intermediates(current, reference, spill_threshold=0)
+    spilled = nodes.get("sorted", "MedInc", "current")
+    assert isinstance(spilled, np.memmap)
+    assert np.array_equal(spilled, np.sort(current["MedInc"].to_numpy(dtype=float)))
+    directory = nodes._spill_dir.name
+    nodes.close()
+    assert not os.path.exists(directory)
+
+
+def test_run_within_large_budget_matches_run(current, reference, make_analyzer):
+    expected, analyzer = make_analyzer(metrics, features), make_analyzer(metrics, features)
+    expected.run(current, reference)
+    analyzer.run(current, reference, memory_limit="2GB")
+    pd.testing.assert_frame_equal(
+        analyzer.results_to_pandas().drop(columns="eval_timestamp"), expected.results_to_pandas().drop(columns="eval_timestamp")
+    )
+    report = analyzer.get_memory_report()
+    assert report["adjustments"] == {}
+    assert 0 < report["peak"] <= report["memory_limit"]
+
+
+def test_run_chunks_metrics_over_budget(current, reference, make_analyzer):
+    options = {"mmd": {"kernel": "rbf"}}
+    expected, analyzer = make_analyzer(metrics, features), make_analyzer(metrics, features)
+    expected._metrics_list = [metric for metric in expected._metrics_list if metric._name == "mmd"]
+    analyzer._metrics_list = [metric for metric in analyzer._metrics_list if metric._name == "mmd"]
+    expected.run(current.iloc[:3000], reference.iloc[:2000], options=options)
+    analyzer.run(current.iloc[:3000], reference.iloc[:2000], options=options, memory_limit="20MB")
+
+    report = analyzer.get_memory_report()
+    assert report["adjustments"]["mmd"].startswith("block_size=")
+    assert report["within_limit"]
+    values = [result.metric_value for result in analyzer._results if result.metric_name == "mmd"]
+    assert values == pytest.approx([result.metric_value for result in expected._results if result.metric_name == "mmd"])
@@ -0,0 +1,158 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from pulsar_metrics.analyzers.plan import Intermediates, MetricPlan
+from pulsar_metrics.metrics.drift import DriftMetric, DriftTestMetric
+from pulsar_metrics.metrics.performance import PerformanceMetric
+from pulsar_metrics.metrics.utils import missing_rate, missing_rate_drift
+
+features = ["MedInc", "HouseAge", "Population"]
+DRIFT_METRICS = ["wasserstein", "psi", "mmd"]
+TEST_METRICS = ["ttest", "ks_2samp", "manwu", "CvM", "levene", "bftest"]
+
+
+@pytest.fixture(scope="module")
+def missing(current, reference) -> tuple:
+    """Current and reference datasets with missing values"""
+    rng = np.random.default_rng(11)
+    missing_current, missing_reference = current.copy(), reference.copy()
+    for data, rate in ((missing_current, 0.3), (missing_reference, 0.05)):
+        for feature in features:
+            data.loc[rng.random(len(data)) < rate, feature] = np.nan
+        data["category"] = np.where(rng.random(len(data)) < rate, None, "a")
+    return missing_current, missing_reference
+
+
+def drift_metrics(make_metrics) -> list:
+    return make_metrics(DriftMetric, DRIFT_METRICS, features) + make_metrics(DriftTestMetric, TEST_METRICS, features)
+
+
+# Testing the masked kernels
+# ==========================
+
+
+def test_masked_kernels_skip_missing_values(missing, make_metrics):
+    missing_current, missing_reference = missing
+    plan = MetricPlan(drift_metrics(make_metrics)).compile(missing_current, missing_reference)
+    assert "direct" not in plan.explain()["node"].values
+    results = plan.execute(missing_current, missing_reference, progress=False)
+    for metric, result in zip(drift_metrics(make_metrics), results):
+        expected = metric.evaluate(
+            missing_current[[metric._feature_name]].dropna(), missing_reference[[metric._feature_name]].dropna()
+        )
+        assert result.metric_value == pytest.approx(expected.metric_value, rel=1e-9, abs=1e-300)
+
+
+@pytest.mark.parametrize("metric_name", ["wasserstein", "psi", "kl", "js", "ttest", "ks_2samp"])
+def test_direct_evaluation_skips_missing_values(metric_name, missing):
+    missing_current, missing_reference = missing
+    metric_class = DriftTestMetric if metric_name in TEST_METRICS else DriftMetric
+    for feature in ["MedInc", "category"]:
+        result = metric_class(metric_name, feature).evaluate(missing_current, missing_reference)
+        expected = metric_class(metric_name, feature).evaluate(
+            missing_current[[feature]].dropna(), missing_reference[[feature]].dropna()
+        )
+        if expected is None:
+            assert result is None
+        else:
+            assert result.metric_value == pytest.approx(expected.metric_value, rel=1e-9, abs=1e-300)
+
+
+@pytest.mark.parametrize("metric_name", ["wasserstein", "ks_2samp"])
+def test_sampled_evaluation_skips_missing_values(metric_name, missing):
+    missing_current, missing_reference = missing
+    metric_class = DriftTestMetric if metric_name in TEST_METRICS else DriftMetric
+    result = metric_class(metric_name, "MedInc").evaluate(missing_current, missing_reference, sampling={"size": 3000})
+    assert np.isfinite(result.metric_value) and np.isfinite(result.conf_int).all()
+    assert result.sample_size == 3000
+    # Without a size limit, the samples are the valid rows
+    exact = metric_class(metric_name, "MedInc").evaluate(missing_current, missing_reference)
+    unlimited = metric_class(metric_name, "MedInc").evaluate(missing_current, missing_reference, sampling={"size": None})
+    assert unlimited.metric_value == pytest.approx(exact.metric_value)
+    assert unlimited.conf_int is None
+
+
+def test_performance_skips_rows_without_label(current):
+    rng = np.random.default_rng(12)
+    data = current.assign(y_pred_proba=current["y_pred_proba"].where(rng.random(len(current)) > 0.1))
+    for metric_name in ["auc", "brier"]:
+        metric = PerformanceMetric(metric_name, y_name="clf_target", pred_name="y_pred_proba")
+        expected = metric.evaluate(data.dropna(subset=["y_pred_proba"])).metric_value
+        assert metric.evaluate(data, bootstrap=True, n_bootstrap=20).metric_value == pytest.approx(expected)
+        assert metric._n_sample == data["y_pred_proba"].notna().sum()
+
+
+def test_sorted_nodes_are_views_of_the_valid_values(missing, current, reference):
+    missing_current, missing_reference = missing
+    nodes = Intermediates(missing_current, missing_reference)
+    mask = nodes.get("mask", "MedInc", "current")
+    sorted_values = nodes.get("sorted", "MedInc", "current")
+    assert len(sorted_values) == mask.sum()
+    assert sorted_values.base is not None
+    assert not np.isnan(sorted_values).any()
+    assert nodes.get("mask", "MedInc", "reference").dtype == bool
+    assert Intermediates(current, reference).get("mask", "MedInc", "current") is None
+
+
+# Testing the missing-rate metrics
+# ================================
+
+
+def test_missing_rate_functions():
+    assert missing_rate(pd.Series([1.0, np.nan, 3.0, np.nan])) == 0.5
+    assert missing_rate(pd.Series([], dtype=float)) == 0.0
+    assert missing_rate_drift(pd.Series(["a", None]), pd.Series(["a", "b", "c", None])) == pytest.approx(0.25)
+
+
+@pytest.mark.parametrize("feature", ["MedInc", "category"])
+def test_missing_rate_metrics_share_the_masks(feature, missing):
+    missing_current, missing_reference = missing
+    metrics = [DriftMetric("missing_rate", feature), DriftMetric("missing_rate_drift", feature), DriftMetric("psi", feature)]
+    plan = MetricPlan(metrics).compile(missing_current, missing_reference)
+    explanation = plan.explain()
+    mask_nodes = explanation[explanation["node"] == "mask"]
+    assert set(mask_nodes["side"]) == {"current", "reference"}
+    assert "missing_rate_drift" in mask_nodes["consumers"].iloc[0]
+
+    results = plan.execute(missing_current, missing_reference, progress=False)
+    expected_rate = missing_current[feature].isnull().mean()
+    assert results[0].metric_value == pytest.approx(expected_rate)
+    assert results[1].metric_value == pytest.approx(abs(expected_rate - missing_reference[feature].isnull().mean()))
+    assert results[1].metric_value == pytest.approx(
+        DriftMetric("missing_rate_drift", feature).evaluate(missing_current, missing_reference).metric_value
+    )
+
+
+def test_analyzer_with_missing_values(missing, make_analyzer):
+    missing_current, missing_reference = missing
+    analyzer = make_analyzer(["ks_2samp", "missing_rate_drift"], features, name="missing")
+    analyzer.run(current=missing_current, reference=missing_reference, options={"missing_rate_drift": {"threshold": 0.1}})
+    results = analyzer.results_to_pandas()
+    drift = results[results["metric_name"] == "missing_rate_drift"]
+    assert len(drift) == len(features)
+    assert drift["metric_value"].between(0.2, 0.3).all()
+    assert results.loc[results["metric_name"] == "ks_2samp", "metric_value"].notnull().all()
+
+
+# Testing the results of failing metrics
+# ======================================
+
+
+def test_failing_evaluation_resets_the_result(missing, current, reference):
+    missing_current, missing_reference = missing
+    metric = DriftTestMetric("chi2", "MedInc")
+    assert metric.get_result() is None
+    assert metric.evaluate(current, reference) is None
+    assert metric.get_result() is None
+
+    metric = DriftTestMetric("ttest", "MedInc")
+    assert metric.evaluate(missing_current, missing_reference) is not None
+    assert metric.evaluate(missing_current, missing_reference.drop(columns=["MedInc"])) is None
+    assert metric.get_result() is None
+
+
+def test_failing_metrics_have_no_result_in_the_plan(current, reference):
+    metrics = [DriftTestMetric("chi2", "MedInc"), DriftTestMetric("ttest", "MedInc")]
+    results = MetricPlan(metrics).compile(current, reference).execute(current, reference, progress=False)
+    assert [result.metric_name for result in results] == ["ttest"]
@@ -0,0 +1,40 @@
+import pytest
+
+from pulsar_metrics.analyzers.plan import MetricPlan, evaluate_metric
+from pulsar_metrics.metrics.drift import DriftMetric, DriftTestMetric
+from pulsar_metrics.metrics.performance import PerformanceMetric
+
+features = ["MedInc", "HouseAge", "Population"]
+
+
+def plan_metrics(make_metrics) -> list:
+    metrics = make_metrics(DriftMetric, ["wasserstein", "psi", "mmd"], features)
+    metrics += make_metrics(DriftTestMetric, ["ttest", "ks_2samp", "manwu", "CvM", "levene", "bftest"], features)
+    metrics.extend(
+        PerformanceMetric(metric_name, y_name="clf_target", pred_name="y_pred_proba")
+        for metric_name in ["auc", "aucpr", "log_loss", "brier"]
+    )
+    return metrics
+
+
+# Testing the metric plan
+# =======================
+
+
+def test_plan_matches_direct_evaluation(current, reference, make_metrics):
+    plan = MetricPlan(plan_metrics(make_metrics), summary_features=features).compile(current, reference)
+    n_metrics = len(plan._metrics_list)
+    results = plan.execute(current, reference)[-n_metrics:]
+    for metric, result in zip(plan_metrics(make_metrics), results):
+        expected = evaluate_metric(metric, current, reference)
+        assert result.metric_value == pytest.approx(expected.metric_value, rel=1e-9, abs=1e-300)
+        assert result.drift_status == expected.drift_status
+
+
+def test_explain_shares_nodes(current, reference, make_metrics):
+    explanation = MetricPlan(plan_metrics(make_metrics), summary_features=features).compile(current, reference).explain()
+    sorted_nodes = explanation[explanation["node"] == "sorted"]
+    assert len(sorted_nodes) == 2 * len(features)
+    assert sorted_nodes["consumers"].apply(len).min() == 7
+    assert (explanation["node"] == "ranking").sum() == 1
+    assert "direct" not in explanation["node"].values
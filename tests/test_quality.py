@@ -0,0 +1,107 @@
+import numpy as np
+import pytest
+
+from pulsar_metrics.analyzers.base import Analyzer
+from pulsar_metrics.analyzers.plan import MetricPlan
+from pulsar_metrics.exceptions import CustomExceptionPulsarMetric
+from pulsar_metrics.metrics.quality import DataQualityMetric
+from pulsar_metrics.metrics.utils import (
+    constant_column,
+    duplicate_rows,
+    out_of_range_rate,
+    unseen_category_rate,
+)
+
+features = ["MedInc", "HouseAge", "region"]
+CHECKS = ["null_rate", "out_of_range_rate", "unseen_category_rate", "constant_column"]
+
+
+@pytest.fixture(scope="module")
+def data(current, reference) -> tuple:
+    """Current and reference datasets with a categorical feature, missing and out of range values"""
+    rng = np.random.default_rng(3)
+    current, reference = current.copy(), reference.copy()
+    reference["region"] = rng.choice(["north", "south", "east"], size=len(reference))
+    current["region"] = rng.choice(["north", "south", "east", "west"], size=len(current), p=[0.3, 0.3, 0.3, 0.1])
+    current.loc[rng.random(len(current)) < 0.1, "MedInc"] = np.nan
+    current.loc[:99, "HouseAge"] = reference["HouseAge"].max() + 1
+    return current, reference
+
+
+def quality_metrics(make_metrics) -> list:
+    return make_metrics(DataQualityMetric, CHECKS, features) + [DataQualityMetric("duplicate_rows", columns=features)]
+
+
+# Testing the quality functions
+# =============================
+
+
+def test_quality_functions(data):
+    current, reference = data
+    outside = ~current["HouseAge"].between(reference["HouseAge"].min(), reference["HouseAge"].max())
+    assert out_of_range_rate(current["HouseAge"], reference["HouseAge"]) == pytest.approx(outside.mean())
+    assert out_of_range_rate(current["region"], reference["region"]) is None
+    assert unseen_category_rate(current["region"], reference["region"]) == pytest.approx((current["region"] == "west").mean())
+    assert unseen_category_rate(current["MedInc"], reference["MedInc"]) is None
+    assert constant_column(current["model_id"]) == 1.0
+    assert constant_column(current["MedInc"]) == 0.0
+    rows = current[["model_id", "model_version"]]
+    assert duplicate_rows(rows) == pytest.approx(1 - 1 / len(rows))
+
+
+def test_unknown_check():
+    with pytest.raises(CustomExceptionPulsarMetric):
+        DataQualityMetric("unknown", "MedInc")
+
+
+def test_inapplicable_checks_have_no_result(data):
+    current, reference = data
+    assert DataQualityMetric("out_of_range_rate", "region").evaluate(current, reference) is None
+    assert DataQualityMetric("unseen_category_rate", "MedInc").evaluate(current, reference) is None
+
+
+# Testing the fused evaluation
+# ============================
+
+
+def test_shared_and_direct_parity(data, make_metrics):
+    current, reference = data
+    plan = MetricPlan(quality_metrics(make_metrics), summary_features=features).compile(current, reference)
+    explanation = plan.explain()
+    assert "direct" not in explanation["node"].values
+    assert {"mask", "sorted", "categories", "row_hashes"} <= set(explanation["node"])
+    results = [result for result in plan.execute(current, reference, progress=False) if result.metric_type == "quality"]
+    expected = [metric.evaluate(current, reference) for metric in quality_metrics(make_metrics)]
+    expected = [result for result in expected if result is not None]
+    assert [(r.metric_name, r.feature_name) for r in results] == [(r.metric_name, r.feature_name) for r in expected]
+    for result, direct in zip(results, expected):
+        assert result.metric_value == pytest.approx(direct.metric_value)
+        assert result.drift_status == direct.drift_status
+
+
+def test_categorical_summary_shares_the_categories(data):
+    current, reference = data
+    plan = MetricPlan([DataQualityMetric("unseen_category_rate", "region")], summary_features=["region"])
+    plan.compile(current, reference)
+    explanation = plan.explain()
+    categories = explanation[(explanation["node"] == "categories") & (explanation["side"] == "current")]
+    assert len(categories) == 1
+    assert len(categories["consumers"].iloc[0]) == 2
+    results = plan.execute(current, reference, progress=False)
+    count = [result for result in results if result.metric_name == "count"]
+    assert count[0].metric_value == current["region"].count()
+
+
+def test_analyzer_quality_checks(data):
+    current, reference = data
+    analyzer = Analyzer(name="quality", model_id=1, model_version=2)
+    analyzer.add_quality_metrics(metrics_list=CHECKS + ["duplicate_rows"], features_list=features)
+    analyzer.run(current=current, reference=reference, options={"null_rate": {"threshold": 0.2}})
+    results = analyzer.results_to_pandas()
+    quality = results[results["metric_type"] == "quality"].set_index(["metric_name", "feature_name"])
+    assert quality.loc[("null_rate", "MedInc"), "metric_value"] == pytest.approx(0.1, abs=0.02)
+    assert not quality.loc[("null_rate", "MedInc"), "drift_status"]
+    assert quality.loc[("out_of_range_rate", "HouseAge"), "drift_status"]
+    assert quality.loc[("unseen_category_rate", "region"), "drift_status"]
+    assert ("out_of_range_rate", "region") not in quality.index
+    assert len(quality.xs("duplicate_rows", level="metric_name")) == 1
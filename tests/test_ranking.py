@@ -0,0 +1,31 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from pulsar_metrics.metrics.enums import PerformanceMetricsFuncs
+from pulsar_metrics.metrics.performance import PerformanceMetric
+from pulsar_metrics.metrics.ranking import RANKING_METRICS, ProbabilisticKernel
+
+rng = np.random.default_rng(1)
+n_rows = 2000
+df = pd.DataFrame({"y_true": rng.integers(0, 2, n_rows)})
+# Rounded scores to exercise ties
+df["y_pred_proba"] = np.clip(0.4 * df["y_true"] + 0.6 * rng.random(n_rows), 0, 1).round(2)
+
+# Testing the sort-once kernel against sklearn
+# ============================================
+
+
+def test_kernel_matches_sklearn():
+    values = ProbabilisticKernel(df["y_true"], df["y_pred_proba"]).evaluate()
+    for metric_name in RANKING_METRICS:
+        expected = PerformanceMetricsFuncs[metric_name].value(df["y_true"], df["y_pred_proba"])
+        assert values[metric_name] == pytest.approx(expected)
+
+
+@pytest.mark.parametrize("metric_name", RANKING_METRICS)
+def test_weighted_bootstrap_matches_resampling(metric_name):
+    metric = PerformanceMetric(metric_name=metric_name, pred_name="y_pred_proba")
+    result = metric.evaluate(current=df, bootstrap=True, n_bootstrap=20)
+    expected = metric._bootstrap(current=df, n_bootstrap=20)
+    assert result.conf_int == pytest.approx(expected)
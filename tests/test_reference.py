@@ -0,0 +1,90 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.stats import ttest_ind
+
+from pulsar_metrics.analyzers.base import Analyzer
+from pulsar_metrics.exceptions import CustomExceptionPulsarMetric
+from pulsar_metrics.metrics.drift import DriftMetric, DriftTestMetric
+from pulsar_metrics.metrics.reference import DecayedReference
+from pulsar_metrics.metrics.states import SerializableState
+
+reference = pd.read_csv("data/california_ref.csv")
+current = pd.read_csv("data/california_new.csv")
+features = ["MedInc", "HouseAge", "Population"]
+windows = np.array_split(reference, 4)
+
+
+# Testing the decayed reference
+# =============================
+
+
+def test_invalid_decay():
+    with pytest.raises(CustomExceptionPulsarMetric):
+        DecayedReference()
+    with pytest.raises(CustomExceptionPulsarMetric):
+        DecayedReference(decay=0.5, horizon=3)
+    with pytest.raises(CustomExceptionPulsarMetric):
+        DecayedReference(decay=1.5)
+
+
+def test_horizon_reference_matches_full_reference():
+    decayed = DecayedReference(horizon=4)
+    for window in [current] + windows:
+        decayed.update(window, features)
+    assert decayed.size("MedInc") == len(reference)
+
+    result = DriftTestMetric("ttest", "MedInc").evaluate(current, decayed)
+    assert result.metric_value == pytest.approx(ttest_ind(current["MedInc"], reference["MedInc"], equal_var=False).pvalue)
+    expected = DriftMetric("kl", "HouseAge").evaluate(current, reference)
+    assert DriftMetric("kl", "HouseAge").evaluate(current, decayed).metric_value == pytest.approx(expected.metric_value)
+
+
+def test_empty_window_has_no_p_value():
+    decayed = DecayedReference(horizon=2).update(reference, features)
+    empty = current.assign(MedInc=np.nan)
+    for metric_name in ["CvM", "ks_2samp"]:
+        assert np.isnan(DriftTestMetric(metric_name, "MedInc").evaluate(empty, decayed).metric_value)
+
+
+def test_decay_weights_the_recent_windows():
+    decayed = DecayedReference(half_life=1)
+    for window in windows:
+        decayed.update(window, features)
+    weights = np.repeat([0.125, 0.25, 0.5, 1.0], [len(window) for window in windows])
+    moments = decayed.side_state("MedInc")["moments"]
+    assert moments.n == pytest.approx(weights.sum())
+    assert moments.mean == pytest.approx(np.average(reference["MedInc"], weights=weights))
+    assert decayed.side_state("MedInc")["sketch"].n == pytest.approx(weights.sum())
+
+
+def test_categorical_feature():
+    data = reference.assign(region=np.where(reference["Latitude"] > 36, "north", "south"))
+    decayed = DecayedReference(decay=0.9).update(data, ["region"])
+    drifted = current.assign(region="north")
+    assert DriftMetric("psi", "region").evaluate(drifted, decayed).metric_value > 0.1
+    assert DriftMetric("wasserstein", "region").evaluate(drifted, decayed) is None
+
+
+def test_serialization():
+    decayed = DecayedReference(horizon=2)
+    for window in windows:
+        decayed.update(window, features)
+    restored = SerializableState.from_dict(json.loads(json.dumps(decayed.to_dict())))
+    assert restored.size("HouseAge") == decayed.size("HouseAge")
+    expected = DriftTestMetric("ks_2samp", "HouseAge").evaluate(current, decayed).metric_value
+    assert DriftTestMetric("ks_2samp", "HouseAge").evaluate(current, restored).metric_value == pytest.approx(expected)
+
+
+def test_analyzer_with_decayed_reference():
+    decayed = DecayedReference(half_life=4)
+    for window in windows:
+        decayed.update(window, features)
+    analyzer = Analyzer(name="california", model_id=1, model_version=2)
+    analyzer.add_drift_metrics(["wasserstein", "ks_2samp", "psi"], features)
+    analyzer.run(current, decayed)
+    results = analyzer.results_to_pandas()
+    assert len(results) == 9
+    assert results["metric_value"].notnull().all()
@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from pulsar_metrics.analyzers.base import Analyzer
+from pulsar_metrics.exceptions import CustomExceptionPulsarMetric as error_msg
+from pulsar_metrics.metrics.drift import DriftMetric, DriftTestMetric
+from pulsar_metrics.metrics.sampling import Sampler
+
+reference = pd.read_csv("data/california_ref.csv")
+current = pd.read_csv("data/california_new.csv")
+
+# Testing the samplers
+# ====================
+
+
+@pytest.mark.parametrize(
+    "params", [{"method": "reservoir"}, {"method": "time"}, {"method": "segment", "segment_column": "y_pred"}]
+)
+def test_sample_is_reproducible_and_nested(params):
+    small = Sampler(**params).sample_index(current, 500)
+    large = Sampler(**params).sample_index(current, 2000)
+    assert len(small) == 500 and len(large) == 2000
+    assert (small == Sampler(**params).sample_index(current, 500)).all()
+    assert np.isin(small, large).all()
+
+
+def test_stratified_allocation_is_proportional():
+    index = Sampler(method="segment", segment_column="y_pred").sample_index(current, 1000)
+    expected = current["y_pred"].value_counts(normalize=True).sort_index() * 1000
+    observed = current["y_pred"].iloc[index].value_counts().sort_index()
+    assert (observed - expected).abs().max() <= 1
+
+
+def test_keys_are_cached_for_the_last_dataset_of_each_stream():
+    sampler = Sampler()
+    first = sampler.sample_index(current, 500)
+    for _ in range(3):
+        sampler.sample_index(current.copy(), 500)
+        sampler.sample_index(reference.copy(), 500, stream=1)
+    assert len(sampler._cache) == 2
+    assert (sampler.sample_index(current, 500) == first).all()
+
+
+def test_segment_sampler_requires_column():
+    with pytest.raises(error_msg):
+        Sampler(method="segment")
+
+
+# Testing sampled drift metrics
+# =============================
+
+
+def test_sampled_metric_records_size_and_interval():
+    full = DriftMetric("wasserstein", "MedInc").evaluate(current, reference)
+    result = DriftMetric("wasserstein", "MedInc").evaluate(current, reference, sampling={"size": 3000})
+    assert result.sample_size == 3000
+    assert result.conf_int[0] <= full.metric_value <= result.conf_int[1]
+
+    test = DriftTestMetric("manwu", "MedInc").evaluate(current, reference, sampling={"size": 3000, "n_bootstrap": 5})
+    assert test.sample_size == 3000 and len(test.conf_int) == 2
+
+
+def test_sampling_larger_than_data_is_exact():
+    full = DriftTestMetric("CvM", "MedInc").evaluate(current, reference)
+    result = DriftTestMetric("CvM", "MedInc").evaluate(current, reference, sampling={"size": max(len(current), len(reference))})
+    assert result.metric_value == full.metric_value
+    assert result.sample_size == len(current) and result.conf_int is None
+
+
+def test_time_budget_bounds_sample_size():
+    result = DriftMetric("mmd", "MedInc").evaluate(
+        current, reference, sampling={"size": None, "time_budget": 0.5, "n_bootstrap": 2}, kernel="rbf"
+    )
+    assert 1000 <= result.sample_size <= len(current)
+
+
+def test_analyzer_sampling():
+    analyzer = Analyzer(name="sampled", model_id=1, model_version=2)
+    analyzer.add_drift_metrics(["ks_2samp", "psi"], ["MedInc", "HouseAge"])
+    analyzer.run(current, reference, sampling={"method": "time", "size": 2000, "n_bootstrap": 5})
+    drift_results = [result for result in analyzer._results if result.metric_type == "drift"]
+    assert len(drift_results) == 4
+    assert all(result.sample_size == 2000 for result in drift_results)
@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from pulsar_metrics.analyzers.base import Analyzer
+from pulsar_metrics.analyzers.plan import MetricPlan
+from pulsar_metrics.analyzers.schema import Schema
+from pulsar_metrics.analyzers.store import ReferenceStore
+from pulsar_metrics.exceptions import CustomExceptionPulsarMetric
+from pulsar_metrics.metrics.drift import DriftMetric
+
+reference = pd.read_csv("data/california_ref.csv")
+current = pd.read_csv("data/california_new.csv")
+features = ["MedInc", "HouseAge", "AveRooms", "AveBedrms", "Population", "AveOccup", "Latitude", "Longitude"]
+
+
+# Testing the dataset schema
+# ==========================
+
+
+def test_infer_schema():
+    schema = Schema.infer(reference)
+    assert schema.features == features
+    assert schema.with_role("id") == ["identifier", "model_id", "model_version"]
+    assert schema.with_role("target") == ["clf_target"]
+    assert schema.with_role("prediction") == ["y_pred_proba", "y_pred"]
+    assert schema["pred_timestamp"] == ("timestamp", "datetime", "int64")
+    assert schema["MedInc"] == ("feature", "continuous", "float32")
+    assert schema.kind("y_pred") == "discrete"
+    assert schema.kind("missing") is None
+
+
+def test_infer_kinds_and_roles():
+    rng = np.random.default_rng(0)
+    data = pd.DataFrame(
+        {
+            "city": rng.choice(["a", "b", "c"], 100),
+            "flag": rng.random(100) > 0.5,
+            "rooms": rng.integers(0, 5, 100),
+            "embedding": list(rng.normal(size=(100, 4))),
+        }
+    )
+    schema = Schema.infer(data, roles={"rooms": "target"})
+    assert [schema.kind(column) for column in data.columns] == ["categorical", "categorical", "discrete", "vector"]
+    assert schema["city"].dtype == "category"
+    assert schema.role("rooms") == "target"
+    assert not schema.is_profiled("embedding")
+    with pytest.raises(CustomExceptionPulsarMetric):
+        Schema({"city": ("feature", "text", "object")})
+
+
+def test_schema_round_trip(tmp_path):
+    schema = Schema.infer(reference)
+    path = str(tmp_path / "schema.json")
+    schema.save(path)
+    assert Schema.load(path) == schema
+    stored = ReferenceStore(str(tmp_path / "store")).put(reference, 1, 2)
+    assert stored.schema == schema
+
+
+def test_plan_skips_non_features():
+    schema = Schema.infer(reference)
+    metrics = [DriftMetric("wasserstein", feature) for feature in ["MedInc", "HouseAge"]]
+    plan = MetricPlan(metrics, summary_features=reference.columns, schema=schema).compile(current, reference)
+    profiled = [feature for kind, feature, _ in plan._steps if kind == "summary"]
+    assert profiled == features + ["clf_target", "y_pred_proba", "y_pred"]
+    assert all(consumed is not None for _, _, consumed in plan._steps)
+
+
+def test_analyzer_schema():
+    analyzer = Analyzer(name="california", model_id=1, model_version=2)
+    with pytest.raises(CustomExceptionPulsarMetric):
+        analyzer.add_drift_metrics(["wasserstein"])
+    analyzer.add_drift_metrics(["wasserstein"], ["MedInc"])
+    analyzer.run(current, reference)
+    assert analyzer.get_schema() == Schema.infer(reference)
+
+    analyzer.add_drift_metrics(["ks_2samp"])
+    analyzer.run(current, reference)
+    results = analyzer.results_to_pandas()
+    assert set(results.loc[results.metric_name == "ks_2samp", "feature_name"]) == set(features)
+    assert not results.feature_name.isin(["identifier", "model_id", "model_version", "pred_timestamp"]).any()
+
+
+def test_compact_keeps_values_out_of_the_reference_range():
+    schema = Schema.infer(pd.DataFrame({"rooms": np.arange(1, 6) % 5 + 1, "age": np.arange(5) + 0.5}))
+    assert np.dtype(schema["rooms"].dtype).kind in "iu"
+    new = pd.DataFrame({"rooms": [100, 200, 300, 1000, 2], "age": [1.5, 2.5, 3.5, 4.5, 5.5]})
+    assert list(schema.compact(new)["rooms"]) == [100, 200, 300, 1000, 2]
+    fractional = pd.DataFrame({"rooms": [1.5, 2.0, 3.0, 4.0, 5.0]})
+    assert list(schema.compact(fractional)["rooms"]) == [1.5, 2.0, 3.0, 4.0, 5.0]
+    assert schema.compact(pd.DataFrame({"rooms": [1.0, 2.0, 5.0]}))["rooms"].dtype == np.dtype(schema["rooms"].dtype)
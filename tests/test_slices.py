@@ -0,0 +1,126 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.metrics import (
+    accuracy_score,
+    f1_score,
+    mean_absolute_error,
+    mean_squared_error,
+)
+
+from pulsar_metrics.analyzers.slices import SliceFinder
+from pulsar_metrics.exceptions import CustomExceptionPulsarMetric
+from pulsar_metrics.metrics.histograms import FrozenBinning
+
+reference = pd.read_csv("data/california_ref.csv")
+current = pd.read_csv("data/california_new.csv")
+features = ["MedInc", "HouseAge", "Latitude", "Longitude"]
+
+rng = np.random.default_rng(3)
+synthetic = pd.DataFrame(
+    {"x": rng.normal(size=100000), "z": rng.normal(size=100000), "device": rng.choice(["a", "b", "c"], 100000)}
+)
+synthetic["y_true"] = rng.integers(0, 2, len(synthetic))
+# The predictions are wrong 10% of the time, and 40% of the time on the slice x > 1 & device = b
+planted = ((synthetic.x > 1) & (synthetic.device == "b")).to_numpy()
+flip = rng.random(len(synthetic)) < np.where(planted, 0.4, 0.1)
+synthetic["y_pred"] = np.where(flip, 1 - synthetic.y_true, synthetic.y_true)
+
+
+def slice_rows(finder, data, slice_name):
+    """Rows of a slice recomputed from the bins of its features"""
+    codes = finder._binning.codes(data)
+    mask = np.ones(len(data), dtype=bool)
+    for condition in slice_name.split(" & "):
+        feature, label = condition.split("=", 1)
+        mask &= codes[:, finder.features.index(feature)] == finder._binning.labels(feature).index(label)
+    return data[mask]
+
+
+# Testing the frozen bin codes
+# ============================
+
+
+def test_codes_match_counts():
+    data = current.assign(category=np.where(current.MedInc > 4, "high", "low"))
+    data.loc[data.index[:10], "MedInc"] = np.nan
+    binning = FrozenBinning(reference.assign(category="low"), ["MedInc", "category"])
+    codes = binning.codes(data)
+    assert codes.shape == (len(data), 2)
+    assert (codes[:10, 0] == -1).all()
+    assert np.bincount(codes[codes[:, 0] >= 0, 0], minlength=len(binning.labels("MedInc"))).sum() == len(data) - 10
+    assert binning.labels("category") == ["low", "<unseen>"]
+    assert (binning.counts(data)[1, :2] == [(data.category == "low").sum(), (data.category == "high").sum()]).all()
+
+
+# Testing the slices
+# ==================
+
+
+@pytest.mark.parametrize("metric_name, func", [("accuracy", accuracy_score), ("f1", f1_score)])
+def test_classification_parity(metric_name, func):
+    finder = SliceFinder(reference, features)
+    slices = finder.find(current, metric_name=metric_name, y_name="clf_target", n_slices=10, n_bootstrap=0)
+    assert len(slices) == 10
+    assert (slices.gap.diff().dropna() <= 0).all()
+    for _, row in slices.iterrows():
+        rows = slice_rows(finder, current, row.slice)
+        assert len(rows) == row.support
+        assert row.metric_value == pytest.approx(func(rows.clf_target, rows.y_pred))
+        outside = current.drop(rows.index)
+        assert row.complement_value == pytest.approx(func(outside.clf_target, outside.y_pred))
+
+
+@pytest.mark.parametrize("metric_name, func", [("mae", mean_absolute_error), ("mse", mean_squared_error)])
+def test_regression_parity(metric_name, func):
+    finder = SliceFinder(reference, features)
+    slices = finder.find(current, metric_name=metric_name, y_name="clf_target", pred_name="y_pred_proba", n_slices=5)
+    for _, row in slices.iterrows():
+        rows = slice_rows(finder, current, row.slice)
+        assert row.metric_value == pytest.approx(func(rows.clf_target, rows.y_pred_proba))
+        assert row.gap == pytest.approx(row.metric_value - row.complement_value)
+
+
+def test_planted_slice():
+    finder = SliceFinder(synthetic, ["x", "z", "device"], bins=4)
+    slices = finder.find(synthetic, min_support=0.02)
+    top = slices.iloc[0]
+    assert top.features == ("x", "device") and top.slice.endswith("device=b")
+    assert top.significant and top.p_value < 0.05
+    assert (slices.support >= 0.02 * len(synthetic)).all()
+    assert slices.depth.isin([1, 2]).all()
+
+
+def test_features_of_different_cardinalities():
+    data = synthetic.iloc[:20000].assign(store=rng.integers(0, 300, 20000).astype(str), flag=rng.integers(0, 2, 20000) == 1)
+    data.loc[data.index[:1000], "store"] = None
+    finder = SliceFinder(data.iloc[1000:], ["x", "store", "flag"], bins=4)
+    slices = finder.find(data, max_depth=3, min_support=30, n_slices=10000, n_bootstrap=0)
+    assert set(slices.depth) == {1, 2, 3}
+    for _, row in slices.groupby("depth").head(50).iterrows():
+        rows = slice_rows(finder, data, row.slice)
+        assert len(rows) == row.support
+        assert row.metric_value == pytest.approx(accuracy_score(rows.y_true, rows.y_pred))
+
+
+def test_missing_values_and_depth():
+    data = current.copy()
+    data.loc[data.index[:500], "MedInc"] = np.nan
+    data.loc[data.index[500:600], "clf_target"] = np.nan
+    finder = SliceFinder(reference, features)
+    slices = finder.find(data, y_name="clf_target", max_depth=1, min_support=200, n_slices=100, n_bootstrap=0)
+    assert (slices.depth == 1).all() and (slices.support >= 200).all()
+    medinc = slices[slices.features == ("MedInc",)]
+    assert medinc.support.sum() <= len(data) - 600
+
+
+def test_invalid_inputs():
+    finder = SliceFinder(reference, features)
+    with pytest.raises(CustomExceptionPulsarMetric):
+        finder.find(current, metric_name="auc", y_name="clf_target")
+    multiclass = current.assign(label=current.HouseAge % 3, prediction=current.HouseAge % 2)
+    with pytest.raises(CustomExceptionPulsarMetric):
+        finder.find(multiclass, metric_name="precision", y_name="label", pred_name="prediction")
+    slices = finder.find(multiclass, y_name="label", pred_name="prediction", n_slices=3, n_bootstrap=0)
+    rows = slice_rows(finder, multiclass, slices.slice[0])
+    assert slices.metric_value[0] == pytest.approx(accuracy_score(rows.label, rows.prediction))
@@ -0,0 +1,85 @@
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from pulsar_metrics.analyzers.store import ReferenceStore
+from pulsar_metrics.exceptions import CustomExceptionPulsarMetric
+
+features = ["MedInc", "HouseAge", "Population"]
+metrics = ["psi", "wasserstein", "ks_2samp", "ttest", "kl"]
+
+
+def attached_sum(stored):
+    values = stored.frame["MedInc"].to_numpy()
+    return float(values.sum()), isinstance(values.base, np.memmap) or not values.flags.owndata
+
+
+# Testing the reference store
+# ===========================
+
+
+def test_stored_reference_columns(tmp_path, reference):
+    stored = ReferenceStore(str(tmp_path)).put(reference, 1, 2)
+    frame = stored.frame
+    assert len(stored) == len(frame) == len(reference)
+    pd.testing.assert_frame_equal(frame[reference.columns], reference, check_dtype=True)
+    assert not frame["MedInc"].to_numpy().flags.owndata
+    assert stored.nodes()[("sorted", "MedInc", "reference")] == pytest.approx(np.sort(reference["MedInc"]))
+
+
+def test_run_on_stored_reference_matches_run(tmp_path, current, reference, make_analyzer):
+    store = ReferenceStore(str(tmp_path))
+    store.put(reference, 1, 2)
+    expected, analyzer = make_analyzer(metrics, features), make_analyzer(metrics, features)
+    expected.run(current, reference)
+    analyzer.run(current, store.get(1, 2))
+    pd.testing.assert_frame_equal(
+        analyzer.results_to_pandas().drop(columns="eval_timestamp"), expected.results_to_pandas().drop(columns="eval_timestamp")
+    )
+
+
+def test_run_on_stored_reference_of_another_version(tmp_path, current, reference, make_analyzer):
+    stored = ReferenceStore(str(tmp_path)).put(reference, 1, 2)
+    analyzer = make_analyzer(metrics, features, model_version=3)
+    with pytest.raises(CustomExceptionPulsarMetric):
+        analyzer.run(current, stored)
+
+
+def test_workers_attach_the_stored_reference(tmp_path, reference):
+    stored = ReferenceStore(str(tmp_path)).put(reference, 1, 2)
+    with ProcessPoolExecutor(max_workers=2) as pool:
+        results = list(pool.map(attached_sum, [stored, stored]))
+    assert results == [(pytest.approx(reference["MedInc"].sum()), True)] * 2
+
+
+def test_versioning_and_invalidation(tmp_path, reference):
+    store = ReferenceStore(str(tmp_path))
+    first = store.put(reference, 1, 2)
+    assert store.put(reference, 1, 2).fingerprint == first.fingerprint
+    assert first.is_current()
+    attached = first.frame
+
+    updated = store.put(reference.assign(MedInc=reference["MedInc"] * 2), 1, 2)
+    assert updated.fingerprint != first.fingerprint
+    assert not first.is_current() and updated.is_current()
+    assert store.get(1, 2).fingerprint == updated.fingerprint
+    # The previous version stays readable by the processes attached to it
+    assert attached["MedInc"].sum() == pytest.approx(reference["MedInc"].sum())
+    # Until it is collected, also by the references attached to it that have not read their files yet
+    unread = pickle.loads(pickle.dumps(first))
+    assert unread.frame["MedInc"].sum() == pytest.approx(reference["MedInc"].sum())
+    assert store.gc() == [first.fingerprint]
+    assert store.gc() == []
+    with pytest.raises(FileNotFoundError):
+        pickle.loads(pickle.dumps(first)).frame
+    assert store.get(1, 2).frame["MedInc"].sum() == pytest.approx(2 * reference["MedInc"].sum())
+
+    store.put(reference.assign(model_version=3), 1, 3)
+    assert store.versions()[["model_id", "model_version"]].values.tolist() == [[1, 2], [1, 3]]
+    store.invalidate(1, 2)
+    with pytest.raises(CustomExceptionPulsarMetric):
+        store.get(1, 2)
+    assert store.versions()["model_version"].tolist() == [3]